@@ -0,0 +1,122 @@
+# --- START OF FILE benchmarks/bench_derived_metrics.py ---
+"""
+Micro-benchmark chi phí thống kê user mỗi tin nhắn: cách cũ (ghi user_activity + Counter song song,
+tính lại tổng emoji và chép mention/reaction ngược vào user_activity ở từng tin) so với
+UserStatsStore (chỉ cộng dồn O(1)) + finalize_user_metrics một lần ở cuối.
+Chạy: python benchmarks/bench_derived_metrics.py
+"""
+import datetime
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cogs", "deep_scan_helpers"))
+from user_stats import UserStatsStore, DISCORD_EPOCH_MS, finalize_user_metrics # noqa: E402
+
+MESSAGE_COUNT = 200_000
+USER_COUNT = 5_000
+LOCATION_COUNT = 50
+CUSTOM_EMOJI_IDS = list(range(1, 41))
+
+
+def _make_messages(rng: random.Random) -> list:
+    """(message_id, author_id, location_id, custom_emoji_ids, mention_ids, reactions_given_by)"""
+    messages = []
+    base_ms = 1_600_000_000_000 - DISCORD_EPOCH_MS
+    for i in range(MESSAGE_COUNT):
+        message_id = (base_ms + i * 60_000) << 22
+        author_id = 10_000 + rng.randrange(USER_COUNT)
+        emojis = tuple(rng.choice(CUSTOM_EMOJI_IDS) for _ in range(rng.choice((0, 0, 0, 1, 2))))
+        mentions = tuple(10_000 + rng.randrange(USER_COUNT * 2) for _ in range(rng.choice((0, 0, 0, 0, 1))))
+        reactors = tuple(10_000 + rng.randrange(USER_COUNT) for _ in range(rng.choice((0, 0, 0, 1, 3))))
+        messages.append((message_id, author_id, 1 + rng.randrange(LOCATION_COUNT), emojis, mentions, reactors))
+    return messages
+
+
+def _bench_legacy(messages: list) -> float:
+    start = time.perf_counter()
+    user_activity = defaultdict(lambda: {'message_count': 0, 'first_seen': None, 'last_seen': None, 'mention_received_count': 0, 'reaction_given_count': 0})
+    message_counts = Counter(); emoji_counts = Counter(); mention_given = Counter()
+    mention_received = Counter(); reaction_given = Counter(); total_custom = Counter()
+    user_custom = defaultdict(Counter); channel_counts = defaultdict(Counter)
+    for message_id, author_id, location_id, emojis, mentions, reactors in messages:
+        timestamp = datetime.datetime.fromtimestamp(((message_id >> 22) + DISCORD_EPOCH_MS) / 1000, tz=datetime.timezone.utc)
+        user_data = user_activity[author_id]
+        user_data['message_count'] += 1
+        message_counts[author_id] = user_data['message_count']
+        if user_data['first_seen'] is None or timestamp < user_data['first_seen']: user_data['first_seen'] = timestamp
+        if user_data['last_seen'] is None or timestamp > user_data['last_seen']: user_data['last_seen'] = timestamp
+        user_data.setdefault('channels_messaged_in', set()).add(location_id)
+        channel_counts[author_id][location_id] += 1
+        custom_counter_user = user_custom[author_id]
+        for emoji_id in emojis: custom_counter_user[emoji_id] += 1
+        emoji_counts[author_id] += len(emojis)
+        user_data['emoji_count'] = user_data.get('emoji_count', 0) + len(emojis)
+        total_custom[author_id] = sum(custom_counter_user.values()) # Tính lại tổng ở mỗi tin
+        if mentions:
+            mention_given[author_id] += len(mentions)
+            user_data.setdefault('distinct_mentions_set', set()).update(mentions)
+            for mentioned_id in mentions:
+                mention_received[mentioned_id] += 1
+                user_activity[mentioned_id]['mention_received_count'] = mention_received[mentioned_id]
+        for reactor_id in reactors:
+            reaction_given[reactor_id] += 1
+            user_activity[reactor_id]['reaction_given_count'] = reaction_given[reactor_id]
+    # Bước tính chỉ số phụ cũ (process_additional_data)
+    distinct = Counter(); most_active = {}
+    for user_id, data in user_activity.items():
+        channels = data.get('channels_messaged_in', set())
+        if channels: distinct[user_id] = len(channels)
+        counts = channel_counts.get(user_id)
+        if counts: most_active[user_id] = max(counts.items(), key=lambda item: item[1])
+        if data['first_seen'] and data['last_seen']:
+            data['activity_span_seconds'] = round((data['last_seen'] - data['first_seen']).total_seconds(), 2)
+    return time.perf_counter() - start
+
+
+def _bench_store(messages: list) -> float:
+    start = time.perf_counter()
+    scan_data = {"user_stats": UserStatsStore(), "user_activity": {}, "user_channel_message_counts": defaultdict(Counter)}
+    stats: UserStatsStore = scan_data["user_stats"]
+    channel_counts = scan_data["user_channel_message_counts"]
+    user_custom = defaultdict(Counter)
+    for message_id, author_id, location_id, emojis, mentions, reactors in messages:
+        row = stats.row(author_id)
+        stats.message_count[row] += 1
+        stats.touch_seen(row, (message_id >> 22) + DISCORD_EPOCH_MS)
+        channel_counts[author_id][location_id] += 1
+        if emojis:
+            custom_counter_user = user_custom[author_id]
+            for emoji_id in emojis: custom_counter_user[emoji_id] += 1
+            stats.emoji_count[row] += len(emojis)
+            stats.custom_emoji_content_count[row] += len(emojis)
+        if mentions:
+            stats.mention_given_count[row] += len(mentions)
+            stats.distinct_mentions.setdefault(row, set()).update(mentions)
+            for mentioned_id in mentions: stats.mention_received_count[stats.row(mentioned_id)] += 1
+        for reactor_id in reactors:
+            stats.reaction_given_count[stats.row(reactor_id)] += 1
+    loop_seconds = time.perf_counter() - start
+    finalize_user_metrics(scan_data)
+    total_seconds = time.perf_counter() - start
+    print(f"  (store: vòng lặp {loop_seconds:.3f}s + chốt chỉ số {total_seconds - loop_seconds:.3f}s)")
+    return total_seconds
+
+
+def main():
+    rng = random.Random(42)
+    messages = _make_messages(rng)
+    print(f"{MESSAGE_COUNT:,} tin nhắn, {USER_COUNT:,} user, {LOCATION_COUNT} kênh")
+    legacy_seconds = _bench_legacy(messages)
+    store_seconds = _bench_store(messages)
+    for name, seconds in (("cũ (mỗi tin)", legacy_seconds), ("store + chốt 1 lần", store_seconds)):
+        print(f"  {name:<20} {seconds:.3f}s  ({seconds / MESSAGE_COUNT * 1e6:.2f} µs/tin)")
+    print(f"  nhanh hơn x{legacy_seconds / store_seconds:.2f}")
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE benchmarks/bench_derived_metrics.py ---
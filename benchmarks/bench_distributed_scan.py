@@ -0,0 +1,141 @@
+# --- START OF FILE benchmarks/bench_distributed_scan.py ---
+"""
+Chạy thử quét phân tán trên máy local: 1 coordinator + N process worker dùng chung một Postgres (DATABASE_URL),
+history lấy từ nguồn giả (không gọi Discord, mỗi trang giả lập độ trễ REST).
+Coordinator đăng job, worker nhận bằng SKIP LOCKED, kết quả gộp lại được so với số đếm trực tiếp từ nguồn giả.
+Chạy: python benchmarks/bench_distributed_scan.py --workers 3 --channels 40 --messages 2000
+"""
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, PROJECT_ROOT)
+from dotenv import load_dotenv # noqa: E402
+load_dotenv(os.path.join(PROJECT_ROOT, ".env"))
+
+import database # noqa: E402
+from cogs.deep_scan_helpers.user_stats import UserStatsStore # noqa: E402
+from cogs.deep_scan_helpers.scan_jobs import JOB_KIND_CHANNEL, publish_scan_jobs, iter_scan_job_results # noqa: E402
+from cogs.deep_scan_helpers.scan_worker import ScanWorker # noqa: E402
+from tests.fakes import FakeUser, FakeMessage, FakeLocation, FakeGuild, snowflake # noqa: E402
+
+FAKE_GUILD_ID = 4242
+USER_COUNT = 500
+BOT_USER_ID = 9_999
+START_MS = 1_650_000_000_000
+
+
+class FakeHistorySource:
+    """Nguồn history giả, sinh giống hệt nhau ở mọi process (cùng seed)."""
+
+    def __init__(self, channel_count: int, messages_per_channel: int, seed: int, page_latency: float):
+        self.guild = FakeGuild(FAKE_GUILD_ID)
+        self.locations = {}
+        users = [FakeUser(1_000 + index) for index in range(USER_COUNT)] + [FakeUser(BOT_USER_ID, is_bot=True)]
+        for channel_index in range(channel_count):
+            rng = random.Random(seed * 1_000 + channel_index)
+            message_count = messages_per_channel * (1 + channel_index % 5) // 3 # Kênh to nhỏ khác nhau
+            channel_id = snowflake(START_MS, channel_index)
+            messages = []
+            for message_index in range(message_count):
+                timestamp_ms = START_MS + 60_000 + message_index * 30_000 + channel_index
+                message_id = snowflake(timestamp_ms, channel_index)
+                words = " ".join(rng.choice(("hi", "ok", "lol", "https://example.com", "<:x:1>")) for _ in range(rng.randint(1, 6)))
+                messages.append(FakeMessage(message_id, rng.choice(users), words))
+            self.locations[channel_id] = FakeLocation(channel_id, f"kenh-{channel_index}", messages, page_latency)
+
+    async def wait_until_ready(self):
+        return
+
+    def guild_ids(self):
+        return [FAKE_GUILD_ID]
+
+    async def get_guild(self, guild_id: int):
+        return self.guild if guild_id == FAKE_GUILD_ID else None
+
+    async def get_location(self, guild, location_id: int):
+        return self.locations[location_id]
+
+    def expected_message_counts(self) -> Counter:
+        return Counter(message.author.id for location in self.locations.values() for message in location._messages)
+
+
+async def _run_worker(index: int, args: argparse.Namespace):
+    await database.connect_db()
+    source = FakeHistorySource(args.channels, args.messages, args.seed, args.page_latency)
+    worker = ScanWorker(None, location_source=source, concurrency=args.concurrency, worker_id=f"bench-{os.getpid()}-{index}")
+    try:
+        await worker.run(stop_when_idle=True)
+    finally:
+        await database.close_db()
+
+
+def _worker_process(index: int, args: argparse.Namespace):
+    asyncio.run(_run_worker(index, args))
+
+
+async def _run_coordinator(args: argparse.Namespace) -> int:
+    await database.connect_db()
+    try:
+        source = FakeHistorySource(args.channels, args.messages, args.seed, args.page_latency)
+        scan_id = await database.create_scan_record(FAKE_GUILD_ID, None)
+        scan_data = {
+            "server": source.guild, "scan_id": scan_id, "scan_errors": [],
+            "user_stats": UserStatsStore(), "overall_total_message_count": 0,
+            "location_scan_stats": {}, "location_size_estimates": {},
+        }
+        job_ids = await publish_scan_jobs(scan_data, [(location, JOB_KIND_CHANNEL, None) for location in source.locations.values()])
+        print(f"Đã đăng {len(job_ids)} job (scan {scan_id}), ~{scan_data.get('estimated_total_messages', 0):,} tin ước lượng.")
+
+        start = time.perf_counter()
+        processes = [multiprocessing.Process(target=_worker_process, args=(index, args)) for index in range(args.workers)]
+        for process in processes: process.start()
+        results = {}
+        async for job_row, location_result in iter_scan_job_results(scan_data, job_ids):
+            results[job_row["location_id"]] = location_result
+        elapsed = time.perf_counter() - start
+        for process in processes: process.join()
+        await database.delete_scan_jobs(scan_id)
+        await database.update_scan_status(scan_id, status="completed", end_time=datetime.datetime.now(datetime.timezone.utc))
+
+        stats: UserStatsStore = scan_data["user_stats"]
+        merged_counts = Counter({stats.user_ids[row]: stats.message_count[row] for row in stats.iter_rows() if stats.message_count[row]})
+        expected_counts = source.expected_message_counts()
+        total = scan_data["overall_total_message_count"]
+        failed = sum(1 for result in results.values() if result is None or result.get("error"))
+        print(f"{args.workers} worker x {args.concurrency} job: {total:,} tin trong {elapsed:.2f}s (~{total / elapsed:,.0f} msg/s), {failed} job lỗi")
+        if merged_counts != expected_counts or total != sum(expected_counts.values()):
+            print(f"SAI: tổng gộp {total:,} / mong đợi {sum(expected_counts.values()):,}, {len(merged_counts ^ expected_counts)} user lệch")
+            return 1
+        print("Khớp: số tin theo user sau khi gộp đúng với nguồn giả.")
+        return 0
+    finally:
+        await database.close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3, help="Số process worker")
+    parser.add_argument("--concurrency", type=int, default=4, help="Số job đồng thời mỗi worker")
+    parser.add_argument("--channels", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=2_000, help="Số tin trung bình mỗi kênh (kênh to/nhỏ xen kẽ)")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="Độ trễ giả lập mỗi trang history (giây)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    if not os.getenv("DATABASE_URL"):
+        sys.exit("Cần DATABASE_URL trỏ tới Postgres local.")
+    multiprocessing.set_start_method("spawn")
+    sys.exit(asyncio.run(_run_coordinator(args)))
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE benchmarks/bench_distributed_scan.py ---
@@ -0,0 +1,62 @@
+# --- START OF FILE benchmarks/bench_keyword_matcher.py ---
+"""
+Micro-benchmark đếm keyword: vòng lặp str.count cũ so với KeywordMatcher.
+Chạy: python benchmarks/bench_keyword_matcher.py
+"""
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cogs", "deep_scan_helpers"))
+from keyword_matcher import KeywordMatcher, MATCH_MODE_SUBSTRING, MATCH_MODE_WORD # noqa: E402
+
+MESSAGE_COUNT = 20_000
+KEYWORD_COUNTS = (1, 50, 500)
+
+
+def _random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+
+
+def _make_messages(rng: random.Random, vocabulary: list) -> list:
+    return [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(3, 40))) for _ in range(MESSAGE_COUNT)]
+
+
+def _bench_naive(messages: list, keywords: list) -> float:
+    start = time.perf_counter()
+    for text in messages:
+        for keyword in keywords:
+            text.count(keyword)
+    return time.perf_counter() - start
+
+
+def _bench_matcher(messages: list, matcher: KeywordMatcher) -> float:
+    start = time.perf_counter()
+    for text in messages:
+        matcher.count(text)
+    return time.perf_counter() - start
+
+
+def main():
+    rng = random.Random(42)
+    vocabulary = [_random_word(rng) for _ in range(3000)]
+    messages = _make_messages(rng, vocabulary)
+    print(f"{MESSAGE_COUNT:,} tin nhắn ngẫu nhiên")
+    print(f"{'keywords':>8} | {'str.count':>12} | {'substring':>12} | {'word':>12}")
+    for keyword_count in KEYWORD_COUNTS:
+        keywords = rng.sample(vocabulary, keyword_count)
+        naive = _bench_naive(messages, keywords)
+        substring = _bench_matcher(messages, KeywordMatcher(keywords, MATCH_MODE_SUBSTRING))
+        word = _bench_matcher(messages, KeywordMatcher(keywords, MATCH_MODE_WORD))
+        print(
+            f"{keyword_count:>8} | {MESSAGE_COUNT / naive:>8,.0f} m/s | "
+            f"{MESSAGE_COUNT / substring:>8,.0f} m/s | {MESSAGE_COUNT / word:>8,.0f} m/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE benchmarks/bench_keyword_matcher.py ---
@@ -0,0 +1,506 @@
+# --- START OF FILE benchmarks/bench_scan_pipeline.py ---
+"""
+Benchmark toàn bộ pipeline quét trên guild giả (không gọi Discord, không cần Postgres):
+scan_all_channels_and_threads -> process_additional_data -> _prepare_ranking_data -> file CSV/JSON.
+Guild giả có kênh text + luồng (đang mở và đã lưu trữ), tin nhắn được sinh dần theo từng trang
+(không giữ sẵn trong RAM) với tỉ lệ emoji/sticker/mention/keyword/reaction/file cấu hình được và độ trễ giả lập.
+Mỗi kích thước chạy trong một process riêng để đo RSS cao nhất chính xác.
+Chạy: python benchmarks/bench_scan_pipeline.py --sizes 100000,1000000,10000000 --page-latency 0
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Any, List, Optional
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, PROJECT_ROOT)
+os.environ.setdefault("DISCORD_TOKEN", "benchmark") # config chỉ đọc biến môi trường, không kết nối gì
+
+import discord # noqa: E402
+import utils # noqa: E402
+from cogs.deep_scan_helpers import scan_all_channels_and_threads, process_additional_data, generate_export_files # noqa: E402
+from cogs.deep_scan_helpers.dm_sender import _prepare_ranking_data # noqa: E402
+from cogs.deep_scan_helpers.keyword_matcher import KeywordMatcher # noqa: E402
+from cogs.deep_scan_helpers.activity_rollups import set_scan_window # noqa: E402
+from cogs.deep_scan_helpers.user_stats import UserStatsStore # noqa: E402
+from cogs.deep_scan_helpers.activity_grid import ActivityGrid # noqa: E402
+from cogs.deep_scan_helpers.scan_profiler import peak_rss_bytes # noqa: E402
+import config # noqa: E402
+from tests import fakes # noqa: E402
+from tests.fakes import FakeMessage, snowflake # noqa: E402
+
+FAKE_GUILD_ID = 777_000
+START_MS = 1_600_000_000_000 # Thời điểm tạo guild giả
+MESSAGE_INTERVAL_MS = 1_000 # Khoảng cách giữa 2 tin liên tiếp trong một location
+WORDS = ("hi", "ok", "lol", "hôm", "nay", "trời", "đẹp", "quá", "ăn", "gì", "chưa", "game", "tối", "nay", "không")
+KEYWORDS = ("shiromi", "event", "giveaway")
+EMOJI_COUNT = 40
+STICKER_COUNT = 10
+MASK_64 = (1 << 64) - 1
+
+
+def _mix(value: int) -> int:
+    """Hash số nguyên 64-bit (splitmix64): thuộc tính tin nhắn là hàm thuần của (location, vị trí) nên trang nào sinh lại cũng giống nhau."""
+    value = (value + 0x9E3779B97F4A7C15) & MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return value ^ (value >> 31)
+
+
+def _chance(hash_value: int, shift: int, rate: float) -> bool:
+    return ((hash_value >> shift) & 0xFFFF) < rate * 0x10000
+
+
+# --- Đối tượng giả (tin nhắn/user/guild cơ bản dùng chung với test: tests/fakes.py) ---
+class FakeMember(fakes.FakeUser):
+    """Member/User giả (chỉ các thuộc tính mà pipeline đọc)."""
+
+    def __init__(self, user_id: int, is_bot: bool = False, joined_at: Optional[datetime.datetime] = None, premium_since: Optional[datetime.datetime] = None):
+        super().__init__(user_id, is_bot)
+        self.name = self.display_name
+        self.mention = f"<@{user_id}>"
+        self.joined_at = joined_at
+        self.premium_since = premium_since
+        self.guild_permissions = discord.Permissions.none()
+        self.roles = []
+        self.status = discord.Status.online
+
+
+class FakeAttachment:
+    def __init__(self, content_type: str):
+        self.content_type = content_type
+
+
+class FakeSticker:
+    def __init__(self, sticker_id: int):
+        self.id = sticker_id
+
+
+class FakeReference:
+    def __init__(self, message_id: int):
+        self.message_id = message_id
+
+
+class FakeReaction:
+    """Reaction giả: users() trả về người thả sau độ trễ giả lập của 1 request REST."""
+
+    def __init__(self, emoji, user_ids: List[int], users_by_id: Dict[int, FakeMember], latency: float, count: Optional[int] = None):
+        self.emoji = emoji
+        self.count = count if count is not None else len(user_ids)
+        self._user_ids = user_ids
+        self._users_by_id = users_by_id
+        self._latency = latency
+
+    async def users(self, limit=None):
+        if self._latency: await asyncio.sleep(self._latency)
+        for user_id in self._user_ids:
+            yield self._users_by_id[user_id]
+
+
+class SyntheticHistory:
+    """History sinh dần của một location: tin thứ i có ID first_id + i * step, nội dung sinh từ hash (location, i)."""
+
+    def __init__(self, synthetic_guild: "SyntheticGuild", seed: int, first_ms: int, message_count: int):
+        self._synthetic = synthetic_guild
+        self._seed = seed
+        self.message_count = message_count
+        self._step = MESSAGE_INTERVAL_MS << 22
+        self._first_id = snowflake(first_ms, seed % 4096)
+        self.last_message_id = self._first_id + (message_count - 1) * self._step if message_count else None
+
+    def message_at(self, index: int) -> FakeMessage:
+        return self._synthetic.make_message(self._seed, index, self._first_id + index * self._step)
+
+    def index_after(self, message_id: int) -> int:
+        """Vị trí tin đầu tiên có ID > message_id."""
+        if message_id < self._first_id: return 0
+        return min(self.message_count, (message_id - self._first_id) // self._step + 1)
+
+    def index_before(self, message_id: int) -> int:
+        """Số tin có ID < message_id."""
+        if message_id <= self._first_id: return 0
+        return min(self.message_count, -(-(message_id - self._first_id) // self._step))
+
+
+class _FakeLocation:
+    """history()/permissions_for() dùng chung cho kênh và luồng giả; tin lấy từ nguồn (`message_count`, `index_after`, `index_before`, `message_at`)."""
+
+    def _init_location(self, fake_guild: "FakeGuild", source):
+        self.guild = fake_guild
+        self._source = source
+        self.last_message_id = source.last_message_id
+
+    async def history(self, limit=100, after=None, before=None, oldest_first=None):
+        if self.guild.page_latency: await asyncio.sleep(self.guild.page_latency) # Giả lập 1 request REST
+        source = self._source
+        if after is not None or oldest_first:
+            start = source.index_after(after.id) if after is not None else 0
+            end = min(start + limit, source.message_count)
+            if before is not None: end = min(end, source.index_before(before.id))
+            indexes = range(start, end)
+        else:
+            end = source.index_before(before.id) if before is not None else source.message_count
+            indexes = range(end - 1, max(0, end - limit) - 1, -1)
+        for index in indexes:
+            yield source.message_at(index)
+
+    def permissions_for(self, member) -> discord.Permissions:
+        return discord.Permissions.all()
+
+
+class FakeTextChannel(_FakeLocation, discord.TextChannel):
+    """Kế thừa discord.TextChannel để các nhánh isinstance của pipeline chạy như thật (không gọi __init__ gốc)."""
+
+    def __init__(self, fake_guild: "FakeGuild", channel_id: int, name: str, position: int, source):
+        self.id = channel_id
+        self.name = name
+        self.topic = None
+        self.nsfw = False
+        self.slowmode_delay = 0
+        self.category_id = None
+        self.position = position
+        self._init_location(fake_guild, source)
+        self.active_threads: List["FakeThread"] = []
+        self.archived_thread_list: List["FakeThread"] = []
+
+    @property
+    def type(self) -> discord.ChannelType:
+        return discord.ChannelType.text
+
+    @property
+    def category(self):
+        return None
+
+    @property
+    def threads(self) -> List["FakeThread"]:
+        return list(self.active_threads)
+
+    async def archived_threads(self, *, limit=None, before=None, private=False, joined=False):
+        if self.guild.page_latency: await asyncio.sleep(self.guild.page_latency)
+        for thread in self.archived_thread_list:
+            yield thread
+
+
+class FakeThread(_FakeLocation, discord.Thread):
+    def __init__(self, fake_guild: "FakeGuild", parent: FakeTextChannel, thread_id: int, name: str, owner_id: Optional[int], source, archived: bool):
+        self.id = thread_id
+        self.name = name
+        self.parent_id = parent.id
+        self.owner_id = owner_id
+        self.archived = archived
+        self.locked = False
+        self.message_count = source.message_count
+        self._created_at = discord.utils.snowflake_time(thread_id)
+        self._init_location(fake_guild, source)
+        self.archive_timestamp = discord.utils.snowflake_time(self.last_message_id or thread_id)
+        (parent.archived_thread_list if archived else parent.active_threads).append(self)
+
+    @property
+    def type(self) -> discord.ChannelType:
+        return discord.ChannelType.public_thread
+
+
+class FakeStatusMessage:
+    async def edit(self, **kwargs):
+        return self
+
+
+class FakeContext:
+    """ctx giả: tin nhắn trạng thái/cảnh báo không gửi đi đâu cả."""
+
+    def __init__(self, guild: "FakeGuild"):
+        self.guild = guild
+        self.sent_count = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent_count += 1
+        return FakeStatusMessage()
+
+
+def make_fake_emoji(fake_guild: "FakeGuild", emoji_id: int, name: str, animated: bool = False) -> discord.Emoji:
+    """Emoji thật của discord.py (isinstance discord.Emoji) nhưng không cần state."""
+    return discord.Emoji(guild=fake_guild, state=None, data={"id": emoji_id, "name": name, "animated": animated, "require_colons": True, "managed": False, "available": True, "roles": []})
+
+
+class FakeGuild(fakes.FakeGuild):
+    """Guild giả: thuộc tính mà pipeline/báo cáo đọc + member, emoji, sticker, kênh (kênh/luồng được thêm sau)."""
+
+    def __init__(self, guild_id: int, name: str, members: List[FakeMember], page_latency: float = 0.0, reaction_latency: float = 0.0):
+        super().__init__(guild_id)
+        self.name = name
+        self.page_latency = page_latency
+        self.reaction_latency = reaction_latency
+        self.created_at = datetime.datetime.fromtimestamp(START_MS / 1000, tz=datetime.timezone.utc)
+        self.owner = None
+        self.owner_id = members[0].id if members else None
+        self.member_count = len(members)
+        self.premium_tier = 0
+        self.premium_subscription_count = 0
+        self.verification_level = discord.VerificationLevel.low
+        self.explicit_content_filter = discord.ContentFilter.disabled
+        self.mfa_level = discord.MFALevel.disabled
+        self.default_notifications = discord.NotificationLevel.only_mentions
+        self.system_channel = self.rules_channel = self.public_updates_channel = self.afk_channel = None
+        self.afk_timeout = 300
+        self.voice_channels: List[Any] = []
+        self.stage_channels: List[Any] = []
+        self.stickers: List[Any] = []
+        self.emojis: List[discord.Emoji] = []
+        self.sticker_ids: List[int] = []
+        self.channels: List[FakeTextChannel] = []
+
+        self.members = list(members)
+        self.bot_member = FakeMember(9_999, is_bot=True, joined_at=self.created_at)
+        self.me = self.bot_member
+        self.members.append(self.bot_member)
+        self._members_by_id = {member.id: member for member in self.members}
+        self.user_ids = [member.id for member in self.members if not member.bot]
+
+    def iter_locations(self):
+        for channel in self.channels:
+            yield channel
+            yield from channel.active_threads
+            yield from channel.archived_thread_list
+
+    @property
+    def total_messages(self) -> int:
+        return sum(location._source.message_count for location in self.iter_locations())
+
+    def get_member(self, user_id: int) -> Optional[FakeMember]:
+        return self._members_by_id.get(user_id)
+
+    async def fetch_member(self, user_id: int) -> Optional[FakeMember]:
+        return self.get_member(user_id) # Snapshot đầy đủ nên thường không tới đây
+
+
+class SyntheticGuild(FakeGuild):
+    """Guild giả với tin sinh từ seed: chạy lại cho kết quả như nhau."""
+
+    def __init__(self, args: argparse.Namespace, total_messages: int):
+        joined_base = datetime.datetime.fromtimestamp(START_MS / 1000, tz=datetime.timezone.utc)
+        members = [
+            FakeMember(1_000 + index, joined_at=joined_base + datetime.timedelta(hours=index),
+                       premium_since=joined_base + datetime.timedelta(days=index) if index % 97 == 0 else None)
+            for index in range(args.users)
+        ]
+        super().__init__(FAKE_GUILD_ID, "Synthetic Guild", members, args.page_latency, args.reaction_latency)
+        self.args = args
+        self.emojis = [make_fake_emoji(self, 50_000 + index, f"e{index}") for index in range(EMOJI_COUNT)]
+        self.sticker_ids = [60_000 + index for index in range(STICKER_COUNT)]
+
+        # Chia tin cho kênh/luồng: kênh to nhỏ xen kẽ (trọng số 1..5), một phần tin nằm trong luồng
+        location_weights = [1 + index % 5 for index in range(args.channels)]
+        weight_total = sum(location_weights)
+        thread_index = 0
+        for index, weight in enumerate(location_weights):
+            location_messages = total_messages * weight // weight_total
+            thread_messages = int(location_messages * args.thread_share) if args.threads_per_channel else 0
+            created_ms = START_MS + index * 1_000
+            channel = FakeTextChannel(
+                self, snowflake(created_ms, index), f"kenh-{index}", index,
+                SyntheticHistory(self, index + 1, created_ms + 60_000, location_messages - thread_messages)
+            )
+            for thread_slot in range(args.threads_per_channel):
+                thread_created_ms = START_MS + 10_000_000 + thread_index * 1_000
+                FakeThread(
+                    self, channel, snowflake(thread_created_ms, 2048 + thread_index % 2048), f"luong-{thread_index}",
+                    self.user_ids[_mix(thread_index) % len(self.user_ids)],
+                    SyntheticHistory(self, 1_000_000 + thread_index, thread_created_ms + 60_000, thread_messages // args.threads_per_channel),
+                    archived=thread_slot % 2 == 1
+                )
+                thread_index += 1
+            self.channels.append(channel)
+
+    def make_message(self, seed: int, index: int, message_id: int) -> FakeMessage:
+        args = self.args
+        hash_value = _mix(seed * 0x100000001B3 + index)
+        author = self.members[hash_value % len(self.user_ids)]
+        words = [WORDS[(hash_value >> (8 + 4 * word)) % len(WORDS)] for word in range(1 + (hash_value >> 40) % 8)]
+        if _chance(hash_value, 16, args.keyword_rate): words.append(KEYWORDS[(hash_value >> 48) % len(KEYWORDS)])
+        if _chance(hash_value, 20, args.link_rate): words.append("https://example.com/x")
+        if _chance(hash_value, 24, args.emoji_rate):
+            emoji = self.emojis[(hash_value >> 32) % EMOJI_COUNT]
+            words.append(str(emoji))
+        message = FakeMessage(message_id, author, " ".join(words))
+        detail_hash = _mix(hash_value)
+        if _chance(detail_hash, 0, args.attachment_rate):
+            message.attachments = [FakeAttachment("image/png" if detail_hash & 1 else "application/pdf")]
+        if _chance(detail_hash, 16, args.sticker_rate):
+            message.stickers = [FakeSticker(self.sticker_ids[(detail_hash >> 33) % STICKER_COUNT])]
+        if _chance(detail_hash, 32, args.mention_rate):
+            message.mentions = [self.members[(detail_hash >> 36) % len(self.user_ids)]]
+        if _chance(detail_hash, 48, args.reply_rate) and index > 0:
+            message.reference = FakeReference(message_id - (MESSAGE_INTERVAL_MS << 22))
+        if args.reaction_rate and _chance(_mix(detail_hash), 0, args.reaction_rate):
+            reaction_hash = _mix(detail_hash + 1)
+            user_ids = [self.user_ids[(reaction_hash >> (8 * slot)) % len(self.user_ids)] for slot in range(1 + reaction_hash % 3)]
+            message.reactions = [FakeReaction(self.emojis[(reaction_hash >> 40) % EMOJI_COUNT], list(dict.fromkeys(user_ids)), self._members_by_id, self.reaction_latency)]
+        return message
+
+
+# --- Chạy pipeline ---
+def new_scan_data(guild: FakeGuild, keywords: List[str], can_scan_reactions: bool) -> Dict[str, Any]:
+    """scan_data như lệnh quét tạo ra sau initialize_scan (quét toàn bộ, không DB)."""
+    now = discord.utils.utcnow()
+    scan_data: Dict[str, Any] = {
+        "server": guild, "bot": None, "ctx": FakeContext(guild),
+        "start_time_cmd": time.monotonic(), "overall_start_time": now,
+        "export_csv": True, "export_json": True, "admin_dm_test": True, "keywords_str": ",".join(keywords),
+        "scan_errors": [], "log_thread": None, "status_message": None, "initial_status_msg": None,
+        "target_keywords": keywords,
+        "keyword_matcher": KeywordMatcher(keywords, config.KEYWORD_MATCH_MODE) if keywords else None,
+        "accessible_channels": list(guild.channels), "skipped_channels_count": 0, "channel_details": [],
+        "user_activity": defaultdict(lambda: {
+            'first_seen': None, 'last_seen': None, 'message_count': 0, 'is_bot': False,
+            'link_count': 0, 'image_count': 0, 'other_file_count': 0,
+            'emoji_count': 0, 'sticker_count': 0, 'mention_given_count': 0,
+            'mention_received_count': 0, 'reply_count': 0, 'reaction_received_count': 0,
+            'reaction_given_count': 0, 'channels_messaged_in': set(), 'distinct_mentions_set': set(),
+            'activity_span_seconds': 0.0,
+        }),
+        "overall_total_message_count": 0, "overall_total_reaction_count": 0,
+        "overall_total_filtered_reaction_count": 0, "processed_channels_count": 0,
+        "processed_threads_count": 0, "skipped_threads_count": 0,
+        "keyword_counts": Counter(), "channel_keyword_counts": defaultdict(Counter),
+        "thread_keyword_counts": defaultdict(Counter), "user_keyword_counts": defaultdict(Counter),
+        "reaction_emoji_counts": Counter(), "filtered_reaction_emoji_counts": Counter(),
+        "sticker_usage_counts": Counter(), "overall_custom_sticker_counts": Counter(),
+        "invite_usage_counts": Counter(), "user_stats": UserStatsStore(),
+        "user_custom_emoji_content_counts": defaultdict(Counter), "overall_custom_emoji_content_counts": Counter(),
+        "user_distinct_mention_given_counts": defaultdict(set), "user_reaction_emoji_given_counts": defaultdict(Counter),
+        "user_thread_creation_counts": Counter(), "tracked_role_grant_counts": Counter(),
+        "user_distinct_channel_counts": Counter(), "user_channel_message_counts": defaultdict(lambda: defaultdict(int)),
+        "user_most_active_channel": {}, "user_sticker_id_counts": defaultdict(Counter),
+        "server_hourly_activity": ActivityGrid(), "channel_hourly_activity": ActivityGrid(),
+        "thread_hourly_activity": ActivityGrid(), "user_hourly_activity": ActivityGrid(),
+        "user_emoji_received_counts": defaultdict(Counter),
+        "current_members_list": list(guild.members), "initial_member_status_counts": Counter(),
+        "channel_counts": Counter(), "all_roles_list": [], "boosters": [],
+        "voice_channel_static_data": [], "invites_data": [], "webhooks_data": [],
+        "integrations_data": [], "oldest_members_data": [],
+        "audit_log_entries_added": 0, "newest_processed_audit_log_id": None,
+        "scan_end_time": None, "overall_duration": datetime.timedelta(0),
+        "audit_log_scan_duration": datetime.timedelta(0),
+        "files_to_send": [], "report_messages_sent": 0,
+        "server_emojis_cache": {emoji.id: emoji for emoji in guild.emojis},
+        "server_sticker_ids_cache": set(guild.sticker_ids), "server_stickers_cache_objects": {},
+        "can_scan_invites": False, "can_scan_webhooks": False, "can_scan_integrations": False,
+        "can_scan_audit_log": False, "can_scan_reactions": can_scan_reactions, "can_scan_archived_threads": True,
+        "permission_audit_results": defaultdict(list),
+        "role_change_stats": Counter(), "user_role_changes": defaultdict(list),
+        "scan_id": None, "scan_started": True, "resume_checkpoint": None,
+        "active_location_progress": {}, "completed_location_results": {},
+        "daily_user_location_counts": Counter(), "daily_location_hourly_counts": Counter(),
+        "incremental_mode": False, "location_checkpoints": {}, "message_index": None,
+        # Như đã có số liệu lần quét trước -> ước lượng đúng, kênh lớn được chia khoảng snowflake
+        "location_scan_stats": {location.id: {"message_count": location._source.message_count} for location in guild.iter_locations()},
+        "location_size_estimates": {},
+    }
+    set_scan_window(scan_data, None)
+    return scan_data
+
+
+def _peak_rss_mb() -> Optional[float]:
+    peak = peak_rss_bytes()
+    return peak / (1024 * 1024) if peak is not None else None
+
+
+async def run_pipeline(guild: FakeGuild, keywords: List[str], can_scan_reactions: bool, skip_export: bool, build_start: float, label: str) -> Dict[str, Any]:
+    """Chạy các pha quét -> xử lý -> xếp hạng -> export trên guild giả, trả về số liệu từng pha."""
+    config.SCAN_RECORD_DIR = "" # Không ghi lại history của guild giả
+    scan_data = new_scan_data(guild, keywords, can_scan_reactions)
+    utils.set_member_snapshot(utils.MemberSnapshot(guild, guild.members, complete=True))
+    phases: List[Dict[str, Any]] = [{"name": "setup", "seconds": time.perf_counter() - build_start, "peak_rss_mb": _peak_rss_mb()}]
+
+    async def _phase(name: str, coro):
+        phase_start = time.perf_counter()
+        result = await coro
+        phases.append({"name": name, "seconds": time.perf_counter() - phase_start, "peak_rss_mb": _peak_rss_mb()})
+        return result
+
+    await _phase("scan", scan_all_channels_and_threads(scan_data))
+    scan_data["scan_end_time"] = discord.utils.utcnow()
+    await _phase("additional_data", process_additional_data(scan_data))
+    await _phase("ranking", _prepare_ranking_data(scan_data, guild))
+    if not skip_export:
+        await _phase("export", generate_export_files(scan_data))
+    await utils.release_member_snapshot(guild)
+
+    export_bytes = 0
+    for export_file in scan_data["files_to_send"]:
+        export_file.fp.seek(0, 2); export_bytes += export_file.fp.tell()
+    return {
+        "label": label, "expected": guild.total_messages, "scanned": scan_data["overall_total_message_count"],
+        "locations": len(scan_data["completed_location_results"]), "users": len(scan_data["user_stats"]),
+        "errors": len(scan_data["scan_errors"]), "export_files": len(scan_data["files_to_send"]),
+        "export_mb": export_bytes / (1024 * 1024), "phases": phases,
+    }
+
+
+def _run_size(args: argparse.Namespace, size: int) -> Dict[str, Any]:
+    """Chạy trong process con (mỗi kích thước một process) để ru_maxrss chỉ phản ánh lần chạy này."""
+    logging.basicConfig(level=logging.WARNING if not args.verbose else logging.INFO)
+    logging.getLogger().setLevel(logging.WARNING if not args.verbose else logging.INFO)
+    build_start = time.perf_counter()
+    guild = SyntheticGuild(args, size)
+    keywords = list(KEYWORDS) if args.keyword_rate > 0 else []
+    return asyncio.run(run_pipeline(guild, keywords, args.reaction_rate > 0, args.skip_export, build_start, f"{size:,} tin"))
+
+
+def print_result(result: Dict[str, Any]):
+    phases = {phase["name"]: phase for phase in result["phases"]}
+    scan_seconds = phases["scan"]["seconds"]
+    pipeline_seconds = sum(phase["seconds"] for phase in result["phases"] if phase["name"] != "setup")
+    print(
+        f"\n== {result['label']} ({result['locations']} kênh/luồng, {result['users']:,} user, {result['errors']} lỗi) ==\n"
+        f"  quét: {result['scanned']:,} tin trong {scan_seconds:.2f}s (~{result['scanned'] / max(scan_seconds, 1e-9):,.0f} msg/s), "
+        f"cả pipeline ~{result['scanned'] / max(pipeline_seconds, 1e-9):,.0f} msg/s"
+    )
+    for phase in result["phases"]:
+        rss = f"{phase['peak_rss_mb']:.0f} MB" if phase["peak_rss_mb"] is not None else "n/a"
+        print(f"  {phase['name']:<16} {phase['seconds']:>9.2f}s   RSS cao nhất tới lúc này: {rss}")
+    if "export" in phases:
+        print(f"  export: {result['export_files']} file, {result['export_mb']:.1f} MB")
+    if result["scanned"] != result["expected"]:
+        print(f"  SAI: quét được {result['scanned']:,} / có {result['expected']:,} tin")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,1000000,10000000", help="Các tổng số tin, cách nhau bởi dấu phẩy")
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--threads-per-channel", type=int, default=4, help="Nửa đang mở, nửa đã lưu trữ")
+    parser.add_argument("--thread-share", type=float, default=0.2, help="Tỉ lệ tin của mỗi kênh nằm trong luồng con")
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--emoji-rate", type=float, default=0.15)
+    parser.add_argument("--sticker-rate", type=float, default=0.02)
+    parser.add_argument("--mention-rate", type=float, default=0.08)
+    parser.add_argument("--keyword-rate", type=float, default=0.01, help="0 = không tìm keyword")
+    parser.add_argument("--link-rate", type=float, default=0.05)
+    parser.add_argument("--attachment-rate", type=float, default=0.04)
+    parser.add_argument("--reply-rate", type=float, default=0.2)
+    parser.add_argument("--reaction-rate", type=float, default=0.03, help="0 = tắt quét reaction")
+    parser.add_argument("--page-latency", type=float, default=0.0, help="Độ trễ giả lập mỗi trang history/luồng lưu trữ (giây)")
+    parser.add_argument("--reaction-latency", type=float, default=0.0, help="Độ trễ giả lập mỗi lần lấy người thả reaction (giây)")
+    parser.add_argument("--skip-export", action="store_true", help="Bỏ qua bước tạo file CSV/JSON")
+    parser.add_argument("--verbose", action="store_true", help="Hiện log INFO của pipeline")
+    args = parser.parse_args()
+    sizes = [int(size.replace("_", "")) for size in args.sizes.split(",") if size.strip()]
+
+    mp_context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as executor:
+            print_result(executor.submit(_run_size, args, size).result())
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE benchmarks/bench_scan_pipeline.py ---
@@ -0,0 +1,164 @@
+# --- START OF FILE benchmarks/bench_scan_replay.py ---
+"""
+Replay bản ghi history thật (ghi khi quét với SCAN_RECORD_DIR) qua pipeline quét, không gọi Discord/Postgres.
+Payload được dựng lại thành discord.Message bằng constructor của discord.py (như khi fetch thật), chia trang 100 tin
+theo đúng after/before mà pipeline yêu cầu, nên so sánh hiệu năng trên nội dung thật (tiếng Việt, mật độ emoji, file...)
+và lặp lại được. Người thả reaction không được ghi lại: replay chọn tất định trong số tác giả của bản ghi.
+Chạy: python benchmarks/bench_scan_replay.py scan_recordings/<guild_id>/scan_<id> --keywords "abc,xyz" --page-latency 0
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from typing import Dict, Any, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, PROJECT_ROOT)
+os.environ.setdefault("DISCORD_TOKEN", "benchmark") # config chỉ đọc biến môi trường, không kết nối gì
+
+import discord # noqa: E402
+from cogs.deep_scan_helpers.history_recorder import ( # noqa: E402
+    LOCATION_FILE_SUFFIX, load_recording_manifest, load_recording_anonymizer, read_location_recording
+)
+from bench_scan_pipeline import ( # noqa: E402
+    FakeGuild, FakeMember, FakeReaction, FakeTextChannel, FakeThread, make_fake_emoji, run_pipeline, print_result
+)
+
+
+class ReplayState:
+    """State tối thiểu để discord.Message dựng tin từ payload: cache user như ConnectionState, không HTTP."""
+
+    def __init__(self, guild: "ReplayGuild"):
+        self.http = None
+        self._emojis: Dict[int, discord.Emoji] = {emoji.id: emoji for emoji in guild.emojis}
+        self._users: Dict[int, discord.User] = {}
+
+    def store_user(self, data: Dict[str, Any], *, cache: bool = True) -> discord.User:
+        user_id = int(data["id"])
+        user = self._users.get(user_id)
+        if user is None:
+            user = discord.User(state=self, data=data)
+            if cache: self._users[user_id] = user
+        return user
+
+    create_user = store_user
+
+    def get_reaction_emoji(self, data: Dict[str, Any]):
+        emoji_id = int(data["id"]) if data.get("id") else None
+        if not emoji_id: return data["name"]
+        return self._emojis.get(emoji_id) or discord.PartialEmoji(name=data.get("name"), id=emoji_id, animated=data.get("animated", False))
+
+    def _get_guild(self, guild_id: Optional[int]):
+        return None
+
+
+class ReplayHistory:
+    """History của một location từ bản ghi: dòng JSON sắp theo ID, chỉ parse + dựng discord.Message khi trang được đọc."""
+
+    def __init__(self, replay_guild: "ReplayGuild", records: List[Tuple[int, str]]):
+        self._guild = replay_guild
+        self._ids = [message_id for message_id, _ in records]
+        self._lines = [line for _, line in records]
+        self.message_count = len(records)
+        self.last_message_id = self._ids[-1] if self._ids else None
+        self.location = None # Gán sau khi tạo kênh/luồng
+
+    def index_after(self, message_id: int) -> int:
+        return bisect_right(self._ids, message_id)
+
+    def index_before(self, message_id: int) -> int:
+        return bisect_left(self._ids, message_id)
+
+    def message_at(self, index: int) -> discord.Message:
+        return self._guild.build_message(self.location, self._lines[index])
+
+
+class ReplayGuild(FakeGuild):
+    """Guild dựng từ thư mục bản ghi: kênh/luồng theo header từng file, member là các tác giả có trong bản ghi."""
+
+    def __init__(self, recording_dir: str, page_latency: float, reaction_latency: float):
+        manifest = load_recording_manifest(recording_dir)
+        location_files = sorted(glob.glob(os.path.join(recording_dir, f"*{LOCATION_FILE_SUFFIX}")))
+        if not location_files:
+            raise SystemExit(f"Không có file {LOCATION_FILE_SUFFIX} nào trong '{recording_dir}'.")
+        loaded: List[Tuple[Dict[str, Any], List[Tuple[int, str]]]] = []
+        authors: Dict[int, bool] = {}
+        for path in location_files:
+            header, records, location_authors = read_location_recording(path)
+            loaded.append((header, records))
+            authors.update(location_authors)
+
+        members = [FakeMember(author_id, is_bot=is_bot) for author_id, is_bot in sorted(authors.items())]
+        super().__init__(manifest["guild_id"], manifest.get("name") or "Replay Guild", members, page_latency, reaction_latency)
+        self.anonymized = bool(manifest.get("anonymized"))
+        self.emojis = [make_fake_emoji(self, emoji["id"], emoji.get("name") or f"e{index}", emoji.get("animated", False)) for index, emoji in enumerate(manifest.get("emojis", []))]
+        self.sticker_ids = list(manifest.get("sticker_ids", []))
+        self._state = ReplayState(self)
+
+        channels_by_id: Dict[int, FakeTextChannel] = {}
+        thread_entries = []
+        for header, records in loaded:
+            if header.get("parent_id"):
+                thread_entries.append((header, records)); continue
+            source = ReplayHistory(self, records)
+            channel = FakeTextChannel(self, header["id"], header.get("name") or str(header["id"]), len(channels_by_id), source)
+            source.location = channel
+            channels_by_id[channel.id] = channel
+        for header, records in thread_entries:
+            parent = channels_by_id.get(header["parent_id"])
+            if parent is None: # Kênh cha không được ghi (vd: lỗi quyền) -> kênh rỗng để giữ luồng
+                empty_source = ReplayHistory(self, [])
+                parent = FakeTextChannel(self, header["parent_id"], f"kenh-{header['parent_id']}", len(channels_by_id), empty_source)
+                empty_source.location = parent
+                channels_by_id[parent.id] = parent
+            source = ReplayHistory(self, records)
+            source.location = FakeThread(self, parent, header["id"], header.get("name") or str(header["id"]), header.get("owner_id"), source, archived=bool(header.get("archived")))
+        self.channels = list(channels_by_id.values())
+
+    def build_message(self, location, line: str) -> discord.Message:
+        message = discord.Message(state=self._state, channel=location, data=json.loads(line))
+        if message.reactions:
+            # Người thả không có trong bản ghi -> chọn tất định trong số tác giả (đúng số lượt thả, tối đa số user)
+            picker = random.Random(message.id)
+            message.reactions = [
+                FakeReaction(reaction.emoji, picker.sample(self.user_ids, min(reaction.count, len(self.user_ids))), self._members_by_id, self.reaction_latency, count=reaction.count)
+                for reaction in message.reactions
+            ]
+        return message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording_dir", help="Thư mục một lần quét: <SCAN_RECORD_DIR>/<guild_id>/scan_<id>")
+    parser.add_argument("--keywords", default="", help="Keyword tìm khi replay (bản ẩn danh: tự xáo giống nội dung nếu còn file salt)")
+    parser.add_argument("--no-reactions", action="store_true", help="Tắt quét người thả reaction")
+    parser.add_argument("--page-latency", type=float, default=0.0, help="Độ trễ giả lập mỗi trang history/luồng lưu trữ (giây)")
+    parser.add_argument("--reaction-latency", type=float, default=0.0, help="Độ trễ giả lập mỗi lần lấy người thả reaction (giây)")
+    parser.add_argument("--skip-export", action="store_true", help="Bỏ qua bước tạo file CSV/JSON")
+    parser.add_argument("--verbose", action="store_true", help="Hiện log INFO của pipeline")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    build_start = time.perf_counter()
+    guild = ReplayGuild(args.recording_dir, args.page_latency, args.reaction_latency)
+    keywords = [keyword.strip().lower() for keyword in args.keywords.split(",") if keyword.strip()]
+    if keywords and guild.anonymized:
+        anonymizer = load_recording_anonymizer(args.recording_dir)
+        if anonymizer is None:
+            print("Cảnh báo: bản ghi ẩn danh nhưng không thấy file salt -> keyword sẽ không khớp nội dung.")
+        else:
+            keywords = [anonymizer.text(keyword) for keyword in keywords]
+    label = f"replay {os.path.basename(os.path.normpath(args.recording_dir))}: {guild.total_messages:,} tin"
+    print_result(asyncio.run(run_pipeline(guild, keywords, not args.no_reactions, args.skip_export, build_start, label)))
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE benchmarks/bench_scan_replay.py ---
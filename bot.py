@@ -23,6 +23,8 @@ import config
 import database
 import discord_logging
 import utils
+import rest_scheduler
+import metrics
 from bot_core import setup as bot_setup
 from bot_core import events as bot_events
 
@@ -32,7 +34,8 @@ log = logging.getLogger(__name__)
 class ShiromiBot(commands.Bot):
     def __init__(self, intents: discord.Intents):
         # Sử dụng hàm để lấy prefix, cho phép prefix thay đổi dựa trên người gửi
-        super().__init__(command_prefix=self._get_prefix, intents=intents, help_command=None)
+        # http_trace: cho rest_scheduler thấy 429 / X-RateLimit-Remaining của mọi request REST
+        super().__init__(command_prefix=self._get_prefix, intents=intents, help_command=None, http_trace=rest_scheduler.build_http_trace())
 
         # Đặt owner_id từ ADMIN_USER_ID trong config, nếu có.
         # Điều này quan trọng cho @commands.is_owner() hoạt động đúng với người dùng thật.
@@ -130,9 +133,12 @@ class ShiromiBot(commands.Bot):
         await database.connect_db()
         loop = asyncio.get_running_loop()
         discord_logging.start_discord_log_thread(loop)
+        self.metrics_server = await metrics.start_metrics_server()
         log.info("Đang tải Cogs...")
         initial_extensions = [
             "cogs.deep_scan_cog",
+            "cogs.live_ingest_cog",
+            "cogs.message_reconcile_cog",
         ]
         for extension in initial_extensions:
             try:
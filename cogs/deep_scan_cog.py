@@ -12,6 +12,7 @@ import config
 import utils
 import database
 import discord_logging
+import metrics
 
 # Import các helper functions từ thư mục deep_scan_helpers
 from .deep_scan_helpers import (
@@ -21,6 +22,21 @@ from .deep_scan_helpers import (
 )
 # Import hàm chuẩn bị ranking data từ dm_sender
 from .deep_scan_helpers.dm_sender import _prepare_ranking_data
+from .deep_scan_helpers.incremental_scan import save_incremental_scan_state
+from .deep_scan_helpers.scan_planner import save_location_size_history
+from .deep_scan_helpers.scan_options import parse_scan_options
+from .deep_scan_helpers.scan_worker import start_scan_worker
+from .deep_scan_helpers.activity_rollups import set_scan_window, save_activity_rollups, build_window_report_embeds
+from .deep_scan_helpers.user_stats import UserStatsStore
+from .deep_scan_helpers.activity_grid import ActivityGrid
+from .deep_scan_helpers.scan_profiler import ScanProfiler, PROFILE_COMPARE_MAX_SCANS, build_profile_comparison_embed
+from .deep_scan_helpers.scan_checkpoint import (
+    load_scan_checkpoint, restore_scan_checkpoint, save_scan_checkpoint, remove_scan_checkpoint,
+    start_periodic_checkpoints, stop_periodic_checkpoints
+)
+from .deep_scan_helpers.scan_memory import (
+    start_scan_memory_monitor, stop_scan_memory_monitor, acquire_spill_store, release_spill_store
+)
 
 
 
@@ -42,14 +58,19 @@ async def save_aggregated_results_to_db(scan_data: Dict[str, Any], ranking_data:
     processed_user_ids = set() # Để tránh trùng lặp nếu user_activity có key lạ
 
     # Lấy cache member để lấy tên hiển thị
-    member_cache: Dict[int, discord.Member] = {m.id: m for m in scan_data.get("current_members_list", [])}
+    member_snapshot: Optional[utils.MemberSnapshot] = scan_data.get("member_snapshot")
+    member_cache: Dict[int, discord.Member] = member_snapshot.members() if member_snapshot else {m.id: m for m in scan_data.get("current_members_list", [])}
+    if member_snapshot:
+        # User đã rời server: lấy tên/avatar từ cache hồ sơ (không gọi REST), ghi lại các user vừa fetch trong lúc quét
+        await member_snapshot.load_cached_profiles([uid for uid in scan_data.get("user_activity", {}) if isinstance(uid, int)])
+        await member_snapshot.flush_profile_cache()
 
     for user_id, user_act_data in scan_data.get("user_activity", {}).items():
         if not isinstance(user_id, int) or user_id in processed_user_ids:
             continue
         processed_user_ids.add(user_id)
 
-        member = member_cache.get(user_id)
+        member = member_cache.get(user_id) or (member_snapshot.get(user_id) if member_snapshot else None)
         display_name = member.display_name if member else f"User {user_id}"
         avatar_url = str(member.display_avatar.url) if member and member.display_avatar else None
 
@@ -117,6 +138,19 @@ class ServerDeepScan(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.scan_worker_task: Optional[asyncio.Task] = None
+
+    async def cog_load(self):
+        # Process này nhận job quét phân tán (của chính nó hoặc process coordinator khác)
+        self.scan_worker_task = start_scan_worker(self.bot)
+        if config.SCAN_DISTRIBUTED and not self.scan_worker_task:
+            log.warning("SCAN_DISTRIBUTED đang bật nhưng process này không nhận job (SCAN_WORKER_ENABLED=false): cần ít nhất một process worker.")
+
+    async def cog_unload(self):
+        if self.scan_worker_task:
+            self.scan_worker_task.cancel()
+            await asyncio.gather(self.scan_worker_task, return_exceptions=True)
+            self.scan_worker_task = None
 
     async def cog_check(self, ctx: commands.Context) -> bool:
         """
@@ -147,6 +181,24 @@ class ServerDeepScan(commands.Cog):
         overall_start_time = discord.utils.utcnow()
         e = lambda name: utils.get_emoji(name, self.bot)
 
+        # Tách cờ (--resume, --days, --since, ...) ra khỏi keywords
+        scan_options, keywords = parse_scan_options(keywords)
+        scan_since: Optional[datetime.datetime] = scan_options.get("since")
+        resume_checkpoint: Optional[Dict[str, Any]] = None
+        if scan_options.get("resume"):
+            resume_checkpoint = await load_scan_checkpoint(ctx.guild.id)
+            if not resume_checkpoint:
+                await ctx.send(f"{e('error')} Không tìm thấy checkpoint quét nào của server này để tiếp tục.")
+                if ctx.command: ctx.command.reset_cooldown(ctx)
+                return
+            # Tiếp tục đúng cấu hình của lần quét bị gián đoạn
+            saved_options = resume_checkpoint.get("options", {})
+            export_csv = saved_options.get("export_csv", export_csv)
+            export_json = saved_options.get("export_json", export_json)
+            admin_dm_test = saved_options.get("admin_dm_test", admin_dm_test)
+            keywords = saved_options.get("keywords_str")
+            scan_since = saved_options.get("scan_since")
+
         # Khởi tạo scan_data với các giá trị mặc định
         scan_data: Dict[str, Any] = {
             "server": ctx.guild, "bot": self.bot, "ctx": ctx,
@@ -174,26 +226,24 @@ class ServerDeepScan(commands.Cog):
             "thread_keyword_counts": defaultdict(Counter), "user_keyword_counts": defaultdict(Counter),
             "reaction_emoji_counts": Counter(), "filtered_reaction_emoji_counts": Counter(),
             "sticker_usage_counts": Counter(), "overall_custom_sticker_counts": Counter(),
-            "invite_usage_counts": Counter(), "user_link_counts": Counter(),
-            "user_image_counts": Counter(), "user_other_file_counts": Counter(),
-            "user_emoji_counts": Counter(), "user_custom_emoji_content_counts": defaultdict(Counter),
-            "overall_custom_emoji_content_counts": Counter(), "user_sticker_counts": Counter(),
-            "user_mention_given_counts": Counter(), "user_distinct_mention_given_counts": TypingDefaultDict(set),
-            "user_mention_received_counts": Counter(), "user_reply_counts": Counter(),
-            "user_reaction_received_counts": Counter(), "user_reaction_given_counts": Counter(),
+            "invite_usage_counts": Counter(),
+            # Bảng thống kê user dạng cột; user_activity và các Counter theo user
+            # (user_link_counts, user_reply_counts, ...) được sinh từ đây sau khi quét kênh xong
+            "user_stats": UserStatsStore(),
+            "user_custom_emoji_content_counts": defaultdict(Counter),
+            "overall_custom_emoji_content_counts": Counter(),
+            "user_distinct_mention_given_counts": TypingDefaultDict(set),
             "user_reaction_emoji_given_counts": defaultdict(Counter),
             "user_thread_creation_counts": Counter(),
             "tracked_role_grant_counts": Counter(),
             "user_distinct_channel_counts": Counter(),
             "user_channel_message_counts": defaultdict(lambda: defaultdict(int)),
             "user_most_active_channel": {},
-            "user_activity_message_counts": Counter(),
-            "user_total_custom_emoji_content_counts": Counter(),
             "user_sticker_id_counts": defaultdict(Counter),
-            "server_hourly_activity": Counter(),
-            "channel_hourly_activity": defaultdict(Counter),
-            "thread_hourly_activity": defaultdict(Counter),
-            "user_hourly_activity": defaultdict(Counter),
+            "server_hourly_activity": ActivityGrid(),
+            "channel_hourly_activity": ActivityGrid(),
+            "thread_hourly_activity": ActivityGrid(),
+            "user_hourly_activity": ActivityGrid(),
             "user_emoji_received_counts": defaultdict(Counter),
             "current_members_list": [], "initial_member_status_counts": Counter(),
             "channel_counts": Counter(), "all_roles_list": [], "boosters": [],
@@ -211,26 +261,49 @@ class ServerDeepScan(commands.Cog):
             "permission_audit_results": defaultdict(list),
             "role_change_stats": Counter(), "user_role_changes": defaultdict(list),
             "scan_id": None, # Sẽ được điền sau khi tạo record
-            "scan_started": False # Cờ để biết đã qua init chưa
+            "scan_started": False, # Cờ để biết đã qua init chưa
+            "resume_checkpoint": resume_checkpoint,
+            "active_location_progress": {}, "completed_location_results": {},
+            "daily_user_location_counts": Counter(), "daily_location_hourly_counts": Counter(),
         }
+        set_scan_window(scan_data, scan_since)
 
         scan_id: Optional[int] = None
+        checkpoint_task: Optional[asyncio.Task] = None
+        memory_monitor = None # Đo bộ nhớ dữ liệu tổng hợp + đổ bớt xuống đĩa khi vượt ngân sách
+        profiler = ScanProfiler(scan_id=None) # Đo từng pha, lưu vào cột scans.profile khi kết thúc
+        scan_failed = True
+        live_ingest = self.bot.get_cog("LiveIngest") # Ghi nhận trực tiếp: tạm giữ sự kiện trong lúc quét
+        message_reconcile = self.bot.get_cog("MessageReconcile") # Đối soát xóa/sửa: chờ quét lưu xong dữ liệu tổng hợp
+        metrics.SCAN_ACTIVE.set(1, guild_id=ctx.guild.id)
+        metrics.LOCATION_MESSAGES.clear(guild_id=ctx.guild.id) # Chỉ giữ số liệu kênh/luồng của lần quét gần nhất
+        metrics.LOCATION_SCAN_SECONDS.clear(guild_id=ctx.guild.id)
         try:
-            # Tạo bản ghi quét trong DB trước
-            scan_id = await database.create_scan_record(ctx.guild.id, ctx.author.id)
+            # Tạo bản ghi quét trong DB trước (resume thì dùng lại scan_id cũ)
+            if resume_checkpoint and resume_checkpoint.get("scan_id"):
+                scan_id = resume_checkpoint["scan_id"]
+                await database.update_scan_status(scan_id, status='running')
+                log.info(f"Tiếp tục quét từ checkpoint với scan_id: {scan_id}")
+            else:
+                scan_id = await database.create_scan_record(ctx.guild.id, ctx.author.id)
             if not scan_id:
                 await ctx.send(f"{e('error')} Không thể tạo bản ghi quét trong database. Vui lòng thử lại sau.")
                 if ctx.command: ctx.command.reset_cooldown(ctx)
                 return
             scan_data["scan_id"] = scan_id # Lưu scan_id vào data
+            profiler.scan_id = scan_id
             log.info(f"Đã khởi tạo quét với scan_id: {scan_id}")
 
             log.info(f"{e('loading')} Khởi tạo quét sâu cho server: [bold cyan]{scan_data['server'].name}[/] ({scan_data['server'].id})")
             if config.ENABLE_REACTION_SCAN: log.warning("[bold yellow]!!! Quét biểu cảm (Reaction Scan) đang BẬT. Quá trình quét có thể chậm hơn !!![/bold yellow]")
             if scan_data["admin_dm_test"]: log.info("[bold magenta]!!! Chế độ TEST DM đang BẬT. DM sẽ chỉ gửi đến ADMIN_USER_ID !!![/bold magenta]")
             else: log.info("[bold green]!!! Chế độ Gửi DM Bình Thường đang BẬT. DM sẽ gửi đến role cấu hình !!![/bold green]")
+            if scan_since: log.info(f"[bold cyan]Quét theo khoảng thời gian: chỉ tin nhắn từ {scan_since.date().isoformat()} (UTC).[/bold cyan]")
 
             # Bước 1: Khởi tạo và kiểm tra
+            profiler.start_phase("init")
+            if live_ingest: await live_ingest.pause_guild(ctx.guild.id)
+            if message_reconcile: await message_reconcile.pause_guild(ctx.guild.id)
             init_successful = await initialize_scan(scan_data)
             if not init_successful:
                  # Cập nhật trạng thái DB nếu init lỗi
@@ -238,14 +311,34 @@ class ServerDeepScan(commands.Cog):
                  if ctx.command: ctx.command.reset_cooldown(ctx)
                  return
 
-            # Bước 2: Quét kênh và luồng
+            if resume_checkpoint:
+                restore_scan_checkpoint(scan_data, resume_checkpoint)
+
+            # Bước 2: Quét kênh và luồng (checkpoint định kỳ + theo dõi bộ nhớ chạy nền)
+            profiler.start_phase("scan_channels")
+            checkpoint_task = start_periodic_checkpoints(scan_data)
+            memory_monitor = start_scan_memory_monitor(scan_data)
             await scan_all_channels_and_threads(scan_data)
+            await stop_scan_memory_monitor(memory_monitor); memory_monitor = None
+            await stop_periodic_checkpoints(checkpoint_task); checkpoint_task = None
             scan_data["scan_end_time"] = discord.utils.utcnow() # Thời điểm quét kênh xong
+            profiler.start_phase("save_scan_state")
+            if config.SCAN_CHECKPOINT_INTERVAL_SECONDS > 0:
+                await save_scan_checkpoint(scan_data) # Crash ở các bước sau sẽ không phải quét lại kênh
+
+            # Bước 2.1: Lưu checkpoint kênh + dữ liệu tổng hợp cho lần quét tăng dần sau, rollup theo ngày
+            incremental_state_saved = await save_incremental_scan_state(scan_data)
+            await save_activity_rollups(scan_data, incremental_state_saved)
+            if live_ingest: await live_ingest.resume_guild(ctx.guild.id, incremental_state_saved)
+            if message_reconcile: message_reconcile.resume_guild(ctx.guild.id)
+            await save_location_size_history(scan_data)
 
             # Bước 3: Xử lý dữ liệu phụ trợ (audit log, boosters, v.v.)
+            profiler.start_phase("additional_data")
             await process_additional_data(scan_data)
 
             # Bước 4: Lưu kết quả tổng hợp của user vào DB cho website
+            profiler.start_phase("db_save")
             try:
                 log.info(f"{e('loading')} Đang chuẩn bị dữ liệu xếp hạng để lưu...")
                 # <<< GỌI HÀM TỪ dm_sender >>>
@@ -261,21 +354,26 @@ class ServerDeepScan(commands.Cog):
                 await database.update_scan_status(scan_id, status='running', error=f"DB Save Error: {db_save_err}")
 
             # Bước 5: Tạo và gửi báo cáo Embeds vào kênh Discord
+            profiler.start_phase("reports")
             await generate_and_send_reports(scan_data)
 
             # Bước 6: Tạo file export nếu yêu cầu
             if scan_data["export_csv"] or scan_data["export_json"]:
+                profiler.start_phase("export")
                 await generate_export_files(scan_data)
             else:
                  log.info("Bỏ qua tạo file export do không có yêu cầu.")
 
+            profiler.end_phase()
             # Bước 7: Gửi DM cá nhân (chạy nền) nếu cấu hình
             should_send_dm = config.DM_REPORT_RECIPIENT_ROLE_ID or scan_data["admin_dm_test"]
             if should_send_dm:
                  is_testing = scan_data["admin_dm_test"]
                  log.debug(f"[Core Logic] Preparing to send DM. is_testing_mode flag from scan_data: {is_testing}")
                  log.info(f"{e('loading')} Bắt đầu gửi báo cáo DM cá nhân...")
-                 asyncio.create_task(send_personalized_dm_reports(scan_data, is_testing_mode=is_testing), name=f"DMReportSender-{ctx.guild.id}")
+                 acquire_spill_store(scan_data) # Task nền còn đọc các bảng đã đổ xuống đĩa
+                 if scan_data.get("member_snapshot") is not None: scan_data["member_snapshot"].acquire() # ... và còn tra member khi dựng DM
+                 asyncio.create_task(self._send_dm_reports_profiled(scan_data, profiler, is_testing), name=f"DMReportSender-{ctx.guild.id}")
                  log.info("Đã tạo task gửi DM chạy nền.")
             else:
                  log.info("Bỏ qua gửi DM do chưa cấu hình role người nhận và không bật test mode.")
@@ -301,6 +399,8 @@ class ServerDeepScan(commands.Cog):
                 error=final_error
             )
             log.info(f"Scan {scan_id} được đánh dấu là '{final_status}' trong DB." + (f" Lỗi: {final_error}" if final_error else ""))
+            remove_scan_checkpoint(ctx.guild.id)
+            scan_failed = False
 
         # --- Xử lý các Exception cụ thể ---
         except commands.BotMissingPermissions as bmp_error:
@@ -324,6 +424,11 @@ class ServerDeepScan(commands.Cog):
             log.critical(f"{e('error')} LỖI KHÔNG MONG MUỐN trong quá trình quét sâu:", exc_info=True)
             error_msg = f"Unexpected Error: {type(ex).__name__} - {str(ex)[:200]}"
             scan_data["scan_errors"].append(f"Lỗi nghiêm trọng không xác định: {type(ex).__name__} - {str(ex)[:200]}")
+            # Lưu checkpoint cuối để có thể --resume
+            if scan_data.get("scan_started") and config.SCAN_CHECKPOINT_INTERVAL_SECONDS > 0:
+                await stop_scan_memory_monitor(memory_monitor); memory_monitor = None
+                await stop_periodic_checkpoints(checkpoint_task); checkpoint_task = None
+                await save_scan_checkpoint(scan_data)
             # Cập nhật DB với trạng thái failed
             if scan_id: await database.update_scan_status(scan_id, status='failed', error=error_msg, end_time=discord.utils.utcnow())
             # Thông báo cho người dùng
@@ -334,12 +439,31 @@ class ServerDeepScan(commands.Cog):
 
         # --- Khối Finally: Luôn chạy để dọn dẹp ---
         finally:
+            await stop_scan_memory_monitor(memory_monitor)
+            await stop_periodic_checkpoints(checkpoint_task)
+            if live_ingest: await live_ingest.resume_guild(ctx.guild.id, False) # Quét dừng trước khi lưu checkpoint -> bỏ dữ liệu giữ lại
+            if message_reconcile: message_reconcile.resume_guild(ctx.guild.id)
             # Bước 9: Gửi tin nhắn hoàn tất cuối cùng và dọn dẹp
             await finalize_scan(scan_data) # Gửi tin nhắn trung gian A, dọn dẹp status msg
             discord_logging.set_log_target_thread(None) # Reset target log
+            if scan_data.get("member_snapshot") is not None: await utils.release_member_snapshot(ctx.guild, scan_data["member_snapshot"])
+            metrics.SCAN_ACTIVE.set(0, guild_id=ctx.guild.id)
+            profiler.finish(scan_data, failed=scan_failed)
+            await profiler.save()
+            release_spill_store(scan_data)
             log.info(f"[dim]Hoàn tất dọn dẹp sau lệnh {ctx.command.name if ctx.command else 'unknown'}.[/dim]")
 
 
+    async def _send_dm_reports_profiled(self, scan_data: Dict[str, Any], profiler: ScanProfiler, is_testing_mode: bool):
+        """Gửi DM cá nhân (task nền) và ghi thêm pha gửi DM vào profile của lần quét."""
+        try:
+            with profiler.phase("dm_reports"):
+                await send_personalized_dm_reports(scan_data, is_testing_mode=is_testing_mode)
+        finally:
+            await profiler.save()
+            if scan_data.get("member_snapshot") is not None: await utils.release_member_snapshot(scan_data["server"], scan_data["member_snapshot"])
+            release_spill_store(scan_data)
+
     # --- Các lệnh command ---
     @commands.command(
         name='romi',
@@ -348,7 +472,9 @@ class ServerDeepScan(commands.Cog):
             "Thực hiện quét sâu server (CHẾ ĐỘ TEST).\n"
             "Các báo cáo DM sẽ được gửi đến ADMIN_USER_ID trong file .env.\n"
             "Usage: `Shiromi romi [export_csv=True/False] [export_json=True/False] [keywords=từ khóa1,từ khóa2]`\n"
-            "Mặc định không export file và không tìm keywords."
+            "Mặc định không export file và không tìm keywords.\n"
+            "Thêm `--resume` vào cuối để tiếp tục lần quét bị gián đoạn từ checkpoint.\n"
+            "Thêm `--days N` hoặc `--since YYYY-MM-DD` để chỉ quét tin nhắn trong khoảng thời gian đó."
         ),
         brief='(OWNER/PROXY) Quét sâu, gửi DM test cho admin.'
     )
@@ -365,7 +491,9 @@ class ServerDeepScan(commands.Cog):
             "Thực hiện quét sâu server (CHẾ ĐỘ BÌNH THƯỜNG).\n"
             "Các báo cáo DM sẽ được gửi đến những người dùng có role được cấu hình trong DM_REPORT_RECIPIENT_ROLE_ID.\n"
             "Usage: `Shiromirun [export_csv=True/False] [export_json=True/False] [keywords=từ khóa1,từ khóa2]`\n"
-            "Mặc định không export file và không tìm keywords."
+            "Mặc định không export file và không tìm keywords.\n"
+            "Thêm `--resume` vào cuối để tiếp tục lần quét bị gián đoạn từ checkpoint.\n"
+            "Thêm `--days N` hoặc `--since YYYY-MM-DD` để chỉ quét tin nhắn trong khoảng thời gian đó."
         ),
         brief='(OWNER/PROXY) Quét sâu, gửi DM cho role cấu hình.'
     )
@@ -375,6 +503,52 @@ class ServerDeepScan(commands.Cog):
         """Lệnh quét sâu ở chế độ bình thường."""
         await self._perform_deep_scan(ctx=ctx, export_csv=export_csv, export_json=export_json, admin_dm_test=False, keywords=keywords)
 
+    @commands.command(
+        name='activity',
+        aliases=['hoatdong'],
+        help=(
+            "Báo cáo hoạt động trong một khoảng thời gian từ dữ liệu rollup của các lần quét trước (không quét lại).\n"
+            "Usage: `Shiromi activity [--days N | --since YYYY-MM-DD]` (mặc định 7 ngày gần nhất)."
+        ),
+        brief='(OWNER/PROXY) Báo cáo hoạt động N ngày qua từ dữ liệu đã lưu.'
+    )
+    @commands.guild_only()
+    async def window_activity_report(self, ctx: commands.Context, *, options: Optional[str] = None):
+        """Gửi embed báo cáo khoảng thời gian bằng SQL trên rollup theo ngày."""
+        e = lambda name: utils.get_emoji(name, self.bot)
+        window_options, _ = parse_scan_options(options or "--days 7")
+        since: Optional[datetime.datetime] = window_options.get("since")
+        if not since:
+            await ctx.send(f"{e('error')} Khoảng thời gian không hợp lệ. Dùng `--days N` hoặc `--since YYYY-MM-DD`.")
+            return
+        async with ctx.typing():
+            embeds = await build_window_report_embeds(self.bot, ctx.guild, since)
+        if not embeds:
+            await ctx.send(f"{e('info')} Chưa có dữ liệu rollup nào từ {since.date().isoformat()}. Hãy chạy lệnh quét trước.")
+            return
+        for embed in embeds:
+            await ctx.send(embed=embed)
+
+    @commands.command(
+        name='scanprofile',
+        aliases=['profilequet'],
+        help=(
+            "So sánh profile (thời gian thực, CPU, request REST, query DB, bộ nhớ theo từng pha) của N lần quét gần nhất.\n"
+            f"Usage: `Shiromi scanprofile [N]` (mặc định 3, tối đa {PROFILE_COMPARE_MAX_SCANS})."
+        ),
+        brief='(OWNER/PROXY) So sánh profile các lần quét gần nhất.'
+    )
+    @commands.guild_only()
+    async def scan_profile_report(self, ctx: commands.Context, count: int = 3):
+        """Gửi embed so sánh profile các lần quét gần nhất của server."""
+        e = lambda name: utils.get_emoji(name, self.bot)
+        count = min(max(count, 1), PROFILE_COMPARE_MAX_SCANS)
+        scans = await database.get_recent_scan_profiles(ctx.guild.id, count)
+        if not scans:
+            await ctx.send(f"{e('info')} Chưa có lần quét nào có profile cho server này.")
+            return
+        await ctx.send(embed=build_profile_comparison_embed(self.bot, ctx.guild, scans))
+
     # Lệnh ping_shiromi để test Cog và quyền
     @commands.command(name='ping_shiromi', help="Kiểm tra bot Shiromi có hoạt động không.", brief="(OWNER/PROXY) Ping bot.")
     async def ping_shiromi_command(self, ctx: commands.Context):
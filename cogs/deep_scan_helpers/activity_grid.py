@@ -0,0 +1,118 @@
+# --- START OF FILE cogs/deep_scan_helpers/activity_grid.py ---
+import logging
+import sys
+from array import array
+from typing import Dict, List, Optional, Iterator, Tuple
+
+log = logging.getLogger(__name__)
+
+HOURS_PER_DAY = 24
+DAYS_PER_WEEK = 7
+GRID_CELLS = HOURS_PER_DAY * DAYS_PER_WEEK # 168 ô / hàng: [thứ][giờ]
+SERVER_GRID_KEY = 0 # server_hourly_activity chỉ có một hàng
+
+_HOUR_MS = 3_600_000
+_DAY_MS = 86_400_000
+_EMPTY_ROW = array('i', bytes(GRID_CELLS * 4)) # 168 số 0 (int32)
+
+
+def weekday_hour_of_ms(timestamp_ms: int) -> Tuple[int, int]:
+    """(thứ 0=Thứ Hai..6=Chủ Nhật, giờ 0-23) theo UTC. 1970-01-01 là Thứ Năm."""
+    return (timestamp_ms // _DAY_MS + 3) % DAYS_PER_WEEK, (timestamp_ms // _HOUR_MS) % HOURS_PER_DAY
+
+
+class ActivityGrid:
+    """
+    Ma trận hoạt động giờ x thứ (7 x 24, int32) cho nhiều key (server/location/user):
+    mỗi ID được gán một hàng, tất cả hàng nằm liền trong một array('i') (hàng r = cells[r*168:(r+1)*168]).
+    Thay cho defaultdict(Counter) {ID: {giờ: số}} - vài trăm byte/ID và có thêm trục thứ trong tuần.
+    """
+
+    def __init__(self):
+        self._row_of: Dict[int, int] = {}
+        self.row_keys = array('q')
+        self.cells = array('i')
+
+    def __len__(self) -> int:
+        return len(self.row_keys)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._row_of
+
+    def __bool__(self) -> bool:
+        return len(self.row_keys) > 0
+
+    def keys(self) -> Iterator[int]:
+        return iter(self.row_keys)
+
+    def row(self, key: int) -> int:
+        """Lấy (hoặc tạo mới) hàng của key. Ô (thứ, giờ) của hàng r: cells[r * GRID_CELLS + thứ * 24 + giờ]."""
+        row = self._row_of.get(key)
+        if row is None:
+            row = len(self.row_keys)
+            self._row_of[key] = row
+            self.row_keys.append(key)
+            self.cells.extend(_EMPTY_ROW)
+        return row
+
+    def find_row(self, key: int) -> Optional[int]:
+        return self._row_of.get(key)
+
+    def add(self, key: int, weekday: int, hour: int, count: int = 1):
+        self.cells[self.row(key) * GRID_CELLS + weekday * HOURS_PER_DAY + hour] += count
+
+    def row_cells(self, key: int) -> Optional[array]:
+        """Bản sao 168 ô của key (None nếu chưa có)."""
+        row = self._row_of.get(key)
+        if row is None: return None
+        return self.cells[row * GRID_CELLS:(row + 1) * GRID_CELLS]
+
+    def hourly(self, key: int) -> List[int]:
+        """24 số tin theo giờ (cộng qua các thứ)."""
+        totals = [0] * HOURS_PER_DAY
+        row_cells = self.row_cells(key)
+        if row_cells is None: return totals
+        for weekday in range(DAYS_PER_WEEK):
+            offset = weekday * HOURS_PER_DAY
+            for hour in range(HOURS_PER_DAY):
+                totals[hour] += row_cells[offset + hour]
+        return totals
+
+    def weekday_totals(self, key: int, offset_hours: int = 0) -> List[int]:
+        """
+        7 số tin theo thứ (Thứ Hai..Chủ Nhật). offset_hours: lệch múi giờ so với UTC -
+        hàng là 168 giờ liên tiếp trong tuần nên chỉ cần dời chỉ số ô để tính theo ngày giờ địa phương.
+        """
+        totals = [0] * DAYS_PER_WEEK
+        row_cells = self.row_cells(key)
+        if row_cells is None: return totals
+        for index, count in enumerate(row_cells):
+            if count: totals[((index + offset_hours) % GRID_CELLS) // HOURS_PER_DAY] += count
+        return totals
+
+    def total(self, key: int) -> int:
+        row_cells = self.row_cells(key)
+        return sum(row_cells) if row_cells is not None else 0
+
+    def merge(self, other: "ActivityGrid"):
+        """Cộng dồn ma trận khác (vd: kết quả từng phần của worker quét phân tán) vào ma trận này."""
+        for other_row, key in enumerate(other.row_keys):
+            base = self.row(key) * GRID_CELLS
+            other_base = other_row * GRID_CELLS
+            for offset in range(GRID_CELLS):
+                count = other.cells[other_base + offset]
+                if count: self.cells[base + offset] += count
+
+    def copy(self) -> "ActivityGrid":
+        """Bản sao độc lập (copy array, nhanh) để checkpoint pickle trong thread."""
+        clone = ActivityGrid.__new__(ActivityGrid)
+        clone._row_of = self._row_of.copy()
+        clone.row_keys = self.row_keys[:]
+        clone.cells = self.cells[:]
+        return clone
+
+    def approx_bytes(self) -> int:
+        """Ước lượng bộ nhớ (array + dict hàng), dùng cho ngân sách bộ nhớ khi quét."""
+        return sys.getsizeof(self.cells) + sys.getsizeof(self.row_keys) + sys.getsizeof(self._row_of) + len(self._row_of) * 64
+
+# --- END OF FILE cogs/deep_scan_helpers/activity_grid.py ---
@@ -0,0 +1,155 @@
+# --- START OF FILE cogs/deep_scan_helpers/activity_rollups.py ---
+import discord
+from discord.ext import commands
+import logging
+import datetime
+from typing import Dict, Any, List, Optional, Set, Tuple
+from collections import Counter
+
+import config
+import database
+import utils
+from reporting import embeds_guild
+from .user_stats import datetime_to_ms, ms_to_snowflake
+from .activity_grid import ActivityGrid, SERVER_GRID_KEY
+
+log = logging.getLogger(__name__)
+
+ROLLUP_EPOCH_DATE = datetime.date(1970, 1, 1) # Ngày 0 của key rollup (timestamp_ms // DAY_MS)
+WINDOW_REPORT_TOP_USERS = 15
+WINDOW_REPORT_TOP_LOCATIONS = 10
+
+
+def set_scan_window(scan_data: Dict[str, Any], since: Optional[datetime.datetime]):
+    """Đặt mốc bắt đầu khoảng quét (--days/--since): history mọi location sẽ chỉ fetch after= mốc này."""
+    scan_data["scan_since"] = since
+    scan_data["scan_since_message_id"] = ms_to_snowflake(datetime_to_ms(since)) if since else None
+
+
+def rollup_day_to_date(day: int) -> datetime.date:
+    return ROLLUP_EPOCH_DATE + datetime.timedelta(days=day)
+
+
+def build_rollup_rows(
+    scan_data: Dict[str, Any],
+    included_location_ids: Optional[Set[int]] = None
+) -> Tuple[List[Tuple[datetime.date, int, int, int]], List[Tuple[datetime.date, int, int, int]]]:
+    """Dòng rollup (ngày, location, user, số tin) và (ngày, location, giờ, số tin); None = mọi location."""
+    daily_rows = [
+        (rollup_day_to_date(day), location_id, user_id, count)
+        for (day, location_id, user_id), count in scan_data.get("daily_user_location_counts", {}).items()
+        if included_location_ids is None or location_id in included_location_ids
+    ]
+    hourly_rows = [
+        (rollup_day_to_date(day), location_id, hour, count)
+        for (day, location_id, hour), count in scan_data.get("daily_location_hourly_counts", {}).items()
+        if included_location_ids is None or location_id in included_location_ids
+    ]
+    return daily_rows, hourly_rows
+
+
+def _collect_rollup_locations(scan_data: Dict[str, Any]) -> Tuple[Dict[int, int], Set[int]]:
+    """({location đã quét: tin mới nhất đã xử lý}, {location quét trọn vẹn không lỗi})."""
+    scanned: Dict[int, int] = {}
+    complete: Set[int] = set()
+    for channel_result in scan_data.get("channel_details", []):
+        for result in [channel_result] + list(channel_result.get("threads_data", [])):
+            if "newest_message_id" not in result: continue # Location chưa quét (bỏ qua/thiếu quyền)
+            scanned[result["id"]] = result.get("newest_message_id") or 0
+            if result.get("processed") and not result.get("error"):
+                complete.add(result["id"])
+    return scanned, complete
+
+
+async def save_activity_rollups(scan_data: Dict[str, Any], incremental_state_saved: bool):
+    """
+    Lưu số tin theo (ngày, kênh/luồng, user) và theo (ngày, kênh/luồng, giờ) sau khi quét kênh xong.
+    - Quét toàn bộ/theo khoảng: thay rollup của các location quét trọn vẹn (từ ngày bắt đầu khoảng), location lỗi giữ số cũ.
+    - Quét tăng dần: cộng phần tin mới, chỉ khi checkpoint tăng dần đã lưu (nếu không lần sau sẽ đọc lại đúng các tin này).
+    """
+    if not config.ENABLE_ACTIVITY_ROLLUPS:
+        return
+    server: discord.Guild = scan_data["server"]
+    incremental_mode = scan_data.get("incremental_mode", False)
+    if incremental_mode and not incremental_state_saved:
+        log.warning("Bỏ qua lưu rollup theo ngày: checkpoint quét tăng dần chưa được lưu nên lần sau sẽ đọc lại các tin này.")
+        scan_data["scan_errors"].append("Không lưu rollup theo ngày do checkpoint quét tăng dần chưa được lưu.")
+        return
+
+    scanned, complete = _collect_rollup_locations(scan_data)
+    included = set(scanned) if incremental_mode else complete
+    daily_rows, hourly_rows = build_rollup_rows(scan_data, included)
+    coverage_rows = [(location_id, scanned[location_id]) for location_id in included if scanned[location_id]]
+    scan_since: Optional[datetime.datetime] = scan_data.get("scan_since")
+
+    saved = await database.save_activity_rollups(
+        server.id, daily_rows, hourly_rows, coverage_rows,
+        replace_location_ids=None if incremental_mode else sorted(complete),
+        replace_from_day=scan_since.date() if scan_since else None
+    )
+    if not saved:
+        scan_data["scan_errors"].append("Lỗi DB: Không thể lưu rollup hoạt động theo ngày.")
+
+
+async def build_window_report_embeds(
+    bot: commands.Bot,
+    guild: discord.Guild,
+    since: datetime.datetime,
+    until: Optional[datetime.datetime] = None
+) -> List[discord.Embed]:
+    """Tạo embed báo cáo hoạt động trong khoảng [since, until] từ rollup đã lưu (chỉ SQL, không quét lại Discord)."""
+    e = lambda name: utils.get_emoji(name, bot)
+    since_day = since.date()
+    until_day = (until or discord.utils.utcnow()).date()
+    window = await database.get_activity_rollup_window(guild.id, since_day, until_day)
+    if not window or not window["user_counts"]:
+        return []
+
+    # Rollup không lưu cờ bot -> lọc theo member hiện tại của server
+    user_counts = Counter({
+        user_id: count for user_id, count in window["user_counts"].items()
+        if not getattr(guild.get_member(user_id), "bot", False)
+    })
+    server_grid = ActivityGrid()
+    location_grid = ActivityGrid()
+    location_totals: Counter = Counter()
+    for location_id, weekday_hour_counts in window["location_hourly"].items():
+        for (weekday, hour), count in weekday_hour_counts.items():
+            server_grid.add(SERVER_GRID_KEY, weekday, hour, count)
+            location_grid.add(location_id, weekday, hour, count)
+        location_totals[location_id] = sum(weekday_hour_counts.values())
+
+    summary_embed = discord.Embed(
+        title=f"{e('stats')} Hoạt động từ {since_day.isoformat()} đến {until_day.isoformat()} (UTC)",
+        color=discord.Color.blue()
+    )
+    summary_embed.description = (
+        f"*Tổng hợp từ dữ liệu các lần quét đã lưu ({window['day_count']} ngày có dữ liệu: "
+        f"{window['first_day']} → {window['last_day']}).*"
+    )
+    summary_embed.add_field(name="Tổng tin nhắn", value=f"{sum(location_totals.values()):,}", inline=True)
+    summary_embed.add_field(name="User hoạt động", value=f"{len(user_counts):,}", inline=True)
+    location_lines = []
+    for rank, (location_id, count) in enumerate(location_totals.most_common(WINDOW_REPORT_TOP_LOCATIONS), 1):
+        location_obj = guild.get_channel_or_thread(location_id)
+        location_label = f"{utils.get_channel_type_emoji(location_obj, bot)} {location_obj.mention}" if location_obj else f"`{location_id}`"
+        location_lines.append(f"**`#{rank}`**. {location_label}: {count:,} tin")
+    summary_embed.add_field(
+        name=f"Top {WINDOW_REPORT_TOP_LOCATIONS} Kênh/Luồng",
+        value="\n".join(location_lines) if location_lines else "Không có dữ liệu.",
+        inline=False
+    )
+
+    embeds: List[discord.Embed] = [summary_embed]
+    user_embed = await utils.create_user_leaderboard_embed(
+        title=f"BXH User Gửi Tin Nhắn Nhiều Nhất ({since_day.isoformat()} → {until_day.isoformat()})",
+        counts=user_counts, value_key=None, guild=guild, bot=bot,
+        limit=WINDOW_REPORT_TOP_USERS, item_name_singular="tin nhắn", item_name_plural="tin nhắn",
+        e=e, color=discord.Color.orange(), filter_admins=True, minimum_value=1
+    )
+    if user_embed: embeds.append(user_embed)
+    golden_hour_embed = await embeds_guild.create_golden_hour_embed(server_grid, location_grid, ActivityGrid(), guild, bot)
+    if golden_hour_embed: embeds.append(golden_hour_embed)
+    return embeds
+
+# --- END OF FILE cogs/deep_scan_helpers/activity_rollups.py ---
@@ -0,0 +1,127 @@
+# --- START OF FILE cogs/deep_scan_helpers/content_analysis.py ---
+import asyncio
+import logging
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Optional, Tuple, Iterable, NamedTuple
+
+import config
+from .keyword_matcher import KeywordMatcher
+
+log = logging.getLogger(__name__)
+
+# Biểu thức chính quy để tối ưu việc tìm kiếm
+URL_REGEX = re.compile(r'https?://\S+')
+EMOJI_REGEX = re.compile(r'<a?:([a-zA-Z0-9_]+):([0-9]+)>|([\U00010000-\U0010ffff])') # Capture cả group unicode
+
+ContentItem = Tuple[int, bool, str] # (author_id, is_bot, content)
+
+
+class ContentCounts(NamedTuple):
+    """Counter từng phần của một lô nội dung (trả về từ process worker rồi gộp trên event loop)."""
+    link_counts: Counter # author_id -> số link
+    emoji_counts: Counter # author_id -> số emoji trong nội dung
+    custom_emoji_counts: Counter # (author_id, emoji_id) -> số lần (chỉ emoji của server)
+    keyword_counts: Counter # keyword -> số lần (mọi tác giả)
+    user_keyword_counts: Counter # (author_id, keyword) -> số lần (chỉ user thật)
+
+
+class ContentAnalyzer:
+    """Phân tích nội dung tin nhắn (link, emoji, keyword) - dùng chung cho process worker và fallback trên loop."""
+
+    def __init__(self, server_emoji_ids: Iterable[int], keywords: Iterable[str], match_mode: str):
+        self.server_emoji_ids = frozenset(server_emoji_ids)
+        keywords = list(keywords)
+        self.init_args = (list(self.server_emoji_ids), keywords, match_mode) # Để dựng lại trong process worker
+        self.keyword_matcher: Optional[KeywordMatcher] = KeywordMatcher(keywords, match_mode) if keywords else None
+
+    def analyze(self, items: List[ContentItem]) -> ContentCounts:
+        counts = ContentCounts(Counter(), Counter(), Counter(), Counter(), Counter())
+        link_counts, emoji_counts, custom_emoji_counts, keyword_counts, user_keyword_counts = counts
+        server_emoji_ids = self.server_emoji_ids
+        keyword_matcher = self.keyword_matcher
+        for author_id, is_bot, content in items:
+            if not is_bot:
+                link_counts[author_id] += len(URL_REGEX.findall(content))
+                emoji_count = 0
+                for match in EMOJI_REGEX.finditer(content):
+                    emoji_count += 1
+                    custom_id_str = match.group(2)
+                    if custom_id_str:
+                        emoji_id = int(custom_id_str)
+                        if emoji_id in server_emoji_ids:
+                            custom_emoji_counts[(author_id, emoji_id)] += 1
+                emoji_counts[author_id] += emoji_count
+            if keyword_matcher:
+                for keyword, count_in_msg in keyword_matcher.count(content.lower()).items():
+                    keyword_counts[keyword] += count_in_msg
+                    if not is_bot:
+                        user_keyword_counts[(author_id, keyword)] += count_in_msg
+        return counts
+
+
+# --- Phía process worker ---
+_worker_analyzer: Optional[ContentAnalyzer] = None
+
+
+def _init_worker(server_emoji_ids: List[int], keywords: List[str], match_mode: str):
+    global _worker_analyzer
+    _worker_analyzer = ContentAnalyzer(server_emoji_ids, keywords, match_mode)
+
+
+def _analyze_in_worker(items: List[ContentItem]) -> ContentCounts:
+    return _worker_analyzer.analyze(items)
+
+
+# --- Phía event loop ---
+class ContentAnalysisPool:
+    """ProcessPoolExecutor nhận các lô (author_id, is_bot, content) và trả về ContentCounts để gộp trên loop."""
+
+    def __init__(self, analyzer: ContentAnalyzer, worker_count: int):
+        self.analyzer = analyzer # Dùng trực tiếp nếu pool hỏng
+        self.worker_count = worker_count
+        self._executor: Optional[ProcessPoolExecutor] = ProcessPoolExecutor(
+            max_workers=worker_count, initializer=_init_worker, initargs=analyzer.init_args
+        )
+        self.batch_count = 0
+
+    async def analyze(self, items: List[ContentItem]) -> ContentCounts:
+        if self._executor is not None:
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, _analyze_in_worker, items)
+                self.batch_count += 1
+                return result
+            except BrokenProcessPool as pool_err:
+                log.error(f"Process pool phân tích nội dung bị hỏng ({pool_err}), chuyển về phân tích trên event loop.")
+                self._executor = None
+        return self.analyzer.analyze(items)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        log.info(f"Process pool phân tích nội dung: đã xử lý {self.batch_count:,} lô trên {self.worker_count} process.")
+
+
+def start_content_analysis_pool(scan_data: Dict[str, Any]) -> Optional[ContentAnalysisPool]:
+    """Tạo process pool phân tích nội dung nếu CONTENT_ANALYSIS_WORKERS > 0 (0 = phân tích ngay trên loop như cũ)."""
+    if config.CONTENT_ANALYSIS_WORKERS <= 0:
+        return None
+    keyword_matcher: Optional[KeywordMatcher] = scan_data.get("keyword_matcher")
+    analyzer = ContentAnalyzer(
+        scan_data.get("server_emojis_cache", {}).keys(),
+        keyword_matcher.keywords if keyword_matcher else [],
+        keyword_matcher.mode if keyword_matcher else config.KEYWORD_MATCH_MODE,
+    )
+    try:
+        pool = ContentAnalysisPool(analyzer, config.CONTENT_ANALYSIS_WORKERS)
+    except Exception as pool_err:
+        log.error(f"Không tạo được process pool phân tích nội dung: {pool_err}. Phân tích trên event loop.")
+        return None
+    scan_data["content_pool"] = pool
+    log.info(f"Phân tích nội dung bằng process pool: {config.CONTENT_ANALYSIS_WORKERS} process.")
+    return pool
+
+# --- END OF FILE cogs/deep_scan_helpers/content_analysis.py ---
@@ -11,6 +11,9 @@ from collections import Counter, defaultdict
 import config
 import utils
 import database
+import rest_scheduler
+import metrics
+from .user_stats import finalize_user_metrics
 
 log = logging.getLogger(__name__)
 
@@ -50,7 +53,8 @@ async def _flush_audit_log_insert_batch_to_db(
                     entry_data['created_at'], entry_data['extra_data']
                 ) for entry_data in batch_entries_data
             ]
-            await conn.executemany(query, data_tuples_to_insert)
+            with metrics.DB_FLUSH_SECONDS.time(operation="audit_log_batch"):
+                await conn.executemany(query, data_tuples_to_insert)
             log.info(f"Successfully flushed {len(data_tuples_to_insert)} audit log entries to DB.")
     except Exception as e_flush:
         log.error(f"Error flushing audit log batch to DB: {e_flush}", exc_info=True)
@@ -70,9 +74,15 @@ async def process_additional_data(scan_data: Dict[str, Any]):
     e = lambda name: utils.get_emoji(name, bot)
     scan_errors: List[str] = scan_data["scan_errors"]
     current_members_list: List[discord.Member] = scan_data["current_members_list"]
-    user_activity = scan_data.get("user_activity", {})
 
     log.info(f"\n--- [bold green]{e('stats')} Xử lý Dữ liệu & Tạo Báo cáo cho {server.name}[/bold green] ---")
+
+    # --- Tính các chỉ số suy ra của user một lần (view Counter, user_activity, số kênh, kênh HĐ nhiều nhất, span) ---
+    log.info(f"{e('stats')} Đang tính toán các chỉ số phụ của user...")
+    calculated = finalize_user_metrics(scan_data)
+    log.info(f"Đã tính toán số kênh hoạt động cho {calculated['distinct_channels']} users.")
+    log.info(f"Đã tính toán kênh hoạt động nhiều nhất cho {calculated['most_active']} users.")
+    log.info(f"Đã tính toán khoảng thời gian hoạt động cho {calculated['span']} users.")
     _log_scan_summary(scan_data)
 
     log.info(f"{e('loading')} Đang fetch/tính toán dữ liệu phụ trợ...")
@@ -101,40 +111,6 @@ async def process_additional_data(scan_data: Dict[str, Any]):
     # --- Quét và Phân tích Audit Log (Tập trung vào Role Grant Tracking) ---
     await _scan_and_analyze_audit_logs(scan_data) # Hàm này đã được sửa đổi bên dưới
 
-    # --- Tính toán các chỉ số phụ từ user_activity và user_channel_message_counts ---
-    log.info(f"{e('stats')} Đang tính toán các chỉ số phụ của user...")
-    user_channel_counts = scan_data.setdefault('user_distinct_channel_counts', Counter())
-    user_most_active_channel_data = scan_data.setdefault('user_most_active_channel', {})
-    user_channel_msg_counts = scan_data.get('user_channel_message_counts', {})
-    calculated_distinct_channels = 0; calculated_most_active = 0; calculated_span = 0
-
-    for user_id, data in user_activity.items():
-        channels_set = data.get('channels_messaged_in', set())
-        distinct_count = len(channels_set)
-        if distinct_count > 0: user_channel_counts[user_id] = distinct_count; calculated_distinct_channels += 1
-        channel_counts_for_user: Optional[Dict[int, int]] = user_channel_msg_counts.get(user_id)
-        if channel_counts_for_user:
-            try:
-                most_active_location_id, message_count = max(channel_counts_for_user.items(), key=lambda item: item[1])
-                user_most_active_channel_data[user_id] = (most_active_location_id, message_count); calculated_most_active += 1
-            except ValueError: pass
-            except Exception as e_most_active: log.error(f"Lỗi khi tính kênh HĐ nhiều nhất cho user {user_id}: {e_most_active}")
-        first_seen = data.get('first_seen'); last_seen = data.get('last_seen')
-        if first_seen and last_seen and last_seen >= first_seen:
-            try:
-                first_aware = first_seen if first_seen.tzinfo else first_seen.replace(tzinfo=datetime.timezone.utc)
-                last_aware = last_seen if last_seen.tzinfo else last_seen.replace(tzinfo=datetime.timezone.utc)
-                if last_aware >= first_aware:
-                    span_seconds = (last_aware - first_aware).total_seconds()
-                    if span_seconds > 0: data['activity_span_seconds'] = round(span_seconds, 2); calculated_span += 1
-                    else: data['activity_span_seconds'] = 0.0
-                else: log.warning(f"Dữ liệu first/last seen không hợp lệ cho user {user_id}. Đặt span = 0."); data['activity_span_seconds'] = 0.0
-            except Exception as e_span: log.warning(f"Lỗi tính activity span cho user {user_id}: {e_span}"); data['activity_span_seconds'] = 0.0
-        else: data['activity_span_seconds'] = 0.0
-
-    log.info(f"Đã tính toán số kênh hoạt động cho {calculated_distinct_channels} users.")
-    log.info(f"Đã tính toán kênh hoạt động nhiều nhất cho {calculated_most_active} users.")
-    log.info(f"Đã tính toán khoảng thời gian hoạt động cho {calculated_span} users.")
     log.info("Hoàn thành fetch và xử lý dữ liệu phụ trợ.")
 
 
@@ -235,7 +211,8 @@ async def _scan_and_analyze_audit_logs(scan_data: Dict[str, Any]):
             logs_in_batch: List[discord.AuditLogEntry] = []; batch_fetch_start_time = time.monotonic()
             try:
                 audit_iterator = server.audit_logs(limit=AUDIT_LOG_API_FETCH_LIMIT_PER_REQUEST, after=discord.Object(id=current_after_id) if current_after_id else None, oldest_first=True)
-                relevant_logs_in_batch = [entry async for entry in audit_iterator if entry.action in config.AUDIT_LOG_ACTIONS_TO_TRACK]
+                async with rest_scheduler.slot(rest_scheduler.ROUTE_AUDIT_LOG):
+                    relevant_logs_in_batch = [entry async for entry in audit_iterator if entry.action in config.AUDIT_LOG_ACTIONS_TO_TRACK]
                 log.debug(f"  Audit log batch {iteration+1}: Fetched, found {len(relevant_logs_in_batch)} relevant action(s) in {time.monotonic() - batch_fetch_start_time:.2f}s.")
             except Exception as audit_fetch_err: log.error(f"  {e('error')} Lỗi fetch audit log batch {iteration+1}: {audit_fetch_err}", exc_info=True); scan_errors.append(f"Lỗi fetch Audit Log: {audit_fetch_err}"); break
             if not relevant_logs_in_batch: log.info(f"  Không tìm thấy entry audit log mới phù hợp (batch {iteration+1})."); break
@@ -11,6 +11,8 @@ import collections
 
 import config
 import utils
+import rest_scheduler
+import metrics
 from reporting import embeds_dm 
 
 log = logging.getLogger(__name__)
@@ -243,6 +245,7 @@ async def send_personalized_dm_reports(
     processed_members_count = 0
 
     for member in members_to_process:
+        metrics.DM_BACKLOG.set(len(members_to_process) - processed_members_count, guild_id=guild.id)
         processed_members_count += 1
         log.info(f"{e('loading')} ({processed_members_count}/{len(members_to_process)}) Đang tạo báo cáo cho {member.display_name} ({member.id})...")
 
@@ -263,16 +266,18 @@ async def send_personalized_dm_reports(
             messages_to_send.append(test_prefix)
         else:
             try:
-                target_dm_channel = member.dm_channel or await member.create_dm()
+                target_dm_channel = member.dm_channel
+                if not target_dm_channel:
+                    async with rest_scheduler.slot(rest_scheduler.ROUTE_DM): target_dm_channel = await member.create_dm()
                 target_description_log = f"User {member.id}"
             except discord.Forbidden:
                  log.warning(f"❌ Không thể tạo/lấy DM channel cho {member.display_name} ({member.id}). Bỏ qua user này.")
-                 failed_dm_count += 1
+                 failed_dm_count += 1; metrics.DM_REPORTS.inc(guild_id=guild.id, status="failed")
                  await asyncio.sleep(DELAY_ON_FORBIDDEN)
                  continue # Sang user tiếp theo
             except Exception as dm_create_err:
                  log.error(f"❌ Lỗi khi tạo DM channel cho {member.display_name} ({member.id}): {dm_create_err}", exc_info=True)
-                 failed_dm_count += 1
+                 failed_dm_count += 1; metrics.DM_REPORTS.inc(guild_id=guild.id, status="failed")
                  await asyncio.sleep(DELAY_ON_UNKNOWN_ERROR)
                  continue # Sang user tiếp theo
 
@@ -348,7 +353,7 @@ async def send_personalized_dm_reports(
             # --- Gửi DM ---
             if not embeds_to_send and not messages_to_send:
                 log.warning(f"Không có nội dung DM để gửi cho {member.display_name}.")
-                failed_dm_count += 1
+                failed_dm_count += 1; metrics.DM_REPORTS.inc(guild_id=guild.id, status="failed")
                 continue # Bỏ qua user này
 
             try:
@@ -356,7 +361,8 @@ async def send_personalized_dm_reports(
                 for msg_content in messages_to_send:
                     if msg_content:
                         if target_dm_channel:
-                            await target_dm_channel.send(content=msg_content)
+                            async with rest_scheduler.slot(rest_scheduler.ROUTE_DM):
+                                await target_dm_channel.send(content=msg_content)
                             await asyncio.sleep(DELAY_BETWEEN_MESSAGES)
                         else:
                             log.warning(f"Target DM channel không còn hợp lệ khi gửi message cho {target_description_log}")
@@ -366,7 +372,8 @@ async def send_personalized_dm_reports(
                 for embed in embeds_to_send:
                     if isinstance(embed, discord.Embed):
                         if target_dm_channel:
-                            await target_dm_channel.send(embed=embed)
+                            async with rest_scheduler.slot(rest_scheduler.ROUTE_DM):
+                                await target_dm_channel.send(embed=embed)
                             await asyncio.sleep(DELAY_BETWEEN_EMBEDS)
                         else:
                             log.warning(f"Target DM channel không còn hợp lệ khi gửi embed cho {target_description_log}")
@@ -376,7 +383,8 @@ async def send_personalized_dm_reports(
                 if final_dm_emoji and target_dm_channel:
                     try:
                         log.debug(f"Đang gửi emoji cuối DM '{final_dm_emoji}' đến {target_description_log}...")
-                        await target_dm_channel.send(final_dm_emoji) # Send emoji dạng content
+                        async with rest_scheduler.slot(rest_scheduler.ROUTE_DM):
+                            await target_dm_channel.send(final_dm_emoji) # Send emoji dạng content
                         await asyncio.sleep(DELAY_AFTER_FINAL_ITEM) 
                     except discord.Forbidden:
                         log.warning(f"  -> Không thể gửi emoji cuối DM đến {target_description_log}: Bot bị chặn?")
@@ -385,39 +393,39 @@ async def send_personalized_dm_reports(
                     except Exception as emoji_e:
                         log.warning(f"  -> Lỗi không xác định khi gửi emoji cuối DM đến {target_description_log}: {emoji_e}")
 
-                sent_dm_count += 1
+                sent_dm_count += 1; metrics.DM_REPORTS.inc(guild_id=guild.id, status="sent")
                 dm_successfully_sent = True # Đánh dấu đã gửi thành công
                 log.info(f"✅ Gửi báo cáo của {member.display_name} ({member.id}) thành công đến {target_description_log}")
 
             except discord.Forbidden:
                 log.warning(f"❌ Không thể gửi DM đến {target_description_log} (cho báo cáo của {member.id}): User/Admin đã chặn DM hoặc bot.")
-                failed_dm_count += 1
+                failed_dm_count += 1; metrics.DM_REPORTS.inc(guild_id=guild.id, status="failed")
                 dm_successfully_sent = False
                 await asyncio.sleep(DELAY_ON_FORBIDDEN)
                 if is_test_mode:
                     log.error("LỖI NGHIÊM TRỌNG: Không thể gửi Test DM đến Admin. Dừng gửi DM.")
                     scan_data["scan_errors"].append("Test DM thất bại: Không thể gửi DM đến Admin (Forbidden).")
-                    return 
+                    metrics.DM_BACKLOG.set(0, guild_id=guild.id); return
                 target_dm_channel = None # Đánh dấu channel không hợp lệ
             except discord.HTTPException as dm_http_err:
                 log.error(f"❌ Lỗi HTTP {dm_http_err.status} khi gửi DM đến {target_description_log} (cho báo cáo của {member.id}): {dm_http_err.text}")
-                failed_dm_count += 1
+                failed_dm_count += 1; metrics.DM_REPORTS.inc(guild_id=guild.id, status="failed")
                 dm_successfully_sent = False
                 await asyncio.sleep(DELAY_ON_HTTP_ERROR)
                 if is_test_mode and dm_http_err.status != 429: # Cho phép retry nếu chỉ là rate limit
                      log.error("LỖI NGHIÊM TRỌNG: Lỗi HTTP khi gửi Test DM đến Admin. Dừng gửi DM.")
                      scan_data["scan_errors"].append(f"Test DM thất bại: Lỗi HTTP {dm_http_err.status} khi gửi đến Admin.")
-                     return
+                     metrics.DM_BACKLOG.set(0, guild_id=guild.id); return
                 target_dm_channel = None # Đánh dấu channel không hợp lệ
             except Exception as dm_err:
                 log.error(f"❌ Lỗi không xác định khi gửi DM đến {target_description_log} (cho báo cáo của {member.id}): {dm_err}", exc_info=True)
-                failed_dm_count += 1
+                failed_dm_count += 1; metrics.DM_REPORTS.inc(guild_id=guild.id, status="failed")
                 dm_successfully_sent = False
                 await asyncio.sleep(DELAY_ON_UNKNOWN_ERROR)
                 if is_test_mode:
                     log.error("LỖI NGHIÊM TRỌNG: Lỗi không xác định khi gửi Test DM đến Admin. Dừng gửi DM.")
                     scan_data["scan_errors"].append("Test DM thất bại: Lỗi không xác định khi gửi đến Admin.")
-                    return
+                    metrics.DM_BACKLOG.set(0, guild_id=guild.id); return
                 target_dm_channel = None # Đánh dấu channel không hợp lệ
 
             # Chỉ delay giữa các user nếu DM trước đó thành công (hoặc không phải lỗi nghiêm trọng dừng test mode)
@@ -426,9 +434,10 @@ async def send_personalized_dm_reports(
 
         except Exception as user_proc_err:
             log.error(f"Lỗi nghiêm trọng khi xử lý dữ liệu DM cho {member.display_name} ({member.id}): {user_proc_err}", exc_info=True)
-            failed_dm_count += 1
+            failed_dm_count += 1; metrics.DM_REPORTS.inc(guild_id=guild.id, status="failed")
             await asyncio.sleep(DELAY_ON_UNKNOWN_ERROR)
 
+    metrics.DM_BACKLOG.set(0, guild_id=guild.id)
     # --- Log kết thúc ---
     log.info(f"--- {e('success')} Hoàn tất gửi DM báo cáo ---")
     mode_str = "Test Mode (gửi đến Admin)" if is_test_mode else "Normal Mode"
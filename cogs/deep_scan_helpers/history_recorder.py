@@ -0,0 +1,307 @@
+# --- START OF FILE cogs/deep_scan_helpers/history_recorder.py ---
+import discord
+import logging
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import config
+from .content_analysis import URL_REGEX
+
+log = logging.getLogger(__name__)
+
+RECORDING_VERSION = 1
+GUILD_MANIFEST_FILE = "guild.json"
+SALT_FILE = "salt"
+LOCATION_FILE_SUFFIX = ".jsonl.gz"
+SNOWFLAKE_INCREMENT_MASK = (1 << 22) - 1
+
+# Token giữ cấu trúc khi ẩn danh (ID bên trong được đổi, phần chữ còn lại bị xáo)
+_CONTENT_TOKEN_REGEX = re.compile(r'<(a?):([a-zA-Z0-9_]+):([0-9]+)>|<(@!?|@&|#)([0-9]+)>|' + URL_REGEX.pattern)
+_WORD_REGEX = re.compile(r'[^\W_]+')
+_ASCII_LOWER = "abcdefghijklmnopqrstuvwxyz"
+_VIETNAMESE_LOWER = "àáảãạăằắẳẵặâầấẩẫậđèéẻẽẹêềếểễệìíỉĩịòóỏõọôồốổỗộơờớởỡợùúủũụưừứửữựỳýỷỹỵ"
+
+
+class Anonymizer:
+    """
+    Đổi ID/chữ một cách tất định theo salt của bản ghi (cùng ID/từ -> cùng kết quả ở mọi file, mọi process).
+    ID tin nhắn/kênh giữ nguyên phần thời gian của snowflake để thống kê theo giờ/ngày và chia khoảng vẫn đúng.
+    Từ được xáo theo từng ký tự nhưng giữ độ dài, hoa/thường, chữ số và loại chữ (ASCII/tiếng Việt có dấu).
+    """
+
+    def __init__(self, salt: bytes, enabled: bool = True):
+        self.salt = salt
+        self.enabled = enabled
+        self._word_cache: Dict[str, str] = {}
+
+    def _digest(self, value: Union[int, str], size: int) -> bytes:
+        return hashlib.blake2b(str(value).encode("utf-8"), digest_size=size, key=self.salt[:64]).digest()
+
+    def snowflake(self, value: Optional[int]) -> Optional[int]:
+        """ID có mốc thời gian (tin nhắn, kênh, luồng): giữ 42 bit thời gian, đổi 22 bit còn lại."""
+        if value is None or not self.enabled: return value
+        return ((value >> 22) << 22) | (int.from_bytes(self._digest(value, 3), "big") & SNOWFLAKE_INCREMENT_MASK)
+
+    def opaque_id(self, value: Optional[int]) -> Optional[int]:
+        """ID không cần thời gian (user, role, emoji, sticker): đổi hẳn."""
+        if value is None or not self.enabled: return value
+        return int.from_bytes(self._digest(value, 6), "big") + 1
+
+    def name(self, prefix: str, value: int) -> str:
+        return f"{prefix}-{self.opaque_id(value) % 100_000}" if self.enabled else prefix
+
+    def _scramble_word(self, word: str) -> str:
+        cached = self._word_cache.get(word)
+        if cached is not None: return cached
+        digest = hashlib.shake_128(self.salt + word.lower().encode("utf-8")).digest(len(word))
+        chars = []
+        for char, byte in zip(word, digest):
+            if char.isdigit(): replacement = str(byte % 10)
+            elif char.isascii(): replacement = _ASCII_LOWER[byte % len(_ASCII_LOWER)]
+            else: replacement = _VIETNAMESE_LOWER[byte % len(_VIETNAMESE_LOWER)]
+            chars.append(replacement.upper() if char.isupper() else replacement)
+        scrambled = "".join(chars)
+        if len(self._word_cache) < 200_000: self._word_cache[word] = scrambled
+        return scrambled
+
+    def _scramble_plain(self, text: str) -> str:
+        return _WORD_REGEX.sub(lambda match: self._scramble_word(match.group(0)), text)
+
+    def text(self, text: Optional[str]) -> Optional[str]:
+        """Xáo nội dung: emoji custom/mention đổi ID, link thành link giả cùng độ dài, emoji unicode và dấu câu giữ nguyên."""
+        if not text or not self.enabled: return text
+        parts: List[str] = []
+        last_end = 0
+        for match in _CONTENT_TOKEN_REGEX.finditer(text):
+            parts.append(self._scramble_plain(text[last_end:match.start()]))
+            if match.group(3): # Emoji custom
+                parts.append(f"<{match.group(1)}:{self._scramble_word(match.group(2))}:{self.opaque_id(int(match.group(3)))}>")
+            elif match.group(5): # Mention user/role/kênh
+                mention_id = int(match.group(5))
+                mapped_id = self.snowflake(mention_id) if match.group(4) == "#" else self.opaque_id(mention_id)
+                parts.append(f"<{match.group(4)}{mapped_id}>")
+            else: # Link
+                parts.append("https://example.com/" + "x" * max(0, len(match.group(0)) - 20))
+            last_end = match.end()
+        parts.append(self._scramble_plain(text[last_end:]))
+        return "".join(parts)
+
+
+# --- Payload tin nhắn (tập con định dạng API của Discord, đủ cho discord.Message dựng lại) ---
+def _iso(value: Optional[datetime.datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _user_payload(user: Union[discord.User, discord.Member], anonymizer: Anonymizer) -> Dict[str, Any]:
+    user_id = anonymizer.opaque_id(user.id)
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id}" if anonymizer.enabled else user.name,
+        "global_name": None if anonymizer.enabled else getattr(user, "global_name", None),
+        "discriminator": "0", "avatar": None, "bot": bool(user.bot),
+    }
+
+
+def message_to_payload(message: discord.Message, anonymizer: Anonymizer) -> Dict[str, Any]:
+    """Chuyển tin nhắn đã fetch về dict dạng payload API (kể cả bản ẩn danh)."""
+    payload: Dict[str, Any] = {
+        "id": str(anonymizer.snowflake(message.id)),
+        "channel_id": str(anonymizer.snowflake(message.channel.id)),
+        "type": message.type.value,
+        "content": anonymizer.text(message.content),
+        "timestamp": _iso(message.created_at),
+        "edited_timestamp": _iso(message.edited_at),
+        "tts": message.tts, "pinned": message.pinned,
+        "mention_everyone": message.mention_everyone,
+        "flags": message.flags.value,
+        "author": _user_payload(message.author, anonymizer),
+        "mentions": [_user_payload(user, anonymizer) for user in message.mentions],
+        "mention_roles": [str(anonymizer.opaque_id(role_id)) for role_id in message.raw_role_mentions],
+        "attachments": [
+            {
+                "id": str(anonymizer.snowflake(attachment.id)),
+                "filename": f"file{os.path.splitext(attachment.filename)[1]}" if anonymizer.enabled else attachment.filename,
+                "size": attachment.size,
+                "url": "https://example.com/file" if anonymizer.enabled else attachment.url,
+                "proxy_url": "https://example.com/file" if anonymizer.enabled else attachment.proxy_url,
+                "content_type": attachment.content_type,
+            }
+            for attachment in message.attachments
+        ],
+        "embeds": [{"type": embed.type} if anonymizer.enabled else embed.to_dict() for embed in message.embeds],
+        "sticker_items": [
+            {"id": str(anonymizer.opaque_id(sticker.id)), "name": anonymizer.name("sticker", sticker.id) if anonymizer.enabled else sticker.name, "format_type": sticker.format.value}
+            for sticker in message.stickers
+        ],
+        "reactions": [],
+    }
+    for reaction in message.reactions:
+        emoji = reaction.emoji
+        if isinstance(emoji, str):
+            emoji_payload = {"id": None, "name": emoji}
+        else:
+            emoji_payload = {"id": str(anonymizer.opaque_id(emoji.id)) if emoji.id else None, "name": anonymizer.name("e", emoji.id) if emoji.id and anonymizer.enabled else emoji.name, "animated": getattr(emoji, "animated", False)}
+        payload["reactions"].append({
+            "emoji": emoji_payload, "count": reaction.count, "me": False, "me_burst": False,
+            "count_details": {"normal": reaction.count, "burst": 0}, "burst_colors": [],
+        })
+    if message.webhook_id:
+        payload["webhook_id"] = str(anonymizer.opaque_id(message.webhook_id))
+    reference = message.reference
+    if reference and reference.message_id:
+        payload["message_reference"] = {
+            "message_id": str(anonymizer.snowflake(reference.message_id)),
+            "channel_id": str(anonymizer.snowflake(reference.channel_id)),
+        }
+    return payload
+
+
+# --- Ghi file ---
+_anonymizers: Dict[str, Anonymizer] = {} # Thư mục guild -> Anonymizer (salt đọc một lần mỗi process)
+
+
+def _recording_key(scan_data: Dict[str, Any]) -> str:
+    """Mỗi lần quét một thư mục (worker và coordinator cùng scan_id ghi chung)."""
+    if scan_data.get("scan_id"): return f"scan_{scan_data['scan_id']}"
+    start_time: Optional[datetime.datetime] = scan_data.get("overall_start_time")
+    return f"scan_{start_time:%Y%m%d_%H%M%S}" if start_time else "scan_adhoc"
+
+
+def _load_anonymizer(guild_dir: str) -> Anonymizer:
+    anonymizer = _anonymizers.get(guild_dir)
+    if anonymizer is not None and anonymizer.enabled == config.SCAN_RECORD_ANONYMIZE:
+        return anonymizer
+    salt_path = os.path.join(guild_dir, SALT_FILE)
+    try:
+        with open(salt_path, "x") as salt_file: # Process đầu tiên tạo salt, các process khác đọc lại
+            salt_file.write(os.urandom(32).hex())
+    except FileExistsError:
+        pass
+    with open(salt_path) as salt_file:
+        salt = bytes.fromhex(salt_file.read().strip())
+    anonymizer = Anonymizer(salt, enabled=config.SCAN_RECORD_ANONYMIZE)
+    _anonymizers[guild_dir] = anonymizer
+    return anonymizer
+
+
+def _write_guild_manifest(recording_dir: str, scan_data: Dict[str, Any], anonymizer: Anonymizer):
+    manifest_path = os.path.join(recording_dir, GUILD_MANIFEST_FILE)
+    if os.path.exists(manifest_path): return
+    server: discord.Guild = scan_data["server"]
+    emojis = []
+    for emoji_id, emoji in scan_data.get("server_emojis_cache", {}).items():
+        emojis.append({
+            "id": anonymizer.opaque_id(emoji_id),
+            "name": anonymizer.name("e", emoji_id) if anonymizer.enabled else getattr(emoji, "name", None),
+            "animated": bool(getattr(emoji, "animated", False)),
+        })
+    manifest = {
+        "version": RECORDING_VERSION, "anonymized": anonymizer.enabled,
+        "guild_id": anonymizer.opaque_id(server.id), "name": "guild" if anonymizer.enabled else server.name,
+        "emojis": emojis,
+        "sticker_ids": [anonymizer.opaque_id(sticker_id) for sticker_id in scan_data.get("server_sticker_ids_cache", ())],
+        "recorded_at": discord.utils.utcnow().isoformat(),
+    }
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False)
+    os.replace(temp_path, manifest_path)
+
+
+class LocationRecorder:
+    """Ghi payload các trang history của một kênh/luồng vào <id>.jsonl.gz (dòng đầu là thông tin location)."""
+
+    def __init__(self, path: str, header: Dict[str, Any], anonymizer: Anonymizer):
+        self.path = path
+        self.anonymizer = anonymizer
+        self.message_count = 0
+        is_new_file = not os.path.exists(path)
+        # Mở nối thêm: resume sau crash ghi tiếp vào file cũ (gzip nhiều member vẫn đọc liền mạch)
+        self._file = gzip.open(path, "at", encoding="utf-8", compresslevel=6)
+        if is_new_file:
+            self._file.write(json.dumps({"location": header}, ensure_ascii=False) + "\n")
+
+    def record_page(self, message_batch: List[discord.Message]):
+        lines = []
+        for message in message_batch:
+            lines.append(json.dumps(message_to_payload(message, self.anonymizer), ensure_ascii=False, separators=(",", ":")))
+        if lines:
+            self._file.write("\n".join(lines) + "\n")
+            self.message_count += len(lines)
+
+    def close(self):
+        try:
+            self._file.close()
+        except Exception as close_err:
+            log.warning(f"Lỗi đóng file ghi history {self.path}: {close_err}")
+
+
+def open_location_recorder(
+    scan_data: Dict[str, Any],
+    location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread]
+) -> Optional[LocationRecorder]:
+    """Mở file ghi cho location nếu bật SCAN_RECORD_DIR. Lỗi ghi không bao giờ làm hỏng lần quét (trả về None)."""
+    if not config.SCAN_RECORD_DIR:
+        return None
+    try:
+        guild_dir = os.path.join(config.SCAN_RECORD_DIR, str(scan_data["server"].id))
+        recording_dir = os.path.join(guild_dir, _recording_key(scan_data))
+        os.makedirs(recording_dir, exist_ok=True)
+        anonymizer = _load_anonymizer(guild_dir)
+        _write_guild_manifest(recording_dir, scan_data, anonymizer)
+        location_id = anonymizer.snowflake(location.id)
+        is_thread = isinstance(location, discord.Thread)
+        header = {
+            "id": location_id,
+            "name": anonymizer.name("luong" if is_thread else "kenh", location.id) if anonymizer.enabled else location.name,
+            "type": location.type.value,
+            "parent_id": anonymizer.snowflake(location.parent_id) if is_thread else None,
+            "owner_id": anonymizer.opaque_id(location.owner_id) if is_thread else None,
+            "archived": bool(location.archived) if is_thread else False,
+        }
+        return LocationRecorder(os.path.join(recording_dir, f"{location_id}{LOCATION_FILE_SUFFIX}"), header, anonymizer)
+    except Exception as record_err:
+        log.warning(f"Không mở được file ghi history cho location {location.id}: {record_err}")
+        return None
+
+
+# --- Đọc bản ghi (replay) ---
+def load_recording_manifest(recording_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(recording_dir, GUILD_MANIFEST_FILE), encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+def load_recording_anonymizer(recording_dir: str) -> Optional[Anonymizer]:
+    """Anonymizer của bản ghi (để xáo keyword giống nội dung khi replay bản ẩn danh)."""
+    salt_path = os.path.join(os.path.dirname(os.path.normpath(recording_dir)), SALT_FILE)
+    if not os.path.exists(salt_path): return None
+    with open(salt_path) as salt_file:
+        return Anonymizer(bytes.fromhex(salt_file.read().strip()))
+
+
+def read_location_recording(path: str) -> Tuple[Dict[str, Any], List[Tuple[int, str]], Dict[int, bool]]:
+    """
+    Đọc một file location: (header, [(message_id, dòng JSON)] sắp cũ -> mới, {author_id: is_bot}).
+    Tin trùng (ghi lại sau khi resume) chỉ giữ một bản.
+    """
+    header: Dict[str, Any] = {}
+    messages: Dict[int, str] = {}
+    authors: Dict[int, bool] = {}
+    with gzip.open(path, "rt", encoding="utf-8") as recording_file:
+        for line in recording_file:
+            if not line.strip(): continue
+            if line.startswith('{"location"'):
+                header = json.loads(line)["location"]
+                continue
+            payload = json.loads(line)
+            messages[int(payload["id"])] = line
+            author = payload.get("author")
+            if author: authors[int(author["id"])] = bool(author.get("bot", False))
+    return header, sorted(messages.items()), authors
+
+# --- END OF FILE cogs/deep_scan_helpers/history_recorder.py ---
@@ -0,0 +1,175 @@
+# --- START OF FILE cogs/deep_scan_helpers/incremental_scan.py ---
+import discord
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+from collections import Counter
+
+import config
+import database
+from .user_stats import UserStatsStore, USER_STAT_COLUMNS, datetime_to_ms, ms_to_datetime
+from .message_index import start_message_index, message_index_rows
+
+log = logging.getLogger(__name__)
+
+
+async def load_incremental_scan_state(scan_data: Dict[str, Any]):
+    """
+    Nạp checkpoint kênh/luồng và dữ liệu tổng hợp đã lưu vào scan_data (giống cách audit log
+    resume từ last_audit_log_id). Sau khi nạp, mỗi location chỉ cần fetch history(after=checkpoint)
+    và phần mới sẽ được cộng dồn thẳng vào bảng thống kê user đã có sẵn dữ liệu cũ.
+    """
+    server: discord.Guild = scan_data["server"]
+    scan_data["incremental_mode"] = False
+    scan_data["location_checkpoints"] = {}
+    scan_data["incremental_location_seeds"] = {}
+    scan_data["rollup_after_ids"] = {}
+    scan_data["message_index"] = None
+    scan_data["message_index_after_id"] = None
+
+    if not config.ENABLE_INCREMENTAL_SCAN:
+        return
+    if scan_data.get("resume_checkpoint"):
+        return # Trạng thái tăng dần đã nằm trong checkpoint, nạp lại từ DB sẽ bị cộng trùng
+    if not scan_data.get("scan_since"):
+        # Chỉ mục tin gần đây (để trừ/sửa số liệu khi tin bị xóa/sửa) đi cùng dữ liệu tổng hợp được lưu
+        start_message_index(scan_data)
+    if scan_data.get("target_keywords"):
+        log.info("Quét có keywords: dùng chế độ quét toàn bộ (keywords cũ không được lưu trong dữ liệu tổng hợp).")
+        return
+    if scan_data.get("scan_since"):
+        log.info("Quét theo khoảng thời gian (--days/--since): không dùng dữ liệu tổng hợp của quét tăng dần.")
+        return
+
+    checkpoints = await database.get_location_scan_checkpoints(server.id)
+    if not checkpoints:
+        log.info("Chưa có checkpoint quét tăng dần cho server này. Lần quét này sẽ quét toàn bộ và lưu checkpoint.")
+        return
+
+    aggregates = await database.get_user_activity_aggregates(server.id)
+    location_user_counts = await database.get_location_user_message_counts(server.id)
+
+    stats: UserStatsStore = scan_data["user_stats"]
+    bot_user_ids = set()
+    seeded_message_total = 0
+    for row in aggregates:
+        user_id = row["user_id"]
+        stats_row = stats.row(user_id)
+        if row.get("is_bot"):
+            stats.is_bot[stats_row] = 1
+            bot_user_ids.add(user_id)
+        for column in USER_STAT_COLUMNS:
+            value = row.get(column) or 0
+            if value: getattr(stats, column)[stats_row] += value
+        for seen_column in ("first_seen_utc", "last_seen_utc"):
+            seen_ms = datetime_to_ms(row.get(seen_column))
+            if seen_ms: stats.touch_seen(stats_row, seen_ms)
+        seeded_message_total += row.get("message_count") or 0
+    scan_data["overall_total_message_count"] = scan_data.get("overall_total_message_count", 0) + seeded_message_total
+
+    user_channel_message_counts = scan_data["user_channel_message_counts"]
+    location_seeds: Dict[int, Dict[str, Any]] = {}
+    for location_id, user_counts in location_user_counts.items():
+        for user_id, count in user_counts.items():
+            user_channel_message_counts[user_id][location_id] += count
+        checkpoint = checkpoints.get(location_id) or {}
+        location_seeds[location_id] = {
+            "message_count": checkpoint.get("message_count") or sum(user_counts.values()),
+            "author_counts": Counter({uid: c for uid, c in user_counts.items() if uid not in bot_user_ids}),
+        }
+
+    scan_data["location_checkpoints"] = {
+        location_id: row["last_message_id"] for location_id, row in checkpoints.items() if row.get("last_message_id")
+    }
+    scan_data["incremental_location_seeds"] = location_seeds
+    scan_data["incremental_mode"] = True
+
+    # Rollup theo ngày có thể đã chứa tin mới hơn checkpoint (vd: lần quét --days sau đó) -> không cộng lại phần đó
+    if config.ENABLE_ACTIVITY_ROLLUPS:
+        rollup_coverage = await database.get_activity_rollup_coverage(server.id)
+        scan_data["rollup_after_ids"] = {
+            location_id: last_id for location_id, last_id in rollup_coverage.items()
+            if last_id > scan_data["location_checkpoints"].get(location_id, 0)
+        }
+    log.info(
+        f"Chế độ quét tăng dần: nạp {len(scan_data['location_checkpoints'])} checkpoint, "
+        f"{len(aggregates)} user, {seeded_message_total:,} tin nhắn đã lưu."
+    )
+
+
+def _collect_checkpoint_rows(scan_data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Lấy checkpoint mới từ kết quả quét. Trả về (rows, số location lỗi giữa chừng mà checkpoint không liên tục).
+    Chỉ quét tuần tự cũ -> mới ("after") có tin mới nhất đã xử lý là checkpoint hợp lệ khi lỗi giữa chừng;
+    quét mới -> cũ hoặc chia khoảng song song ("ranges", cả khi quét tăng dần) có thể đã đọc tin mới hơn
+    phần chưa quét của khoảng lỗi -> lưu tin mới nhất làm checkpoint sẽ bỏ sót vĩnh viễn phần đó.
+    """
+    rows: List[Dict[str, Any]] = []
+    partial_failures = 0
+    for channel_result in scan_data.get("channel_details", []):
+        location_results = [channel_result] + list(channel_result.get("threads_data", []))
+        for result in location_results:
+            if "newest_message_id" not in result: continue # Location chưa quét (bỏ qua/thiếu quyền)
+            if result.get("error") and result.get("new_message_count", 0) > 0 and result.get("scan_direction") != "after":
+                partial_failures += 1
+            rows.append({
+                "location_id": result["id"],
+                "parent_channel_id": result.get("parent_channel_id"),
+                "last_message_id": result.get("newest_message_id"),
+                "message_count": result.get("message_count", 0),
+            })
+    return rows, partial_failures
+
+
+def build_user_aggregate_rows(stats: UserStatsStore) -> List[Dict[str, Any]]:
+    """Dòng user_activity_aggregates từ bảng thống kê user."""
+    user_aggregate_rows: List[Dict[str, Any]] = []
+    for stats_row in stats.iter_rows():
+        row = {column: getattr(stats, column)[stats_row] for column in USER_STAT_COLUMNS}
+        row.update({
+            "user_id": stats.user_ids[stats_row],
+            "is_bot": bool(stats.is_bot[stats_row]),
+            "first_seen_utc": ms_to_datetime(stats.first_seen_ms[stats_row]),
+            "last_seen_utc": ms_to_datetime(stats.last_seen_ms[stats_row]),
+        })
+        user_aggregate_rows.append(row)
+    return user_aggregate_rows
+
+
+def build_location_user_rows(scan_data: Dict[str, Any]) -> List[Tuple[int, int, int]]:
+    """(location_id, user_id, số tin) từ user_channel_message_counts."""
+    return [
+        (location_id, user_id, count)
+        for user_id, location_counts in scan_data.get("user_channel_message_counts", {}).items()
+        for location_id, count in location_counts.items() if count > 0
+    ]
+
+
+async def save_incremental_scan_state(scan_data: Dict[str, Any]) -> bool:
+    """Lưu checkpoint kênh/luồng và dữ liệu tổng hợp sau khi quét kênh xong. Trả về True nếu đã lưu."""
+    if not config.ENABLE_INCREMENTAL_SCAN:
+        return False
+    if scan_data.get("scan_since"):
+        return False # Số liệu chỉ của khoảng thời gian, không phải toàn bộ lịch sử -> không ghi đè dữ liệu tổng hợp
+    server: discord.Guild = scan_data["server"]
+    incremental_mode = scan_data.get("incremental_mode", False)
+
+    checkpoint_rows, partial_failures = _collect_checkpoint_rows(scan_data)
+    # Dữ liệu tổng hợp đã gồm phần quét được của location lỗi: lưu checkpoint cũ (quét lại -> đếm trùng)
+    # hay checkpoint mới (bỏ sót) đều sai, nên không lưu gì cả (lần sau quét lại từ trạng thái đã lưu trước đó)
+    if partial_failures:
+        log.warning(f"Bỏ qua lưu trạng thái quét tăng dần: {partial_failures} kênh/luồng bị lỗi giữa chừng khi quét mới -> cũ hoặc chia khoảng.")
+        scan_data["scan_errors"].append("Không lưu checkpoint quét tăng dần do có kênh lỗi giữa chừng.")
+        return False
+
+    user_aggregate_rows = build_user_aggregate_rows(scan_data["user_stats"])
+    location_user_rows = build_location_user_rows(scan_data)
+
+    saved = await database.save_incremental_scan_state(
+        server.id, checkpoint_rows, user_aggregate_rows, location_user_rows,
+        replace_checkpoints=not incremental_mode, message_index_rows=message_index_rows(scan_data)
+    )
+    if not saved:
+        scan_data["scan_errors"].append("Lỗi DB: Không thể lưu trạng thái quét tăng dần.")
+    return saved
+
+# --- END OF FILE cogs/deep_scan_helpers/incremental_scan.py ---
@@ -12,6 +12,9 @@ import utils
 import database
 import discord_logging
 from reporting import embeds_guild
+from .incremental_scan import load_incremental_scan_state
+from .scan_planner import load_location_size_history
+from .keyword_matcher import KeywordMatcher
 
 log = logging.getLogger(__name__)
 
@@ -90,6 +93,8 @@ async def initialize_scan(scan_data: Dict[str, Any]) -> bool:
             scan_errors.append(f"Lỗi keywords: {kw_err}")
             target_keywords = [] # Reset nếu lỗi
     scan_data["target_keywords"] = target_keywords
+    # Dựng bộ đếm keyword một lần cho cả lần quét
+    scan_data["keyword_matcher"] = KeywordMatcher(target_keywords, config.KEYWORD_MATCH_MODE) if target_keywords else None
 
     # --- Kiểm tra quyền Bot ---
     if not await _check_bot_permissions(scan_data):
@@ -104,6 +109,10 @@ async def initialize_scan(scan_data: Dict[str, Any]) -> bool:
     total_accessible_channels = len(scan_data["accessible_channels"])
     log.info(f"Tìm thấy [green]{total_accessible_channels}[/] kênh có thể quét, [yellow]{scan_data['skipped_channels_count']}[/] bị bỏ qua.")
 
+    # --- Nạp checkpoint quét tăng dần (nếu bật) ---
+    await load_incremental_scan_state(scan_data)
+    await load_location_size_history(scan_data)
+
     # --- Cập nhật Embed trạng thái ban đầu ---
     start_embed = _create_start_embed(scan_data)
     await _update_initial_status(scan_data, content=None, embed=start_embed)
@@ -223,6 +232,10 @@ async def _fetch_initial_cache(scan_data: Dict[str, Any]) -> bool:
             current_members_list = list(server.members) 
 
         scan_data["current_members_list"] = current_members_list
+        # Index member theo ID dùng chung cho quét/báo cáo/DM (thay cho fetch_member từng user)
+        member_snapshot = utils.MemberSnapshot(server, current_members_list, complete=bot.intents.members, bot=bot)
+        utils.set_member_snapshot(member_snapshot)
+        scan_data["member_snapshot"] = member_snapshot
         log.info(f"Lấy được {len(current_members_list)} thành viên.")
         scan_data["initial_member_status_counts"] = Counter(str(m.status) for m in current_members_list)
         scan_data["channel_counts"] = Counter(c.type for c in server.channels)
@@ -409,6 +422,10 @@ def _create_start_embed(scan_data: Dict[str, Any]) -> discord.Embed:
         inline=False
     )
 
+    if config.ENABLE_INCREMENTAL_SCAN:
+        scan_mode_desc = "Tăng dần (chỉ tin mới)" if scan_data.get("incremental_mode") else "Toàn bộ (lưu checkpoint)"
+        start_embed.add_field(name="Chế độ Quét", value=scan_mode_desc, inline=True)
+
     if log_thread:
         start_embed.add_field(name="Log Chi Tiết", value=f"Xem tại: {log_thread.mention}", inline=False)
     else:
@@ -0,0 +1,146 @@
+# --- START OF FILE cogs/deep_scan_helpers/job_codec.py ---
+import base64
+import datetime
+import json
+import sys
+from array import array
+from collections import Counter, defaultdict
+from typing import Any, Dict, Callable
+
+from .user_stats import UserStatsStore
+from .activity_grid import ActivityGrid
+from .message_index import MessageIndexBuffer
+
+# Mã hóa JSON cho tham số/kết quả job quét phân tán (thay cho pickle: bảng scan_jobs dùng chung giữa các process,
+# unpickle dữ liệu từ đó là chạy code của bất kỳ ai ghi được vào bảng).
+# Dữ liệu chỉ gồm số, chuỗi và vài kiểu container; kiểu JSON không giữ được (key int/tuple, Counter, array,
+# bảng dạng cột) được gói trong object một key có tag "$...". Khi đọc chỉ chấp nhận đúng các tag/lớp trong danh sách dưới.
+
+# Lớp dạng cột được phép gửi qua job: khôi phục bằng cách gán lại đúng các field của object rỗng (không gọi code tùy ý)
+_OBJECT_CLASSES: Dict[str, type] = {
+    "user_stats": UserStatsStore,
+    "activity_grid": ActivityGrid,
+    "message_index": MessageIndexBuffer,
+}
+_OBJECT_NAMES = {cls: name for name, cls in _OBJECT_CLASSES.items()}
+_OBJECT_TEMPLATES: Dict[str, Dict[str, Any]] = {name: vars(cls()) for name, cls in _OBJECT_CLASSES.items()}
+_DEFAULT_FACTORIES: Dict[str, Callable] = {"Counter": Counter, "int": int, "list": list, "set": set, "dict": dict}
+_ARRAY_TYPECODES = frozenset("bBhHiIlLqQd")
+
+
+class JobPayloadError(ValueError):
+    """Dữ liệu job trong DB không đúng định dạng (bị sửa tay, phiên bản khác...)."""
+
+
+def _array_bytes(values: array) -> str:
+    if sys.byteorder == "big":
+        values = values[:]
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+
+def _bytes_array(typecode: str, data: str) -> array:
+    if typecode not in _ARRAY_TYPECODES:
+        raise JobPayloadError(f"kiểu array không hợp lệ: {typecode!r}")
+    values = array(typecode)
+    values.frombytes(base64.b64decode(data, validate=True))
+    if sys.byteorder == "big": values.byteswap()
+    return values
+
+
+def _pairs(value: dict) -> list:
+    return [[encode_value(key), encode_value(inner)] for key, inner in value.items()]
+
+
+def encode_value(value: Any) -> Any:
+    """Chuyển giá trị (kiểu trong danh sách cho phép) sang cấu trúc JSON thuần. Kiểu khác -> TypeError."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    if isinstance(value, tuple):
+        return {"$t": [encode_value(item) for item in value]}
+    if isinstance(value, (set, frozenset)):
+        return {"$s": [encode_value(item) for item in value]}
+    if isinstance(value, Counter):
+        return {"$c": _pairs(value)}
+    if isinstance(value, defaultdict):
+        factory_name = getattr(value.default_factory, "__name__", "")
+        if factory_name in _DEFAULT_FACTORIES and _DEFAULT_FACTORIES[factory_name] is value.default_factory:
+            return {"$dd": [factory_name, _pairs(value)]}
+        return {"$d": _pairs(value)} # Factory lambda: gửi dạng dict như checkpoint
+    if isinstance(value, dict):
+        return {"$d": _pairs(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, array):
+        return {"$a": [value.typecode, _array_bytes(value)]}
+    object_name = _OBJECT_NAMES.get(type(value))
+    if object_name:
+        return {"$o": [object_name, {field: encode_value(inner) for field, inner in vars(value).items()}]}
+    raise TypeError(f"Không mã hóa được kiểu {type(value).__name__} cho job quét")
+
+
+def _decode_pairs(pairs: Any) -> list:
+    if not isinstance(pairs, list) or not all(isinstance(pair, list) and len(pair) == 2 for pair in pairs):
+        raise JobPayloadError("dict phải là danh sách cặp [key, value]")
+    return [(decode_value(key), decode_value(inner)) for key, inner in pairs]
+
+
+def _decode_object(object_name: Any, fields: Any) -> Any:
+    template = _OBJECT_TEMPLATES.get(object_name) if isinstance(object_name, str) else None
+    if template is None:
+        raise JobPayloadError(f"lớp không được phép: {object_name!r}")
+    if not isinstance(fields, dict) or set(fields) != set(template):
+        raise JobPayloadError(f"field của {object_name} không khớp")
+    instance = _OBJECT_CLASSES[object_name].__new__(_OBJECT_CLASSES[object_name])
+    for field, encoded in fields.items():
+        decoded = decode_value(encoded)
+        expected = template[field]
+        if type(decoded) is not type(expected) or (isinstance(expected, array) and decoded.typecode != expected.typecode):
+            raise JobPayloadError(f"field {object_name}.{field} sai kiểu")
+        setattr(instance, field, decoded)
+    return instance
+
+
+def decode_value(data: Any) -> Any:
+    """Ngược lại của encode_value; chỉ chấp nhận các tag ở trên (JobPayloadError nếu sai định dạng)."""
+    if data is None or isinstance(data, (bool, int, float, str)):
+        return data
+    if isinstance(data, list):
+        return [decode_value(item) for item in data]
+    if not isinstance(data, dict) or len(data) != 1:
+        raise JobPayloadError("object JSON phải là một tag duy nhất")
+    tag, body = next(iter(data.items()))
+    if not isinstance(body, (list, str)):
+        raise JobPayloadError(f"nội dung tag {tag!r} không hợp lệ")
+    if tag in ("$t", "$s", "$c", "$d") and not isinstance(body, list):
+        raise JobPayloadError(f"nội dung tag {tag!r} phải là danh sách")
+    try:
+        if tag == "$t": return tuple(decode_value(item) for item in body)
+        if tag == "$s": return {decode_value(item) for item in body}
+        if tag == "$c": return Counter(dict(_decode_pairs(body)))
+        if tag == "$d": return dict(_decode_pairs(body))
+        if tag == "$dd":
+            factory_name, pairs = body
+            if factory_name not in _DEFAULT_FACTORIES:
+                raise JobPayloadError(f"default_factory không được phép: {factory_name!r}")
+            return defaultdict(_DEFAULT_FACTORIES[factory_name], _decode_pairs(pairs))
+        if tag == "$dt": return datetime.datetime.fromisoformat(body)
+        if tag == "$date": return datetime.date.fromisoformat(body)
+        if tag == "$a": return _bytes_array(*body)
+        if tag == "$o": return _decode_object(*body)
+    except JobPayloadError:
+        raise
+    except (TypeError, ValueError) as decode_err: # Sai số phần tử/kiểu bên trong tag
+        raise JobPayloadError(f"tag {tag} không hợp lệ: {decode_err}") from decode_err
+    raise JobPayloadError(f"tag không được phép: {tag!r}")
+
+
+def dumps(value: Any) -> str:
+    """Chuỗi JSON để ghi vào cột JSONB."""
+    return json.dumps(encode_value(value), separators=(",", ":"), ensure_ascii=False)
+
+# --- END OF FILE cogs/deep_scan_helpers/job_codec.py ---
@@ -0,0 +1,130 @@
+# --- START OF FILE cogs/deep_scan_helpers/keyword_matcher.py ---
+import logging
+from typing import Dict, List, Tuple, Iterable
+
+log = logging.getLogger(__name__)
+
+MATCH_MODE_SUBSTRING = "substring" # Giống str.count: đếm cả khi keyword nằm trong từ khác
+MATCH_MODE_WORD = "word" # Chỉ đếm khi keyword đứng riêng (không dính chữ/số/_ ở hai đầu)
+MATCH_MODES = (MATCH_MODE_SUBSTRING, MATCH_MODE_WORD)
+
+# Ít keyword thì str.count (chạy bằng C) vẫn nhanh hơn duyệt automaton bằng Python
+AHO_CORASICK_MIN_KEYWORDS = 100 # Điểm hòa đo bằng benchmarks/bench_keyword_matcher.py
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_" # Giống \w của re với chuỗi Unicode
+
+
+def _is_standalone(text: str, start: int, end: int) -> bool:
+    """Ranh giới từ của chế độ 'word' (dùng chung cho cả hai cách đếm): hai đầu không dính chữ/số/_."""
+    return (start == 0 or not _is_word_char(text[start - 1])) and (end == len(text) or not _is_word_char(text[end]))
+
+
+def _count_standalone(text: str, keyword: str) -> int:
+    """Như text.count(keyword) nhưng chỉ đếm lần xuất hiện đứng riêng; lần không hợp lệ không chặn lần chồng lên nó."""
+    count = 0
+    start = text.find(keyword)
+    while start != -1:
+        end = start + len(keyword)
+        if _is_standalone(text, start, end):
+            count += 1
+            start = text.find(keyword, end)
+        else:
+            start = text.find(keyword, start + 1)
+    return count
+
+
+class KeywordMatcher:
+    """
+    Đếm nhiều keyword trong một lượt duyệt nội dung (automaton Aho-Corasick, dựng một lần mỗi lần quét).
+    Mỗi keyword được đếm độc lập và không chồng lấn, giống hệt `text.count(keyword)`.
+    """
+
+    def __init__(self, keywords: Iterable[str], mode: str = MATCH_MODE_SUBSTRING):
+        if mode not in MATCH_MODES:
+            log.warning(f"Chế độ khớp keyword '{mode}' không hợp lệ, dùng '{MATCH_MODE_SUBSTRING}'.")
+            mode = MATCH_MODE_SUBSTRING
+        self.mode = mode
+        self.keywords: List[str] = list(dict.fromkeys(kw for kw in keywords if kw))
+        self.use_automaton = len(self.keywords) >= AHO_CORASICK_MIN_KEYWORDS
+        if self.use_automaton:
+            self._build_automaton()
+
+    def __bool__(self) -> bool:
+        return bool(self.keywords)
+
+    def _build_automaton(self):
+        # goto[state] = {ký tự: state kế tiếp}; output[state] = các (index keyword, độ dài) kết thúc tại state
+        goto: List[Dict[str, int]] = [{}]
+        output: List[Tuple[Tuple[int, int], ...]] = [()]
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    output.append(())
+                state = next_state
+            output[state] = output[state] + ((index, len(keyword)),)
+
+        # BFS tính fail link và gộp output theo fail link
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]; head += 1
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                candidate = goto[fallback].get(char, 0)
+                fail[next_state] = candidate if candidate != next_state else 0
+                output[next_state] = output[next_state] + output[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def count(self, text: str) -> Dict[str, int]:
+        """Trả về {keyword: số lần xuất hiện} (chỉ keyword có xuất hiện). `text` cần được lower() trước."""
+        if not text or not self.keywords:
+            return {}
+        if not self.use_automaton:
+            if self.mode == MATCH_MODE_WORD:
+                # Tìm bằng str.find (C), chỉ kiểm tra ranh giới ở các vị trí có xuất hiện
+                return {kw: c for kw in self.keywords if kw in text and (c := _count_standalone(text, kw))}
+            if len(self.keywords) == 1:
+                keyword = self.keywords[0]
+                c = text.count(keyword)
+                return {keyword: c} if c else {}
+            return {kw: c for kw in self.keywords if (c := text.count(kw))}
+
+        goto = self._goto; fail = self._fail; output = self._output
+        root = goto[0]
+        word_mode = self.mode == MATCH_MODE_WORD
+        next_allowed_start: Dict[int, int] = {} # index keyword -> vị trí bắt đầu sớm nhất (không chồng lấn)
+        hits: Dict[int, int] = {}
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0) if state else root.get(char, 0)
+            if not state or not output[state]:
+                continue
+            end = position + 1
+            for index, length in output[state]:
+                start = end - length
+                if start < next_allowed_start.get(index, 0):
+                    continue
+                if word_mode and not _is_standalone(text, start, end):
+                    continue
+                hits[index] = hits.get(index, 0) + 1
+                next_allowed_start[index] = end
+        keywords = self.keywords
+        return {keywords[index]: c for index, c in hits.items()}
+
+# --- END OF FILE cogs/deep_scan_helpers/keyword_matcher.py ---
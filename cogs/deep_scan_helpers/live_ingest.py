@@ -0,0 +1,292 @@
+# --- START OF FILE cogs/deep_scan_helpers/live_ingest.py ---
+import discord
+from discord.ext import commands
+import logging
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Tuple, NamedTuple, Iterable
+from collections import Counter, defaultdict
+
+import config
+import database
+from .user_stats import UserStatsStore, ms_to_snowflake
+from .scan_channels import MessageRecord, _to_message_record, _aggregate_message_batch
+from .incremental_scan import build_user_aggregate_rows, build_location_user_rows
+from .activity_rollups import build_rollup_rows
+from .message_index import start_message_index, index_message_batch, message_index_rows
+
+log = logging.getLogger(__name__)
+
+LIVE_LOCATION_TYPES = (discord.TextChannel, discord.VoiceChannel, discord.Thread) # Giống các loại location mà lệnh quét đọc
+STATUS_LOG_SECONDS = 300
+
+
+class LiveMessage(NamedTuple):
+    location_id: int
+    parent_channel_id: Optional[int]
+    is_thread: bool
+    record: MessageRecord
+
+
+class LiveReaction(NamedTuple):
+    location_id: int
+    message_id: int
+    user_id: Optional[int] # None = người thả là bot (không tính reaction_given)
+    author_id: Optional[int] # None = không biết tác giả hoặc tác giả là bot (không tính reaction_received)
+    delta: int # +1 thả, -1 gỡ
+    held: bool # Nhận lúc guild đang được quét
+
+
+class _GuildLiveState:
+    """
+    Trạng thái ghi nhận trực tiếp của một guild.
+    Guild chỉ "live" sau khi một lần quét tăng dần trong phiên gateway này lưu xong checkpoint:
+    mọi tin mới hơn checkpoint từ đó đều đi qua gateway nên chỉ cần cộng dồn, không phải quét lại.
+    """
+
+    def __init__(self):
+        self.live = False
+        self.paused = False # Đang quét: giữ sự kiện lại, xử lý sau khi quét lưu checkpoint
+        self.live_since_id = 0 # Location tạo sau mốc này (không có checkpoint) cũng được ghi nhận từ đầu
+        self.checkpoints: Dict[int, int] = {} # location_id -> message ID mới nhất đã được tính
+        self.pending_messages: List[LiveMessage] = []
+        self.pending_reactions: List[LiveReaction] = []
+        self.overflowed = False
+
+    def pending_count(self) -> int:
+        return len(self.pending_messages) + len(self.pending_reactions)
+
+    def location_threshold(self, location_id: int) -> Optional[int]:
+        """Message ID mà tin cũ hơn/bằng đã được tính; None = location chưa được theo dõi liên tục."""
+        checkpoint = self.checkpoints.get(location_id)
+        if checkpoint is not None:
+            return checkpoint
+        if location_id > self.live_since_id:
+            return 0 # Location tạo sau khi bắt đầu ghi nhận -> có đủ mọi tin
+        return None
+
+    def drop_pending(self):
+        self.pending_messages.clear()
+        self.pending_reactions.clear()
+
+
+def _new_live_buffer(guild: discord.Guild) -> Dict[str, Any]:
+    """scan_data thu gọn để dùng lại _aggregate_message_batch (cùng cách trích chỉ số với lúc quét)."""
+    buffer = {
+        "server": guild, "scan_errors": [],
+        "user_stats": UserStatsStore(),
+        "user_channel_message_counts": defaultdict(lambda: defaultdict(int)),
+        "daily_user_location_counts": Counter(), "daily_location_hourly_counts": Counter(),
+        "server_emojis_cache": {emoji.id: emoji for emoji in guild.emojis},
+        "server_sticker_ids_cache": {sticker.id for sticker in guild.stickers},
+    }
+    start_message_index(buffer)
+    return buffer
+
+
+class LiveIngestor:
+    """
+    Ghi nhận on_message / reaction ngoài lúc quét, gom trong bộ nhớ và ghi theo lô (write-behind)
+    vào bảng tổng hợp mỗi LIVE_INGEST_FLUSH_SECONDS giây.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self._states: Dict[int, _GuildLiveState] = {}
+        self._flush_lock = asyncio.Lock()
+        self.ingested_messages = 0
+        self.ingested_reactions = 0
+        self.skipped_events = 0
+        self.failed_flushes = 0
+
+    def _state(self, guild_id: int) -> _GuildLiveState:
+        state = self._states.get(guild_id)
+        if state is None:
+            state = self._states[guild_id] = _GuildLiveState()
+        return state
+
+    def _accepting(self, guild_id: int) -> Optional[_GuildLiveState]:
+        state = self._states.get(guild_id)
+        if state is None or not (state.live or state.paused) or state.overflowed:
+            return None
+        if state.pending_count() >= config.LIVE_INGEST_MAX_PENDING:
+            # DB không theo kịp: bỏ dữ liệu chờ, lần quét sau sẽ đọc lại từ checkpoint
+            log.warning(f"Ghi nhận trực tiếp guild {guild_id}: quá {config.LIVE_INGEST_MAX_PENDING:,} sự kiện chờ ghi, dừng theo dõi tới lần quét sau.")
+            state.drop_pending()
+            state.live = False
+            state.overflowed = state.paused
+            return None
+        return state
+
+    # --- Sự kiện gateway (đồng bộ, chỉ thêm vào hàng chờ) ---
+    def on_message(self, message: discord.Message):
+        if not message.guild or not isinstance(message.channel, LIVE_LOCATION_TYPES):
+            return
+        state = self._accepting(message.guild.id)
+        if state is None:
+            return
+        record = _to_message_record(message)
+        if record is None:
+            return
+        is_thread = isinstance(message.channel, discord.Thread)
+        state.pending_messages.append(LiveMessage(
+            message.channel.id, message.channel.parent_id if is_thread else None, is_thread, record
+        ))
+
+    def on_reaction(self, payload: discord.RawReactionActionEvent, delta: int):
+        if not config.ENABLE_REACTION_SCAN or payload.guild_id is None:
+            return
+        state = self._accepting(payload.guild_id)
+        if state is None:
+            return
+        guild = self.bot.get_guild(payload.guild_id)
+        if guild is None:
+            return
+        # Cùng bộ lọc với lúc quét: chỉ emoji của server hoặc unicode trong REACTION_UNICODE_EXCEPTIONS
+        emoji = payload.emoji
+        if emoji.is_custom_emoji():
+            if guild.get_emoji(emoji.id) is None: return
+        elif emoji.name not in config.REACTION_UNICODE_EXCEPTIONS:
+            return
+        reactor = payload.member or guild.get_member(payload.user_id)
+        author_id = getattr(payload, "message_author_id", None)
+        author = guild.get_member(author_id) if author_id else None
+        state.pending_reactions.append(LiveReaction(
+            payload.channel_id, payload.message_id,
+            None if reactor is not None and reactor.bot else payload.user_id,
+            None if not author_id or (author is not None and author.bot) else author_id,
+            delta, state.paused
+        ))
+
+    def discard_messages(self, guild_id: int, message_ids: Iterable[int]):
+        """Tin bị xóa trước khi kịp ghi: bỏ khỏi hàng chờ (không cộng rồi lại phải trừ)."""
+        state = self._states.get(guild_id)
+        if state is None or not state.pending_messages:
+            return
+        message_ids = set(message_ids)
+        state.pending_messages = [item for item in state.pending_messages if item.record.message_id not in message_ids]
+
+    def on_new_session(self):
+        """Phiên gateway mới (không resume được): sự kiện trong lúc mất kết nối đã mất -> chờ lần quét tiếp theo."""
+        live_guilds = [guild_id for guild_id, state in self._states.items() if state.live]
+        for state in self._states.values():
+            state.live = False
+            state.drop_pending()
+        if live_guilds:
+            log.warning(f"Phiên gateway mới: dừng ghi nhận trực tiếp {len(live_guilds)} guild cho tới lần quét tăng dần tiếp theo.")
+
+    # --- Phối hợp với lệnh quét ---
+    async def pause_guild(self, guild_id: int):
+        """Lệnh quét bắt đầu: giữ sự kiện lại và chờ lần ghi đang chạy xong (quét sẽ đọc checkpoint từ DB)."""
+        state = self._state(guild_id)
+        state.paused = True
+        state.overflowed = False
+        state.live_since_id = ms_to_snowflake(int(time.time() * 1000))
+        async with self._flush_lock:
+            pass
+
+    async def resume_guild(self, guild_id: int, scan_state_saved: bool):
+        """
+        Lệnh quét xong. scan_state_saved=True: checkpoint mới đã lưu -> nạp lại và bắt đầu ghi nhận
+        (sự kiện giữ lại trong lúc quét chỉ tính phần mới hơn checkpoint). Ngược lại bỏ dữ liệu giữ lại.
+        """
+        state = self._states.get(guild_id)
+        if state is None or not state.paused:
+            return
+        if scan_state_saved and not state.overflowed:
+            checkpoints = await database.get_location_scan_checkpoints(guild_id)
+            state.checkpoints = {location_id: row.get("last_message_id") or 0 for location_id, row in checkpoints.items()}
+            state.live = True
+            log.info(f"Ghi nhận trực tiếp guild {guild_id}: theo dõi {len(state.checkpoints)} kênh/luồng, {state.pending_count():,} sự kiện giữ lại trong lúc quét.")
+        else:
+            state.live = False
+            state.drop_pending()
+        state.paused = False
+        state.overflowed = False
+
+    # --- Ghi theo lô ---
+    async def flush(self):
+        async with self._flush_lock:
+            for guild_id, state in list(self._states.items()):
+                if state.paused or not state.live or not state.pending_count():
+                    continue
+                await self._flush_guild(guild_id, state)
+
+    async def _flush_guild(self, guild_id: int, state: _GuildLiveState):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            state.drop_pending(); state.live = False
+            return
+        messages, state.pending_messages = state.pending_messages, []
+        reactions, state.pending_reactions = state.pending_reactions, []
+
+        buffer = _new_live_buffer(guild)
+        by_location: Dict[int, List[MessageRecord]] = defaultdict(list)
+        location_info: Dict[int, Tuple[Optional[int], bool]] = {}
+        skipped = 0
+        for live_message in messages:
+            threshold = state.location_threshold(live_message.location_id)
+            if threshold is None or live_message.record.message_id <= threshold:
+                skipped += 1
+                continue
+            by_location[live_message.location_id].append(live_message.record)
+            location_info[live_message.location_id] = (live_message.parent_channel_id, live_message.is_thread)
+
+        checkpoint_rows: List[Dict[str, Any]] = []
+        for location_id, records in by_location.items():
+            parent_channel_id, is_thread = location_info[location_id]
+            _aggregate_message_batch(records, buffer, location_id, is_thread)
+            index_message_batch(records, buffer, location_id)
+            checkpoint_rows.append({
+                "location_id": location_id, "parent_channel_id": parent_channel_id,
+                "last_message_id": max(record.message_id for record in records), "message_count": len(records),
+            })
+
+        stats: UserStatsStore = buffer["user_stats"]
+        reaction_count = 0
+        for reaction in reactions:
+            threshold = state.location_threshold(reaction.location_id)
+            # Reaction lúc đang quét vào tin quét đã đọc: không biết quét đọc trước hay sau khi thả -> bỏ
+            if threshold is None or (reaction.held and reaction.message_id <= threshold):
+                skipped += 1
+                continue
+            if reaction.user_id: stats.reaction_given_count[stats.row(reaction.user_id)] += reaction.delta
+            if reaction.author_id: stats.reaction_received_count[stats.row(reaction.author_id)] += reaction.delta
+            reaction_count += 1
+
+        daily_rows, hourly_rows = build_rollup_rows(buffer) if config.ENABLE_ACTIVITY_ROLLUPS else ([], [])
+        saved = await database.apply_live_activity(
+            guild_id, build_user_aggregate_rows(stats), build_location_user_rows(buffer),
+            checkpoint_rows, daily_rows, hourly_rows, message_index_rows(buffer)
+        )
+        self.skipped_events += skipped
+        if not saved:
+            # Giữ lại để thử ghi ở lần sau (checkpoint chưa đổi nên không bị tính trùng)
+            self.failed_flushes += 1
+            state.pending_messages[:0] = messages
+            state.pending_reactions[:0] = reactions
+            return
+        for row in checkpoint_rows:
+            state.checkpoints[row["location_id"]] = max(state.checkpoints.get(row["location_id"], 0), row["last_message_id"])
+        self.ingested_messages += buffer.get("overall_total_message_count", 0)
+        self.ingested_reactions += reaction_count
+        log.debug(f"Ghi nhận trực tiếp guild {guild_id}: ghi {buffer.get('overall_total_message_count', 0)} tin, {reaction_count} reaction ({skipped} bỏ qua).")
+
+    async def run(self):
+        """Vòng ghi định kỳ (task nền của cog)."""
+        last_status_log = time.monotonic()
+        while True:
+            await asyncio.sleep(config.LIVE_INGEST_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as flush_err:
+                log.error(f"Lỗi ghi dữ liệu trực tiếp: {flush_err}", exc_info=True)
+            if time.monotonic() - last_status_log >= STATUS_LOG_SECONDS:
+                last_status_log = time.monotonic()
+                live_count = sum(1 for state in self._states.values() if state.live)
+                log.info(
+                    f"Ghi nhận trực tiếp: {live_count} guild đang theo dõi, đã ghi {self.ingested_messages:,} tin, "
+                    f"{self.ingested_reactions:,} reaction ({self.skipped_events:,} bỏ qua, {self.failed_flushes} lần ghi lỗi)."
+                )
+
+# --- END OF FILE cogs/deep_scan_helpers/live_ingest.py ---
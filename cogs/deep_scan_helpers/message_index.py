@@ -0,0 +1,164 @@
+# --- START OF FILE cogs/deep_scan_helpers/message_index.py ---
+import logging
+import time
+from array import array
+from typing import Dict, Any, List, Optional, Tuple, Iterable, Iterator
+
+import config
+from .user_stats import ms_to_snowflake
+from .content_analysis import URL_REGEX, EMOJI_REGEX
+
+log = logging.getLogger(__name__)
+
+# Phần mỗi tin nhắn cộng vào user_activity_aggregates (ngoài message_count = 1), theo thứ tự cột counts trong DB.
+# mention_received_count của người được mention suy ra từ mention_ids.
+CONTRIBUTION_COLUMNS = (
+    "link_count", "image_count", "other_file_count", "emoji_count",
+    "custom_emoji_content_count", "sticker_count", "mention_given_count", "reply_count",
+)
+CONTRIBUTION_WIDTH = len(CONTRIBUTION_COLUMNS)
+_ZERO_CONTRIBUTION = (0,) * CONTRIBUTION_WIDTH
+_LINK, _IMAGE, _OTHER_FILE, _EMOJI, _CUSTOM_EMOJI, _STICKER, _MENTION_GIVEN, _REPLY = range(CONTRIBUTION_WIDTH)
+
+MessageIndexRow = Tuple[int, int, int, bool, List[int], List[int]] # (message_id, location_id, author_id, is_bot, counts, mention_ids)
+
+
+def message_index_enabled() -> bool:
+    return config.ENABLE_INCREMENTAL_SCAN and config.MESSAGE_INDEX_RETENTION_DAYS > 0
+
+
+def message_index_cutoff_id() -> int:
+    """Tin có ID <= mốc này nằm ngoài khoảng lưu chỉ mục (MESSAGE_INDEX_RETENTION_DAYS ngày gần nhất)."""
+    return ms_to_snowflake(int(time.time() * 1000) - config.MESSAGE_INDEX_RETENTION_DAYS * 86_400_000)
+
+
+def content_contribution(content: str, server_emoji_ids) -> Tuple[int, int, int]:
+    """(số link, số emoji, số emoji của server) trong nội dung - cùng cách đếm với _aggregate_message_batch."""
+    if not content:
+        return 0, 0, 0
+    emoji_count = custom_emoji_count = 0
+    for match in EMOJI_REGEX.finditer(content):
+        emoji_count += 1
+        custom_id_str = match.group(2)
+        if custom_id_str and int(custom_id_str) in server_emoji_ids:
+            custom_emoji_count += 1
+    return len(URL_REGEX.findall(content)), emoji_count, custom_emoji_count
+
+
+def message_contribution(record, server_emoji_ids) -> Tuple[int, ...]:
+    """Phần một MessageRecord cộng vào các cột CONTRIBUTION_COLUMNS (tin của bot chỉ tính message_count)."""
+    if record.is_bot:
+        return _ZERO_CONTRIBUTION
+    link_count, emoji_count, custom_emoji_count = content_contribution(record.content, server_emoji_ids)
+    return (
+        link_count, record.image_count, record.other_file_count, emoji_count,
+        custom_emoji_count, len(record.sticker_ids), len(record.mention_ids), int(record.is_reply),
+    )
+
+
+def edited_contribution(
+    row: Dict[str, Any], data: Dict[str, Any], server_emoji_ids
+) -> Tuple[List[int], List[int]]:
+    """
+    (counts, mention_ids) mới của tin đã lưu trong chỉ mục sau một sự kiện sửa tin (payload.data thô của gateway).
+    Trường không có trong data (vd: chỉ cập nhật embed) giữ nguyên giá trị cũ; sticker/reply không đổi khi sửa.
+    """
+    counts = list(row["counts"])
+    mention_ids = list(row["mention_ids"] or ())
+    if row["is_bot"]:
+        return counts, mention_ids
+    if "content" in data:
+        counts[_LINK], counts[_EMOJI], counts[_CUSTOM_EMOJI] = content_contribution(data.get("content") or "", server_emoji_ids)
+    if "attachments" in data:
+        attachments = data.get("attachments") or []
+        image_count = sum(1 for att in attachments if (att.get("content_type") or "").startswith("image/"))
+        counts[_IMAGE], counts[_OTHER_FILE] = image_count, len(attachments) - image_count
+    if "mentions" in data:
+        mention_ids = [int(user["id"]) for user in data.get("mentions") or [] if not user.get("bot")]
+        counts[_MENTION_GIVEN] = len(mention_ids)
+    return counts, mention_ids
+
+
+class MessageIndexBuffer:
+    """
+    Chỉ mục message ID -> (tác giả, kênh/luồng, phần đóng góp) thu được trong một lần quét/lần ghi trực tiếp,
+    dạng cột (array) như UserStatsStore để không tạo một tuple/dict cho mỗi tin nhắn.
+    """
+
+    def __init__(self):
+        self.message_ids = array('q')
+        self.location_ids = array('q')
+        self.author_ids = array('q')
+        self.is_bot = array('b')
+        self.counts = array('i') # CONTRIBUTION_WIDTH giá trị mỗi tin
+        self.mention_ids: Dict[int, Tuple[int, ...]] = {} # row -> user ID được mention (thưa)
+
+    def __len__(self) -> int:
+        return len(self.message_ids)
+
+    def append(self, location_id: int, record, counts: Iterable[int]):
+        row = len(self.message_ids)
+        self.message_ids.append(record.message_id)
+        self.location_ids.append(location_id)
+        self.author_ids.append(record.author_id)
+        self.is_bot.append(1 if record.is_bot else 0)
+        self.counts.extend(counts)
+        if record.mention_ids and not record.is_bot:
+            self.mention_ids[row] = record.mention_ids
+
+    def merge(self, other: "MessageIndexBuffer"):
+        """Nối chỉ mục khác (vd: kết quả từng phần của worker quét phân tán) vào chỉ mục này."""
+        offset = len(self.message_ids)
+        self.message_ids.extend(other.message_ids)
+        self.location_ids.extend(other.location_ids)
+        self.author_ids.extend(other.author_ids)
+        self.is_bot.extend(other.is_bot)
+        self.counts.extend(other.counts)
+        for row, mention_ids in other.mention_ids.items():
+            self.mention_ids[offset + row] = mention_ids
+
+    def copy(self) -> "MessageIndexBuffer":
+        """Bản sao độc lập để checkpoint pickle trong thread (mention_ids là tuple, chỉ cần copy dict)."""
+        clone = MessageIndexBuffer.__new__(MessageIndexBuffer)
+        for name in ("message_ids", "location_ids", "author_ids", "is_bot", "counts"):
+            setattr(clone, name, getattr(self, name)[:])
+        clone.mention_ids = self.mention_ids.copy()
+        return clone
+
+    def iter_rows(self) -> Iterator[MessageIndexRow]:
+        for row in range(len(self.message_ids)):
+            start = row * CONTRIBUTION_WIDTH
+            yield (
+                self.message_ids[row], self.location_ids[row], self.author_ids[row], bool(self.is_bot[row]),
+                list(self.counts[start:start + CONTRIBUTION_WIDTH]), list(self.mention_ids.get(row, ())),
+            )
+
+
+def start_message_index(scan_data: Dict[str, Any]):
+    """Bật thu thập chỉ mục cho lần quét/lần ghi này (chỉ tin mới hơn mốc lưu giữ)."""
+    if message_index_enabled():
+        scan_data["message_index"] = MessageIndexBuffer()
+        scan_data["message_index_after_id"] = message_index_cutoff_id()
+    else:
+        scan_data["message_index"] = None
+        scan_data["message_index_after_id"] = None
+
+
+def index_message_batch(records: List[Any], scan_data: Dict[str, Any], location_id: int):
+    """Ghi phần đóng góp của các tin trong lô vào chỉ mục (đồng bộ, gọi ngay sau _aggregate_message_batch)."""
+    index: Optional[MessageIndexBuffer] = scan_data.get("message_index")
+    if index is None:
+        return
+    after_id = scan_data.get("message_index_after_id") or 0
+    server_emoji_ids = scan_data.get("server_emojis_cache", {})
+    for record in records:
+        if record.message_id > after_id:
+            index.append(location_id, record, message_contribution(record, server_emoji_ids))
+
+
+def message_index_rows(scan_data: Dict[str, Any]) -> Optional[List[MessageIndexRow]]:
+    """Dòng chỉ mục để lưu; None = không thu thập (không đụng tới bảng chỉ mục)."""
+    index: Optional[MessageIndexBuffer] = scan_data.get("message_index")
+    return list(index.iter_rows()) if index is not None else None
+
+# --- END OF FILE cogs/deep_scan_helpers/message_index.py ---
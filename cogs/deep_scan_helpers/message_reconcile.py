@@ -0,0 +1,220 @@
+# --- START OF FILE cogs/deep_scan_helpers/message_reconcile.py ---
+import discord
+from discord.ext import commands
+import logging
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Set, Tuple, Iterable
+from collections import Counter, defaultdict
+
+import config
+import database
+from .user_stats import snowflake_to_ms
+from .scan_planner import DAY_MS
+from .activity_rollups import rollup_day_to_date
+from .message_index import CONTRIBUTION_COLUMNS, edited_contribution, message_index_cutoff_id
+
+log = logging.getLogger(__name__)
+
+RECONCILE_MAX_PENDING = 100_000 # Số tin chờ đối soát tối đa mỗi guild (vượt quá thì bỏ, số liệu lệch tới lần quét toàn bộ sau)
+RECONCILE_FETCH_CHUNK_SIZE = 5_000
+PRUNE_INTERVAL_SECONDS = 3600
+EDIT_DATA_KEYS = ("content", "attachments", "mentions") # Trường của tin đã sửa ảnh hưởng tới số liệu
+
+
+class _GuildReconcileState:
+    def __init__(self):
+        self.paused = False # Đang quét: giữ sự kiện lại, đối soát sau khi quét lưu dữ liệu tổng hợp
+        self.deleted_ids: Set[int] = set()
+        self.edits: Dict[int, Dict[str, Any]] = {} # message_id -> các trường mới nhất (EDIT_DATA_KEYS)
+
+    def pending_count(self) -> int:
+        return len(self.deleted_ids) + len(self.edits)
+
+
+class MessageReconciler:
+    """
+    Đối soát dữ liệu tổng hợp đã lưu với sự kiện xóa/sửa tin (raw, kể cả xóa hàng loạt):
+    tra chỉ mục message_contributions để trừ hoặc sửa đúng phần tin nhắn đó đã cộng vào.
+    Tin cũ hơn MESSAGE_INDEX_RETENTION_DAYS không có trong chỉ mục nên không được đối soát.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self._states: Dict[int, _GuildReconcileState] = {}
+        self._flush_lock = asyncio.Lock()
+        self._cutoff_id = message_index_cutoff_id()
+        self._cutoff_refreshed = time.monotonic()
+        self.reconciled_deletes = 0
+        self.reconciled_edits = 0
+        self.unindexed_events = 0
+
+    def _state(self, guild_id: int) -> _GuildReconcileState:
+        state = self._states.get(guild_id)
+        if state is None:
+            state = self._states[guild_id] = _GuildReconcileState()
+        return state
+
+    def _indexed(self, message_id: int) -> bool:
+        if time.monotonic() - self._cutoff_refreshed >= 60:
+            self._cutoff_id = message_index_cutoff_id(); self._cutoff_refreshed = time.monotonic()
+        return message_id > self._cutoff_id
+
+    def _has_room(self, guild_id: int, state: _GuildReconcileState) -> bool:
+        if state.pending_count() < RECONCILE_MAX_PENDING:
+            return True
+        self.unindexed_events += 1
+        if self.unindexed_events % 1000 == 1:
+            log.warning(f"Đối soát tin guild {guild_id}: quá {RECONCILE_MAX_PENDING:,} tin chờ, bỏ qua sự kiện mới.")
+        return False
+
+    # --- Sự kiện gateway (đồng bộ, chỉ thêm vào hàng chờ) ---
+    def on_delete(self, guild_id: Optional[int], message_ids: Iterable[int]):
+        if guild_id is None:
+            return
+        state = self._state(guild_id)
+        for message_id in message_ids:
+            if not self._indexed(message_id) or not self._has_room(guild_id, state):
+                continue
+            state.deleted_ids.add(message_id)
+            state.edits.pop(message_id, None)
+
+    def on_edit(self, guild_id: Optional[int], message_id: int, data: Dict[str, Any]):
+        if guild_id is None or not self._indexed(message_id):
+            return
+        changed = {key: data[key] for key in EDIT_DATA_KEYS if key in data}
+        if not changed:
+            return # Chỉ cập nhật embed/ghim...
+        state = self._state(guild_id)
+        if message_id in state.deleted_ids or (message_id not in state.edits and not self._has_room(guild_id, state)):
+            return
+        state.edits.setdefault(message_id, {}).update(changed)
+
+    # --- Phối hợp với lệnh quét (lệnh quét nạp rồi ghi đè dữ liệu tổng hợp -> không được trừ ở giữa) ---
+    async def pause_guild(self, guild_id: int):
+        self._state(guild_id).paused = True
+        async with self._flush_lock:
+            pass
+
+    def resume_guild(self, guild_id: int):
+        state = self._states.get(guild_id)
+        if state is not None:
+            state.paused = False
+
+    # --- Ghi theo lô ---
+    async def flush(self):
+        async with self._flush_lock:
+            live_ingest = self.bot.get_cog("LiveIngest")
+            if live_ingest:
+                # Tin vừa nhận qua gateway phải vào chỉ mục trước khi đối soát xóa/sửa của chính nó
+                await live_ingest.ingestor.flush()
+            for guild_id, state in list(self._states.items()):
+                if state.paused or not state.pending_count():
+                    continue
+                await self._flush_guild(guild_id, state)
+
+    async def _flush_guild(self, guild_id: int, state: _GuildReconcileState):
+        deleted_ids, state.deleted_ids = state.deleted_ids, set()
+        edits, state.edits = state.edits, {}
+        message_ids = list(deleted_ids | set(edits))
+        index_rows: Dict[int, Dict[str, Any]] = {}
+        for start in range(0, len(message_ids), RECONCILE_FETCH_CHUNK_SIZE):
+            chunk_rows = await database.get_message_contributions(guild_id, message_ids[start:start + RECONCILE_FETCH_CHUNK_SIZE])
+            if chunk_rows is None:
+                self._requeue(state, deleted_ids, edits)
+                return
+            index_rows.update(chunk_rows)
+        self.unindexed_events += len(message_ids) - len(index_rows)
+        if not index_rows:
+            return
+
+        guild = self.bot.get_guild(guild_id)
+        server_emoji_ids = {emoji.id for emoji in guild.emojis} if guild else set()
+        user_deltas: Dict[int, Counter] = defaultdict(Counter)
+        location_user_deltas: Counter = Counter()
+        checkpoint_deltas: Counter = Counter()
+        daily_deltas: Counter = Counter()
+        hourly_deltas: Counter = Counter()
+        updated_index_rows: List[Tuple[int, int, int, bool, List[int], List[int]]] = []
+        removed_ids: List[int] = []
+
+        for message_id in deleted_ids:
+            row = index_rows.get(message_id)
+            if row is None: continue
+            author_id, location_id = row["author_id"], row["location_id"]
+            author_deltas = user_deltas[author_id]
+            author_deltas["message_count"] -= 1
+            for column, value in zip(CONTRIBUTION_COLUMNS, row["counts"]):
+                author_deltas[column] -= value
+            for mentioned_user_id in row["mention_ids"] or ():
+                user_deltas[mentioned_user_id]["mention_received_count"] -= 1
+            location_user_deltas[(location_id, author_id)] -= 1
+            checkpoint_deltas[location_id] -= 1
+            if config.ENABLE_ACTIVITY_ROLLUPS:
+                timestamp_ms = snowflake_to_ms(message_id)
+                day = timestamp_ms // DAY_MS
+                daily_deltas[(day, location_id, author_id)] -= 1
+                hourly_deltas[(day, location_id, (timestamp_ms // 3_600_000) % 24)] -= 1
+            removed_ids.append(message_id)
+
+        for message_id, data in edits.items():
+            row = index_rows.get(message_id)
+            if row is None: continue
+            counts, mention_ids = edited_contribution(row, data, server_emoji_ids)
+            if counts == list(row["counts"]) and mention_ids == list(row["mention_ids"] or ()):
+                continue # Sửa nội dung nhưng số liệu không đổi
+            author_deltas = user_deltas[row["author_id"]]
+            for column, old_value, new_value in zip(CONTRIBUTION_COLUMNS, row["counts"], counts):
+                if new_value != old_value: author_deltas[column] += new_value - old_value
+            mention_changes = Counter(mention_ids)
+            mention_changes.subtract(row["mention_ids"] or ())
+            for mentioned_user_id, change in mention_changes.items():
+                if change: user_deltas[mentioned_user_id]["mention_received_count"] += change
+            updated_index_rows.append((message_id, row["location_id"], row["author_id"], row["is_bot"], counts, mention_ids))
+
+        saved = await database.apply_message_reconciliation(
+            guild_id,
+            [dict(deltas, user_id=user_id) for user_id, deltas in user_deltas.items() if any(deltas.values())],
+            [(location_id, user_id, delta) for (location_id, user_id), delta in location_user_deltas.items() if delta],
+            [(location_id, delta) for location_id, delta in checkpoint_deltas.items() if delta],
+            [(rollup_day_to_date(day), location_id, user_id, delta) for (day, location_id, user_id), delta in daily_deltas.items() if delta],
+            [(rollup_day_to_date(day), location_id, hour, delta) for (day, location_id, hour), delta in hourly_deltas.items() if delta],
+            removed_ids, updated_index_rows
+        )
+        if not saved:
+            self._requeue(state, deleted_ids, edits)
+            return
+        self.reconciled_deletes += len(removed_ids)
+        self.reconciled_edits += len(updated_index_rows)
+        log.debug(f"Đối soát guild {guild_id}: trừ {len(removed_ids)} tin bị xóa, sửa {len(updated_index_rows)} tin.")
+
+    def _requeue(self, state: _GuildReconcileState, deleted_ids: Set[int], edits: Dict[int, Dict[str, Any]]):
+        """Lỗi DB: trả lại hàng chờ để thử ở lần sau (chỉ mục chưa đổi nên không bị trừ trùng)."""
+        state.deleted_ids |= deleted_ids
+        for message_id, data in edits.items():
+            if message_id in state.deleted_ids: continue
+            merged = dict(data); merged.update(state.edits.get(message_id, {})) # Sửa mới hơn ghi đè sửa cũ
+            state.edits[message_id] = merged
+
+    async def run(self):
+        """Vòng đối soát định kỳ + dọn chỉ mục cũ (task nền của cog)."""
+        last_prune = 0.0
+        last_status_log = time.monotonic()
+        while True:
+            await asyncio.sleep(config.MESSAGE_RECONCILE_FLUSH_SECONDS)
+            try:
+                await self.flush()
+                if time.monotonic() - last_prune >= PRUNE_INTERVAL_SECONDS:
+                    last_prune = time.monotonic()
+                    pruned = await database.prune_message_contributions(message_index_cutoff_id())
+                    if pruned: log.info(f"Đã dọn {pruned:,} dòng chỉ mục tin cũ hơn {config.MESSAGE_INDEX_RETENTION_DAYS} ngày.")
+            except Exception as reconcile_err:
+                log.error(f"Lỗi đối soát tin bị xóa/sửa: {reconcile_err}", exc_info=True)
+            if time.monotonic() - last_status_log >= PRUNE_INTERVAL_SECONDS:
+                last_status_log = time.monotonic()
+                log.info(
+                    f"Đối soát tin: đã trừ {self.reconciled_deletes:,} tin bị xóa, sửa {self.reconciled_edits:,} tin "
+                    f"({self.unindexed_events:,} sự kiện không có trong chỉ mục)."
+                )
+
+# --- END OF FILE cogs/deep_scan_helpers/message_reconcile.py ---
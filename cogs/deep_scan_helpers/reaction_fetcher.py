@@ -0,0 +1,210 @@
+# --- START OF FILE cogs/deep_scan_helpers/reaction_fetcher.py ---
+import discord
+import logging
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Tuple, Union, NamedTuple
+from collections import Counter, defaultdict
+
+import config
+import database
+import rest_scheduler
+from .user_stats import UserStatsStore
+
+log = logging.getLogger(__name__)
+
+CACHE_FLUSH_ROWS = 500 # Số dòng cache gom lại trước khi ghi DB
+CACHE_LOOKUP_JOBS = 500 # Số job gom lại (qua nhiều trang/kênh) trước khi tra cache DB một lần
+
+
+class ReactionJob(NamedTuple):
+    message_id: int
+    emoji_key: Union[int, str] # Key của reaction đã lọc (ID emoji server hoặc unicode)
+    count: int
+    reaction: Optional[discord.Reaction] # None: job nạp lại từ checkpoint, worker lấy lại tin nhắn
+    location_id: int = 0
+
+
+class ReactionFetcher:
+    """
+    Pool worker lấy danh sách người thả reaction, tách khỏi vòng quét history.
+    Quét kênh chỉ đẩy job vào hàng đợi (có giới hạn -> tự chờ khi worker không kịp).
+    Reaction có số lượt thả không đổi so với lần quét trước được lấy từ cache DB, không gọi API.
+    Tra cache theo lô CACHE_LOOKUP_JOBS job (gom từ nhiều trang) thay vì mỗi trang một lần.
+    Job chưa cộng vào số liệu (chờ tra cache, trong hàng đợi, đang fetch) được lưu kèm checkpoint (pending_jobs)
+    vì cursor quét đã đi qua tin nhắn của chúng; resume thì nạp lại bằng requeue.
+    """
+
+    def __init__(self, scan_data: Dict[str, Any], worker_count: int, queue_size: int):
+        self.scan_data = scan_data
+        self.guild_id: int = scan_data["server"].id
+        self.worker_count = worker_count
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._workers: List[asyncio.Task] = []
+        # Job chưa cộng vào số liệu, cũng dùng để bỏ job trùng (message, emoji). Xong job nào thì bỏ khỏi đây nên
+        # không lớn dần theo cả lần quét (mỗi tin chỉ được đọc một lần: khoảng snowflake không chồng nhau, cursor resume khớp số liệu)
+        self._outstanding: Dict[Tuple[int, str], ReactionJob] = {}
+        self._pending_cache_rows: List[Tuple[int, str, int, List[int]]] = []
+        self._lookup_jobs: List[ReactionJob] = [] # Chờ tra cache
+        self._used_cache_keys: List[Tuple[int, str]] = [] # Cache vừa được dùng lại (cập nhật last_fetched theo lô)
+        self._in_flight = 0
+        self._started_at = time.monotonic()
+        self.fetched_count = 0
+        self.cache_hit_count = 0
+        self.error_count = 0
+
+    def start(self):
+        for i in range(self.worker_count):
+            self._workers.append(asyncio.create_task(self._worker(), name=f"ReactionFetcher-{self.guild_id}-{i}"))
+        log.info(f"Reaction fetcher: khởi động {self.worker_count} worker.")
+
+    @property
+    def backlog(self) -> int:
+        return len(self._lookup_jobs) + self.queue.qsize() + self._in_flight
+
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self._started_at
+        return (self.fetched_count + self.cache_hit_count) / elapsed if elapsed > 0.1 else 0.0
+
+    async def submit_many(self, jobs: List[ReactionJob]):
+        """Nhận job của một lô tin nhắn; đủ CACHE_LOOKUP_JOBS job thì tra cache một lần cho cả lô gom được."""
+        for job in jobs:
+            job_key = (job.message_id, str(job.emoji_key))
+            if job_key in self._outstanding: continue
+            self._outstanding[job_key] = job
+            self._lookup_jobs.append(job)
+        if len(self._lookup_jobs) >= CACHE_LOOKUP_JOBS:
+            await self._resolve_lookups()
+
+    def pending_jobs(self) -> List[Tuple[int, int, Union[int, str], int]]:
+        """(location_id, message_id, emoji_key, count) của các job chưa cộng vào số liệu (chụp cùng checkpoint, không await)."""
+        return [(job.location_id, job.message_id, job.emoji_key, job.count) for job in self._outstanding.values()]
+
+    def requeue(self, pending_jobs: List[Tuple[int, int, Union[int, str], int]]):
+        """Resume: đưa lại các job lưu trong checkpoint vào lô tra cache (cache trượt thì worker lấy lại tin nhắn)."""
+        for location_id, message_id, emoji_key, count in pending_jobs:
+            job = ReactionJob(message_id, emoji_key, count, None, location_id)
+            self._outstanding[(message_id, str(emoji_key))] = job
+            self._lookup_jobs.append(job)
+        if pending_jobs:
+            log.info(f"Reaction fetcher: nạp lại {len(pending_jobs):,} job lấy người thả reaction từ checkpoint.")
+
+    async def _resolve_lookups(self):
+        """Dùng cache nếu số lượt thả không đổi, còn lại đưa vào hàng đợi fetch API."""
+        lookup_jobs, self._lookup_jobs = self._lookup_jobs, []
+        if not lookup_jobs:
+            return
+        cached = await database.get_reaction_user_cache(self.guild_id, list({job.message_id for job in lookup_jobs}))
+        for job in lookup_jobs:
+            cache_key = (job.message_id, str(job.emoji_key))
+            cached_entry = cached.get(cache_key)
+            if cached_entry and cached_entry[0] == job.count:
+                self._apply_users(job, cached_entry[1])
+                self.cache_hit_count += 1
+                self._used_cache_keys.append(cache_key)
+            else:
+                await self.queue.put(job)
+        if len(self._used_cache_keys) >= CACHE_FLUSH_ROWS:
+            await self._flush_used_keys()
+
+    def _apply_users(self, job: ReactionJob, user_ids: List[int]):
+        self._outstanding.pop((job.message_id, str(job.emoji_key)), None) # Cùng lúc với cộng số liệu -> checkpoint không lưu trùng
+        stats: UserStatsStore = self.scan_data["user_stats"]
+        user_react_emoji_given_counter = self.scan_data.setdefault("user_reaction_emoji_given_counts", defaultdict(Counter))
+        for user_id in user_ids:
+            stats.reaction_given_count[stats.row(user_id)] += 1
+            user_react_emoji_given_counter[user_id][job.emoji_key] += 1
+
+    async def _load_reaction(self, job: ReactionJob) -> Optional[discord.Reaction]:
+        """Job nạp lại từ checkpoint: lấy lại tin nhắn để có Reaction (None nếu tin/reaction đã bị xóa)."""
+        guild: discord.Guild = self.scan_data["server"]
+        try:
+            async with rest_scheduler.slot(rest_scheduler.ROUTE_HISTORY):
+                location = guild.get_channel_or_thread(job.location_id) or await guild.fetch_channel(job.location_id)
+                message = await location.fetch_message(job.message_id)
+        except discord.NotFound:
+            return None
+        for reaction in message.reactions:
+            emoji = reaction.emoji
+            emoji_key = emoji if isinstance(emoji, str) else emoji.id
+            if emoji_key == job.emoji_key:
+                return reaction
+        return None
+
+    async def _worker(self):
+        while True:
+            job: ReactionJob = await self.queue.get()
+            self._in_flight += 1
+            try:
+                reaction = job.reaction or await self._load_reaction(job)
+                if reaction is None:
+                    self._outstanding.pop((job.message_id, str(job.emoji_key)), None)
+                    continue
+                async with rest_scheduler.slot(rest_scheduler.ROUTE_REACTIONS):
+                    user_ids = [user.id async for user in reaction.users() if user and not user.bot] # Chỉ đếm user thật
+                self._apply_users(job, user_ids)
+                self.fetched_count += 1
+                self._pending_cache_rows.append((job.message_id, str(job.emoji_key), job.count, user_ids))
+                if len(self._pending_cache_rows) >= CACHE_FLUSH_ROWS:
+                    await self._flush_cache()
+            except Exception as user_fetch_err:
+                self.error_count += 1
+                self._outstanding.pop((job.message_id, str(job.emoji_key)), None)
+                log.warning(f"Lỗi lấy user thả reaction '{job.emoji_key}' msg {job.message_id}: {user_fetch_err}")
+            finally:
+                self._in_flight -= 1
+                self.queue.task_done()
+
+    async def _flush_cache(self):
+        rows, self._pending_cache_rows = self._pending_cache_rows, []
+        if rows:
+            await database.save_reaction_user_cache(self.guild_id, rows)
+
+    async def _flush_used_keys(self):
+        keys, self._used_cache_keys = self._used_cache_keys, []
+        if keys:
+            await database.touch_reaction_user_cache(self.guild_id, keys)
+
+    async def close(self):
+        """Tra nốt cache, chờ xử lý hết hàng đợi, dừng worker và ghi nốt cache."""
+        await self._resolve_lookups()
+        await self.queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self._flush_cache()
+        await self._flush_used_keys()
+        log.info(
+            f"Reaction fetcher xong: {self.fetched_count:,} reaction fetch API, {self.cache_hit_count:,} lấy từ cache, "
+            f"{self.error_count:,} lỗi ({self.throughput():.1f} reaction/s)."
+        )
+
+    async def abort(self):
+        """Dừng worker ngay (khi quét lỗi), bỏ các job còn lại."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+def start_reaction_fetcher(scan_data: Dict[str, Any]) -> Optional[ReactionFetcher]:
+    """Tạo và khởi động reaction fetcher nếu lần quét này có quét reaction."""
+    if not scan_data.get("can_scan_reactions", False):
+        return None
+    fetcher = ReactionFetcher(scan_data, config.REACTION_FETCH_WORKERS, config.REACTION_FETCH_QUEUE_SIZE)
+    fetcher.start()
+    fetcher.requeue(scan_data.pop("resume_reaction_jobs", None) or [])
+    scan_data["reaction_fetcher"] = fetcher
+    return fetcher
+
+
+async def prune_reaction_cache():
+    """Dọn cache người thả reaction không được dùng quá REACTION_CACHE_RETENTION_DAYS ngày (gọi sau mỗi lần quét)."""
+    if config.REACTION_CACHE_RETENTION_DAYS <= 0:
+        return
+    pruned = await database.prune_reaction_user_cache(config.REACTION_CACHE_RETENTION_DAYS)
+    if pruned:
+        log.info(f"Đã dọn {pruned:,} dòng cache người thả reaction không dùng quá {config.REACTION_CACHE_RETENTION_DAYS} ngày.")
+
+# --- END OF FILE cogs/deep_scan_helpers/reaction_fetcher.py ---
@@ -11,9 +11,31 @@ import config
 import utils
 import database
 from reporting import embeds_guild, embeds_user, embeds_items, embeds_analysis, embeds_dm
+from .activity_grid import ActivityGrid
 
 log = logging.getLogger(__name__)
 
+# Embed dựng từ dữ liệu không được nạp lại khi quét tăng dần (theo giờ, emoji/sticker, reaction theo emoji):
+# ghi chú ở footer để không đọc nhầm thành số liệu toàn thời gian như các BXH theo user/kênh
+SINCE_LAST_SCAN_EMBEDS = {
+    embeds_items.create_unused_emoji_embed,
+    embeds_guild.create_umbra_hour_embed, embeds_guild.create_golden_hour_embed,
+    embeds_analysis.create_least_filtered_reaction_embed, embeds_analysis.create_filtered_reaction_embed,
+    embeds_items.create_least_sticker_usage_embed, embeds_items.create_top_sticker_usage_embed,
+    embeds_analysis.create_top_content_emoji_embed, embeds_analysis.create_top_reaction_givers_embed,
+    embeds_user.create_top_reaction_received_users_embed,
+    embeds_user.create_least_custom_emoji_users_embed, embeds_user.create_top_custom_emoji_users_embed,
+    embeds_user.create_least_sticker_users_embed, embeds_user.create_top_sticker_users_embed,
+}
+
+
+def label_since_last_scan(embed: discord.Embed):
+    footer_text = embed.footer.text
+    embed.set_footer(
+        text=f"{utils.SINCE_LAST_SCAN_NOTE} | {footer_text}" if footer_text else utils.SINCE_LAST_SCAN_NOTE,
+        icon_url=embed.footer.icon_url
+    )
+
 # --- Hàm Gửi Embed Helper---
 async def _send_report_embeds(
     scan_data: Dict[str, Any],
@@ -133,9 +155,9 @@ async def generate_and_send_reports(scan_data: Dict[str, Any]):
     channel_details = scan_data.get("channel_details", [])
     voice_channel_static_data = scan_data.get("voice_channel_static_data", []) # Giữ lại nếu cần
     user_distinct_channel_counts = scan_data.get("user_distinct_channel_counts", Counter())
-    server_hourly_activity = scan_data.get("server_hourly_activity", Counter())
-    channel_hourly_activity = scan_data.get("channel_hourly_activity", defaultdict(Counter))
-    thread_hourly_activity = scan_data.get("thread_hourly_activity", defaultdict(Counter))
+    server_hourly_activity = scan_data.get("server_hourly_activity", ActivityGrid())
+    channel_hourly_activity = scan_data.get("channel_hourly_activity", ActivityGrid())
+    thread_hourly_activity = scan_data.get("thread_hourly_activity", ActivityGrid())
     overall_total_reaction_count = scan_data.get("overall_total_reaction_count", 0) # Thô
     overall_filtered_reaction_count = scan_data.get("overall_total_filtered_reaction_count", 0) # Đã lọc
     user_emoji_received_counts = scan_data.get("user_emoji_received_counts", defaultdict(Counter))
@@ -157,14 +179,18 @@ async def generate_and_send_reports(scan_data: Dict[str, Any]):
                 embed_or_list = await embed_creation_func(*args, **kwargs)
             else:
                 embed_or_list = embed_creation_func(*args, **kwargs)
+            created: List[discord.Embed] = []
             if isinstance(embed_or_list, list):
                 for embed in embed_or_list:
-                    if isinstance(embed, discord.Embed): target_list.append(embed)
+                    if isinstance(embed, discord.Embed): created.append(embed)
                     elif embed is not None: log.debug(f"Hàm '{func_name}' trả về phần tử không phải Embed trong list.")
             elif isinstance(embed_or_list, discord.Embed):
-                target_list.append(embed_or_list)
+                created.append(embed_or_list)
             elif embed_or_list is not None:
                  log.debug(f"Hàm '{func_name}' trả về giá trị không phải Embed hoặc list.")
+            if scan_data.get("incremental_mode") and embed_creation_func in SINCE_LAST_SCAN_EMBEDS:
+                for embed in created: label_since_last_scan(embed)
+            target_list.extend(created)
         except Exception as ex:
             error_msg = f"Lỗi tạo embed '{func_name}': {ex}"
             log.error(f"{e('error')} {error_msg}", exc_info=True)
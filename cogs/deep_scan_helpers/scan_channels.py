@@ -3,275 +3,394 @@ import discord
 from discord.ext import commands
 import logging
 import asyncio
+import heapq
 import time
 import datetime
-import re
-from typing import Dict, Any, List, Union, Optional, Set, Tuple
-from collections import Counter, defaultdict
+from typing import Dict, Any, List, Union, Optional, Set, Tuple, NamedTuple, Callable
+from collections import Counter, defaultdict, deque
 import dotenv
 import os
 import config
 import utils
+import database
 import discord_logging
+import rest_scheduler
+import metrics
+from .user_stats import UserStatsStore, snowflake_to_ms
+from .activity_grid import ActivityGrid, GRID_CELLS, HOURS_PER_DAY, SERVER_GRID_KEY, weekday_hour_of_ms
+from .reaction_fetcher import ReactionJob, start_reaction_fetcher, prune_reaction_cache
+from .keyword_matcher import KeywordMatcher
+from .content_analysis import URL_REGEX, EMOJI_REGEX, ContentCounts, ContentAnalysisPool, start_content_analysis_pool
+from .scan_concurrency import AdaptiveScanLimiter, create_scan_limiter, start_scan_controller
+from .scan_planner import DAY_MS, estimate_location_size, order_largest_first, estimate_remaining_seconds, plan_history_ranges
+from .scan_jobs import JOB_KIND_CHANNEL, JOB_KIND_THREAD, publish_scan_jobs, iter_scan_job_results
+from .message_index import index_message_batch
+from .history_recorder import open_location_recorder
 
 log = logging.getLogger(__name__)
 
-# Biểu thức chính quy để tối ưu việc tìm kiếm
-URL_REGEX = re.compile(r'https?://\S+')
-EMOJI_REGEX = re.compile(r'<a?:([a-zA-Z0-9_]+):([0-9]+)>|([\U00010000-\U0010ffff])') # Capture cả group unicode
 
 # --- Hằng số cho quét song song ---
-MAX_CONCURRENT_SCANS = config.MAX_CONCURRENT_CHANNEL_SCANS # Số kênh/luồng quét đồng thời tối đa
-scan_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SCANS)
+HISTORY_BATCH_SIZE = 100 # Số tin nhắn mỗi lô xử lý (= số tin mỗi trang history của Discord)
+FIRST_MESSAGES_LIMIT = 5 # Số tin nhắn đầu tiên của kênh giữ lại cho báo cáo
+FIRST_MESSAGES_PREVIEW = 80
+
+
+# --- Bản ghi gọn của một tin nhắn (chỉ giữ các trường cần cho thống kê) ---
+class MessageRecord(NamedTuple):
+    message_id: int
+    author_id: int
+    is_bot: bool
+    content: str
+    image_count: int
+    other_file_count: int
+    sticker_ids: Tuple[int, ...]
+    mention_ids: Tuple[int, ...] # Chỉ user được mention (không tính bot)
+    is_reply: bool
+
+
+def _to_message_record(message: discord.Message) -> Optional[MessageRecord]:
+    """Chuyển tin nhắn thành MessageRecord. Trả về None với tin nhắn hệ thống/không có tác giả."""
+    if not message.author or message.is_system(): # Bỏ qua tin nhắn hệ thống và webhook
+        return None
+    attachments = message.attachments
+    image_count = sum(1 for att in attachments if att.content_type and att.content_type.startswith('image/')) if attachments else 0
+    return MessageRecord(
+        message_id=message.id,
+        author_id=message.author.id,
+        is_bot=message.author.bot,
+        content=message.content or "",
+        image_count=image_count,
+        other_file_count=len(attachments) - image_count,
+        sticker_ids=tuple(sticker_item.id for sticker_item in message.stickers),
+        mention_ids=tuple(m.id for m in message.mentions if not m.bot),
+        is_reply=bool(message.reference and message.reference.message_id),
+    )
 
 
-# --- Hàm quét tin nhắn (được dùng cho cả kênh và luồng) ---
-async def _process_message(message: discord.Message, scan_data: Dict[str, Any], location_id: int):
-    """Xử lý một tin nhắn, cập nhật scan_data."""
-    target_keywords = scan_data["target_keywords"]
-    can_scan_reactions = scan_data.get("can_scan_reactions", False)
+async def _iter_history_pages(
+    location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread],
+    after_message_id: Optional[int] = None,
+    before_message_id: Optional[int] = None,
+    page_size: int = HISTORY_BATCH_SIZE,
+    stop_before_id: Optional[int] = None
+):
+    """
+    Fetch history từng trang (mỗi trang = 1 request REST, đi qua rest_scheduler).
+    Có after_message_id: đi từ cũ -> mới (dừng trước stop_before_id nếu có); ngược lại đi từ mới -> cũ (bắt đầu trước before_message_id nếu có).
+    """
+    oldest_first = after_message_id is not None
+    cursor = after_message_id if oldest_first else before_message_id
+    guild_label = getattr(getattr(location, "guild", None), "id", "")
+    while True:
+        async with rest_scheduler.slot(rest_scheduler.ROUTE_HISTORY):
+            page_started = time.perf_counter()
+            if oldest_first:
+                page = [m async for m in location.history(limit=page_size, after=discord.Object(id=cursor), oldest_first=True)]
+            else:
+                page = [m async for m in location.history(limit=page_size, before=discord.Object(id=cursor) if cursor else None)]
+            metrics.HISTORY_PAGE_SECONDS.observe(time.perf_counter() - page_started, guild_id=guild_label)
+        if not page:
+            return
+        if stop_before_id is not None and oldest_first and page[-1].id >= stop_before_id:
+            page = [m for m in page if m.id < stop_before_id] # Trang vượt qua cuối khoảng được giao
+            if page: yield page
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        cursor = page[-1].id
+
+
+# --- Tổng hợp một lô tin nhắn (đồng bộ, không await) ---
+def _aggregate_message_batch(
+    records: List[MessageRecord], scan_data: Dict[str, Any], location_id: int, is_thread: bool,
+    content_counts: Optional[ContentCounts] = None
+):
+    """
+    Cộng dồn thống kê của cả lô vào scan_data trong một vòng lặp.
+    content_counts: kết quả phân tích nội dung (link/emoji/keyword) đã tính ở process pool -> chỉ việc gộp.
+    """
+    if not records:
+        return
+    analyze_content = content_counts is None
+    keyword_matcher: Optional[KeywordMatcher] = scan_data.get("keyword_matcher") if analyze_content else None
     server_emojis_cache: Dict[int, discord.Emoji] = scan_data.get("server_emojis_cache", {})
     server_sticker_ids_cache: Set[int] = scan_data.get("server_sticker_ids_cache", set())
 
-    timestamp = message.created_at
-    if not message.author or message.is_system(): # Bỏ qua tin nhắn hệ thống và webhook
-        return
-
-    author_id = message.author.id
-    is_bot = message.author.bot
-
-    # Cập nhật tổng tin nhắn toàn server
-    if "overall_total_message_count" not in scan_data:
-        scan_data["overall_total_message_count"] = 0
-    scan_data["overall_total_message_count"] += 1
-
-    # Cập nhật user_activity
-    user_data = scan_data["user_activity"][author_id]
-    user_data['message_count'] += 1
-    scan_data["user_activity_message_counts"][author_id] = user_data['message_count']
-
-    if user_data['first_seen'] is None or timestamp < user_data['first_seen']:
-        user_data['first_seen'] = timestamp
-    if user_data['last_seen'] is None or timestamp > user_data['last_seen']:
-        user_data['last_seen'] = timestamp
-    if is_bot:
-        user_data['is_bot'] = True
-
-    # Lưu kênh/luồng user đã nhắn (dùng cho tính distinct)
-    user_data.setdefault('channels_messaged_in', set()).add(location_id)
-
-    # Đếm tin nhắn cho user trong kênh/luồng này
-    scan_data["user_channel_message_counts"][author_id][location_id] += 1
-
-    # Thu thập dữ liệu giờ
-    hour = timestamp.hour
-    scan_data.setdefault("server_hourly_activity", Counter())[hour] += 1
-    is_thread = isinstance(message.channel, discord.Thread)
-    if is_thread:
-        scan_data.setdefault("thread_hourly_activity", defaultdict(Counter))[location_id][hour] += 1
-    else:
-        scan_data.setdefault("channel_hourly_activity", defaultdict(Counter))[location_id][hour] += 1
-
-    # --- THÊM THU THẬP GIỜ USER ---
-    # Thu thập dữ liệu giờ cho user
-    scan_data.setdefault("user_hourly_activity", defaultdict(Counter))[author_id][hour] += 1
-    # --- KẾT THÚC THÊM ---
-
-    # --- Phân tích nội dung tin nhắn (chỉ cho user không phải bot) ---
-    msg_content = message.content or ""
-    msg_content_lower = msg_content.lower()
-
-    if not is_bot:
-        # Đếm link
-        link_count = len(URL_REGEX.findall(msg_content))
-        scan_data["user_link_counts"][author_id] += link_count
-        user_data['link_count'] = user_data.get('link_count', 0) + link_count
-
-        # Đếm ảnh và file khác
-        image_count = sum(1 for att in message.attachments if att.content_type and att.content_type.startswith('image/'))
-        other_file_count = len(message.attachments) - image_count
-        scan_data["user_image_counts"][author_id] += image_count
-        user_data['image_count'] = user_data.get('image_count', 0) + image_count
-        scan_data.setdefault("user_other_file_counts", Counter())[author_id] += other_file_count
-        user_data['other_file_count'] = user_data.get('other_file_count', 0) + other_file_count
-
-        # Đếm emoji trong nội dung
-        emoji_matches = EMOJI_REGEX.finditer(msg_content)
-        emoji_count = 0
-        custom_emoji_content_counter_user = scan_data.setdefault("user_custom_emoji_content_counts", defaultdict(Counter))[author_id]
-        overall_custom_emoji_counter = scan_data.setdefault("overall_custom_emoji_content_counts", Counter())
-
-        for match in emoji_matches:
-            emoji_count += 1
-            custom_name, custom_id_str, unicode_emoji = match.groups()
-            if custom_id_str:
-                try:
-                    emoji_id = int(custom_id_str)
-                    if emoji_id in server_emojis_cache:
-                        custom_emoji_content_counter_user[emoji_id] += 1
-                        overall_custom_emoji_counter[emoji_id] += 1
-                except ValueError:
-                    pass
-
-        scan_data["user_emoji_counts"][author_id] += emoji_count
-        user_data['emoji_count'] = user_data.get('emoji_count', 0) + emoji_count
-        scan_data["user_total_custom_emoji_content_counts"][author_id] = sum(custom_emoji_content_counter_user.values())
-
-        # Đếm sticker
-        sticker_count = len(message.stickers)
-        scan_data["user_sticker_counts"][author_id] += sticker_count
-        user_data['sticker_count'] = user_data.get('sticker_count', 0) + sticker_count
-        overall_custom_sticker_counter = scan_data.setdefault("overall_custom_sticker_counts", Counter())
-        sticker_usage_counter = scan_data.setdefault("sticker_usage_counts", Counter())
-        user_sticker_id_counter = scan_data.setdefault("user_sticker_id_counts", defaultdict(Counter))[author_id]
-
-        for sticker_item in message.stickers:
-             sticker_id_str = str(sticker_item.id)
-             sticker_usage_counter[sticker_id_str] += 1
-             user_sticker_id_counter[sticker_id_str] += 1
-             if sticker_item.id in server_sticker_ids_cache:
-                  overall_custom_sticker_counter[sticker_item.id] += 1
-
-        # Đếm mention (chỉ user, không bot)
-        non_bot_mentions = [m for m in message.mentions if not m.bot]
-        if non_bot_mentions:
-            mention_given_count = len(non_bot_mentions)
-            scan_data["user_mention_given_counts"][author_id] += mention_given_count
-            user_data['mention_given_count'] = user_data.get('mention_given_count', 0) + mention_given_count
-
-            distinct_mentioned_ids_in_msg = {m.id for m in non_bot_mentions}
-            user_data.setdefault('distinct_mentions_set', set()).update(distinct_mentioned_ids_in_msg)
-
-            user_mention_received_counter = scan_data.setdefault("user_mention_received_counts", Counter())
-            for mentioned_user in non_bot_mentions:
-                mentioned_user_id = mentioned_user.id
-                user_mention_received_counter[mentioned_user_id] += 1
-                scan_data["user_activity"][mentioned_user_id]['mention_received_count'] = user_mention_received_counter[mentioned_user_id]
-
-        # Đếm reply
-        if message.reference and message.reference.message_id:
-            scan_data["user_reply_counts"][author_id] += 1
-            user_data['reply_count'] = user_data.get('reply_count', 0) + 1
-
-    # --- Đếm keywords (nếu có) ---
-    if target_keywords and msg_content_lower:
+    # Lấy sẵn các container một lần cho cả lô
+    stats: UserStatsStore = scan_data["user_stats"]
+    location_user_counts = scan_data["user_channel_message_counts"]
+    # Ma trận giờ x thứ: hàng server/location cố định cho cả lô, chỉ hàng user phải tra theo tin
+    server_grid: ActivityGrid = scan_data.setdefault("server_hourly_activity", ActivityGrid())
+    server_cells, server_base = server_grid.cells, server_grid.row(SERVER_GRID_KEY) * GRID_CELLS
+    location_grid: ActivityGrid = scan_data.setdefault("thread_hourly_activity" if is_thread else "channel_hourly_activity", ActivityGrid())
+    location_cells, location_base = location_grid.cells, location_grid.row(location_id) * GRID_CELLS
+    user_grid: ActivityGrid = scan_data.setdefault("user_hourly_activity", ActivityGrid())
+    user_cells = user_grid.cells
+    collect_rollups = config.ENABLE_ACTIVITY_ROLLUPS
+    if collect_rollups:
+        # Rollup theo ngày (ngày UTC tính từ 1970-01-01) để báo cáo theo khoảng thời gian bằng SQL
+        daily_rollup = scan_data.setdefault("daily_user_location_counts", Counter()) # (ngày, location, user) -> số tin
+        hourly_rollup = scan_data.setdefault("daily_location_hourly_counts", Counter()) # (ngày, location, giờ) -> số tin
+        rollup_after_id = scan_data.get("rollup_after_ids", {}).get(location_id, 0) # Tin <= ID này đã có trong rollup
+    user_custom_emoji_counter = scan_data.setdefault("user_custom_emoji_content_counts", defaultdict(Counter))
+    overall_custom_emoji_counter = scan_data.setdefault("overall_custom_emoji_content_counts", Counter())
+    overall_custom_sticker_counter = scan_data.setdefault("overall_custom_sticker_counts", Counter())
+    sticker_usage_counter = scan_data.setdefault("sticker_usage_counts", Counter())
+    user_sticker_id_counter = scan_data.setdefault("user_sticker_id_counts", defaultdict(Counter))
+    if keyword_matcher:
         keyword_counter = scan_data.setdefault("keyword_counts", Counter())
-        channel_kw_counter = scan_data.setdefault("channel_keyword_counts", defaultdict(Counter))
-        thread_kw_counter = scan_data.setdefault("thread_keyword_counts", defaultdict(Counter))
+        location_kw_counter = scan_data.setdefault("thread_keyword_counts" if is_thread else "channel_keyword_counts", defaultdict(Counter))[location_id]
         user_kw_counter = scan_data.setdefault("user_keyword_counts", defaultdict(Counter))
-        for keyword in target_keywords:
-            count_in_msg = msg_content_lower.count(keyword)
-            if count_in_msg > 0:
+
+    # Cập nhật tổng tin nhắn toàn server
+    scan_data["overall_total_message_count"] = scan_data.get("overall_total_message_count", 0) + len(records)
+
+    for record in records:
+        author_id = record.author_id
+        is_bot = record.is_bot
+
+        # Cập nhật bảng thống kê user (user_activity + các Counter theo user được sinh lại sau khi quét xong)
+        row = stats.row(author_id)
+        stats.message_count[row] += 1
+        timestamp_ms = snowflake_to_ms(record.message_id)
+        stats.touch_seen(row, timestamp_ms)
+        if is_bot:
+            stats.is_bot[row] = 1
+
+        # Đếm tin nhắn cho user trong kênh/luồng này (kênh đã nhắn được suy ra từ đây)
+        location_user_counts[author_id][location_id] += 1
+
+        # Thu thập dữ liệu giờ + thứ (UTC, tính thẳng từ snowflake)
+        weekday, hour = weekday_hour_of_ms(timestamp_ms)
+        cell = weekday * HOURS_PER_DAY + hour
+        server_cells[server_base + cell] += 1
+        location_cells[location_base + cell] += 1
+        user_cells[user_grid.row(author_id) * GRID_CELLS + cell] += 1
+        if collect_rollups and record.message_id > rollup_after_id:
+            day = timestamp_ms // DAY_MS
+            daily_rollup[(day, location_id, author_id)] += 1
+            hourly_rollup[(day, location_id, hour)] += 1
+
+        msg_content = record.content
+
+        # --- Phân tích nội dung tin nhắn (chỉ cho user không phải bot) ---
+        if not is_bot:
+            # Đếm link
+            if msg_content and analyze_content:
+                stats.link_count[row] += len(URL_REGEX.findall(msg_content))
+
+            # Đếm ảnh và file khác
+            stats.image_count[row] += record.image_count
+            stats.other_file_count[row] += record.other_file_count
+
+            # Đếm emoji trong nội dung
+            if msg_content and analyze_content:
+                emoji_count = 0
+                custom_emoji_in_msg = 0
+                for match in EMOJI_REGEX.finditer(msg_content):
+                    emoji_count += 1
+                    custom_id_str = match.group(2)
+                    if custom_id_str:
+                        try:
+                            emoji_id = int(custom_id_str)
+                            if emoji_id in server_emojis_cache:
+                                user_custom_emoji_counter[author_id][emoji_id] += 1
+                                overall_custom_emoji_counter[emoji_id] += 1
+                                custom_emoji_in_msg += 1
+                        except ValueError:
+                            pass
+                stats.emoji_count[row] += emoji_count
+                # Cộng dồn (không tính lại tổng) để giữ được số liệu đã nạp từ lần quét tăng dần trước
+                stats.custom_emoji_content_count[row] += custom_emoji_in_msg
+
+            # Đếm sticker
+            if record.sticker_ids:
+                stats.sticker_count[row] += len(record.sticker_ids)
+                author_sticker_counter = user_sticker_id_counter[author_id]
+                for sticker_id in record.sticker_ids:
+                    sticker_id_str = str(sticker_id)
+                    sticker_usage_counter[sticker_id_str] += 1
+                    author_sticker_counter[sticker_id_str] += 1
+                    if sticker_id in server_sticker_ids_cache:
+                        overall_custom_sticker_counter[sticker_id] += 1
+
+            # Đếm mention (chỉ user, không bot)
+            if record.mention_ids:
+                stats.mention_given_count[row] += len(record.mention_ids)
+                stats.distinct_mentions.setdefault(row, set()).update(record.mention_ids)
+                for mentioned_user_id in record.mention_ids:
+                    stats.mention_received_count[stats.row(mentioned_user_id)] += 1
+
+            # Đếm reply
+            if record.is_reply:
+                stats.reply_count[row] += 1
+
+        # --- Đếm keywords (nếu có) ---
+        if keyword_matcher and msg_content:
+            for keyword, count_in_msg in keyword_matcher.count(msg_content.lower()).items():
                 keyword_counter[keyword] += count_in_msg
-                if isinstance(message.channel, discord.Thread):
-                    thread_kw_counter[location_id][keyword] += count_in_msg
-                else:
-                    channel_kw_counter[location_id][keyword] += count_in_msg
+                location_kw_counter[keyword] += count_in_msg
                 if not is_bot:
                     user_kw_counter[author_id][keyword] += count_in_msg
 
-    # --- Đếm reactions (nếu bật và có quyền) ---
-    if can_scan_reactions and message.reactions:
-        try:
-            msg_react_received_count = 0 # Bao nhiêu reaction nhận được (kể cả bot thả)
-            msg_react_filtered_count = 0 # Bao nhiêu reaction nhận được (đã lọc)
-
-            filtered_reaction_emoji_counter = scan_data.setdefault("filtered_reaction_emoji_counts", Counter())
-            reaction_total_emoji_counter = scan_data.setdefault("reaction_emoji_counts", Counter())
-            user_react_given_counter = scan_data.setdefault("user_reaction_given_counts", Counter())
-            user_react_emoji_given_counter = scan_data.setdefault("user_reaction_emoji_given_counts", defaultdict(Counter))
-
-            for reaction in message.reactions:
-                react_count = reaction.count # Số lượt thả của reaction này
-                if react_count <= 0: continue
-
-                emoji = reaction.emoji
-                emoji_key_for_filtered: Optional[Union[int, str]] = None
-                is_custom_server_emoji = False
-                is_allowed_unicode = False
-
-                if isinstance(emoji, discord.Emoji):
-                    if emoji.id in server_emojis_cache:
-                        is_custom_server_emoji = True
-                        emoji_key_for_filtered = emoji.id
-                elif isinstance(emoji, str): # Chỉ xử lý string unicode
-                    if emoji in config.REACTION_UNICODE_EXCEPTIONS:
-                        is_allowed_unicode = True
-                        emoji_key_for_filtered = emoji
-
-                # Thêm vào counter tổng thô (luôn luôn)
-                reaction_total_emoji_counter[str(emoji)] += react_count
-                msg_react_received_count += react_count
-
-                is_filtered_reaction = is_custom_server_emoji or is_allowed_unicode
-
-                # Nếu là reaction được lọc
-                if is_filtered_reaction and emoji_key_for_filtered is not None:
-                    msg_react_filtered_count += react_count
-                    filtered_reaction_emoji_counter[emoji_key_for_filtered] += react_count
-
-                    # Đếm người thả reaction (chỉ cho reaction đã lọc)
-                    try:
-                        async for user in reaction.users():
-                            if user and not user.bot: # Chỉ đếm user thật
-                                user_id = user.id
-                                user_react_given_counter[user_id] += 1
-                                user_react_emoji_given_counter[user_id][emoji_key_for_filtered] += 1
-                                # Cập nhật vào user_activity của người thả
-                                scan_data["user_activity"][user_id]['reaction_given_count'] = user_react_given_counter[user_id]
-
-                    except Exception as user_fetch_err:
-                        log.warning(f"Lỗi lấy user thả reaction '{emoji}' msg {message.id}: {user_fetch_err}")
-
-            # Cập nhật tổng reaction thô và đã lọc
-            scan_data["overall_total_reaction_count"] = scan_data.get("overall_total_reaction_count", 0) + msg_react_received_count
-            scan_data["overall_total_filtered_reaction_count"] = scan_data.get("overall_total_filtered_reaction_count", 0) + msg_react_filtered_count
-
-            # Đếm reaction nhận được (chỉ cho user)
-            if not is_bot:
-                user_react_received_counter = scan_data.setdefault("user_reaction_received_counts", Counter())
-                # Chỉ cộng số reaction đã lọc vào đây để BXH nhất quán
-                user_react_received_counter[author_id] += msg_react_filtered_count
-                user_data['reaction_received_count'] = user_react_received_counter[author_id]
-
-                # <<< THÊM LOGIC ĐẾM EMOJI NHẬN ĐƯỢC CHO USER >>>
-                if msg_react_filtered_count > 0: # Chỉ đếm nếu có reaction đã lọc
-                    user_emoji_received_counter_for_author = scan_data.setdefault("user_emoji_received_counts", defaultdict(Counter))[author_id]
-                    # Cần lặp lại qua các reaction đã lọc để lấy emoji_key
-                    for inner_reaction in message.reactions:
-                         inner_emoji = inner_reaction.emoji
-                         inner_emoji_key: Optional[Union[int, str]] = None
-                         is_inner_custom = False
-                         is_inner_allowed_unicode = False
-
-                         if isinstance(inner_emoji, discord.Emoji):
-                              if inner_emoji.id in server_emojis_cache:
-                                   is_inner_custom = True
-                                   inner_emoji_key = inner_emoji.id
-                         elif isinstance(inner_emoji, str):
-                              if inner_emoji in config.REACTION_UNICODE_EXCEPTIONS:
-                                   is_inner_allowed_unicode = True
-                                   inner_emoji_key = inner_emoji
-
-                         # Nếu là reaction được lọc và có key hợp lệ
-                         if (is_inner_custom or is_inner_allowed_unicode) and inner_emoji_key is not None:
-                              user_emoji_received_counter_for_author[inner_emoji_key] += inner_reaction.count
-
-
-        except AttributeError as attr_err:
-            log_emoji_info = "N/A"
-            if 'reaction' in locals() and hasattr(reaction, 'emoji'):
-                log_emoji_info = f"Type: {type(reaction.emoji).__name__}, Value: {repr(reaction.emoji)[:50]}"
-            log.warning(f"Lỗi thuộc tính khi xử lý reaction msg {message.id} location {location_id}: {attr_err} (Emoji info: {log_emoji_info})")
-        except Exception as react_err:
-            log.warning(f"Lỗi xử lý reaction msg {message.id} location {location_id}: {react_err}")
+    if content_counts is not None:
+        _merge_content_counts(content_counts, scan_data, location_id, is_thread)
+
+
+def _merge_content_counts(content_counts: ContentCounts, scan_data: Dict[str, Any], location_id: int, is_thread: bool):
+    """Gộp Counter từng phần do process pool trả về vào bảng thống kê user và các Counter của scan_data."""
+    stats: UserStatsStore = scan_data["user_stats"]
+    for author_id, link_count in content_counts.link_counts.items():
+        stats.link_count[stats.row(author_id)] += link_count
+    for author_id, emoji_count in content_counts.emoji_counts.items():
+        stats.emoji_count[stats.row(author_id)] += emoji_count
+    if content_counts.custom_emoji_counts:
+        user_custom_emoji_counter = scan_data.setdefault("user_custom_emoji_content_counts", defaultdict(Counter))
+        overall_custom_emoji_counter = scan_data.setdefault("overall_custom_emoji_content_counts", Counter())
+        for (author_id, emoji_id), count in content_counts.custom_emoji_counts.items():
+            user_custom_emoji_counter[author_id][emoji_id] += count
+            overall_custom_emoji_counter[emoji_id] += count
+            stats.custom_emoji_content_count[stats.row(author_id)] += count
+    if content_counts.keyword_counts:
+        scan_data.setdefault("keyword_counts", Counter()).update(content_counts.keyword_counts)
+        scan_data.setdefault("thread_keyword_counts" if is_thread else "channel_keyword_counts", defaultdict(Counter))[location_id].update(content_counts.keyword_counts)
+        user_kw_counter = scan_data.setdefault("user_keyword_counts", defaultdict(Counter))
+        for (author_id, keyword), count in content_counts.user_keyword_counts.items():
+            user_kw_counter[author_id][keyword] += count
+
+
+async def _analyze_page_content(scan_data: Dict[str, Any], message_batch: List[discord.Message]) -> Optional[ContentCounts]:
+    """Gửi nội dung của trang sang process pool (nếu bật). None = phân tích ngay trong _aggregate_message_batch."""
+    content_pool: Optional[ContentAnalysisPool] = scan_data.get("content_pool")
+    if content_pool is None:
+        return None
+    items = [
+        (message.author.id, message.author.bot, message.content)
+        for message in message_batch
+        if message.content and message.author and not message.is_system()
+    ]
+    if not items:
+        return ContentCounts(Counter(), Counter(), Counter(), Counter(), Counter())
+    return await content_pool.analyze(items)
+
+
+# --- Đếm reactions của các tin nhắn trong lô (chỉ chạy khi bật quét reaction) ---
+async def _process_reaction_batch(messages: List[discord.Message], scan_data: Dict[str, Any], location_id: int):
+    """Đếm reaction nhận được ngay, còn việc lấy người thả được đẩy sang ReactionFetcher."""
+    reaction_jobs: List[ReactionJob] = []
+    for message in messages:
+        reaction_jobs.extend(_count_message_reactions(message, scan_data, location_id))
+    fetcher = scan_data.get("reaction_fetcher")
+    if reaction_jobs and fetcher:
+        await fetcher.submit_many(reaction_jobs)
+
+
+def _count_message_reactions(message: discord.Message, scan_data: Dict[str, Any], location_id: int) -> List[ReactionJob]:
+    """Đếm reaction của một tin nhắn. Trả về các job lấy người thả cho reaction đã lọc."""
+    server_emojis_cache: Dict[int, discord.Emoji] = scan_data.get("server_emojis_cache", {})
+    stats: UserStatsStore = scan_data["user_stats"]
+    author_id = message.author.id
+    is_bot = message.author.bot
+    reaction_jobs: List[ReactionJob] = []
+    try:
+        msg_react_received_count = 0 # Bao nhiêu reaction nhận được (kể cả bot thả)
+        msg_react_filtered_count = 0 # Bao nhiêu reaction nhận được (đã lọc)
+
+        filtered_reaction_emoji_counter = scan_data.setdefault("filtered_reaction_emoji_counts", Counter())
+        reaction_total_emoji_counter = scan_data.setdefault("reaction_emoji_counts", Counter())
+
+        for reaction in message.reactions:
+            react_count = reaction.count # Số lượt thả của reaction này
+            if react_count <= 0: continue
+
+            emoji = reaction.emoji
+            emoji_key_for_filtered: Optional[Union[int, str]] = None
+            is_custom_server_emoji = False
+            is_allowed_unicode = False
+
+            if isinstance(emoji, discord.Emoji):
+                if emoji.id in server_emojis_cache:
+                    is_custom_server_emoji = True
+                    emoji_key_for_filtered = emoji.id
+            elif isinstance(emoji, str): # Chỉ xử lý string unicode
+                if emoji in config.REACTION_UNICODE_EXCEPTIONS:
+                    is_allowed_unicode = True
+                    emoji_key_for_filtered = emoji
+
+            # Thêm vào counter tổng thô (luôn luôn)
+            reaction_total_emoji_counter[str(emoji)] += react_count
+            msg_react_received_count += react_count
+
+            is_filtered_reaction = is_custom_server_emoji or is_allowed_unicode
+
+            # Nếu là reaction được lọc
+            if is_filtered_reaction and emoji_key_for_filtered is not None:
+                msg_react_filtered_count += react_count
+                filtered_reaction_emoji_counter[emoji_key_for_filtered] += react_count
+
+                # Đếm người thả reaction (chỉ cho reaction đã lọc) -> worker của ReactionFetcher
+                reaction_jobs.append(ReactionJob(message.id, emoji_key_for_filtered, react_count, reaction, location_id))
+
+        # Cập nhật tổng reaction thô và đã lọc
+        scan_data["overall_total_reaction_count"] = scan_data.get("overall_total_reaction_count", 0) + msg_react_received_count
+        scan_data["overall_total_filtered_reaction_count"] = scan_data.get("overall_total_filtered_reaction_count", 0) + msg_react_filtered_count
+
+        # Đếm reaction nhận được (chỉ cho user)
+        if not is_bot:
+            # Chỉ cộng số reaction đã lọc vào đây để BXH nhất quán
+            stats.reaction_received_count[stats.row(author_id)] += msg_react_filtered_count
+
+            # Emoji nhận được: dùng lại các reaction đã lọc ở vòng trên (không lọc lại lần nữa)
+            if reaction_jobs:
+                user_emoji_received_counter_for_author = scan_data.setdefault("user_emoji_received_counts", defaultdict(Counter))[author_id]
+                for job in reaction_jobs:
+                    user_emoji_received_counter_for_author[job.emoji_key] += job.count
+
+
+    except AttributeError as attr_err:
+        log_emoji_info = "N/A"
+        if 'reaction' in locals() and hasattr(reaction, 'emoji'):
+            log_emoji_info = f"Type: {type(reaction.emoji).__name__}, Value: {repr(reaction.emoji)[:50]}"
+        log.warning(f"Lỗi thuộc tính khi xử lý reaction msg {message.id} location {location_id}: {attr_err} (Emoji info: {log_emoji_info})")
+    except Exception as react_err:
+        log.warning(f"Lỗi xử lý reaction msg {message.id} location {location_id}: {react_err}")
+    return reaction_jobs
 
 
 # --- Hàm Helper để cập nhật chi tiết cho một location (kênh hoặc luồng) ---
+def _format_first_message(msg: discord.Message) -> str:
+    author_display = msg.author.display_name if msg.author else "Không rõ"
+    timestamp_str = msg.created_at.strftime('%d/%m/%y %H:%M')
+    content_preview = (msg.content or "")[:FIRST_MESSAGES_PREVIEW].replace('`', "'").replace('\n', ' ')
+    if len(msg.content or "") > FIRST_MESSAGES_PREVIEW: content_preview += "..."
+    elif not content_preview and msg.attachments: content_preview = "[File đính kèm]"
+    elif not content_preview and msg.embeds: content_preview = "[Embed]"
+    elif not content_preview and msg.stickers: content_preview = "[Sticker]"
+    elif not content_preview: content_preview = "[Nội dung trống]"
+    return f"[`{timestamp_str}`] **{utils.escape_markdown(author_display)}**: {utils.escape_markdown(content_preview)}"
+
+
+def _track_oldest_messages(progress: Dict[str, Any], message_batch: List[discord.Message]):
+    """Giữ FIRST_MESSAGES_LIMIT tin cũ nhất đã thấy [(message_id, dòng log)], chỉ format tin lọt vào danh sách."""
+    oldest: Optional[List[Tuple[int, str]]] = progress.get("oldest_messages")
+    if oldest is None or not message_batch:
+        return
+    batch_min_id = min(message_batch[0].id, message_batch[-1].id) # Trang luôn có thứ tự (cũ->mới hoặc mới->cũ)
+    if len(oldest) >= FIRST_MESSAGES_LIMIT and batch_min_id > oldest[-1][0]:
+        return
+    candidates = heapq.nsmallest(FIRST_MESSAGES_LIMIT, message_batch, key=lambda m: m.id)
+    merged = oldest + [(m.id, _format_first_message(m)) for m in candidates if len(oldest) < FIRST_MESSAGES_LIMIT or m.id < oldest[-1][0]]
+    merged.sort(key=lambda entry: entry[0])
+    progress["oldest_messages"] = merged[:FIRST_MESSAGES_LIMIT]
+
+
 async def _populate_additional_location_details(
     scan_data: Dict[str, Any],
     location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread],
-    result_dict_to_update: Dict[str, Any] # Dict kết quả của location này
+    result_dict_to_update: Dict[str, Any], # Dict kết quả của location này
+    oldest_messages: Optional[List[Tuple[int, str]]] = None # Tin cũ nhất đã thấy khi quét (None = phải fetch lại)
 ):
     server: discord.Guild = scan_data["server"]
     bot: commands.Bot = scan_data["bot"]
@@ -301,19 +420,14 @@ async def _populate_additional_location_details(
     result_dict_to_update["top_chatter_roles"] = top_chatter_roles
 
     first_messages_log_list: List[str] = []
-    if isinstance(location, (discord.TextChannel, discord.VoiceChannel)):
-        first_messages_limit = 5; first_messages_preview = 80
+    if isinstance(location, (discord.TextChannel, discord.VoiceChannel)) and oldest_messages is not None:
+        # Lần quét này đã đọc tới tin đầu tiên của kênh -> dùng luôn, không gọi lại API
+        first_messages_log_list = [line for _, line in oldest_messages] or ["`[Không có tin nhắn]`"]
+    elif isinstance(location, (discord.TextChannel, discord.VoiceChannel)):
         try:
-            async for msg in location.history(limit=first_messages_limit, oldest_first=True):
-                author_display = msg.author.display_name if msg.author else "Không rõ"
-                timestamp_str = msg.created_at.strftime('%d/%m/%y %H:%M')
-                content_preview = (msg.content or "")[:first_messages_preview].replace('`', "'").replace('\n', ' ')
-                if len(msg.content or "") > first_messages_preview: content_preview += "..."
-                elif not content_preview and msg.attachments: content_preview = "[File đính kèm]"
-                elif not content_preview and msg.embeds: content_preview = "[Embed]"
-                elif not content_preview and msg.stickers: content_preview = "[Sticker]"
-                elif not content_preview: content_preview = "[Nội dung trống]"
-                first_messages_log_list.append(f"[`{timestamp_str}`] **{utils.escape_markdown(author_display)}**: {utils.escape_markdown(content_preview)}")
+            async with rest_scheduler.slot(rest_scheduler.ROUTE_HISTORY):
+                async for msg in location.history(limit=FIRST_MESSAGES_LIMIT, oldest_first=True):
+                    first_messages_log_list.append(_format_first_message(msg))
             if not first_messages_log_list and channel_message_count == 0: first_messages_log_list.append("`[Không có tin nhắn]`")
             elif not first_messages_log_list and channel_message_count > 0: first_messages_log_list.append("`[LỖI]` Không thể fetch tin nhắn đầu.")
         except Exception as e_first:
@@ -336,20 +450,122 @@ async def _populate_additional_location_details(
     result_dict_to_update["reaction_count_filtered"] = None
 
 
-# --- Hàm Wrapper để quét một location (kênh hoặc luồng) ---
-async def _scan_individual_location_wrapper(
+# --- Đọc history của một location (tuần tự hoặc chia khoảng snowflake song song) ---
+def _consume_history_page(
+    message_batch: List[discord.Message],
     scan_data: Dict[str, Any],
     location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread],
-) -> Dict[str, Any]:
-    location_message_count = 0
-    location_error: Optional[str] = None
-    author_counter_location: Counter = Counter()
-    location_scan_start_time = discord.utils.utcnow()
-    processed_flag = False
+    progress: Dict[str, Any],
+    content_counts: Optional[ContentCounts] = None
+) -> List[discord.Message]:
+    """Cập nhật tiến độ + tổng hợp một trang (đồng bộ). Trả về các tin cần lấy người thả reaction."""
+    records: List[MessageRecord] = []
+    reaction_messages: List[discord.Message] = []
+    author_counter_location: Counter = progress["author_counts"]
+    can_scan_reactions = scan_data.get("can_scan_reactions", False)
+    cpu_started = time.process_time()
+    for message in message_batch:
+        progress["message_count"] += 1
+        progress["new_message_count"] += 1
+        if progress["newest_message_id"] is None or message.id > progress["newest_message_id"]:
+            progress["newest_message_id"] = message.id
+        if message.author and not message.author.bot:
+            author_counter_location[message.author.id] += 1
+        record = _to_message_record(message)
+        if record is None: continue
+        records.append(record)
+        if can_scan_reactions and message.reactions:
+            reaction_messages.append(message)
+    # Cursor và số liệu của cả lô được cập nhật cùng lúc (không await ở giữa),
+    # nên checkpoint chụp giữa chừng không bao giờ đếm trùng/thiếu tin trong lô
+    _aggregate_message_batch(records, scan_data, location.id, isinstance(location, discord.Thread), content_counts)
+    index_message_batch(records, scan_data, location.id)
+    metrics.SCAN_MESSAGES.inc(len(message_batch), guild_id=scan_data["server"].id)
+    _track_oldest_messages(progress, message_batch)
+    progress["page_count"] += 1
+    progress["aggregate_cpu_seconds"] += time.process_time() - cpu_started
+    if progress.get("history_recorder"): # Ghi lại trang cho replay benchmark (SCAN_RECORD_DIR), không tính vào CPU tổng hợp
+        progress["history_recorder"].record_page(message_batch)
+    return reaction_messages
+
+
+async def _scan_history_sequential(
+    scan_data: Dict[str, Any],
+    location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread],
+    progress: Dict[str, Any],
+    after_message_id: Optional[int],
+    before_message_id: Optional[int]
+):
+    async for message_batch in _iter_history_pages(location, after_message_id, before_message_id):
+        content_counts = await _analyze_page_content(scan_data, message_batch) # Chờ xong trước khi cập nhật cursor
+        progress["cursor"] = message_batch[-1].id
+        reaction_messages = _consume_history_page(message_batch, scan_data, location, progress, content_counts)
+        if reaction_messages:
+            await _process_reaction_batch(reaction_messages, scan_data, location.id)
+
+
+async def _scan_history_range(
+    scan_data: Dict[str, Any],
+    location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread],
+    progress: Dict[str, Any],
+    history_range: Dict[str, Any],
+    on_page: Optional[Callable[[], None]] = None
+):
+    """Quét một khoảng snowflake (cũ -> mới); history_range["after"] là cursor resume của khoảng."""
+    async for message_batch in _iter_history_pages(location, after_message_id=history_range["after"], stop_before_id=history_range["stop"]):
+        content_counts = await _analyze_page_content(scan_data, message_batch)
+        history_range["after"] = message_batch[-1].id
+        reaction_messages = _consume_history_page(message_batch, scan_data, location, progress, content_counts)
+        if reaction_messages:
+            await _process_reaction_batch(reaction_messages, scan_data, location.id)
+        if on_page: on_page()
+    history_range["done"] = True
+
+
+async def _scan_history_ranges(
+    scan_data: Dict[str, Any],
+    location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread],
+    progress: Dict[str, Any]
+):
+    """
+    Quét song song các khoảng snowflake của một location lớn. Location luôn tự quét hết các khoảng
+    bằng permit của chính nó; permit phụ chỉ được lấy khi đang trống (try_acquire, không chờ),
+    mỗi permit phụ chạy thêm một luồng nhận khoảng chưa ai nhận. Không chờ permit khi đang giữ permit
+    nên các location lớn không thể chờ lẫn nhau (deadlock) dù giới hạn nhỏ hơn số location bị chia.
+    Các khoảng ghi thẳng vào bộ đếm chung của location (progress) và bảng thống kê user.
+    scan_data["range_limiter"] (worker quét phân tán) là ngân sách permit phụ riêng, không dùng chung với permit job.
+    """
+    limiter: AdaptiveScanLimiter = scan_data.get("range_limiter") or scan_data["scan_limiter"]
+    unclaimed_ranges = deque(history_range for history_range in progress["ranges"] if not history_range["done"])
+    if not unclaimed_ranges:
+        return
+    helper_tasks: List[asyncio.Task] = []
+
+    async def _scan_claimed_ranges(history_range: Dict[str, Any]):
+        # Quét khoảng đã nhận, rồi nhận tiếp khoảng chưa ai quét cho tới khi hết
+        while history_range is not None:
+            await _scan_history_range(scan_data, location, progress, history_range, on_page=_spawn_helpers)
+            history_range = unclaimed_ranges.popleft() if unclaimed_ranges else None
+
+    def _spawn_helpers():
+        # Gọi sau mỗi trang: permit vừa trống (hoặc giới hạn vừa tăng) thì nhận thêm khoảng
+        while unclaimed_ranges and limiter.try_acquire():
+            task = asyncio.create_task(_scan_claimed_ranges(unclaimed_ranges.popleft()), name=f"ScanRange-{location.id}-{len(helper_tasks)}")
+            task.add_done_callback(lambda _task: limiter.release()) # Trả permit cả khi task bị hủy trước khi chạy
+            helper_tasks.append(task)
+
+    try:
+        first_range = unclaimed_ranges.popleft()
+        _spawn_helpers()
+        await _scan_claimed_ranges(first_range)
+        await asyncio.gather(*helper_tasks)
+    finally:
+        for task in helper_tasks: task.cancel() # Một khoảng lỗi -> dừng các khoảng còn lại
+        await asyncio.gather(*helper_tasks, return_exceptions=True)
 
-    log_prefix = f"Thread '{location.name}' ({location.id})" if isinstance(location, discord.Thread) else f"Channel '{location.name}' ({location.id})"
-    log.info(f"Wrapper: Bắt đầu quét {log_prefix}")
 
+def _base_location_result(location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread]) -> Dict[str, Any]:
+    """Dict kết quả rỗng của một location (điền dần khi quét)."""
     result = {
         "id": location.id, "name": location.name, "type": str(location.type),
         "processed": False, "message_count": 0, "error": None,
@@ -364,6 +580,69 @@ async def _scan_individual_location_wrapper(
         result["parent_channel_id"] = location.parent_id
         result["archived"] = location.archived
         result["locked"] = location.locked
+    return result
+
+
+# --- Hàm Wrapper để quét một location (kênh hoặc luồng) ---
+async def _scan_individual_location_wrapper(
+    scan_data: Dict[str, Any],
+    location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread],
+) -> Dict[str, Any]:
+    location_error: Optional[str] = None
+    location_scan_start_time = discord.utils.utcnow()
+    processed_flag = False
+
+    # Location đã quét xong trước khi crash (resume từ checkpoint) -> dùng lại kết quả
+    resumed_result = scan_data.get("resumed_location_results", {}).pop(location.id, None)
+    if resumed_result is not None:
+        log.info(f"Wrapper: Dùng lại kết quả đã lưu (resume) cho '{location.name}' ({location.id}).")
+        scan_data.setdefault("completed_location_results", {})[location.id] = resumed_result
+        return resumed_result
+
+    # Tiến độ của location (checkpoint định kỳ đọc dict này để lưu cursor resume)
+    progress: Dict[str, Any] = {
+        "direction": "before", "cursor": None, "message_count": 0, "new_message_count": 0,
+        "newest_message_id": None, "author_counts": Counter(),
+        "oldest_messages": None, "page_count": 0, "aggregate_cpu_seconds": 0.0,
+    }
+    after_message_id: Optional[int] = None
+    before_message_id: Optional[int] = None
+
+    # Quét tăng dần: bắt đầu từ số liệu đã lưu và chỉ fetch tin mới hơn checkpoint
+    if scan_data.get("incremental_mode"):
+        after_message_id = scan_data.get("location_checkpoints", {}).get(location.id)
+        location_seed = scan_data.get("incremental_location_seeds", {}).get(location.id)
+        if location_seed:
+            progress["message_count"] = location_seed.get("message_count", 0)
+            progress["author_counts"].update(location_seed.get("author_counts", {}))
+    # Quét theo khoảng thời gian (--days/--since): chỉ fetch tin sau mốc bắt đầu khoảng
+    window_after_id: Optional[int] = scan_data.get("scan_since_message_id")
+    if window_after_id and (after_message_id or 0) < window_after_id:
+        after_message_id = window_after_id
+    progress["newest_message_id"] = after_message_id
+    if not after_message_id and isinstance(location, (discord.TextChannel, discord.VoiceChannel)):
+        progress["oldest_messages"] = [] # Quét cả lịch sử kênh -> giữ luôn các tin đầu tiên
+
+    # Resume location đang quét dở: khôi phục bộ đếm và tiếp tục từ cursor
+    resume_cursor = scan_data.get("resume_location_cursors", {}).pop(location.id, None)
+    if resume_cursor:
+        progress.update(resume_cursor)
+        if resume_cursor["direction"] == "after": after_message_id = resume_cursor["cursor"]
+        elif resume_cursor["direction"] == "before": before_message_id = resume_cursor["cursor"]
+    elif not before_message_id:
+        # Location lớn: chia thành nhiều khoảng snowflake quét song song
+        progress["ranges"] = plan_history_ranges(scan_data, location, after_message_id)
+    if progress.get("ranges"):
+        progress["direction"] = "ranges"
+    elif after_message_id:
+        progress["direction"] = "after"
+    scan_data.setdefault("active_location_progress", {})[location.id] = progress
+
+    log_prefix = f"Thread '{location.name}' ({location.id})" if isinstance(location, discord.Thread) else f"Channel '{location.name}' ({location.id})"
+    log.info(f"Wrapper: Bắt đầu quét {log_prefix}")
+
+    result = _base_location_result(location)
+    if isinstance(location, discord.Thread):
         if location.owner_id:
             owner = await utils.fetch_user_data(scan_data["server"], location.owner_id, bot_ref=scan_data["bot"])
             result["owner_id"] = location.owner_id
@@ -378,16 +657,21 @@ async def _scan_individual_location_wrapper(
                 location_error = f"Bỏ qua luồng '{location.name}' ({location.id}): {reason}."
                 result["error"] = location_error; result["processed"] = False
                 result["scan_duration_seconds"] = (discord.utils.utcnow() - location_scan_start_time).total_seconds()
+                scan_data["active_location_progress"].pop(location.id, None)
                 log.warning(location_error)
                 scan_data["scan_errors"].append(location_error)
                 return result
 
-        message_iterator = location.history(limit=None)
-        async for message in message_iterator:
-            await _process_message(message, scan_data, location.id)
-            location_message_count += 1
-            if message.author and not message.author.bot:
-                author_counter_location[message.author.id] += 1
+        progress["history_recorder"] = open_location_recorder(scan_data, location)
+        if progress.get("ranges"):
+            log.info(f"{log_prefix}: chia thành {len(progress['ranges'])} khoảng snowflake quét song song")
+            await _scan_history_ranges(scan_data, location, progress)
+        else:
+            if after_message_id:
+                log.debug(f"{log_prefix}: quét từ cũ -> mới sau message ID {after_message_id}")
+            elif before_message_id:
+                log.debug(f"{log_prefix}: resume quét trước message ID {before_message_id}")
+            await _scan_history_sequential(scan_data, location, progress, after_message_id, before_message_id)
         processed_flag = True
 
     except discord.Forbidden as forbidden_err:
@@ -397,112 +681,270 @@ async def _scan_individual_location_wrapper(
         await asyncio.sleep(2)
     except Exception as e_loc:
         location_error = f"Lỗi không xác định quét {log_prefix}: {e_loc}"
+    finally:
+        if progress.get("history_recorder"):
+            progress.pop("history_recorder").close()
 
+    scan_data["active_location_progress"].pop(location.id, None)
     if location_error:
         log.error(location_error, exc_info=True)
         scan_data["scan_errors"].append(location_error)
         result["error"] = location_error
     result["processed"] = processed_flag
-    result["message_count"] = location_message_count
-    result["author_counts"] = author_counter_location
-
-    await _populate_additional_location_details(scan_data, location, result)
+    result["message_count"] = progress["message_count"]
+    result["new_message_count"] = progress["new_message_count"]
+    result["newest_message_id"] = progress["newest_message_id"]
+    result["scan_direction"] = progress["direction"] # Quyết định newest_message_id có là checkpoint liên tục khi lỗi giữa chừng
+    result["author_counts"] = progress["author_counts"]
+    result["page_count"] = progress["page_count"] # Cho profile quét (scan_profiler)
+    result["aggregate_cpu_seconds"] = progress["aggregate_cpu_seconds"]
+
+    await _populate_additional_location_details(
+        scan_data, location, result, oldest_messages=progress.get("oldest_messages") if processed_flag else None
+    )
 
     result["scan_duration_seconds"] = (discord.utils.utcnow() - location_scan_start_time).total_seconds()
+    scan_data.setdefault("completed_location_results", {})[location.id] = result
+    location_labels = {"guild_id": scan_data["server"].id, "location_id": location.id, "location": location.name}
+    metrics.LOCATION_MESSAGES.set(result["message_count"], **location_labels)
+    metrics.LOCATION_SCAN_SECONDS.set(result["scan_duration_seconds"], **location_labels)
     log.info(f"Wrapper: Hoàn thành {log_prefix}. Tin: {result['message_count']}. Thời gian: {result['scan_duration_seconds']:.2f}s. Lỗi: {result['error']}")
     return result
 
 
+# --- Quét một location khi có permit (kênh và luồng dùng chung ngân sách permit) ---
+async def _scan_location_with_permit(
+    scan_data: Dict[str, Any],
+    location: Union[discord.TextChannel, discord.VoiceChannel, discord.Thread],
+) -> Dict[str, Any]:
+    limiter: AdaptiveScanLimiter = scan_data["scan_limiter"]
+    async with limiter.permit(priority=estimate_location_size(scan_data, location)):
+        return await _scan_individual_location_wrapper(scan_data, location)
+
+
+async def _list_channel_threads(
+    scan_data: Dict[str, Any],
+    channel: discord.TextChannel
+) -> List[discord.Thread]:
+    """Luồng đang mở + luồng đã lưu trữ (nếu có quyền) của kênh, xếp theo kích thước ước lượng giảm dần."""
+    threads_to_scan: List[discord.Thread] = []
+    scan_since: Optional[datetime.datetime] = scan_data.get("scan_since")
+    try:
+        threads_to_scan.extend(channel.threads)
+        if scan_data.get("can_scan_archived_threads", False):
+            log.debug(f"  Fetching archived threads cho kênh {channel.name}...")
+            async with rest_scheduler.slot(rest_scheduler.ROUTE_THREADS):
+                async for thread_obj in channel.archived_threads(limit=None):
+                    # Luồng trả về theo thời điểm lưu trữ mới -> cũ; luồng lưu trữ trước mốc khoảng quét không thể có tin mới hơn
+                    if scan_since and thread_obj.archive_timestamp and thread_obj.archive_timestamp < scan_since:
+                        break
+                    threads_to_scan.append(thread_obj)
+    except Exception as e_fetch_thread:
+        log.error(f"  Lỗi fetch threads cho kênh {channel.name}: {e_fetch_thread}")
+        scan_data["scan_errors"].append(f"Lỗi fetch threads kênh {channel.name}: {e_fetch_thread}")
+
+    window_after_id: Optional[int] = scan_data.get("scan_since_message_id")
+    if window_after_id:
+        threads_to_scan = [t for t in threads_to_scan if not t.last_message_id or t.last_message_id > window_after_id]
+    unique_threads_map: Dict[int, discord.Thread] = {t.id: t for t in threads_to_scan}
+    return order_largest_first(scan_data, list(unique_threads_map.values()))
+
+
 # --- Hàm xử lý một kênh và các luồng con của nó ---
 async def _process_single_channel_and_its_threads(
     scan_data: Dict[str, Any],
     channel: Union[discord.TextChannel, discord.VoiceChannel]
 ) -> Dict[str, Any]:
-    async with scan_semaphore:
-        log.info(f"Bắt đầu xử lý song song cho kênh: {channel.name} ({channel.id})")
-        channel_result = await _scan_individual_location_wrapper(scan_data, channel)
+    log.info(f"Bắt đầu xử lý song song cho kênh: {channel.name} ({channel.id})")
+    # Kênh cha trả permit ngay sau khi quét xong history của nó, trước khi chờ các luồng con
+    channel_result = await _scan_location_with_permit(scan_data, channel)
+
+    if isinstance(channel, discord.TextChannel) and channel_result.get("processed"):
+        unique_threads_to_scan = await _list_channel_threads(scan_data, channel)
+
+        if unique_threads_to_scan:
+            log.info(f"  Kênh {channel.name} có {len(unique_threads_to_scan)} luồng để quét song song.")
+            thread_tasks = [
+                asyncio.create_task(_scan_location_with_permit(scan_data, thread_obj))
+                for thread_obj in unique_threads_to_scan
+            ]
+            thread_scan_results = await asyncio.gather(*thread_tasks, return_exceptions=True)
+            channel_result["threads_data"] = [res for res in thread_scan_results if isinstance(res, dict)]
+            for res_thread_err in thread_scan_results:
+                if isinstance(res_thread_err, Exception):
+                    log.error(f"    Lỗi trong một task quét luồng (kênh {channel.name}): {res_thread_err}")
+    else:
+        channel_result["threads_data"] = []
 
-        if isinstance(channel, discord.TextChannel) and channel_result.get("processed"):
-            threads_to_scan: List[discord.Thread] = []
-            try:
-                threads_to_scan.extend(channel.threads)
-                if scan_data.get("can_scan_archived_threads", False):
-                    log.debug(f"  Fetching archived threads cho kênh {channel.name}...")
-                    async for thread_obj in channel.archived_threads(limit=None):
-                        threads_to_scan.append(thread_obj)
-            except Exception as e_fetch_thread:
-                log.error(f"  Lỗi fetch threads cho kênh {channel.name}: {e_fetch_thread}")
-                scan_data["scan_errors"].append(f"Lỗi fetch threads kênh {channel.name}: {e_fetch_thread}")
-
-            unique_threads_map: Dict[int, discord.Thread] = {t.id: t for t in threads_to_scan}
-            unique_threads_to_scan = list(unique_threads_map.values())
-
-            if unique_threads_to_scan:
-                log.info(f"  Kênh {channel.name} có {len(unique_threads_to_scan)} luồng để quét song song.")
-                thread_tasks = [
-                    asyncio.create_task(_scan_individual_location_wrapper(scan_data, thread_obj))
-                    for thread_obj in unique_threads_to_scan
-                ]
-                thread_scan_results = await asyncio.gather(*thread_tasks, return_exceptions=True)
-                channel_result["threads_data"] = [res for res in thread_scan_results if isinstance(res, dict)]
-                for res_thread_err in thread_scan_results:
-                    if isinstance(res_thread_err, Exception):
-                        log.error(f"    Lỗi trong một task quét luồng (kênh {channel.name}): {res_thread_err}")
+    log.info(f"Hoàn thành xử lý song song cho kênh: {channel.name}. Tổng tin kênh: {channel_result.get('message_count',0)}")
+    return channel_result
+
+
+def _count_channel_result(scan_data: Dict[str, Any], channel_result_with_threads: Dict[str, Any]):
+    """Cộng số kênh/luồng đã xử lý và bị bỏ qua từ kết quả của một kênh (kèm luồng con)."""
+    if channel_result_with_threads.get("processed"):
+        scan_data["processed_channels_count"] += 1
+    for thread_res in channel_result_with_threads.get("threads_data", []):
+        if thread_res.get("processed") and not thread_res.get("error"):
+            scan_data["processed_threads_count"] += 1
         else:
-            channel_result["threads_data"] = []
+            scan_data["skipped_threads_count"] += 1
 
-        log.info(f"Hoàn thành xử lý song song cho kênh: {channel.name}. Tổng tin kênh: {channel_result.get('message_count',0)}")
-        return channel_result
+
+# --- Quét trong process này: mỗi kênh (kèm luồng con) là một task ---
+async def _scan_locally(
+    scan_data: Dict[str, Any],
+    ordered_channels: List[Union[discord.TextChannel, discord.VoiceChannel]],
+    report_progress
+) -> List[Dict[str, Any]]:
+    new_channel_details: List[Dict[str, Any]] = []
+    channel_tasks = [
+        asyncio.create_task(_process_single_channel_and_its_threads(scan_data, ch_obj))
+        for ch_obj in ordered_channels
+    ]
+
+    completed_tasks_count = 0
+    total_tasks_initial = len(channel_tasks)
+
+    # Worker lấy người thả reaction chạy song song với quét history
+    reaction_fetcher = start_reaction_fetcher(scan_data)
+    content_pool = start_content_analysis_pool(scan_data)
+    concurrency_task = start_scan_controller(scan_data["scan_limiter"], scan_data)
+    try:
+        for coro in asyncio.as_completed(channel_tasks):
+            try:
+                channel_result_with_threads = await coro
+                if channel_result_with_threads: # Kiểm tra None phòng trường hợp lỗi lạ
+                    new_channel_details.append(channel_result_with_threads)
+                    _count_channel_result(scan_data, channel_result_with_threads)
+            except Exception as e_task:
+                log.error(f"Lỗi nghiêm trọng trong một tác vụ quét kênh chính: {e_task}", exc_info=True)
+                scan_data["scan_errors"].append(f"Lỗi nghiêm trọng task quét kênh: {e_task}")
+            finally:
+                completed_tasks_count += 1
+                await report_progress(completed_tasks_count, total_tasks_initial)
+
+        if reaction_fetcher:
+            await reaction_fetcher.close()
+    except BaseException:
+        if reaction_fetcher:
+            await reaction_fetcher.abort()
+        raise
+    finally:
+        scan_data.pop("reaction_fetcher", None)
+        if content_pool:
+            scan_data.pop("content_pool", None)
+            content_pool.shutdown()
+        if concurrency_task:
+            concurrency_task.cancel()
+            await asyncio.gather(concurrency_task, return_exceptions=True)
+    return new_channel_details
+
+
+# --- Quét phân tán: đăng job từng kênh/luồng vào DB, các process worker quét, ở đây chỉ gộp kết quả ---
+async def _scan_distributed(
+    scan_data: Dict[str, Any],
+    ordered_channels: List[Union[discord.TextChannel, discord.VoiceChannel]],
+    report_progress
+) -> Optional[List[Dict[str, Any]]]:
+    """Trả về None nếu không đăng được job (khi đó quét trong process này như bình thường)."""
+    scan_id = scan_data["scan_id"]
+    text_channels = [channel for channel in ordered_channels if isinstance(channel, discord.TextChannel)]
+    # Coordinator liệt kê luồng trước (luồng được quét cả khi kênh cha lỗi, worker tự bỏ qua luồng thiếu quyền)
+    thread_lists = await asyncio.gather(*(_list_channel_threads(scan_data, channel) for channel in text_channels))
+    threads_by_channel: Dict[int, List[discord.Thread]] = {channel.id: threads for channel, threads in zip(text_channels, thread_lists)}
+
+    locations: Dict[int, Union[discord.TextChannel, discord.VoiceChannel, discord.Thread]] = {}
+    results: Dict[int, Dict[str, Any]] = {}
+    job_locations = []
+    resumed_results = scan_data.get("resumed_location_results", {})
+    for channel in ordered_channels:
+        for location in [channel] + threads_by_channel.get(channel.id, []):
+            locations[location.id] = location
+            resumed_result = resumed_results.pop(location.id, None)
+            if resumed_result is not None: # Đã quét xong trước khi crash (resume)
+                results[location.id] = resumed_result
+                scan_data.setdefault("completed_location_results", {})[location.id] = resumed_result
+                continue
+            is_thread = isinstance(location, discord.Thread)
+            job_locations.append((location, JOB_KIND_THREAD if is_thread else JOB_KIND_CHANNEL, channel.id if is_thread else None))
+
+    job_ids = await publish_scan_jobs(scan_data, job_locations) if job_locations else []
+    if job_locations and not job_ids:
+        log.error("Không đăng được job quét phân tán, chuyển sang quét trong process này.")
+        scan_data["scan_errors"].append("Quét phân tán: không đăng được job, đã quét trong process coordinator.")
+        return None
+    log.info(f"Quét phân tán: đã đăng {len(job_ids)} job (scan {scan_id}), {len(results)} location dùng lại kết quả resume. Đang chờ worker...")
+
+    total_locations = len(locations)
+    try:
+        async for job_row, location_result in iter_scan_job_results(scan_data, job_ids):
+            location = locations[job_row["location_id"]]
+            if location_result is None:
+                location_error = f"Job quét phân tán '{location.name}' ({location.id}) thất bại: {job_row.get('error')}"
+                log.error(location_error)
+                scan_data["scan_errors"].append(location_error)
+                location_result = _base_location_result(location)
+                location_result["error"] = location_error
+            results[location.id] = location_result
+            scan_data.setdefault("completed_location_results", {})[location.id] = location_result
+            await report_progress(len(results), total_locations)
+    finally:
+        await database.delete_scan_jobs(scan_id) # Kết quả đã gộp xong (hoặc coordinator dừng) -> worker không nhận tiếp
+
+    new_channel_details: List[Dict[str, Any]] = []
+    for channel in ordered_channels:
+        channel_result = results.get(channel.id)
+        if channel_result is None: continue
+        channel_result["threads_data"] = [results[thread.id] for thread in threads_by_channel.get(channel.id, []) if thread.id in results]
+        new_channel_details.append(channel_result)
+        _count_channel_result(scan_data, channel_result)
+    return new_channel_details
 
 
 # --- Hàm chính để quét tất cả các kênh và luồng ---
 async def scan_all_channels_and_threads(scan_data: Dict[str, Any]):
     accessible_channels: List[Union[discord.TextChannel, discord.VoiceChannel]] = scan_data["accessible_channels"]
-    bot: commands.Bot = scan_data["bot"]
-    e = lambda name: utils.get_emoji(name, bot)
 
-    log.info(f"Bắt đầu quét song song {len(accessible_channels)} kênh (tối đa {MAX_CONCURRENT_SCANS} đồng thời)...")
+    scan_limiter = create_scan_limiter()
+    scan_data["scan_limiter"] = scan_limiter
+    log.info(
+        f"Bắt đầu quét song song {len(accessible_channels)} kênh "
+        f"({scan_limiter.limit} đồng thời, tự điều chỉnh {scan_limiter.min_limit}-{scan_limiter.max_limit})..."
+    )
 
-    last_status_update_time = scan_data["overall_start_time"]
+    status_state = {"last_update": scan_data["overall_start_time"], "message": scan_data["initial_status_msg"]}
     update_interval_seconds = 12
-    status_message = scan_data["initial_status_msg"]
 
-    new_channel_details: List[Dict[str, Any]] = []
+    async def _report_progress(completed_count: int, total_count: int):
+        now = discord.utils.utcnow()
+        if (now - status_state["last_update"]).total_seconds() > update_interval_seconds or completed_count == total_count:
+            status_embed = _create_progress_embed(scan_data, completed_count, total_count, now)
+            status_state["message"] = await _update_status_message(scan_data["ctx"], status_state["message"], status_embed)
+            scan_data["status_message"] = status_state["message"]
+            status_state["last_update"] = now
+
     scan_data["processed_channels_count"] = 0
     scan_data["processed_threads_count"] = 0
     scan_data["skipped_threads_count"] = 0
 
-    channel_tasks = [
-        _process_single_channel_and_its_threads(scan_data, ch_obj)
-        for ch_obj in accessible_channels
-    ]
-
-    completed_tasks_count = 0
-    total_tasks_initial = len(channel_tasks)
-
-    for coro in asyncio.as_completed(channel_tasks):
-        try:
-            channel_result_with_threads = await coro
-            if channel_result_with_threads: # Kiểm tra None phòng trường hợp lỗi lạ
-                new_channel_details.append(channel_result_with_threads)
-                if channel_result_with_threads.get("processed"):
-                    scan_data["processed_channels_count"] += 1
-                for thread_res in channel_result_with_threads.get("threads_data", []):
-                    if thread_res.get("processed") and not thread_res.get("error"):
-                        scan_data["processed_threads_count"] += 1
-                    else:
-                        scan_data["skipped_threads_count"] += 1
-        except Exception as e_task:
-            log.error(f"Lỗi nghiêm trọng trong một tác vụ quét kênh chính: {e_task}", exc_info=True)
-            scan_data["scan_errors"].append(f"Lỗi nghiêm trọng task quét kênh: {e_task}")
-        finally:
-            completed_tasks_count += 1
-            now = discord.utils.utcnow()
-            if (now - last_status_update_time).total_seconds() > update_interval_seconds or completed_tasks_count == total_tasks_initial:
-                status_embed = _create_progress_embed(scan_data, completed_tasks_count, total_tasks_initial, now)
-                status_message = await _update_status_message(scan_data["ctx"], status_message, status_embed)
-                scan_data["status_message"] = status_message
-                last_status_update_time = now
+    # Kênh lớn (theo ước lượng) được tạo task và nhận permit trước, kênh nhỏ lấp chỗ trống về sau
+    ordered_channels = order_largest_first(scan_data, accessible_channels)
+    scan_data["scan_start_message_count"] = scan_data.get("overall_total_message_count", 0)
+    if ordered_channels:
+        log.info(
+            f"Xếp lịch quét: ước lượng ~{scan_data.get('estimated_total_messages', 0):,} tin, kênh lớn nhất "
+            f"'{ordered_channels[0].name}' (~{scan_data['location_size_estimates'].get(ordered_channels[0].id, 0):,} tin)."
+        )
+
+    new_channel_details: Optional[List[Dict[str, Any]]] = None
+    if config.SCAN_DISTRIBUTED and scan_data.get("scan_id"):
+        new_channel_details = await _scan_distributed(scan_data, ordered_channels, _report_progress)
+    if new_channel_details is None:
+        new_channel_details = await _scan_locally(scan_data, ordered_channels, _report_progress)
+    rest_scheduler.rest_scheduler.log_summary()
+    if scan_data.get("can_scan_reactions"):
+        await prune_reaction_cache()
 
     scan_data["channel_details"] = new_channel_details
     log.info(
@@ -520,12 +962,12 @@ async def _update_status_message(
     embed: discord.Embed
 ) -> Optional[discord.Message]:
     try:
-        if current_status_message:
-            await current_status_message.edit(content=None, embed=embed)
-            return current_status_message
-        else:
+        async with rest_scheduler.slot(rest_scheduler.ROUTE_STATUS):
+            if current_status_message:
+                await current_status_message.edit(content=None, embed=embed)
+                return current_status_message
             new_msg = await ctx.send(embed=embed)
-            return new_msg
+        return new_msg
     except (discord.NotFound, discord.HTTPException) as http_err:
         log.warning(f"Cập nhật trạng thái thất bại ({http_err.status}), thử gửi lại.")
         try:
@@ -555,8 +997,11 @@ def _create_progress_embed(
     overall_msgs = scan_data.get('overall_total_message_count', 0)
     overall_scan_speed = (overall_msgs / time_so_far_sec) if time_so_far_sec > 0.1 else 0
 
-    avg_time_per_initial_channel = (time_so_far_sec / completed_locations_count) if completed_locations_count > 0 else 60.0
-    estimated_remaining_sec = max(0.0, (total_initial_channels - completed_locations_count) * avg_time_per_initial_channel)
+    # ETA theo số tin ước lượng còn lại của từng kênh/luồng; chưa có dữ liệu thì tạm tính theo số kênh
+    estimated_remaining_sec = estimate_remaining_seconds(scan_data, time_so_far_sec)
+    if estimated_remaining_sec is None:
+        avg_time_per_initial_channel = (time_so_far_sec / completed_locations_count) if completed_locations_count > 0 else 60.0
+        estimated_remaining_sec = max(0.0, (total_initial_channels - completed_locations_count) * avg_time_per_initial_channel)
     estimated_completion_time = now + datetime.timedelta(seconds=estimated_remaining_sec)
 
     status_embed = discord.Embed(
@@ -568,7 +1013,7 @@ def _create_progress_embed(
     status_embed.add_field(name="Tiến độ (Kênh)", value=f"{completed_locations_count}/{total_initial_channels}", inline=True)
     status_embed.add_field(name="Tổng Tin Nhắn", value=f"{overall_msgs:,}", inline=True)
     status_embed.add_field(name="Tốc độ (Tổng)", value=f"~{overall_scan_speed:.1f} msg/s", inline=True)
-    users_detected = len(scan_data['user_activity'])
+    users_detected = len(scan_data['user_stats'])
     status_embed.add_field(name="Users Phát Hiện", value=f"{users_detected:,}", inline=True)
     status_embed.add_field(name="TG Ước Tính", value=utils.format_timedelta(datetime.timedelta(seconds=estimated_remaining_sec)), inline=True)
     status_embed.add_field(name="Dự Kiến Xong", value=utils.format_discord_time(estimated_completion_time, 'R'), inline=True)
@@ -576,10 +1021,20 @@ def _create_progress_embed(
     if scan_data.get("can_scan_reactions", False):
         filtered_reaction_count = scan_data.get("overall_total_filtered_reaction_count", 0)
         status_embed.add_field(name=f"{e('reaction')} React (Lọc)", value=f"{filtered_reaction_count:,}", inline=True)
+        reaction_fetcher = scan_data.get("reaction_fetcher")
+        if reaction_fetcher:
+            status_embed.add_field(name="Hàng đợi React", value=f"{reaction_fetcher.backlog:,} job", inline=True)
+            status_embed.add_field(
+                name="Tốc độ React",
+                value=f"~{reaction_fetcher.throughput():.1f}/s (cache: {reaction_fetcher.cache_hit_count:,})",
+                inline=True
+            )
     else:
         status_embed.add_field(name="\u200b", value="\u200b", inline=True) # Placeholder để giữ layout
 
-    footer_text = f"Quét song song | Server ID: {scan_data['server'].id}"
+    scan_limiter: Optional[AdaptiveScanLimiter] = scan_data.get("scan_limiter")
+    footer_text = f"Quét song song ({scan_limiter.active}/{scan_limiter.limit})" if scan_limiter else "Quét song song"
+    footer_text += f" | Server ID: {scan_data['server'].id}"
     if discord_logging.get_log_target_thread():
         footer_text += " | Log chi tiết trong thread"
     status_embed.set_footer(text=footer_text)
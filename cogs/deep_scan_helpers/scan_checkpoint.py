@@ -0,0 +1,252 @@
+# --- START OF FILE cogs/deep_scan_helpers/scan_checkpoint.py ---
+import discord
+import logging
+import asyncio
+import os
+import pickle
+import time
+from typing import Dict, Any, Optional
+from collections import Counter, defaultdict
+
+import config
+from .user_stats import UserStatsStore
+from .activity_grid import ActivityGrid
+from .message_index import MessageIndexBuffer
+from .scan_memory import SpillStore, SpilledNestedCounts, SpillReference, spilled_deltas, restore_spilled_key
+
+log = logging.getLogger(__name__)
+
+CHECKPOINT_FORMAT_VERSION = 3 # 3: dữ liệu giờ chuyển sang ActivityGrid
+
+# Các key trong scan_data được cộng dồn khi quét kênh -> cần lưu để resume
+# (user_stats chứa toàn bộ số đếm theo user; user_activity và Counter theo user được sinh lại sau khi quét)
+CHECKPOINT_AGGREGATE_KEYS = (
+    "user_stats", "overall_total_message_count", "overall_total_reaction_count",
+    "overall_total_filtered_reaction_count", "keyword_counts", "channel_keyword_counts",
+    "thread_keyword_counts", "user_keyword_counts", "reaction_emoji_counts",
+    "filtered_reaction_emoji_counts", "sticker_usage_counts", "overall_custom_sticker_counts",
+    "user_custom_emoji_content_counts", "overall_custom_emoji_content_counts",
+    "user_reaction_emoji_given_counts", "user_channel_message_counts", "user_sticker_id_counts",
+    "server_hourly_activity", "channel_hourly_activity", "thread_hourly_activity",
+    "user_hourly_activity", "user_emoji_received_counts", "scan_errors",
+    "daily_user_location_counts", "daily_location_hourly_counts", "message_index",
+    # Trạng thái quét tăng dần (đã nạp lúc bắt đầu, không nạp lại khi resume)
+    "incremental_mode", "location_checkpoints", "incremental_location_seeds", "rollup_after_ids",
+    "message_index_after_id",
+)
+
+
+def _checkpoint_path(guild_id: int) -> str:
+    return os.path.join(config.SCAN_CHECKPOINT_DIR, f"scan_{guild_id}.pkl")
+
+
+def _spill_snapshot_path(guild_id: int) -> str:
+    """Bản chụp file SQLite của các bảng đã đổ xuống đĩa, đi kèm checkpoint."""
+    return os.path.join(config.SCAN_CHECKPOINT_DIR, f"scan_{guild_id}.spill.sqlite")
+
+
+def _to_picklable(value: Any) -> Any:
+    """defaultdict dùng lambda làm factory không pickle được -> chuyển lớp ngoài về dict."""
+    if isinstance(value, SpilledNestedCounts): # Dữ liệu nằm trong bản chụp SQLite
+        return SpillReference(value.table)
+    if isinstance(value, defaultdict) and getattr(value.default_factory, "__name__", "") == "<lambda>":
+        return dict(value)
+    return value
+
+
+def _snapshot_value(value: Any) -> Any:
+    """
+    Bản sao (chạy trên event loop, không await) đủ sâu để pickle trong thread trong khi vòng quét vẫn ghi vào bản gốc:
+    bảng dạng cột copy array, Counter/dict copy thêm một tầng bên trong (bộ đếm chỉ lồng tối đa 2 tầng).
+    """
+    if isinstance(value, (UserStatsStore, ActivityGrid, MessageIndexBuffer)):
+        return value.copy()
+    if isinstance(value, SpilledNestedCounts):
+        return _to_picklable(value)
+    if isinstance(value, dict):
+        snapshot = value.copy() # Giữ kiểu Counter/defaultdict
+        for inner_key, inner_value in snapshot.items():
+            if isinstance(inner_value, dict): snapshot[inner_key] = inner_value.copy()
+        return _to_picklable(snapshot)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+def _write_atomic(path: str, payload: bytes):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _dump_checkpoint(path: str, checkpoint: Dict[str, Any]) -> int:
+    """pickle + ghi file (chạy trong thread, checkpoint là bản sao riêng). Trả về số byte đã ghi."""
+    payload = pickle.dumps(checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+    _write_atomic(path, payload)
+    return len(payload)
+
+
+def _build_location_cursors(scan_data: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    """Cursor resume của các location đang quét dở (copy để pickle không đụng dữ liệu đang ghi)."""
+    cursors: Dict[int, Dict[str, Any]] = {}
+    for location_id, progress in scan_data.get("active_location_progress", {}).items():
+        if progress.get("cursor") is None and not progress.get("ranges"): continue
+        cursors[location_id] = {
+            "direction": progress["direction"], "cursor": progress["cursor"],
+            "message_count": progress["message_count"], "new_message_count": progress["new_message_count"],
+            "newest_message_id": progress["newest_message_id"],
+            "author_counts": Counter(progress["author_counts"]),
+            "ranges": [dict(history_range) for history_range in progress.get("ranges", [])],
+            "oldest_messages": list(progress["oldest_messages"]) if progress.get("oldest_messages") is not None else None,
+        }
+    return cursors
+
+
+async def save_scan_checkpoint(scan_data: Dict[str, Any]) -> bool:
+    """Chụp trạng thái quét hiện tại và ghi ra file (ghi file trong thread riêng)."""
+    server: discord.Guild = scan_data["server"]
+    start = time.monotonic()
+    spill_store: Optional[SpillStore] = scan_data.get("spill_store")
+    spill_lock = spill_store.write_lock if spill_store else None
+    if spill_lock:
+        await spill_lock.acquire() # File SQLite đứng yên tới khi chụp xong (lần đổ đang dở chờ ở đây)
+    try:
+        completed_results = {}
+        for location_id, result in scan_data.get("completed_location_results", {}).items():
+            result_copy = dict(result)
+            result_copy["threads_data"] = [] # Luồng con được lưu riêng theo ID
+            completed_results[location_id] = result_copy
+        checkpoint = {
+            "version": CHECKPOINT_FORMAT_VERSION,
+            "guild_id": server.id,
+            "scan_id": scan_data.get("scan_id"),
+            "saved_at": discord.utils.utcnow(),
+            "options": {
+                "export_csv": scan_data.get("export_csv", False),
+                "export_json": scan_data.get("export_json", False),
+                "admin_dm_test": scan_data.get("admin_dm_test", False),
+                "keywords_str": scan_data.get("keywords_str"),
+                "scan_since": scan_data.get("scan_since"),
+            },
+            "aggregates": {key: _snapshot_value(scan_data[key]) for key in CHECKPOINT_AGGREGATE_KEYS if key in scan_data},
+            "completed_location_results": completed_results,
+            "location_cursors": _build_location_cursors(scan_data),
+            # Người thả reaction của tin đã nằm sau cursor nhưng chưa lấy xong -> resume lấy lại
+            "reaction_jobs": scan_data["reaction_fetcher"].pending_jobs() if scan_data.get("reaction_fetcher") else [],
+        }
+        # Phần của bảng đã đổ còn trong RAM cũng copy ngay lúc này -> bản chụp SQLite khớp với pickle
+        spill_deltas = spilled_deltas(scan_data) if spill_store else []
+        # Bản sao ở trên được chụp liền một mạch trên event loop (khớp với nhau);
+        # chụp SQLite và pickle (phần tốn nhất) chạy trong thread nên không chặn vòng quét
+        snapshot_seconds = time.monotonic() - start
+        if spill_store:
+            try: await asyncio.to_thread(spill_store.write_snapshot, _spill_snapshot_path(server.id), spill_deltas)
+            finally:
+                spill_lock.release()
+                spill_lock = None
+        payload_size = await asyncio.to_thread(_dump_checkpoint, _checkpoint_path(server.id), checkpoint)
+        log.info(
+            f"Đã lưu checkpoint quét ({payload_size / 1024 / 1024:.1f} MB, {len(completed_results)} location xong, "
+            f"{len(checkpoint['location_cursors'])} đang dở) trong {time.monotonic() - start:.2f}s "
+            f"(chụp trên event loop {snapshot_seconds:.2f}s)."
+        )
+        return True
+    except Exception as e_ckpt:
+        log.error(f"Lỗi lưu checkpoint quét cho guild {server.id}: {e_ckpt}", exc_info=True)
+        return False
+    finally:
+        if spill_lock: spill_lock.release() # Lỗi trước khi kịp chụp SQLite
+
+
+async def load_scan_checkpoint(guild_id: int) -> Optional[Dict[str, Any]]:
+    """Đọc checkpoint đã lưu của guild. Trả về None nếu không có hoặc không hợp lệ."""
+    path = _checkpoint_path(guild_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        def _read() -> Dict[str, Any]:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        checkpoint = await asyncio.to_thread(_read)
+        if not isinstance(checkpoint, dict) or checkpoint.get("version") != CHECKPOINT_FORMAT_VERSION or checkpoint.get("guild_id") != guild_id:
+            log.warning(f"Checkpoint quét '{path}' không hợp lệ hoặc khác phiên bản, bỏ qua.")
+            return None
+        return checkpoint
+    except Exception as e_load:
+        log.error(f"Lỗi đọc checkpoint quét '{path}': {e_load}", exc_info=True)
+        return None
+
+
+def remove_scan_checkpoint(guild_id: int):
+    """Xóa checkpoint (và bản chụp dữ liệu đã đổ xuống đĩa) sau khi quét hoàn tất."""
+    for path in (_checkpoint_path(guild_id), _spill_snapshot_path(guild_id)):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                log.info(f"Đã xóa checkpoint quét '{path}'.")
+        except OSError as e_rm:
+            log.warning(f"Không thể xóa checkpoint quét '{path}': {e_rm}")
+
+
+def restore_scan_checkpoint(scan_data: Dict[str, Any], checkpoint: Dict[str, Any]):
+    """Nạp dữ liệu tổng hợp + kết quả location đã xong + cursor từ checkpoint vào scan_data mới."""
+    for key, value in checkpoint.get("aggregates", {}).items():
+        target = scan_data.get(key)
+        if isinstance(value, SpillReference):
+            snapshot_path = _spill_snapshot_path(checkpoint["guild_id"])
+            if not os.path.exists(snapshot_path):
+                raise FileNotFoundError(f"Checkpoint tham chiếu dữ liệu đã đổ xuống đĩa nhưng thiếu file '{snapshot_path}'.")
+            restore_spilled_key(scan_data, key, snapshot_path)
+        elif isinstance(target, defaultdict):
+            for inner_key, inner_value in value.items():
+                inner_target = target[inner_key]
+                if isinstance(inner_target, dict) and isinstance(inner_value, dict): inner_target.update(inner_value)
+                else: target[inner_key] = inner_value
+        elif isinstance(target, Counter):
+            target.update(value)
+        elif isinstance(target, list):
+            target.extend(value)
+        else:
+            scan_data[key] = value
+
+    scan_data["resumed_location_results"] = checkpoint.get("completed_location_results", {})
+    scan_data["resume_location_cursors"] = checkpoint.get("location_cursors", {})
+    scan_data["resume_reaction_jobs"] = checkpoint.get("reaction_jobs", [])
+    log.info(
+        f"Đã nạp checkpoint (lưu lúc {checkpoint.get('saved_at')}): "
+        f"{len(scan_data['resumed_location_results'])} location đã xong, "
+        f"{len(scan_data['resume_location_cursors'])} location tiếp tục từ cursor, "
+        f"{len(scan_data['resume_reaction_jobs'])} job reaction chờ lấy lại, "
+        f"{scan_data.get('overall_total_message_count', 0):,} tin nhắn."
+    )
+
+
+async def _periodic_checkpoint_loop(scan_data: Dict[str, Any], interval_seconds: int):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await save_scan_checkpoint(scan_data)
+
+
+def start_periodic_checkpoints(scan_data: Dict[str, Any]) -> Optional[asyncio.Task]:
+    """Tạo task nền lưu checkpoint định kỳ trong lúc quét kênh."""
+    interval_seconds = config.SCAN_CHECKPOINT_INTERVAL_SECONDS
+    if interval_seconds <= 0:
+        return None
+    return asyncio.create_task(
+        _periodic_checkpoint_loop(scan_data, interval_seconds),
+        name=f"ScanCheckpoint-{scan_data['server'].id}"
+    )
+
+
+async def stop_periodic_checkpoints(task: Optional[asyncio.Task]):
+    if not task: return
+    task.cancel()
+    try: await task
+    except asyncio.CancelledError: pass
+    except Exception as e_task: log.warning(f"Task checkpoint kết thúc với lỗi: {e_task}")
+
+# --- END OF FILE cogs/deep_scan_helpers/scan_checkpoint.py ---
@@ -0,0 +1,145 @@
+# --- START OF FILE cogs/deep_scan_helpers/scan_concurrency.py ---
+import logging
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+import config
+import rest_scheduler
+import metrics
+
+log = logging.getLogger(__name__)
+
+GROWTH_MIN_GAIN = 1.05 # Tăng thêm 1 luồng quét phải giúp tốc độ tăng >= 5%, nếu không thì lùi lại
+
+
+class AdaptiveScanLimiter:
+    """
+    Giới hạn số kênh/luồng đang đọc history cùng lúc (thay cho Semaphore cố định).
+    Kênh và luồng dùng chung một ngân sách permit; giới hạn được điều chỉnh theo msg/s đo được và số 429.
+    Permit trống được cấp cho location có ước lượng lớn nhất đang chờ (lớn làm trước, nhỏ lấp chỗ trống).
+    """
+
+    def __init__(self, initial_limit: int, min_limit: int, max_limit: int):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial_limit, self.min_limit), self.max_limit)
+        self.active = 0
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = [] # (-ưu tiên, thứ tự, future)
+        self._sequence = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for item in self._waiters if not item[2].done())
+
+    def _wake_waiters(self):
+        while self._waiters and self.active < self.limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done(): continue # Người chờ đã bị hủy
+            self.active += 1
+            future.set_result(None)
+
+    def _release(self):
+        self.active -= 1
+        self._wake_waiters()
+
+    @contextlib.asynccontextmanager
+    async def permit(self, priority: float = 0.0):
+        """Chờ permit quét; `priority` lớn hơn (vd: số tin nhắn ước lượng) được cấp trước."""
+        if not self._waiters and self.active < self.limit:
+            self.active += 1
+            metrics.SCAN_PERMIT_WAIT_SECONDS.observe(0.0)
+        else:
+            waiting_since = time.monotonic()
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (-priority, next(self._sequence), future))
+            self._wake_waiters()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release() # Đã được cấp permit nhưng bị hủy trước khi dùng
+                else:
+                    future.cancel()
+                raise
+            metrics.SCAN_PERMIT_WAIT_SECONDS.observe(time.monotonic() - waiting_since)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def try_acquire(self) -> bool:
+        """
+        Lấy permit ngay nếu còn trống và không ai đang chờ (không bao giờ chờ).
+        Dùng cho việc phụ của một location đã giữ permit (vd: khoảng snowflake phụ) - nếu chờ ở đây
+        thì các location đang giữ permit sẽ chờ lẫn nhau. Phải gọi release() khi xong.
+        """
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters) # Bỏ người chờ đã hủy ở đầu hàng
+        if self.waiting or self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        """Trả permit lấy bằng try_acquire()."""
+        self._release()
+
+    def set_limit(self, new_limit: int):
+        self.limit = min(max(new_limit, self.min_limit), self.max_limit)
+        self._wake_waiters()
+
+    async def run_controller(self, scan_data: Dict[str, Any], interval_seconds: float):
+        """Vòng điều chỉnh kiểu hill-climbing: tăng khi có ích, lùi khi không, giảm mạnh khi gặp 429."""
+        last_time = time.monotonic()
+        last_messages = scan_data.get("overall_total_message_count", 0)
+        last_rate_limited = rest_scheduler.rest_scheduler.total_rate_limited
+        previous_rate = 0.0
+        last_step = 0
+        while True:
+            await asyncio.sleep(interval_seconds)
+            now = time.monotonic()
+            messages = scan_data.get("overall_total_message_count", 0)
+            rate_limited = rest_scheduler.rest_scheduler.total_rate_limited
+            rate = (messages - last_messages) / max(now - last_time, 0.001)
+            new_429 = rate_limited - last_rate_limited
+            last_time, last_messages, last_rate_limited = now, messages, rate_limited
+
+            old_limit = self.limit
+            if new_429 > 0:
+                self.set_limit(self.limit - max(1, self.limit // 4))
+                last_step = -1
+            elif self.active + self.waiting < self.limit:
+                last_step = 0 # Không đủ việc để dùng hết permit -> giữ nguyên
+            elif last_step > 0 and rate < previous_rate * GROWTH_MIN_GAIN:
+                self.set_limit(self.limit - 1)
+                last_step = 0
+            else:
+                self.set_limit(self.limit + 1)
+                last_step = 1 if self.limit != old_limit else 0
+            previous_rate = rate
+            if self.limit != old_limit:
+                log.info(f"Điều chỉnh quét song song: {old_limit} -> {self.limit} (~{rate:.1f} msg/s, 429 mới: {new_429}).")
+
+
+def create_scan_limiter() -> AdaptiveScanLimiter:
+    return AdaptiveScanLimiter(
+        initial_limit=config.MAX_CONCURRENT_CHANNEL_SCANS,
+        min_limit=1,
+        max_limit=config.SCAN_CONCURRENCY_MAX,
+    )
+
+
+def start_scan_controller(limiter: AdaptiveScanLimiter, scan_data: Dict[str, Any]) -> Optional[asyncio.Task]:
+    interval_seconds = config.SCAN_CONCURRENCY_ADJUST_SECONDS
+    if interval_seconds <= 0 or limiter.max_limit == limiter.min_limit:
+        return None
+    return asyncio.create_task(
+        limiter.run_controller(scan_data, interval_seconds),
+        name=f"ScanConcurrency-{scan_data['server'].id}"
+    )
+
+# --- END OF FILE cogs/deep_scan_helpers/scan_concurrency.py ---
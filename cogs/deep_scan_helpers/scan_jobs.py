@@ -0,0 +1,166 @@
+# --- START OF FILE cogs/deep_scan_helpers/scan_jobs.py ---
+import logging
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
+from collections import Counter
+
+import config
+import database
+from .user_stats import UserStatsStore
+from .activity_grid import ActivityGrid
+from .message_index import MessageIndexBuffer
+from .keyword_matcher import KeywordMatcher
+from .scan_checkpoint import CHECKPOINT_AGGREGATE_KEYS, _to_picklable
+from .scan_planner import ScanLocation, estimate_location_size
+from . import job_codec
+from .job_codec import JobPayloadError
+
+log = logging.getLogger(__name__)
+
+JOB_KIND_CHANNEL = "channel"
+JOB_KIND_THREAD = "thread"
+SCAN_JOB_MAX_ATTEMPTS = 3 # Số lần nhận job tối đa (worker lỗi/chết) trước khi đánh dấu failed
+JOB_STATUS_LOG_SECONDS = 30
+
+# Dữ liệu tổng hợp worker gửi về cho coordinator (trạng thái quét tăng dần thuộc về coordinator nên không gửi)
+PARTIAL_AGGREGATE_KEYS = tuple(
+    key for key in CHECKPOINT_AGGREGATE_KEYS
+    if key not in ("incremental_mode", "location_checkpoints", "incremental_location_seeds", "rollup_after_ids", "message_index_after_id")
+)
+
+# Key của tham số job (build_job_spec) - worker từ chối spec có key lạ
+JOB_SPEC_KEYS = frozenset({
+    "keywords", "match_mode", "can_scan_reactions", "server_emoji_ids", "server_sticker_ids", "incremental_after",
+    "seed", "rollup_after", "resume_cursor", "scan_since", "index_after", "estimate",
+})
+
+
+# --- Phía coordinator: đăng job ---
+def build_job_spec(scan_data: Dict[str, Any], location: ScanLocation) -> Dict[str, Any]:
+    """Tham số worker cần để quét một location giống hệt khi quét trong process này."""
+    keyword_matcher: Optional[KeywordMatcher] = scan_data.get("keyword_matcher")
+    incremental = scan_data.get("incremental_mode", False)
+    return {
+        "keywords": list(keyword_matcher.keywords) if keyword_matcher else [],
+        "match_mode": keyword_matcher.mode if keyword_matcher else config.KEYWORD_MATCH_MODE,
+        "can_scan_reactions": scan_data.get("can_scan_reactions", False),
+        "server_emoji_ids": list(scan_data.get("server_emojis_cache", {})),
+        "server_sticker_ids": list(scan_data.get("server_sticker_ids_cache", ())),
+        "incremental_after": scan_data.get("location_checkpoints", {}).get(location.id) if incremental else None,
+        "seed": scan_data.get("incremental_location_seeds", {}).get(location.id) if incremental else None,
+        "rollup_after": scan_data.get("rollup_after_ids", {}).get(location.id),
+        "resume_cursor": scan_data.get("resume_location_cursors", {}).pop(location.id, None),
+        "scan_since": scan_data.get("scan_since"),
+        "index_after": scan_data.get("message_index_after_id") if scan_data.get("message_index") is not None else None,
+        "estimate": estimate_location_size(scan_data, location),
+    }
+
+
+async def publish_scan_jobs(scan_data: Dict[str, Any], locations: List[Tuple[ScanLocation, str, Optional[int]]]) -> List[int]:
+    """Đăng một job cho mỗi (location, kind, parent_channel_id). Trả về job_id (rỗng nếu DB lỗi)."""
+    jobs = []
+    for location, kind, parent_channel_id in locations:
+        spec = build_job_spec(scan_data, location)
+        jobs.append({
+            "location_id": location.id, "parent_channel_id": parent_channel_id, "kind": kind,
+            "priority": spec["estimate"], "spec": job_codec.dumps(spec),
+        })
+    return await database.enqueue_scan_jobs(scan_data["scan_id"], scan_data["server"].id, jobs)
+
+
+# --- Kết quả từng phần: worker đóng gói, coordinator gộp ---
+def decode_job_spec(data: Any) -> Dict[str, Any]:
+    """Tham số job đọc từ cột JSONB (đã qua json.loads). JobPayloadError nếu sai định dạng."""
+    spec = job_codec.decode_value(data)
+    if not isinstance(spec, dict) or not set(spec) <= JOB_SPEC_KEYS:
+        raise JobPayloadError("tham số job không hợp lệ")
+    if not isinstance(spec.get("estimate", 0), int) or not isinstance(spec.get("keywords", []), list):
+        raise JobPayloadError("tham số job sai kiểu")
+    return spec
+
+
+def serialize_job_result(job_scan_data: Dict[str, Any], result: Dict[str, Any]) -> str:
+    """Đóng gói kết quả location + dữ liệu tổng hợp của riêng job thành JSON (cột scan_jobs.result)."""
+    result_copy = dict(result)
+    result_copy["threads_data"] = [] # Coordinator tự ghép luồng vào kênh cha
+    payload = {
+        "result": result_copy,
+        "aggregates": {key: _to_picklable(job_scan_data[key]) for key in PARTIAL_AGGREGATE_KEYS if key in job_scan_data},
+    }
+    return job_codec.dumps(payload)
+
+
+def decode_job_result(data: Any) -> Dict[str, Any]:
+    """Kết quả job đọc từ cột JSONB. Chỉ nhận dữ liệu tổng hợp có trong PARTIAL_AGGREGATE_KEYS."""
+    payload = job_codec.decode_value(data)
+    if not isinstance(payload, dict) or set(payload) != {"result", "aggregates"}:
+        raise JobPayloadError("kết quả job không hợp lệ")
+    if not isinstance(payload["result"], dict) or not isinstance(payload["aggregates"], dict):
+        raise JobPayloadError("kết quả job sai kiểu")
+    unknown_keys = set(payload["aggregates"]) - set(PARTIAL_AGGREGATE_KEYS)
+    if unknown_keys:
+        raise JobPayloadError(f"kết quả job có key lạ: {sorted(unknown_keys)}")
+    return payload
+
+
+def _merge_value(target: Any, value: Any) -> Any:
+    """Cộng dồn value vào target (Counter/dict lồng nhau cộng theo key, số thì cộng, list nối thêm)."""
+    if isinstance(target, (UserStatsStore, MessageIndexBuffer, ActivityGrid)):
+        target.merge(value)
+    elif isinstance(target, Counter):
+        target.update(value)
+    elif isinstance(target, dict):
+        for inner_key, inner_value in value.items():
+            target[inner_key] = _merge_value(target[inner_key], inner_value) if inner_key in target else inner_value
+    elif isinstance(target, list):
+        target.extend(value)
+    elif isinstance(target, (int, float)) and isinstance(value, (int, float)):
+        return target + value
+    else:
+        return value
+    return target
+
+
+def merge_partial_aggregates(scan_data: Dict[str, Any], aggregates: Dict[str, Any]):
+    """Gộp dữ liệu tổng hợp từng phần của một job vào scan_data (đồng bộ, không await)."""
+    for key, value in aggregates.items():
+        scan_data[key] = _merge_value(scan_data[key], value) if key in scan_data else value
+
+
+async def iter_scan_job_results(scan_data: Dict[str, Any], job_ids: List[int]) -> AsyncIterator[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """
+    Chờ các job xong và gộp dữ liệu tổng hợp của từng job ngay khi đọc được.
+    Yield (dòng job, kết quả location) - kết quả None nếu job thất bại hết lượt thử.
+    """
+    scan_id = scan_data["scan_id"]
+    remaining = set(job_ids)
+    last_status_log = time.monotonic()
+    while remaining:
+        requeued = await database.requeue_stale_scan_jobs(scan_id, config.SCAN_JOB_STALE_SECONDS, SCAN_JOB_MAX_ATTEMPTS)
+        if requeued:
+            log.warning(f"Quét phân tán: {requeued} job mất heartbeat (worker dừng?) đã được trả về hàng đợi.")
+        for row in await database.get_finished_scan_jobs(scan_id, list(remaining)):
+            remaining.discard(row["job_id"])
+            result: Optional[Dict[str, Any]] = None
+            if row["status"] == "done" and row["result"] is not None:
+                try:
+                    partial = decode_job_result(row["result"])
+                except Exception as e_load:
+                    row["error"] = f"Không đọc được kết quả: {e_load}"
+                else:
+                    merge_partial_aggregates(scan_data, partial["aggregates"])
+                    result = partial["result"]
+            yield row, result
+        if not remaining:
+            break
+        if time.monotonic() - last_status_log >= JOB_STATUS_LOG_SECONDS:
+            last_status_log = time.monotonic()
+            status_counts = await database.get_scan_job_status_counts(scan_id)
+            log.info(
+                f"Quét phân tán: {status_counts.get('pending', 0)} job chờ, {status_counts.get('running', 0)} đang chạy, "
+                f"còn {len(remaining)}/{len(job_ids)} job chưa gộp."
+            )
+        await asyncio.sleep(config.SCAN_JOB_POLL_SECONDS)
+
+# --- END OF FILE cogs/deep_scan_helpers/scan_jobs.py ---
@@ -0,0 +1,472 @@
+# --- START OF FILE cogs/deep_scan_helpers/scan_memory.py ---
+import logging
+import asyncio
+import glob
+import itertools
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Tuple
+
+import config
+import metrics
+from .scan_profiler import current_rss_bytes
+
+log = logging.getLogger(__name__)
+
+# Bảng {user_id: {khóa con: số}} tăng theo user x (kênh/giờ/keyword/emoji/sticker) -> được phép đổ xuống đĩa
+SPILLABLE_KEYS = (
+    "user_channel_message_counts", "user_keyword_counts",
+    "user_reaction_emoji_given_counts", "user_emoji_received_counts",
+    "user_custom_emoji_content_counts", "user_sticker_id_counts",
+)
+# Key không phải dữ liệu tổng hợp (object Discord, cấu hình...) -> không đo
+UNMEASURED_KEYS = {"server", "bot", "ctx", "log_thread", "status_message", "initial_status_msg", "scan_limiter", "spill_store"}
+SIZE_SAMPLE_LIMIT = 1000 # Số phần tử lấy mẫu khi ước lượng một dict/set lớn
+ENTRY_OVERHEAD_BYTES = 32 # Ô trong bảng hash + con trỏ, ngoài kích thước key/value
+SPILL_TARGET_RATIO = 0.6 # Đổ tới khi tổng còn <= 60% ngân sách (tránh đổ liên tục quanh ngưỡng)
+SPILL_MIN_BYTES = 1024 * 1024 # Bảng nhỏ hơn 1 MB không đáng đổ
+SPILL_CHUNK_ROWS = 50_000 # Số dòng mỗi lần ghi SQLite trước khi nhường event loop
+
+_open_spill_paths = set() # File của các SpillStore còn dùng (task DM của lần quét trước có thể vẫn đang đọc)
+
+
+# --- Ước lượng bộ nhớ ---
+def _entry_bytes(value: Any) -> int:
+    """Kích thước một phần tử con (1 tầng): container thì cộng thêm phần tử của nó, không đệ quy sâu hơn."""
+    if isinstance(value, (dict, set, frozenset, list, tuple)):
+        return sys.getsizeof(value) + len(value) * (ENTRY_OVERHEAD_BYTES + 28)
+    if hasattr(value, "approx_bytes"):
+        return value.approx_bytes()
+    return sys.getsizeof(value)
+
+
+def estimate_bytes(value: Any) -> int:
+    """
+    Ước lượng bộ nhớ của một giá trị trong scan_data: bảng hash + key + giá trị con (lấy mẫu tối đa
+    SIZE_SAMPLE_LIMIT phần tử rồi nhân lên). Với bảng đã đổ xuống đĩa chỉ tính phần còn trong RAM.
+    """
+    if hasattr(value, "approx_bytes"):
+        return value.approx_bytes()
+    if isinstance(value, dict):
+        size = len(value) if not isinstance(value, SpilledNestedCounts) else dict.__len__(value)
+        total = sys.getsizeof(value)
+        if size:
+            sample = list(itertools.islice(dict.items(value), SIZE_SAMPLE_LIMIT))
+            sample_bytes = sum(sys.getsizeof(key) + _entry_bytes(inner) + ENTRY_OVERHEAD_BYTES for key, inner in sample)
+            total += sample_bytes * size // len(sample)
+        return total
+    if isinstance(value, (set, frozenset, list, tuple)):
+        total = sys.getsizeof(value)
+        if value:
+            sample = list(itertools.islice(value, SIZE_SAMPLE_LIMIT))
+            total += sum(_entry_bytes(item) for item in sample) * len(value) // len(sample)
+        return total
+    return sys.getsizeof(value)
+
+
+def measure_scan_data(scan_data: Dict[str, Any]) -> Dict[str, int]:
+    """Bộ nhớ ước lượng (byte) theo từng key của scan_data."""
+    sizes: Dict[str, int] = {}
+    for key, value in list(scan_data.items()):
+        if key in UNMEASURED_KEYS or value is None: continue
+        try: sizes[key] = estimate_bytes(value)
+        except Exception as size_err: log.debug(f"Không ước lượng được bộ nhớ của '{key}': {size_err}")
+    return sizes
+
+
+# --- Kho SQLite tạm ---
+class SpillStore:
+    """
+    File SQLite tạm của một lần quét: mỗi key đổ xuống là một bảng (outer_key, inner_key, count).
+    inner_key không khai báo kiểu nên giữ nguyên int/str (ID kênh, giờ, keyword, emoji unicode...).
+    Dùng chung giữa lệnh quét và task gửi DM nền -> đếm số người dùng, người cuối cùng đóng thì xóa file.
+    """
+
+    def __init__(self, path: str, seed_path: Optional[str] = None):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path): os.remove(path)
+        if seed_path: shutil.copyfile(seed_path, path) # Resume: tiếp tục từ bản chụp trong checkpoint
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        _open_spill_paths.add(path)
+        self._conn.execute("PRAGMA journal_mode=OFF") # File tạm: mất khi crash cũng không sao (đã có checkpoint riêng)
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._tables = {row[0] for row in self._conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        self._users = 1
+        # Lần đổ đang ghi dở (xen kẽ với quét) theo bảng: [danh sách (outer, {inner: số}), vị trí outer chưa ghi]
+        self._pending: Dict[str, List[Any]] = {}
+        # Giữ khi chụp checkpoint (thread đang đọc file): add_nested_async chờ ở đây thay vì ghi chen vào
+        self.write_lock = asyncio.Lock()
+        self.spilled_rows = 0
+
+    def _ensure_table(self, table: str):
+        if table in self._tables: return
+        _create_table(self._conn, table)
+        self._tables.add(table)
+
+    def _write_rows(self, table: str, rows: List[Tuple[int, Any, int]]):
+        _upsert_rows(self._conn, table, rows)
+        self.spilled_rows += len(rows)
+
+    @staticmethod
+    def _iter_rows(nested_items: Iterable[Tuple[int, Dict[Any, int]]]) -> Iterator[Tuple[int, Any, int]]:
+        for outer_key, inner in nested_items:
+            for inner_key, count in inner.items():
+                if count: yield outer_key, inner_key, count
+
+    def add_nested(self, table: str, nested_items: Iterable[Tuple[int, Dict[Any, int]]]) -> int:
+        """Cộng dồn {outer: {inner: số}} vào bảng (đồng bộ). Trả về số dòng đã ghi."""
+        self._ensure_table(table)
+        written = 0
+        rows_iter = self._iter_rows(nested_items)
+        while True:
+            rows = list(itertools.islice(rows_iter, SPILL_CHUNK_ROWS))
+            if not rows: return written
+            self._write_rows(table, rows)
+            written += len(rows)
+
+    async def add_nested_async(self, table: str, nested_items: Iterable[Tuple[int, Dict[Any, int]]]) -> int:
+        """
+        Như add_nested nhưng nhường event loop sau mỗi ~SPILL_CHUNK_ROWS dòng (dùng khi đang quét).
+        Dữ liệu nguồn không còn ai ghi vào; phần chưa ghi (theo vị trí outer) nằm trong _pending để
+        drain_pending ghi nốt hoặc pending_items đưa vào bản chụp checkpoint.
+        """
+        self._ensure_table(table)
+        written = 0
+        pending = [list(nested_items), 0]
+        items = pending[0]
+        self._pending[table] = pending
+        try:
+            while pending[1] < len(items):
+                async with self.write_lock:
+                    if self._pending.get(table) is not pending: break # drain_pending đã ghi nốt
+                    start = end = pending[1]
+                    row_count = 0
+                    while end < len(items) and row_count < SPILL_CHUNK_ROWS:
+                        row_count += len(items[end][1])
+                        end += 1
+                    rows = list(self._iter_rows(items[start:end]))
+                    if rows: self._write_rows(table, rows)
+                    pending[1] = end
+                    written += len(rows)
+                await asyncio.sleep(0)
+            return written
+        finally:
+            if self._pending.get(table) is pending: del self._pending[table]
+
+    def drain_pending(self, table: Optional[str] = None):
+        """Ghi nốt (đồng bộ) lần đổ đang dở của một bảng hoặc mọi bảng."""
+        for pending_table in ([table] if table else list(self._pending)):
+            pending = self._pending.pop(pending_table, None)
+            if pending is None: continue
+            items, position = pending
+            self.add_nested(pending_table, items[position:])
+
+    def pending_items(self) -> List[Tuple[str, List[Tuple[int, Dict[Any, int]]]]]:
+        """Phần chưa ghi của các lần đổ đang dở (dữ liệu nguồn không còn bị ghi nên đọc từ thread được)."""
+        return [(table, items[position:]) for table, (items, position) in self._pending.items() if position < len(items)]
+
+    def load(self, table: str, outer_key: int) -> List[Tuple[Any, int]]:
+        if table not in self._tables: return []
+        return self._conn.execute(f'SELECT inner_key, count FROM "{table}" WHERE outer_key = ?', (outer_key,)).fetchall()
+
+    def has(self, table: str, outer_key: int) -> bool:
+        if table not in self._tables: return False
+        return self._conn.execute(f'SELECT 1 FROM "{table}" WHERE outer_key = ? LIMIT 1', (outer_key,)).fetchone() is not None
+
+    def outer_keys(self, table: str) -> Iterator[int]:
+        if table not in self._tables: return iter(())
+        return (row[0] for row in self._conn.execute(f'SELECT DISTINCT outer_key FROM "{table}" ORDER BY outer_key'))
+
+    def count_outer(self, table: str) -> int:
+        if table not in self._tables: return 0
+        return self._conn.execute(f'SELECT COUNT(DISTINCT outer_key) FROM "{table}"').fetchone()[0]
+
+    def iter_grouped(self, table: str) -> Iterator[Tuple[int, List[Tuple[Any, int]]]]:
+        """Duyệt theo outer_key (thứ tự khóa chính nên chỉ giữ trong RAM các dòng của một outer_key)."""
+        if table not in self._tables: return
+        cursor = self._conn.execute(f'SELECT outer_key, inner_key, count FROM "{table}" ORDER BY outer_key, inner_key')
+        for outer_key, group in itertools.groupby(cursor, key=lambda row: row[0]):
+            yield outer_key, [(inner_key, count) for _, inner_key, count in group]
+
+    def write_snapshot(self, path: str, deltas: List[Tuple[str, List[Tuple[int, Dict[Any, int]]]]]):
+        """
+        Chụp file rồi cộng `deltas` (phần còn trong RAM / chưa ghi, đã copy trên event loop) vào bản chụp.
+        Chạy trong thread bằng kết nối riêng (sqlite3 không dùng chung kết nối giữa các thread), gọi khi giữ
+        write_lock để file không đổi trong lúc chụp; file đang quét không bị ghi thêm nên phần trong RAM vẫn ở RAM.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        source = sqlite3.connect(self.path)
+        target = sqlite3.connect(tmp_path, isolation_level=None)
+        try:
+            source.backup(target)
+            target.execute("PRAGMA journal_mode=OFF")
+            target.execute("PRAGMA synchronous=OFF")
+            for table, nested_items in deltas:
+                _create_table(target, table)
+                rows_iter = self._iter_rows(nested_items)
+                while True:
+                    rows = list(itertools.islice(rows_iter, SPILL_CHUNK_ROWS))
+                    if not rows: break
+                    _upsert_rows(target, table, rows)
+        finally:
+            source.close()
+            target.close()
+        os.replace(tmp_path, path)
+
+    def acquire(self):
+        self._users += 1
+
+    def release(self):
+        self._users -= 1
+        if self._users > 0: return
+        _open_spill_paths.discard(self.path)
+        try:
+            self._conn.close()
+            os.remove(self.path)
+            log.info(f"Đã xóa file dữ liệu tạm '{self.path}' ({self.spilled_rows:,} dòng đã đổ xuống).")
+        except Exception as close_err:
+            log.warning(f"Lỗi dọn file dữ liệu tạm '{self.path}': {close_err}")
+
+
+def _create_table(conn: sqlite3.Connection, table: str):
+    conn.execute(
+        f'CREATE TABLE IF NOT EXISTS "{table}" (outer_key INTEGER NOT NULL, inner_key NOT NULL, count INTEGER NOT NULL, '
+        f'PRIMARY KEY (outer_key, inner_key)) WITHOUT ROWID'
+    )
+
+
+def _upsert_rows(conn: sqlite3.Connection, table: str, rows: List[Tuple[int, Any, int]]):
+    conn.execute("BEGIN")
+    conn.executemany(
+        f'INSERT INTO "{table}" (outer_key, inner_key, count) VALUES (?, ?, ?) '
+        f'ON CONFLICT (outer_key, inner_key) DO UPDATE SET count = count + excluded.count',
+        rows
+    )
+    conn.execute("COMMIT")
+
+
+class SpillReference:
+    """Thay cho bảng đã đổ xuống đĩa trong checkpoint (dữ liệu nằm ở file SQLite chụp kèm checkpoint)."""
+
+    def __init__(self, table: str):
+        self.table = table
+
+
+class SpilledNestedCounts(defaultdict):
+    """
+    {outer: {inner: số}} có phần đã đổ xuống SpillStore. Ghi (`d[user][kênh] += n`) đi vào phần trong RAM như defaultdict;
+    đọc qua get/items/keys/values/len/iter sẽ đổ nốt phần trong RAM xuống rồi đọc từ SQLite (gộp đủ cả hai).
+    `in` xét cả hai phía mà không đổ, để việc gộp kết quả worker trong lúc quét vẫn rẻ.
+    """
+
+    def __init__(self, store: SpillStore, table: str, default_factory):
+        super().__init__(default_factory)
+        self.store = store
+        self.table = table
+
+    def flush(self):
+        self.store.drain_pending(self.table)
+        if dict.__len__(self):
+            self.store.add_nested(self.table, list(dict.items(self)))
+            dict.clear(self)
+
+    def _build(self, rows: List[Tuple[Any, int]]):
+        inner = self.default_factory()
+        for inner_key, count in rows:
+            inner[inner_key] = count
+        return inner
+
+    def get(self, key, default=None):
+        self.flush()
+        rows = self.store.load(self.table, key)
+        return self._build(rows) if rows else default
+
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self, key) or self.store.has(self.table, key)
+
+    def __iter__(self):
+        self.flush()
+        return self.store.outer_keys(self.table)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        self.flush()
+        for outer_key, rows in self.store.iter_grouped(self.table):
+            yield outer_key, self._build(rows)
+
+    def values(self):
+        for _, inner in self.items():
+            yield inner
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.store.count_outer(self.table)
+
+    def __repr__(self) -> str:
+        return f"<SpilledNestedCounts {self.table} ({dict.__len__(self)} key trong RAM, file {self.store.path})>"
+
+
+# --- Đổ dữ liệu xuống đĩa ---
+def get_spill_store(scan_data: Dict[str, Any], seed_path: Optional[str] = None) -> SpillStore:
+    store: Optional[SpillStore] = scan_data.get("spill_store")
+    if store is None:
+        guild_id = scan_data["server"].id
+        # Dọn file còn sót từ lần quét crash trước của guild (trừ file đang được dùng)
+        for stale_path in glob.glob(os.path.join(config.SCAN_SPILL_DIR, f"scan_{guild_id}_*.sqlite")):
+            if stale_path in _open_spill_paths: continue
+            try: os.remove(stale_path)
+            except OSError as rm_err: log.warning(f"Không thể xóa file dữ liệu tạm cũ '{stale_path}': {rm_err}")
+        path = os.path.join(config.SCAN_SPILL_DIR, f"scan_{guild_id}_{scan_data.get('scan_id') or os.getpid()}.sqlite")
+        store = SpillStore(path, seed_path=seed_path)
+        scan_data["spill_store"] = store
+    return store
+
+
+async def spill_key(scan_data: Dict[str, Any], key: str) -> int:
+    """
+    Đổ một bảng theo user xuống SQLite. Bảng cũ được thay ngay bằng SpilledNestedCounts rỗng (các lô sau ghi vào đó),
+    bảng cũ không còn ai ghi nên có thể ghi xuống từng phần xen kẽ với việc quét.
+    """
+    current = scan_data.get(key)
+    if not isinstance(current, defaultdict) or not dict.__len__(current):
+        return 0
+    store = get_spill_store(scan_data)
+    scan_data[key] = SpilledNestedCounts(store, key, current.default_factory)
+    written = await store.add_nested_async(key, dict.items(current))
+    metrics.SCAN_SPILLED_ROWS.inc(written, guild_id=scan_data["server"].id, key=key)
+    return written
+
+
+def spilled_deltas(scan_data: Dict[str, Any]) -> List[Tuple[str, List[Tuple[int, Dict[Any, int]]]]]:
+    """
+    Phần chưa nằm trong file SQLite của các bảng đã đổ (trong RAM + lần đổ đang dở), copy trên event loop
+    cùng lúc với phần còn lại của checkpoint để SpillStore.write_snapshot cộng vào bản chụp trong thread.
+    """
+    store: Optional[SpillStore] = scan_data.get("spill_store")
+    if store is None: return []
+    deltas = store.pending_items()
+    for key in SPILLABLE_KEYS:
+        value = scan_data.get(key)
+        if isinstance(value, SpilledNestedCounts) and dict.__len__(value):
+            deltas.append((value.table, [(outer_key, dict(inner)) for outer_key, inner in dict.items(value)]))
+    return deltas
+
+
+def restore_spilled_key(scan_data: Dict[str, Any], key: str, snapshot_path: str):
+    """Resume: gắn lại bảng đã đổ từ file SQLite chụp kèm checkpoint (bỏ dữ liệu đã nạp vào bảng trong RAM vì bản chụp đã gồm đủ)."""
+    current = scan_data.get(key)
+    default_factory = current.default_factory if isinstance(current, defaultdict) else dict
+    store = get_spill_store(scan_data, seed_path=snapshot_path)
+    scan_data[key] = SpilledNestedCounts(store, key, default_factory)
+
+
+def acquire_spill_store(scan_data: Dict[str, Any]):
+    """Task nền (gửi DM) còn đọc dữ liệu sau khi lệnh quét kết thúc -> giữ file tới khi task xong."""
+    store: Optional[SpillStore] = scan_data.get("spill_store")
+    if store: store.acquire()
+
+
+def release_spill_store(scan_data: Dict[str, Any]):
+    store: Optional[SpillStore] = scan_data.get("spill_store")
+    if store: store.release()
+
+
+# --- Theo dõi ngân sách bộ nhớ khi quét ---
+class ScanMemoryMonitor:
+    """
+    Đo định kỳ bộ nhớ ước lượng của từng key trong scan_data (metric + log), và nếu có ngân sách
+    (SCAN_MEMORY_BUDGET_MB) thì đổ các bảng theo user lớn nhất xuống SQLite khi tổng vượt ngân sách.
+    """
+
+    def __init__(self, scan_data: Dict[str, Any], budget_bytes: int, interval_seconds: float):
+        self.scan_data = scan_data
+        self.guild_id = scan_data["server"].id
+        self.budget_bytes = budget_bytes
+        self.interval_seconds = interval_seconds
+        self.peak_total_bytes = 0
+        self.peak_sizes: Dict[str, int] = {}
+        self.spill_count = 0
+        self._stop_event = asyncio.Event()
+
+    async def run(self):
+        while not self._stop_event.is_set():
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.check()
+            except Exception as check_err:
+                log.error(f"Lỗi kiểm tra bộ nhớ khi quét guild {self.guild_id}: {check_err}", exc_info=True)
+
+    async def check(self):
+        sizes = measure_scan_data(self.scan_data)
+        total = sum(sizes.values())
+        for key, size in sizes.items():
+            metrics.SCAN_AGGREGATE_BYTES.set(size, guild_id=self.guild_id, key=key)
+        if total > self.peak_total_bytes:
+            self.peak_total_bytes = total
+            self.peak_sizes = sizes
+        if not self.budget_bytes or total <= self.budget_bytes:
+            return
+
+        target_bytes = int(self.budget_bytes * SPILL_TARGET_RATIO)
+        candidates = sorted(
+            ((sizes[key], key) for key in SPILLABLE_KEYS if sizes.get(key, 0) >= SPILL_MIN_BYTES),
+            reverse=True
+        )
+        rss = current_rss_bytes()
+        log.warning(
+            f"Dữ liệu tổng hợp guild {self.guild_id} ~{total / 1024 / 1024:,.0f} MB vượt ngân sách {self.budget_bytes / 1024 / 1024:,.0f} MB"
+            + (f" (RSS {rss / 1024 / 1024:,.0f} MB)" if rss else "") + ", đổ bớt xuống đĩa."
+        )
+        for size, key in candidates:
+            if total <= target_bytes: break
+            start = time.monotonic()
+            written = await spill_key(self.scan_data, key)
+            total -= size
+            self.spill_count += 1
+            metrics.SCAN_AGGREGATE_BYTES.set(estimate_bytes(self.scan_data[key]), guild_id=self.guild_id, key=key)
+            log.info(f"Đã đổ '{key}' (~{size / 1024 / 1024:,.1f} MB, {written:,} dòng) xuống SQLite trong {time.monotonic() - start:.1f}s.")
+        if total > self.budget_bytes:
+            log.warning(f"Sau khi đổ vẫn còn ~{total / 1024 / 1024:,.0f} MB (phần còn lại không đổ được xuống đĩa).")
+
+    async def stop(self):
+        """Dừng sau khi lần đổ đang chạy (nếu có) ghi xong, để các bước sau đọc đủ dữ liệu."""
+        self._stop_event.set()
+
+    def log_summary(self):
+        if not self.peak_sizes: return
+        top = sorted(self.peak_sizes.items(), key=lambda item: item[1], reverse=True)[:5]
+        log.info(
+            f"Bộ nhớ dữ liệu tổng hợp cao nhất ~{self.peak_total_bytes / 1024 / 1024:,.1f} MB "
+            f"({', '.join(f'{key}: {size / 1024 / 1024:,.1f} MB' for key, size in top)}), đã đổ xuống đĩa {self.spill_count} lần."
+        )
+
+
+def start_scan_memory_monitor(scan_data: Dict[str, Any]) -> Tuple[ScanMemoryMonitor, asyncio.Task]:
+    monitor = ScanMemoryMonitor(scan_data, config.SCAN_MEMORY_BUDGET_MB * 1024 * 1024, config.SCAN_MEMORY_CHECK_SECONDS)
+    metrics.SCAN_AGGREGATE_BYTES.clear(guild_id=monitor.guild_id)
+    task = asyncio.create_task(monitor.run(), name=f"ScanMemoryMonitor-{monitor.guild_id}")
+    return monitor, task
+
+
+async def stop_scan_memory_monitor(monitor_and_task: Optional[Tuple[ScanMemoryMonitor, asyncio.Task]]):
+    if not monitor_and_task: return
+    monitor, task = monitor_and_task
+    await monitor.stop()
+    try: await task
+    except asyncio.CancelledError: pass
+    except Exception as e_task: log.warning(f"Task theo dõi bộ nhớ kết thúc với lỗi: {e_task}")
+    monitor.log_summary()
+
+# --- END OF FILE cogs/deep_scan_helpers/scan_memory.py ---
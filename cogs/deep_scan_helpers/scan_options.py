@@ -0,0 +1,73 @@
+# --- START OF FILE cogs/deep_scan_helpers/scan_options.py ---
+import logging
+import datetime
+from typing import Dict, Any, Optional, Tuple, Callable
+
+log = logging.getLogger(__name__)
+
+# Cờ dạng "--xxx" được tách ra từ phần keywords của lệnh quét
+SCAN_BOOLEAN_FLAGS: Dict[str, str] = {
+    "--resume": "resume",
+}
+
+
+def _parse_days(value: str) -> datetime.datetime:
+    """`--days N`: N ngày gần nhất tính cả hôm nay (bắt đầu từ 00:00 UTC)."""
+    days = int(value)
+    if days <= 0:
+        raise ValueError("số ngày phải > 0")
+    today = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - datetime.timedelta(days=days - 1)
+
+
+def _parse_since(value: str) -> datetime.datetime:
+    """`--since YYYY-MM-DD`: từ 00:00 UTC của ngày đó."""
+    day = datetime.date.fromisoformat(value)
+    return datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc)
+
+
+# Cờ có giá trị ("--xxx giá_trị" hoặc "--xxx=giá_trị") -> (tên option, hàm parse)
+# --days và --since cùng ghi vào "since" (thời điểm bắt đầu khoảng quét, luôn là đầu ngày UTC)
+SCAN_VALUE_FLAGS: Dict[str, Tuple[str, Callable[[str], Any]]] = {
+    "--days": ("since", _parse_days),
+    "--since": ("since", _parse_since),
+}
+
+
+def parse_scan_options(raw_keywords: Optional[str]) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    Tách các cờ tùy chọn (vd: `--resume`, `--days 30`, `--since 2024-01-01`) ra khỏi chuỗi keywords của lệnh quét.
+    Trả về (options, keywords còn lại hoặc None).
+    """
+    options: Dict[str, Any] = {}
+    if not raw_keywords:
+        return options, raw_keywords
+
+    remaining_tokens = []
+    tokens = raw_keywords.split()
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        index += 1
+        flag, _, inline_value = token.partition("=")
+        option_name = SCAN_BOOLEAN_FLAGS.get(token.lower())
+        value_flag = SCAN_VALUE_FLAGS.get(flag.lower())
+        if option_name:
+            options[option_name] = True
+        elif value_flag:
+            if not inline_value and index < len(tokens):
+                inline_value = tokens[index]; index += 1
+            option_name, parser = value_flag
+            try:
+                options[option_name] = parser(inline_value)
+            except ValueError as parse_err:
+                log.warning(f"Bỏ qua cờ quét '{flag}' với giá trị không hợp lệ '{inline_value}': {parse_err}")
+        elif token.startswith("--"):
+            log.warning(f"Bỏ qua cờ quét không hợp lệ: '{token}'")
+        else:
+            remaining_tokens.append(token)
+
+    remaining_keywords = " ".join(remaining_tokens).strip()
+    return options, remaining_keywords or None
+
+# --- END OF FILE cogs/deep_scan_helpers/scan_options.py ---
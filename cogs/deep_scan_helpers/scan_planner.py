@@ -0,0 +1,154 @@
+# --- START OF FILE cogs/deep_scan_helpers/scan_planner.py ---
+import discord
+import logging
+import time
+from typing import Dict, Any, List, Optional, Union
+
+import config
+import database
+from .user_stats import snowflake_to_ms
+
+log = logging.getLogger(__name__)
+
+DAY_MS = 86_400_000
+# Ước lượng thô khi chưa từng quét location: số tin / ngày hoạt động, giảm dần theo số ngày im lặng
+HEURISTIC_MESSAGES_PER_ACTIVE_DAY = 20
+HEURISTIC_IDLE_HALF_DAYS = 30
+
+ScanLocation = Union[discord.TextChannel, discord.VoiceChannel, discord.Thread]
+
+
+async def load_location_size_history(scan_data: Dict[str, Any]):
+    """Nạp số tin nhắn của từng kênh/luồng ở lần quét trước (để xếp lịch quét lớn trước)."""
+    scan_data["location_size_estimates"] = {}
+    scan_data["location_scan_stats"] = await database.get_location_scan_stats(scan_data["server"].id)
+    if scan_data["location_scan_stats"]:
+        log.info(f"Nạp kích thước lần quét trước của {len(scan_data['location_scan_stats'])} kênh/luồng để xếp lịch quét.")
+
+
+def _estimate_from_snowflakes(location: ScanLocation, now_ms: int) -> int:
+    """Đoán kích thước từ tuổi location và độ mới của last_message_id (khi chưa có số liệu cũ)."""
+    last_message_id = getattr(location, "last_message_id", None)
+    if not last_message_id:
+        return 0
+    last_message_ms = snowflake_to_ms(last_message_id)
+    active_days = max(last_message_ms - snowflake_to_ms(location.id), 0) / DAY_MS
+    idle_days = max(now_ms - last_message_ms, 0) / DAY_MS
+    return 1 + int(HEURISTIC_MESSAGES_PER_ACTIVE_DAY * active_days / (1 + idle_days / HEURISTIC_IDLE_HALF_DAYS))
+
+
+def estimate_location_size(scan_data: Dict[str, Any], location: ScanLocation) -> int:
+    """
+    Ước lượng số tin nhắn lần quét này phải đọc ở một location và ghi vào scan_data["location_size_estimates"].
+    Ưu tiên: số liệu lần quét trước > message_count của luồng > tuổi snowflake của last_message_id.
+    """
+    estimates: Dict[int, int] = scan_data.setdefault("location_size_estimates", {})
+    if location.id in estimates:
+        return estimates[location.id]
+
+    now_ms = int(time.time() * 1000)
+    previous = scan_data.get("location_scan_stats", {}).get(location.id)
+    previous_count: Optional[int] = previous.get("message_count") if previous else None
+    seed = scan_data.get("incremental_location_seeds", {}).get(location.id)
+    if seed:
+        previous_count = seed.get("message_count", previous_count)
+    checkpoint_id = scan_data.get("location_checkpoints", {}).get(location.id) if scan_data.get("incremental_mode") else None
+    window_after_id = scan_data.get("scan_since_message_id")
+    if window_after_id and window_after_id > max(checkpoint_id or 0, location.id):
+        # Quét theo khoảng thời gian: chỉ phần tin sau mốc, ước lượng như quét tăng dần từ mốc đó
+        checkpoint_id = window_after_id
+        if previous_count is None:
+            message_count = getattr(location, "message_count", None)
+            previous_count = message_count if isinstance(message_count, int) else _estimate_from_snowflakes(location, now_ms)
+
+    if location.id in scan_data.get("resumed_location_results", {}):
+        estimate = 0 # Đã quét xong trước khi crash
+    elif checkpoint_id:
+        # Quét tăng dần: chỉ phần tin mới, ước lượng theo tốc độ tin trung bình của location
+        last_message_id = getattr(location, "last_message_id", None)
+        if not last_message_id or last_message_id <= checkpoint_id:
+            estimate = 0
+        else:
+            checkpoint_ms = snowflake_to_ms(checkpoint_id)
+            lifetime_ms = max(checkpoint_ms - snowflake_to_ms(location.id), DAY_MS)
+            new_span_ms = snowflake_to_ms(last_message_id) - checkpoint_ms
+            estimate = 1 + int((previous_count or 0) * new_span_ms / lifetime_ms)
+    elif previous_count is not None:
+        estimate = previous_count
+    elif isinstance(getattr(location, "message_count", None), int):
+        estimate = location.message_count # Luồng có sẵn số tin (xấp xỉ) từ Discord
+    else:
+        estimate = _estimate_from_snowflakes(location, now_ms)
+
+    estimates[location.id] = estimate
+    scan_data["estimated_total_messages"] = scan_data.get("estimated_total_messages", 0) + estimate
+    return estimate
+
+
+def order_largest_first(scan_data: Dict[str, Any], locations: List[ScanLocation]) -> List[ScanLocation]:
+    """Sắp xếp location theo kích thước ước lượng giảm dần (location lớn bắt đầu trước)."""
+    return sorted(locations, key=lambda location: estimate_location_size(scan_data, location), reverse=True)
+
+
+def plan_history_ranges(scan_data: Dict[str, Any], location: ScanLocation, after_message_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Chia history của location lớn thành các khoảng snowflake ID liên tiếp (từ lúc tạo/checkpoint tới last_message_id)
+    để quét song song. Mỗi khoảng: {"after": ID loại trừ, "stop": ID chặn trên loại trừ (None = tới hết), "done": bool}.
+    Trả về [] nếu location không đủ lớn để chia.
+    """
+    min_messages = config.SCAN_RANGE_SPLIT_MIN_MESSAGES
+    if min_messages <= 0:
+        return []
+    last_message_id = getattr(location, "last_message_id", None)
+    start_after = after_message_id or location.id - 1
+    if not last_message_id or last_message_id <= start_after:
+        return []
+    parts = min(config.SCAN_RANGE_SPLIT_MAX_PARTS, estimate_location_size(scan_data, location) // min_messages)
+    step = (last_message_id - start_after) // parts if parts >= 2 else 0
+    if step <= 0:
+        return []
+    bounds = [start_after + step * i for i in range(parts)]
+    return [
+        {"after": bounds[i], "stop": bounds[i + 1] + 1 if i + 1 < parts else None, "done": False}
+        for i in range(parts)
+    ]
+
+
+def estimate_remaining_seconds(scan_data: Dict[str, Any], elapsed_seconds: float) -> Optional[float]:
+    """
+    ETA = số tin ước lượng còn lại của các location chưa xong / tốc độ đọc tin của lần quét này.
+    Trả về None khi chưa đủ dữ liệu (chưa có ước lượng hoặc chưa đọc được tin nào).
+    """
+    estimates: Dict[int, int] = scan_data.get("location_size_estimates", {})
+    scanned_this_run = scan_data.get("overall_total_message_count", 0) - scan_data.get("scan_start_message_count", 0)
+    if not estimates or scanned_this_run <= 0 or elapsed_seconds <= 0.1:
+        return None
+    completed = scan_data.get("completed_location_results", {})
+    active_progress = scan_data.get("active_location_progress", {})
+    remaining_messages = 0
+    for location_id, estimate in estimates.items():
+        if location_id in completed: continue
+        progress = active_progress.get(location_id)
+        scanned = progress["new_message_count"] if progress else 0
+        remaining_messages += max(estimate - scanned, 0)
+    return remaining_messages / (scanned_this_run / elapsed_seconds)
+
+
+async def save_location_size_history(scan_data: Dict[str, Any]):
+    """Lưu số tin nhắn của các kênh/luồng quét thành công để lần quét sau xếp lịch chính xác hơn."""
+    if scan_data.get("scan_since"):
+        return # Quét theo khoảng thời gian chỉ đếm một phần lịch sử, không dùng làm kích thước location
+    rows: List[Dict[str, Any]] = []
+    for channel_detail in scan_data.get("channel_details", []):
+        for detail in [channel_detail] + channel_detail.get("threads_data", []):
+            if not detail.get("processed") or detail.get("error"): continue
+            rows.append({
+                "location_id": detail["id"],
+                "parent_channel_id": detail.get("parent_channel_id"),
+                "message_count": detail.get("message_count", 0),
+                "scan_duration_seconds": detail.get("scan_duration_seconds", 0.0),
+            })
+    if rows and await database.save_location_scan_stats(scan_data["server"].id, rows):
+        log.info(f"Đã lưu kích thước {len(rows)} kênh/luồng cho lần xếp lịch quét sau.")
+
+# --- END OF FILE cogs/deep_scan_helpers/scan_planner.py ---
@@ -0,0 +1,208 @@
+# --- START OF FILE cogs/deep_scan_helpers/scan_profiler.py ---
+import discord
+from discord.ext import commands
+import logging
+import contextlib
+import os
+import time
+from typing import Dict, Any, List, Optional
+
+import database
+import rest_scheduler
+import utils
+
+try:
+    import resource # Không có trên Windows
+except ImportError:
+    resource = None
+
+log = logging.getLogger(__name__)
+
+PROFILE_VERSION = 1
+PROFILE_MAX_LOCATIONS = 25 # Chỉ lưu các kênh/luồng quét lâu nhất để JSONB không phình theo số kênh
+PROFILE_COMPARE_MAX_SCANS = 6 # Số lần quét tối đa so sánh trong một embed (giới hạn độ rộng bảng)
+PROFILE_TOP_LOCATIONS_SHOWN = 5
+
+
+def current_rss_bytes() -> Optional[int]:
+    """RSS hiện tại của process (Linux: /proc/self/statm), None nếu không đọc được."""
+    try:
+        with open("/proc/self/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """RSS cao nhất từ lúc process chạy (ru_maxrss tính bằng KB trên Linux)."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _to_mb(value: Optional[int]) -> Optional[float]:
+    return round(value / (1024 * 1024), 1) if value is not None else None
+
+
+class _Span:
+    """Mốc bắt đầu của một pha; `close()` trả về số liệu chênh lệch tới thời điểm đóng."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.rest_start = rest_scheduler.rest_scheduler.total_requests
+        self.rest_429_start = rest_scheduler.rest_scheduler.total_rate_limited
+        self.db_start = database.query_count
+
+    def close(self, failed: bool = False) -> Dict[str, Any]:
+        record = {
+            "name": self.name,
+            "wall_s": round(time.perf_counter() - self.wall_start, 3),
+            "cpu_s": round(time.process_time() - self.cpu_start, 3),
+            "rest_calls": rest_scheduler.rest_scheduler.total_requests - self.rest_start,
+            "rest_429": rest_scheduler.rest_scheduler.total_rate_limited - self.rest_429_start,
+            "db_queries": database.query_count - self.db_start if database.query_logging_enabled else None,
+            "rss_mb": _to_mb(current_rss_bytes()),
+            "peak_rss_mb": _to_mb(peak_rss_bytes()),
+        }
+        if failed: record["failed"] = True
+        return record
+
+
+class ScanProfiler:
+    """
+    Đo từng pha của lệnh quét: thời gian thực, CPU, số request REST (qua rest_scheduler), số query DB và bộ nhớ.
+    CPU/REST/DB là số liệu của cả process trong khoảng thời gian của pha (gồm cả guild khác quét cùng lúc).
+    Pha chính chạy tuần tự bằng `start_phase` (pha mới tự đóng pha trước); việc chạy nền dùng `with profiler.phase(...)`.
+    """
+
+    def __init__(self, scan_id: Optional[int]):
+        self.scan_id = scan_id
+        self.phases: List[Dict[str, Any]] = []
+        self._total = _Span("total")
+        self._current: Optional[_Span] = None
+        self._summary: Dict[str, Any] = {}
+
+    def start_phase(self, name: str):
+        self.end_phase()
+        self._current = _Span(name)
+
+    def end_phase(self, failed: bool = False):
+        if self._current is not None:
+            self.phases.append(self._current.close(failed))
+            self._current = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        span = _Span(name)
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.phases.append(span.close(failed))
+
+    def finish(self, scan_data: Dict[str, Any], failed: bool = False):
+        """Đóng pha đang chạy và chốt số liệu tổng + theo kênh/luồng (gọi một lần khi lệnh quét kết thúc)."""
+        self.end_phase(failed)
+        locations = []
+        for result in scan_data.get("completed_location_results", {}).values():
+            wall_s = result.get("scan_duration_seconds", 0.0)
+            new_messages = result.get("new_message_count", result.get("message_count", 0))
+            locations.append({
+                "id": result.get("id"), "name": result.get("name"),
+                "wall_s": round(wall_s, 3), "messages": new_messages,
+                "pages": result.get("page_count"),
+                "aggregate_cpu_s": round(result["aggregate_cpu_seconds"], 3) if result.get("aggregate_cpu_seconds") is not None else None,
+                "msg_per_s": round(new_messages / wall_s, 1) if wall_s > 0 else None,
+            })
+        locations.sort(key=lambda location: location["wall_s"], reverse=True)
+        self._summary = {
+            "total": self._total.close(failed),
+            "messages": scan_data.get("overall_total_message_count", 0),
+            "incremental": bool(scan_data.get("incremental_mode")),
+            "location_count": len(locations),
+            "locations": locations[:PROFILE_MAX_LOCATIONS],
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"version": PROFILE_VERSION, "phases": list(self.phases), **self._summary}
+
+    async def save(self):
+        if self.scan_id:
+            await database.save_scan_profile(self.scan_id, self.to_dict())
+
+
+# --- Lệnh so sánh profile ---
+def _format_seconds(value: Optional[float]) -> str:
+    if value is None: return "-"
+    if value >= 3600: return f"{value / 3600:.1f}h"
+    if value >= 60: return f"{value / 60:.1f}m"
+    return f"{value:.1f}s"
+
+
+def _format_count(value: Optional[float]) -> str:
+    if value is None: return "-"
+    if value >= 1_000_000: return f"{value / 1_000_000:.1f}M"
+    if value >= 10_000: return f"{value / 1000:.0f}k"
+    return f"{value:,.0f}"
+
+
+def _phase_table(profiles: List[Dict[str, Any]], labels: List[str], metric_key: str, formatter) -> str:
+    phase_names: List[str] = []
+    for profile in profiles:
+        for phase in profile.get("phases", []):
+            if phase["name"] not in phase_names: phase_names.append(phase["name"])
+    name_width = max([len(name) for name in phase_names + ["tổng"]])
+    lines = [" " * name_width + "".join(f"{label:>9}" for label in labels)]
+    for name in phase_names + ["tổng"]:
+        cells = []
+        for profile in profiles:
+            if name == "tổng":
+                value = (profile.get("total") or {}).get(metric_key)
+            else: # Một pha có thể chạy nhiều lần (vd: gửi DM) -> cộng dồn
+                values = [phase.get(metric_key) for phase in profile.get("phases", []) if phase["name"] == name]
+                value = sum(v for v in values if v is not None) if any(v is not None for v in values) else None
+            cells.append(f"{formatter(value):>9}")
+        lines.append(f"{name:<{name_width}}" + "".join(cells))
+    return "```\n" + "\n".join(lines) + "\n```"
+
+
+def build_profile_comparison_embed(bot: commands.Bot, guild: discord.Guild, scans: List[Dict[str, Any]]) -> discord.Embed:
+    """Embed so sánh profile của các lần quét (mới nhất trước): thời gian/CPU/REST/DB theo pha + kênh chậm nhất."""
+    e = lambda name: utils.get_emoji(name, bot)
+    scans = scans[:PROFILE_COMPARE_MAX_SCANS]
+    profiles = [scan["profile"] for scan in scans]
+    labels = [f"#{scan['scan_id']}" for scan in scans]
+    embed = discord.Embed(title=f"{e('stats')} Profile {len(scans)} lần quét gần nhất - {guild.name}", color=discord.Color.blue())
+    summary_lines = []
+    for scan, profile in zip(scans, profiles):
+        total = profile.get("total") or {}
+        wall_s = total.get("wall_s") or 0
+        rate = f"{profile.get('messages', 0) / wall_s:,.1f} msg/s" if wall_s else "-"
+        summary_lines.append(
+            f"**#{scan['scan_id']}** ({scan['status']}, {discord.utils.format_dt(scan['start_time'], 'R')}): "
+            f"{_format_count(profile.get('messages'))} tin{' (tăng dần)' if profile.get('incremental') else ''}, "
+            f"{profile.get('location_count', 0)} kênh/luồng, {rate}, RSS max {total.get('peak_rss_mb') or '-'} MB"
+        )
+    embed.description = "\n".join(summary_lines)
+    embed.add_field(name="Thời gian thực theo pha", value=_phase_table(profiles, labels, "wall_s", _format_seconds), inline=False)
+    embed.add_field(name="CPU theo pha (cả process)", value=_phase_table(profiles, labels, "cpu_s", _format_seconds), inline=False)
+    embed.add_field(name="Request REST theo pha", value=_phase_table(profiles, labels, "rest_calls", _format_count), inline=False)
+    embed.add_field(name="Query DB theo pha", value=_phase_table(profiles, labels, "db_queries", _format_count), inline=False)
+    slowest_lines = [
+        f"`{location['name']}`: {_format_seconds(location['wall_s'])}, {_format_count(location['messages'])} tin"
+        + (f", {location['pages']} trang" if location.get("pages") is not None else "")
+        + (f", CPU tổng hợp {location['aggregate_cpu_s']:.2f}s" if location.get("aggregate_cpu_s") is not None else "")
+        for location in profiles[0].get("locations", [])[:PROFILE_TOP_LOCATIONS_SHOWN]
+    ]
+    embed.add_field(
+        name=f"Kênh/Luồng quét lâu nhất (#{scans[0]['scan_id']})",
+        value="\n".join(slowest_lines) if slowest_lines else "Không có dữ liệu.",
+        inline=False
+    )
+    embed.set_footer(text="CPU/REST/DB là số liệu cả process trong thời gian của pha.")
+    return embed
+
+# --- END OF FILE cogs/deep_scan_helpers/scan_profiler.py ---
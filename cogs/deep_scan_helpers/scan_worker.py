@@ -0,0 +1,197 @@
+# --- START OF FILE cogs/deep_scan_helpers/scan_worker.py ---
+import discord
+from discord.ext import commands
+import logging
+import asyncio
+import os
+import socket
+import time
+from typing import Dict, Any, List, Optional
+from collections import Counter, defaultdict
+
+import config
+import database
+import rest_scheduler
+from .user_stats import UserStatsStore
+from .activity_grid import ActivityGrid
+from .keyword_matcher import KeywordMatcher
+from .reaction_fetcher import start_reaction_fetcher
+from .scan_concurrency import AdaptiveScanLimiter
+from .scan_channels import _scan_location_with_permit
+from .scan_jobs import SCAN_JOB_MAX_ATTEMPTS, decode_job_spec, serialize_job_result
+from .activity_rollups import set_scan_window
+from .message_index import MessageIndexBuffer
+
+log = logging.getLogger(__name__)
+
+
+class DiscordLocationSource:
+    """Lấy guild/kênh/luồng của job từ cache gateway của bot (luồng đã lưu trữ thì fetch qua REST)."""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    async def wait_until_ready(self):
+        await self.bot.wait_until_ready()
+
+    def guild_ids(self) -> List[int]:
+        return [guild.id for guild in self.bot.guilds]
+
+    async def get_guild(self, guild_id: int) -> Optional[discord.Guild]:
+        return self.bot.get_guild(guild_id)
+
+    async def get_location(self, guild: discord.Guild, location_id: int):
+        location = guild.get_channel_or_thread(location_id)
+        if location is None:
+            async with rest_scheduler.slot(rest_scheduler.ROUTE_THREADS):
+                location = await guild.fetch_channel(location_id)
+        return location
+
+
+def _build_job_scan_data(
+    bot: Optional[commands.Bot],
+    guild: discord.Guild,
+    job: Dict[str, Any],
+    spec: Dict[str, Any],
+    limiter: AdaptiveScanLimiter,
+    range_limiter: Optional[AdaptiveScanLimiter] = None
+) -> Dict[str, Any]:
+    """scan_data riêng cho một job: chỉ các bộ đếm mà việc quét history ghi vào (sẽ được gửi về coordinator)."""
+    location_id = job["location_id"]
+    keywords = spec.get("keywords") or []
+    guild_emojis = {emoji.id: emoji for emoji in getattr(guild, "emojis", ())}
+    job_scan_data: Dict[str, Any] = {
+        "server": guild, "bot": bot, "scan_id": job["scan_id"], "scan_errors": [],
+        "user_stats": UserStatsStore(),
+        "overall_total_message_count": 0, "overall_total_reaction_count": 0,
+        "overall_total_filtered_reaction_count": 0,
+        "keyword_counts": Counter(), "channel_keyword_counts": defaultdict(Counter),
+        "thread_keyword_counts": defaultdict(Counter), "user_keyword_counts": defaultdict(Counter),
+        "reaction_emoji_counts": Counter(), "filtered_reaction_emoji_counts": Counter(),
+        "sticker_usage_counts": Counter(), "overall_custom_sticker_counts": Counter(),
+        "user_custom_emoji_content_counts": defaultdict(Counter),
+        "overall_custom_emoji_content_counts": Counter(),
+        "user_reaction_emoji_given_counts": defaultdict(Counter),
+        "user_channel_message_counts": defaultdict(lambda: defaultdict(int)),
+        "user_sticker_id_counts": defaultdict(Counter),
+        "server_hourly_activity": ActivityGrid(),
+        "channel_hourly_activity": ActivityGrid(),
+        "thread_hourly_activity": ActivityGrid(),
+        "user_hourly_activity": ActivityGrid(),
+        "user_emoji_received_counts": defaultdict(Counter),
+        "daily_user_location_counts": Counter(), "daily_location_hourly_counts": Counter(),
+        # Chỉ cần biết ID có thuộc server không (emoji có thể chưa có trong cache gateway của worker)
+        "server_emojis_cache": {emoji_id: guild_emojis.get(emoji_id) for emoji_id in spec.get("server_emoji_ids", ())},
+        "server_sticker_ids_cache": set(spec.get("server_sticker_ids", ())),
+        "keyword_matcher": KeywordMatcher(keywords, spec.get("match_mode", config.KEYWORD_MATCH_MODE)) if keywords else None,
+        "can_scan_reactions": spec.get("can_scan_reactions", False),
+        "scan_limiter": limiter, "range_limiter": range_limiter,
+        "location_scan_stats": {}, "location_size_estimates": {location_id: spec.get("estimate", 0)},
+        "active_location_progress": {}, "completed_location_results": {},
+        "resume_location_cursors": {location_id: spec["resume_cursor"]} if spec.get("resume_cursor") else {},
+        "incremental_mode": bool(spec.get("incremental_after")),
+        "location_checkpoints": {location_id: spec["incremental_after"]} if spec.get("incremental_after") else {},
+        "incremental_location_seeds": {location_id: spec["seed"]} if spec.get("seed") else {},
+        "rollup_after_ids": {location_id: spec["rollup_after"]} if spec.get("rollup_after") else {},
+        "message_index": MessageIndexBuffer() if spec.get("index_after") else None,
+        "message_index_after_id": spec.get("index_after"),
+    }
+    set_scan_window(job_scan_data, spec.get("scan_since"))
+    return job_scan_data
+
+
+class ScanWorker:
+    """
+    Nhận job quét kênh/luồng từ bảng scan_jobs (SKIP LOCKED, nhiều process không nhận trùng),
+    quét bằng đúng code quét của coordinator rồi ghi kết quả từng phần (JSON, xem job_codec) về DB.
+    location_source mặc định lấy kênh từ bot; bản giả (vd: benchmark) chỉ cần cùng các method.
+    """
+
+    def __init__(self, bot: Optional[commands.Bot], location_source=None, concurrency: Optional[int] = None, worker_id: Optional[str] = None):
+        self.bot = bot
+        self.location_source = location_source or DiscordLocationSource(bot)
+        self.concurrency = concurrency or config.SCAN_WORKER_CONCURRENCY
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        # Permit cho job (mỗi vòng nhận job giữ tối đa 1) và ngân sách riêng cho khoảng snowflake phụ của kênh lớn:
+        # khoảng phụ không lấy permit của job, nên job bị chia không phải tranh permit với chính các job đang chạy
+        self.limiter = AdaptiveScanLimiter(self.concurrency, 1, self.concurrency)
+        self.range_limiter = AdaptiveScanLimiter(self.concurrency, 1, self.concurrency)
+        self._running_jobs: Dict[int, int] = {} # job_id -> location_id
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+        self.message_count = 0
+
+    async def run(self, stop_when_idle: bool = False):
+        """Vòng nhận job. stop_when_idle=True: dừng khi hàng đợi trống và không còn job đang chạy."""
+        await self.location_source.wait_until_ready()
+        log.info(f"Scan worker '{self.worker_id}' bắt đầu nhận job ({self.concurrency} job đồng thời).")
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop(), name=f"ScanWorkerHeartbeat-{self.worker_id}")
+        try:
+            await asyncio.gather(*(self._job_loop(stop_when_idle) for _ in range(self.concurrency)))
+        finally:
+            heartbeat_task.cancel()
+            await asyncio.gather(heartbeat_task, return_exceptions=True)
+            log.info(f"Scan worker '{self.worker_id}' dừng: {self.completed_jobs} job xong, {self.failed_jobs} lỗi, {self.message_count:,} tin.")
+
+    async def _job_loop(self, stop_when_idle: bool):
+        while True:
+            job = await database.claim_scan_job(self.worker_id, self.location_source.guild_ids())
+            if job is None:
+                if stop_when_idle and not self._running_jobs:
+                    return
+                await asyncio.sleep(config.SCAN_JOB_POLL_SECONDS)
+                continue
+            await self._run_job(job)
+
+    async def _heartbeat_loop(self):
+        interval_seconds = max(1.0, config.SCAN_JOB_STALE_SECONDS / 3)
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await database.heartbeat_scan_jobs(self.worker_id, list(self._running_jobs))
+
+    async def _run_job(self, job: Dict[str, Any]):
+        job_id = job["job_id"]
+        self._running_jobs[job_id] = job["location_id"]
+        start = time.monotonic()
+        reaction_fetcher = None
+        try:
+            spec = decode_job_spec(job["spec"])
+            guild = await self.location_source.get_guild(job["guild_id"])
+            if guild is None:
+                raise LookupError(f"worker không thấy guild {job['guild_id']}")
+            location = await self.location_source.get_location(guild, job["location_id"])
+            job_scan_data = _build_job_scan_data(self.bot, guild, job, spec, self.limiter, self.range_limiter)
+            reaction_fetcher = start_reaction_fetcher(job_scan_data)
+            result = await _scan_location_with_permit(job_scan_data, location)
+            if reaction_fetcher:
+                await reaction_fetcher.close()
+                reaction_fetcher = None
+            payload = serialize_job_result(job_scan_data, result)
+            if await database.complete_scan_job(job_id, self.worker_id, payload):
+                self.completed_jobs += 1
+                self.message_count += job_scan_data["overall_total_message_count"]
+                log.info(
+                    f"Scan worker '{self.worker_id}': xong job {job_id} ({job['kind']} {job['location_id']}), "
+                    f"{job_scan_data['overall_total_message_count']:,} tin trong {time.monotonic() - start:.1f}s "
+                    f"(kết quả {len(payload) / 1024:.0f} KB)."
+                )
+            else:
+                log.warning(f"Scan worker '{self.worker_id}': job {job_id} không còn thuộc worker này (đã bị trả lại/xóa), bỏ kết quả.")
+        except Exception as job_err:
+            self.failed_jobs += 1
+            log.error(f"Scan worker '{self.worker_id}': lỗi job {job_id} (location {job['location_id']}, lần {job['attempts']}): {job_err}", exc_info=True)
+            await database.fail_scan_job(job_id, self.worker_id, f"{type(job_err).__name__}: {job_err}", SCAN_JOB_MAX_ATTEMPTS)
+        finally:
+            if reaction_fetcher:
+                await reaction_fetcher.abort()
+            self._running_jobs.pop(job_id, None)
+
+
+def start_scan_worker(bot: commands.Bot) -> Optional[asyncio.Task]:
+    """Chạy nền vòng nhận job quét phân tán nếu process này bật SCAN_WORKER_ENABLED."""
+    if not config.SCAN_WORKER_ENABLED:
+        return None
+    worker = ScanWorker(bot)
+    return asyncio.create_task(worker.run(), name=f"ScanWorker-{worker.worker_id}")
+
+# --- END OF FILE cogs/deep_scan_helpers/scan_worker.py ---
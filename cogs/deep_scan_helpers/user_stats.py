@@ -0,0 +1,221 @@
+# --- START OF FILE cogs/deep_scan_helpers/user_stats.py ---
+import logging
+import datetime
+import itertools
+import sys
+from array import array
+from typing import Dict, Any, Optional, Set, Iterator
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+DISCORD_EPOCH_MS = 1420070400000
+
+# Các chỉ số đếm theo user (trùng tên cột trong bảng user_activity_aggregates)
+USER_STAT_COLUMNS = (
+    "message_count", "link_count", "image_count", "other_file_count", "emoji_count",
+    "sticker_count", "mention_given_count", "mention_received_count", "reply_count",
+    "reaction_received_count", "reaction_given_count", "custom_emoji_content_count",
+)
+
+# Các chỉ số chỉ được phân tích cho tin nhắn của user thật (không phải bot).
+# Bản cũ luôn ghi key cho mọi tác giả không phải bot (kể cả giá trị 0) -> view giữ nguyên hành vi đó.
+HUMAN_AUTHOR_COLUMNS = frozenset({
+    "link_count", "image_count", "other_file_count", "emoji_count",
+    "sticker_count", "custom_emoji_content_count",
+})
+
+# Key Counter trong scan_data (dùng bởi báo cáo/xuất file/DB) -> cột trong UserStatsStore
+COUNTER_VIEW_COLUMNS: Dict[str, str] = {
+    "user_activity_message_counts": "message_count",
+    "user_link_counts": "link_count",
+    "user_image_counts": "image_count",
+    "user_other_file_counts": "other_file_count",
+    "user_emoji_counts": "emoji_count",
+    "user_sticker_counts": "sticker_count",
+    "user_mention_given_counts": "mention_given_count",
+    "user_mention_received_counts": "mention_received_count",
+    "user_reply_counts": "reply_count",
+    "user_reaction_received_counts": "reaction_received_count",
+    "user_reaction_given_counts": "reaction_given_count",
+    "user_total_custom_emoji_content_counts": "custom_emoji_content_count",
+}
+
+
+def snowflake_to_ms(snowflake_id: int) -> int:
+    """Thời điểm tạo (ms UTC) của một Discord snowflake."""
+    return (snowflake_id >> 22) + DISCORD_EPOCH_MS
+
+
+def ms_to_snowflake(timestamp_ms: int) -> int:
+    """Snowflake nhỏ nhất tạo tại thời điểm timestamp_ms (dùng làm mốc after=/before= cho history)."""
+    return max(timestamp_ms - DISCORD_EPOCH_MS, 0) << 22
+
+
+def datetime_to_ms(value: Optional[datetime.datetime]) -> int:
+    if value is None: return 0
+    if value.tzinfo is None: value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def ms_to_datetime(value: int) -> Optional[datetime.datetime]:
+    if not value: return None
+    return datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+
+
+class UserStatsStore:
+    """
+    Bảng thống kê user dạng cột: mỗi user ID được gán một hàng (index liên tục),
+    mỗi chỉ số là một array('q'). Thay cho hàng chục Counter/dict song song theo user ID.
+    """
+
+    def __init__(self):
+        self._row_of: Dict[int, int] = {}
+        self.user_ids = array('q')
+        self.is_bot = array('b')
+        self.first_seen_ms = array('q') # 0 = chưa có
+        self.last_seen_ms = array('q')
+        for column in USER_STAT_COLUMNS:
+            setattr(self, column, array('q'))
+        self.distinct_mentions: Dict[int, Set[int]] = {} # row -> set user ID (thưa, chỉ user có mention)
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._row_of
+
+    def row(self, user_id: int) -> int:
+        """Lấy (hoặc tạo mới) hàng của user."""
+        row = self._row_of.get(user_id)
+        if row is None:
+            row = len(self.user_ids)
+            self._row_of[user_id] = row
+            self.user_ids.append(user_id)
+            self.is_bot.append(0)
+            self.first_seen_ms.append(0)
+            self.last_seen_ms.append(0)
+            for column in USER_STAT_COLUMNS:
+                getattr(self, column).append(0)
+        return row
+
+    def find_row(self, user_id: int) -> Optional[int]:
+        return self._row_of.get(user_id)
+
+    def touch_seen(self, row: int, timestamp_ms: int):
+        first = self.first_seen_ms[row]
+        if first == 0 or timestamp_ms < first: self.first_seen_ms[row] = timestamp_ms
+        if timestamp_ms > self.last_seen_ms[row]: self.last_seen_ms[row] = timestamp_ms
+
+    def merge(self, other: "UserStatsStore"):
+        """Cộng dồn bảng thống kê khác (vd: kết quả từng phần của worker quét phân tán) vào bảng này."""
+        for other_row in other.iter_rows():
+            row = self.row(other.user_ids[other_row])
+            if other.is_bot[other_row]: self.is_bot[row] = 1
+            if other.first_seen_ms[other_row]: self.touch_seen(row, other.first_seen_ms[other_row])
+            if other.last_seen_ms[other_row]: self.touch_seen(row, other.last_seen_ms[other_row])
+            for column in USER_STAT_COLUMNS:
+                getattr(self, column)[row] += getattr(other, column)[other_row]
+            mentions = other.distinct_mentions.get(other_row)
+            if mentions: self.distinct_mentions.setdefault(row, set()).update(mentions)
+
+    def copy(self) -> "UserStatsStore":
+        """Bản sao độc lập (copy từng array, nhanh) để checkpoint pickle trong thread khi vòng quét vẫn ghi tiếp."""
+        clone = UserStatsStore.__new__(UserStatsStore)
+        clone._row_of = self._row_of.copy()
+        for name in ("user_ids", "is_bot", "first_seen_ms", "last_seen_ms") + USER_STAT_COLUMNS:
+            setattr(clone, name, getattr(self, name)[:])
+        clone.distinct_mentions = {row: set(mentions) for row, mentions in self.distinct_mentions.items()}
+        return clone
+
+    def approx_bytes(self) -> int:
+        """Ước lượng bộ nhớ của bảng (cột array + dict hàng + set mention), dùng cho ngân sách bộ nhớ khi quét."""
+        total = sum(sys.getsizeof(getattr(self, column)) for column in USER_STAT_COLUMNS)
+        total += sys.getsizeof(self.user_ids) + sys.getsizeof(self.is_bot) + sys.getsizeof(self.first_seen_ms) + sys.getsizeof(self.last_seen_ms)
+        total += sys.getsizeof(self._row_of) + len(self._row_of) * 64 # int key/value của dict hàng
+        total += sys.getsizeof(self.distinct_mentions)
+        if self.distinct_mentions: # Lấy mẫu một phần set để không phải duyệt hết user mỗi lần đo
+            sample = list(itertools.islice(self.distinct_mentions.values(), 1000))
+            total += sum(sys.getsizeof(mentions) + len(mentions) * 32 for mentions in sample) * len(self.distinct_mentions) // len(sample)
+        return total
+
+    def is_human_author(self, row: int) -> bool:
+        return self.message_count[row] > 0 and not self.is_bot[row]
+
+    def has_own_activity(self, row: int) -> bool:
+        """User tự gửi tin hoặc thả reaction (hàng chỉ có lượt được nhắc tên thì không)."""
+        return self.message_count[row] > 0 or self.reaction_given_count[row] > 0
+
+    def iter_rows(self) -> Iterator[int]:
+        return iter(range(len(self.user_ids)))
+
+    def counter(self, column: str) -> Counter:
+        """Tạo view dạng Counter {user_id: giá trị} cho một cột."""
+        values = getattr(self, column)
+        user_ids = self.user_ids
+        if column in HUMAN_AUTHOR_COLUMNS:
+            return Counter({user_ids[row]: values[row] for row in self.iter_rows() if values[row] or self.is_human_author(row)})
+        return Counter({user_ids[row]: values[row] for row in self.iter_rows() if values[row]})
+
+    def user_activity_entry(self, row: int) -> Dict[str, Any]:
+        """Dict user_activity (cùng cấu trúc với bản cũ) cho một hàng."""
+        entry: Dict[str, Any] = {
+            'first_seen': ms_to_datetime(self.first_seen_ms[row]),
+            'last_seen': ms_to_datetime(self.last_seen_ms[row]),
+            'is_bot': bool(self.is_bot[row]),
+        }
+        for column in USER_STAT_COLUMNS:
+            if column == "custom_emoji_content_count": continue # Không nằm trong user_activity
+            entry[column] = getattr(self, column)[row]
+        entry['distinct_mentions_set'] = set(self.distinct_mentions.get(row, ()))
+        entry['channels_messaged_in'] = set()
+        first_ms, last_ms = self.first_seen_ms[row], self.last_seen_ms[row]
+        entry['activity_span_seconds'] = round((last_ms - first_ms) / 1000, 2) if first_ms and last_ms > first_ms else 0.0
+        return entry
+
+
+def materialize_user_views(scan_data: Dict[str, Any]):
+    """
+    Sinh các Counter view và user_activity từ UserStatsStore sau khi quét kênh xong,
+    để các bước sau (xếp hạng, embed, xuất file, lưu DB) dùng như trước.
+    """
+    stats: UserStatsStore = scan_data["user_stats"]
+    for counter_key, column in COUNTER_VIEW_COLUMNS.items():
+        scan_data[counter_key] = stats.counter(column)
+
+    # User chỉ được nhắc tên vẫn có hàng (để đếm mention_received) nhưng không vào user_activity:
+    # user_activity là danh sách user có hoạt động (báo cáo, xuất file, user_scan_results)
+    user_activity = scan_data["user_activity"]
+    user_activity.clear()
+    for row in stats.iter_rows():
+        if stats.has_own_activity(row):
+            user_activity[stats.user_ids[row]] = stats.user_activity_entry(row)
+    log.info(f"Đã tạo view thống kê cho {len(user_activity):,}/{len(stats):,} user từ bảng dạng cột (bỏ user chỉ được nhắc tên).")
+
+
+def finalize_user_metrics(scan_data: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Tính các chỉ số suy ra một lần khi kết thúc (vòng quét chỉ cộng dồn O(1) vào UserStatsStore):
+    view Counter/user_activity, kênh đã nhắn, số kênh khác nhau, kênh hoạt động nhiều nhất, activity span.
+    Trả về số user được tính cho từng chỉ số (để ghi log).
+    """
+    materialize_user_views(scan_data)
+    user_activity = scan_data["user_activity"]
+    user_channel_counts: Counter = scan_data.setdefault("user_distinct_channel_counts", Counter())
+    user_most_active_channel: Dict[int, Any] = scan_data.setdefault("user_most_active_channel", {})
+    calculated = {"distinct_channels": 0, "most_active": 0, "span": 0}
+
+    for user_id, location_counts in scan_data.get("user_channel_message_counts", {}).items():
+        if not location_counts: continue
+        most_active_location_id, most_active_count = max(location_counts.items(), key=lambda item: item[1])
+        user_most_active_channel[user_id] = (most_active_location_id, most_active_count); calculated["most_active"] += 1
+        entry = user_activity.get(user_id)
+        if entry is None: continue
+        channels_set = entry['channels_messaged_in']
+        channels_set.update(loc for loc, count in location_counts.items() if count > 0)
+        if channels_set: user_channel_counts[user_id] = len(channels_set); calculated["distinct_channels"] += 1
+
+    calculated["span"] = sum(1 for entry in user_activity.values() if entry['activity_span_seconds'] > 0)
+    return calculated
+
+# --- END OF FILE cogs/deep_scan_helpers/user_stats.py ---
@@ -0,0 +1,68 @@
+# --- START OF FILE cogs/live_ingest_cog.py ---
+import discord
+from discord.ext import commands
+import logging
+import asyncio
+from typing import Optional
+
+import config
+from .deep_scan_helpers.live_ingest import LiveIngestor
+
+log = logging.getLogger(__name__)
+
+
+class LiveIngest(commands.Cog):
+    """Cog ghi nhận trực tiếp tin nhắn/reaction từ gateway vào dữ liệu tổng hợp (write-behind theo lô)."""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.ingestor = LiveIngestor(bot)
+        self.flush_task: Optional[asyncio.Task] = None
+
+    async def cog_load(self):
+        self.flush_task = asyncio.create_task(self.ingestor.run(), name="live_ingest_flush")
+
+    async def cog_unload(self):
+        if self.flush_task:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+            self.flush_task = None
+        await self.ingestor.flush() # Ghi nốt dữ liệu đang chờ
+
+    # Lệnh quét gọi 2 hàm này qua bot.get_cog("LiveIngest")
+    async def pause_guild(self, guild_id: int):
+        await self.ingestor.pause_guild(guild_id)
+
+    async def resume_guild(self, guild_id: int, scan_state_saved: bool):
+        await self.ingestor.resume_guild(guild_id, scan_state_saved)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # READY (không phải RESUMED) = phiên gateway mới, sự kiện trong lúc mất kết nối không được gửi lại
+        self.ingestor.on_new_session()
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        self.ingestor.on_message(message)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        self.ingestor.on_reaction(payload, 1)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        self.ingestor.on_reaction(payload, -1)
+
+
+async def setup(bot: commands.Bot):
+    """Hàm setup để thêm Cog vào bot (chỉ khi bật LIVE_INGEST_ENABLED)."""
+    if not config.LIVE_INGEST_ENABLED:
+        log.info("Ghi nhận trực tiếp đang tắt (LIVE_INGEST_ENABLED=false), không tải Cog LiveIngest.")
+        return
+    if not config.ENABLE_INCREMENTAL_SCAN:
+        log.warning("LIVE_INGEST_ENABLED cần ENABLE_INCREMENTAL_SCAN=true (ghi nhận bắt đầu từ checkpoint quét tăng dần), không tải Cog LiveIngest.")
+        return
+    await bot.add_cog(LiveIngest(bot))
+    log.info("Cog LiveIngest đã được tải (ghi nhận trực tiếp tin nhắn/reaction).")
+
+# --- END OF FILE cogs/live_ingest_cog.py ---
@@ -0,0 +1,68 @@
+# --- START OF FILE cogs/message_reconcile_cog.py ---
+import discord
+from discord.ext import commands
+import logging
+import asyncio
+from typing import Optional
+
+import config
+from .deep_scan_helpers.message_index import message_index_enabled
+from .deep_scan_helpers.message_reconcile import MessageReconciler
+
+log = logging.getLogger(__name__)
+
+
+class MessageReconcile(commands.Cog):
+    """Cog trừ/sửa dữ liệu tổng hợp đã lưu khi tin nhắn bị xóa (kể cả xóa hàng loạt) hoặc sửa."""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.reconciler = MessageReconciler(bot)
+        self.reconcile_task: Optional[asyncio.Task] = None
+
+    async def cog_load(self):
+        self.reconcile_task = asyncio.create_task(self.reconciler.run(), name="message_reconcile")
+
+    async def cog_unload(self):
+        if self.reconcile_task:
+            self.reconcile_task.cancel()
+            await asyncio.gather(self.reconcile_task, return_exceptions=True)
+            self.reconcile_task = None
+        await self.reconciler.flush()
+
+    # Lệnh quét gọi 2 hàm này qua bot.get_cog("MessageReconcile")
+    async def pause_guild(self, guild_id: int):
+        await self.reconciler.pause_guild(guild_id)
+
+    def resume_guild(self, guild_id: int):
+        self.reconciler.resume_guild(guild_id)
+
+    def _discard_live_messages(self, guild_id: Optional[int], message_ids):
+        live_ingest = self.bot.get_cog("LiveIngest")
+        if live_ingest and guild_id is not None:
+            live_ingest.ingestor.discard_messages(guild_id, message_ids)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self._discard_live_messages(payload.guild_id, (payload.message_id,))
+        self.reconciler.on_delete(payload.guild_id, (payload.message_id,))
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        self._discard_live_messages(payload.guild_id, payload.message_ids)
+        self.reconciler.on_delete(payload.guild_id, payload.message_ids)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        self.reconciler.on_edit(payload.guild_id, payload.message_id, payload.data)
+
+
+async def setup(bot: commands.Bot):
+    """Hàm setup để thêm Cog vào bot (cần ENABLE_INCREMENTAL_SCAN và MESSAGE_INDEX_RETENTION_DAYS > 0)."""
+    if not message_index_enabled():
+        log.info("Đối soát tin bị xóa/sửa đang tắt (cần ENABLE_INCREMENTAL_SCAN=true và MESSAGE_INDEX_RETENTION_DAYS > 0).")
+        return
+    await bot.add_cog(MessageReconcile(bot))
+    log.info(f"Cog MessageReconcile đã được tải (đối soát tin bị xóa/sửa trong {config.MESSAGE_INDEX_RETENTION_DAYS} ngày gần nhất).")
+
+# --- END OF FILE cogs/message_reconcile_cog.py ---
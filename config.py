@@ -24,6 +24,53 @@ else:
 # Trong config.py, gần các hằng số khác
 MAX_CONCURRENT_CHANNEL_SCANS = int(os.getenv("MAX_CONCURRENT_CHANNEL_SCANS", "5"))
 log.info(f"Số kênh/luồng quét đồng thời tối đa: {MAX_CONCURRENT_CHANNEL_SCANS}")
+# Quét song song tự điều chỉnh: bắt đầu từ MAX_CONCURRENT_CHANNEL_SCANS, tăng tối đa SCAN_CONCURRENCY_MAX
+SCAN_CONCURRENCY_MAX = max(MAX_CONCURRENT_CHANNEL_SCANS, int(os.getenv("SCAN_CONCURRENCY_MAX", str(MAX_CONCURRENT_CHANNEL_SCANS * 3))))
+SCAN_CONCURRENCY_ADJUST_SECONDS = int(os.getenv("SCAN_CONCURRENCY_ADJUST_SECONDS", "15"))
+log.info(f"Quét song song tự điều chỉnh: tối đa {SCAN_CONCURRENCY_MAX}, mỗi {SCAN_CONCURRENCY_ADJUST_SECONDS}s" if SCAN_CONCURRENCY_ADJUST_SECONDS > 0 else "Quét song song tự điều chỉnh: Tắt")
+# Chia kênh lớn thành nhiều khoảng snowflake quét song song (0 = không chia)
+SCAN_RANGE_SPLIT_MIN_MESSAGES = int(os.getenv("SCAN_RANGE_SPLIT_MIN_MESSAGES", "50000"))
+SCAN_RANGE_SPLIT_MAX_PARTS = max(1, int(os.getenv("SCAN_RANGE_SPLIT_MAX_PARTS", "4")))
+log.info(f"Chia kênh lớn: mỗi ~{SCAN_RANGE_SPLIT_MIN_MESSAGES} tin một khoảng, tối đa {SCAN_RANGE_SPLIT_MAX_PARTS} khoảng" if SCAN_RANGE_SPLIT_MIN_MESSAGES > 0 else "Chia kênh lớn: Tắt")
+# Quét tăng dần: chỉ fetch tin nhắn mới hơn checkpoint đã lưu của từng kênh/luồng
+ENABLE_INCREMENTAL_SCAN = os.getenv("ENABLE_INCREMENTAL_SCAN", "False").lower() == "true"
+log.info(f"Quét tăng dần (incremental): {'Bật' if ENABLE_INCREMENTAL_SCAN else 'Tắt'}")
+# Rollup số tin theo ngày (kênh/user/giờ) lưu vào DB để báo cáo theo khoảng thời gian (--days/--since, lệnh activity) bằng SQL
+ENABLE_ACTIVITY_ROLLUPS = os.getenv("ENABLE_ACTIVITY_ROLLUPS", "True").lower() == "true"
+log.info(f"Rollup hoạt động theo ngày: {'Bật' if ENABLE_ACTIVITY_ROLLUPS else 'Tắt'}")
+# Ghi nhận trực tiếp on_message/reaction vào bảng tổng hợp (cần ENABLE_INCREMENTAL_SCAN), ghi theo lô mỗi LIVE_INGEST_FLUSH_SECONDS giây
+LIVE_INGEST_ENABLED = os.getenv("LIVE_INGEST_ENABLED", "False").lower() == "true"
+LIVE_INGEST_FLUSH_SECONDS = max(1, int(os.getenv("LIVE_INGEST_FLUSH_SECONDS", "5")))
+LIVE_INGEST_MAX_PENDING = int(os.getenv("LIVE_INGEST_MAX_PENDING", "100000"))
+log.info(f"Ghi nhận trực tiếp: ghi mỗi {LIVE_INGEST_FLUSH_SECONDS}s, tối đa {LIVE_INGEST_MAX_PENDING} sự kiện chờ" if LIVE_INGEST_ENABLED else "Ghi nhận trực tiếp: Tắt")
+# Chỉ mục tin gần đây (message ID -> tác giả, kênh, phần đóng góp) để trừ/sửa dữ liệu tổng hợp khi tin bị xóa/sửa (0 = tắt)
+MESSAGE_INDEX_RETENTION_DAYS = max(0, int(os.getenv("MESSAGE_INDEX_RETENTION_DAYS", "30")))
+MESSAGE_RECONCILE_FLUSH_SECONDS = max(1, int(os.getenv("MESSAGE_RECONCILE_FLUSH_SECONDS", "10")))
+log.info(f"Đối soát tin bị xóa/sửa: chỉ mục {MESSAGE_INDEX_RETENTION_DAYS} ngày, ghi mỗi {MESSAGE_RECONCILE_FLUSH_SECONDS}s" if MESSAGE_INDEX_RETENTION_DAYS > 0 and ENABLE_INCREMENTAL_SCAN else "Đối soát tin bị xóa/sửa: Tắt")
+# Checkpoint định kỳ dữ liệu quét ra file để có thể tiếp tục (--resume) sau khi bot crash
+SCAN_CHECKPOINT_INTERVAL_SECONDS = int(os.getenv("SCAN_CHECKPOINT_INTERVAL_SECONDS", "300"))
+SCAN_CHECKPOINT_DIR = os.getenv("SCAN_CHECKPOINT_DIR", "scan_checkpoints")
+log.info(f"Checkpoint quét: mỗi {SCAN_CHECKPOINT_INTERVAL_SECONDS}s vào '{SCAN_CHECKPOINT_DIR}'" if SCAN_CHECKPOINT_INTERVAL_SECONDS > 0 else "Checkpoint quét định kỳ: Tắt")
+# Quét phân tán: coordinator đăng job từng kênh/luồng vào bảng scan_jobs, các process bot bật SCAN_WORKER_ENABLED nhận job và quét
+SCAN_DISTRIBUTED = os.getenv("SCAN_DISTRIBUTED", "False").lower() == "true"
+SCAN_WORKER_ENABLED = os.getenv("SCAN_WORKER_ENABLED", "False").lower() == "true"
+SCAN_WORKER_CONCURRENCY = max(1, int(os.getenv("SCAN_WORKER_CONCURRENCY", str(MAX_CONCURRENT_CHANNEL_SCANS))))
+SCAN_JOB_POLL_SECONDS = max(0.2, float(os.getenv("SCAN_JOB_POLL_SECONDS", "2")))
+SCAN_JOB_STALE_SECONDS = max(10, int(os.getenv("SCAN_JOB_STALE_SECONDS", "300")))
+log.info(f"Quét phân tán: {'Bật' if SCAN_DISTRIBUTED else 'Tắt'} | Worker nhận job: {f'Bật ({SCAN_WORKER_CONCURRENCY} job đồng thời)' if SCAN_WORKER_ENABLED else 'Tắt'}")
+# Ngân sách bộ nhớ (ước lượng) cho dữ liệu tổng hợp khi quét: vượt thì đổ các bảng theo user lớn nhất xuống SQLite tạm (0 = chỉ đo, không đổ)
+SCAN_MEMORY_BUDGET_MB = max(0, int(os.getenv("SCAN_MEMORY_BUDGET_MB", "0")))
+SCAN_MEMORY_CHECK_SECONDS = max(1, int(os.getenv("SCAN_MEMORY_CHECK_SECONDS", "15")))
+SCAN_SPILL_DIR = os.getenv("SCAN_SPILL_DIR", "scan_spill")
+log.info(f"Ngân sách bộ nhớ khi quét: {SCAN_MEMORY_BUDGET_MB} MB (đổ xuống '{SCAN_SPILL_DIR}'), kiểm tra mỗi {SCAN_MEMORY_CHECK_SECONDS}s" if SCAN_MEMORY_BUDGET_MB > 0 else "Ngân sách bộ nhớ khi quét: Tắt (chỉ đo)")
+# Ghi lại payload các trang history đã quét (JSONL nén gzip, mỗi kênh/luồng một file) để replay benchmark offline; trống = tắt
+SCAN_RECORD_DIR = os.getenv("SCAN_RECORD_DIR", "").strip()
+SCAN_RECORD_ANONYMIZE = os.getenv("SCAN_RECORD_ANONYMIZE", "True").lower() == "true"
+log.info(f"Ghi lại history khi quét: '{SCAN_RECORD_DIR}' ({'ẩn danh ID/nội dung' if SCAN_RECORD_ANONYMIZE else 'giữ nguyên dữ liệu'})" if SCAN_RECORD_DIR else "Ghi lại history khi quét: Tắt")
+# Endpoint metrics dạng Prometheus (GET /metrics); 0 = tắt
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+log.info(f"Endpoint metrics: {f'{METRICS_HOST}:{METRICS_PORT}' if METRICS_PORT > 0 else 'Tắt'}")
 # --- Helper Function ---
 def _parse_id_list(env_var_name: str) -> Set[int]:
     id_str = os.getenv(env_var_name)
@@ -69,6 +116,26 @@ FINAL_STICKER_ID_STR = os.getenv("FINAL_STICKER_ID")
 FINAL_STICKER_ID = int(FINAL_STICKER_ID_STR) if FINAL_STICKER_ID_STR and FINAL_STICKER_ID_STR.isdigit() else None
 BOT_NAME = os.getenv("BOT_NAME", "Shiromi")
 ENABLE_REACTION_SCAN = os.getenv("ENABLE_REACTION_SCAN", "False").lower() == "true"
+# Worker lấy danh sách người thả reaction chạy song song với quét tin nhắn
+REACTION_FETCH_WORKERS = max(1, int(os.getenv("REACTION_FETCH_WORKERS", "4")))
+REACTION_FETCH_QUEUE_SIZE = max(1, int(os.getenv("REACTION_FETCH_QUEUE_SIZE", "2000")))
+log.info(f"Reaction fetcher: {REACTION_FETCH_WORKERS} worker, hàng đợi tối đa {REACTION_FETCH_QUEUE_SIZE} job")
+# Cache người thả reaction không được fetch/dùng lại quá số ngày này sẽ bị xóa sau mỗi lần quét (0 = giữ mãi)
+REACTION_CACHE_RETENTION_DAYS = max(0, int(os.getenv("REACTION_CACHE_RETENTION_DAYS", "90")))
+log.info(f"Cache người thả reaction: giữ {REACTION_CACHE_RETENTION_DAYS} ngày kể từ lần dùng cuối" if REACTION_CACHE_RETENTION_DAYS > 0 else "Cache người thả reaction: giữ mãi")
+# Tổng số request REST đồng thời tối đa khi quét (rest_scheduler tự giảm khi gặp 429 rồi tăng dần lại)
+REST_GLOBAL_CONCURRENCY = max(1, int(os.getenv("REST_GLOBAL_CONCURRENCY", str(SCAN_CONCURRENCY_MAX + 4))))
+log.info(f"REST scheduler: tối đa {REST_GLOBAL_CONCURRENCY} request đồng thời")
+# Cách khớp keyword khi quét: "substring" (đếm cả trong từ khác) hoặc "word" (chỉ từ đứng riêng)
+KEYWORD_MATCH_MODE = os.getenv("KEYWORD_MATCH_MODE", "substring").strip().lower()
+log.info(f"Chế độ khớp keyword: {KEYWORD_MATCH_MODE}")
+# Số process phân tích nội dung tin nhắn (link/emoji/keyword) song song với việc đọc history. 0 = phân tích trên event loop
+CONTENT_ANALYSIS_WORKERS = max(0, int(os.getenv("CONTENT_ANALYSIS_WORKERS", "0")))
+log.info(f"Process phân tích nội dung: {CONTENT_ANALYSIS_WORKERS}" if CONTENT_ANALYSIS_WORKERS else "Process phân tích nội dung: Tắt (phân tích trên event loop)")
+# Cache hồ sơ user (tên, avatar, bot) trong DB dùng lại qua các lần quét; user không tồn tại cũng được nhớ
+USER_PROFILE_CACHE_TTL_HOURS = int(os.getenv("USER_PROFILE_CACHE_TTL_HOURS", "168"))
+USER_PROFILE_NEGATIVE_TTL_HOURS = int(os.getenv("USER_PROFILE_NEGATIVE_TTL_HOURS", "24"))
+log.info(f"Cache hồ sơ user: TTL {USER_PROFILE_CACHE_TTL_HOURS}h, không tìm thấy {USER_PROFILE_NEGATIVE_TTL_HOURS}h" if USER_PROFILE_CACHE_TTL_HOURS > 0 else "Cache hồ sơ user: Tắt")
 WEBSITE_BASE_URL = os.getenv("WEBSITE_BASE_URL", "http://localhost:3000")
 
 # --- Deep Scan Enhancement Configs ---
@@ -3,16 +3,20 @@ import asyncpg
 import os
 import datetime
 import json
-from typing import Optional, Dict, Any, List, Union
+from typing import Optional, Dict, Any, List, Union, Tuple
 import logging
 import discord
 import discord.enums
 import asyncio
 
+import metrics
+
 log = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 pool: Optional[asyncpg.Pool] = None
+query_count = 0 # Tổng số query đã gửi (profile quét đọc chênh lệch theo từng pha)
+query_logging_enabled = False # asyncpg < 0.29 không có add_query_logger -> không đếm được
 
 async def connect_db() -> Optional[asyncpg.Pool]:
     """Thiết lập kết nối cơ sở dữ liệu."""
@@ -31,7 +35,7 @@ async def connect_db() -> Optional[asyncpg.Pool]:
             DATABASE_URL,
             min_size=2,
             max_size=10,
-            init=__set_json_codec, 
+            init=__init_connection,
             command_timeout=60
         )
         log.info("Đã thiết lập nhóm kết nối cơ sở dữ liệu.")
@@ -80,6 +84,18 @@ async def __set_json_codec(conn):
     except Exception as e:
         log.error(f"Không thể đặt codec JSON cho kết nối {conn}: {e}", exc_info=True)
 
+def __count_query(record):
+    global query_count
+    query_count += 1
+
+async def __init_connection(conn):
+    """Khởi tạo mỗi kết nối mới của pool: codec JSON + bộ đếm query."""
+    global query_logging_enabled
+    await __set_json_codec(conn)
+    if hasattr(conn, "add_query_logger"):
+        conn.add_query_logger(__count_query)
+        query_logging_enabled = True
+
 async def setup_tables():
     """Tạo các bảng cần thiết nếu chúng chưa tồn tại và cập nhật cấu trúc nếu cần."""
     if not pool:
@@ -129,6 +145,7 @@ async def setup_tables():
                     error_message TEXT
                 );
             """)
+            await conn.execute("ALTER TABLE scans ADD COLUMN IF NOT EXISTS profile JSONB;") # Profile từng pha của lần quét
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_scans_guild_status_end ON scans (guild_id, status, website_accessible, end_time DESC);")
 
             # Thêm lệnh ALTER TABLE để cập nhật bảng scans hiện có (chỉ chạy nếu cần)
@@ -177,6 +194,174 @@ async def setup_tables():
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_scan_results_scan_user ON user_scan_results (scan_id, user_id);")
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_scan_results_scan_name ON user_scan_results (scan_id, display_name_at_scan);")
 
+            # --- BẢNG CHECKPOINT QUÉT TĂNG DẦN (mỗi kênh/luồng) ---
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS location_scan_checkpoints (
+                    guild_id BIGINT NOT NULL,
+                    location_id BIGINT NOT NULL,
+                    parent_channel_id BIGINT,
+                    last_message_id BIGINT,
+                    message_count BIGINT DEFAULT 0,
+                    last_scan_time TIMESTAMPTZ,
+                    PRIMARY KEY (guild_id, location_id)
+                );
+            """)
+
+            # --- BẢNG TỔNG HỢP USER (cộng dồn qua các lần quét) ---
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_activity_aggregates (
+                    guild_id BIGINT NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    is_bot BOOLEAN DEFAULT FALSE,
+                    message_count BIGINT DEFAULT 0,
+                    link_count BIGINT DEFAULT 0,
+                    image_count BIGINT DEFAULT 0,
+                    other_file_count BIGINT DEFAULT 0,
+                    emoji_count BIGINT DEFAULT 0,
+                    sticker_count BIGINT DEFAULT 0,
+                    mention_given_count BIGINT DEFAULT 0,
+                    mention_received_count BIGINT DEFAULT 0,
+                    reply_count BIGINT DEFAULT 0,
+                    reaction_received_count BIGINT DEFAULT 0,
+                    reaction_given_count BIGINT DEFAULT 0,
+                    custom_emoji_content_count BIGINT DEFAULT 0,
+                    first_seen_utc TIMESTAMPTZ,
+                    last_seen_utc TIMESTAMPTZ,
+                    PRIMARY KEY (guild_id, user_id)
+                );
+            """)
+
+            # --- BẢNG TỔNG HỢP TIN NHẮN USER THEO KÊNH/LUỒNG ---
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS location_user_message_counts (
+                    guild_id BIGINT NOT NULL,
+                    location_id BIGINT NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    message_count BIGINT DEFAULT 0,
+                    PRIMARY KEY (guild_id, location_id, user_id)
+                );
+            """)
+
+            # --- BẢNG CACHE NGƯỜI THẢ REACTION (bỏ qua fetch lại nếu số lượt thả không đổi) ---
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS reaction_user_cache (
+                    guild_id BIGINT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    emoji_key TEXT NOT NULL,
+                    reaction_count INTEGER NOT NULL,
+                    user_ids BIGINT[] NOT NULL,
+                    last_fetched TIMESTAMPTZ DEFAULT NOW(),
+                    PRIMARY KEY (guild_id, message_id, emoji_key)
+                );
+            """)
+            # last_fetched = lần cuối được fetch/dùng lại -> dọn cache không dùng quá REACTION_CACHE_RETENTION_DAYS ngày
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_reaction_user_cache_last_fetched ON reaction_user_cache (last_fetched);")
+
+            # --- BẢNG KÍCH THƯỚC KÊNH/LUỒNG (ước lượng để xếp lịch quét lớn trước) ---
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS location_scan_stats (
+                    guild_id BIGINT NOT NULL,
+                    location_id BIGINT NOT NULL,
+                    parent_channel_id BIGINT,
+                    message_count BIGINT DEFAULT 0,
+                    scan_duration_seconds DOUBLE PRECISION DEFAULT 0,
+                    last_scan_time TIMESTAMPTZ,
+                    PRIMARY KEY (guild_id, location_id)
+                );
+            """)
+
+            # --- BẢNG CACHE HỒ SƠ USER (dùng lại qua các lần quét, có cả kết quả không tìm thấy) ---
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_profile_cache (
+                    user_id BIGINT PRIMARY KEY,
+                    username TEXT,
+                    display_name TEXT,
+                    avatar_hash TEXT,
+                    avatar_url TEXT,
+                    is_bot BOOLEAN DEFAULT FALSE,
+                    not_found BOOLEAN DEFAULT FALSE,
+                    fetched_at TIMESTAMPTZ DEFAULT NOW()
+                );
+            """)
+
+            # --- BẢNG JOB QUÉT PHÂN TÁN (coordinator đăng job từng kênh/luồng, worker nhận bằng SKIP LOCKED) ---
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_jobs (
+                    job_id BIGSERIAL PRIMARY KEY,
+                    scan_id BIGINT NOT NULL REFERENCES scans(scan_id) ON DELETE CASCADE,
+                    guild_id BIGINT NOT NULL,
+                    location_id BIGINT NOT NULL,
+                    parent_channel_id BIGINT,
+                    kind VARCHAR(10) NOT NULL, -- 'channel' hoặc 'thread'
+                    priority BIGINT NOT NULL DEFAULT 0, -- Số tin ước lượng, lớn nhận trước
+                    spec JSONB NOT NULL, -- Tham số quét (JSON có tag kiểu, xem job_codec)
+                    status VARCHAR(10) NOT NULL DEFAULT 'pending', -- pending / running / done / failed
+                    worker_id TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claimed_at TIMESTAMPTZ,
+                    heartbeat_at TIMESTAMPTZ,
+                    finished_at TIMESTAMPTZ,
+                    result JSONB, -- Kết quả location + dữ liệu tổng hợp từng phần (JSON có tag kiểu)
+                    error TEXT
+                );
+            """)
+            # Bản cũ lưu spec/result dạng pickle (BYTEA). Job chỉ sống trong một lần quét -> xóa job cũ rồi đổi kiểu cột
+            spec_type = await conn.fetchval(
+                "SELECT data_type FROM information_schema.columns WHERE table_name = 'scan_jobs' AND column_name = 'spec'"
+            )
+            if spec_type == "bytea":
+                log.info("Đổi cột spec/result của bảng scan_jobs từ pickle (BYTEA) sang JSONB...")
+                await conn.execute("DELETE FROM scan_jobs;")
+                await conn.execute("ALTER TABLE scan_jobs ALTER COLUMN spec TYPE JSONB USING NULL, ALTER COLUMN result TYPE JSONB USING NULL;")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_jobs_claim ON scan_jobs (status, guild_id, priority DESC, job_id);")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_jobs_scan ON scan_jobs (scan_id, status);")
+
+            # --- BẢNG ROLLUP HOẠT ĐỘNG THEO NGÀY (báo cáo theo khoảng thời gian bằng SQL, không cần quét lại) ---
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS activity_daily_rollups (
+                    guild_id BIGINT NOT NULL,
+                    day DATE NOT NULL, -- Ngày UTC
+                    location_id BIGINT NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    message_count BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (guild_id, day, location_id, user_id)
+                );
+            """)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS activity_hourly_rollups (
+                    guild_id BIGINT NOT NULL,
+                    day DATE NOT NULL,
+                    location_id BIGINT NOT NULL,
+                    hour SMALLINT NOT NULL, -- Giờ UTC (0-23)
+                    message_count BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (guild_id, day, location_id, hour)
+                );
+            """)
+            # Tin mới nhất đã được cộng vào rollup của từng location (quét tăng dần không cộng trùng)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS activity_rollup_coverage (
+                    guild_id BIGINT NOT NULL,
+                    location_id BIGINT NOT NULL,
+                    last_message_id BIGINT NOT NULL,
+                    PRIMARY KEY (guild_id, location_id)
+                );
+            """)
+
+            # --- BẢNG CHỈ MỤC TIN GẦN ĐÂY (trừ/sửa dữ liệu tổng hợp khi tin bị xóa/sửa) ---
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS message_contributions (
+                    guild_id BIGINT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    location_id BIGINT NOT NULL,
+                    author_id BIGINT NOT NULL,
+                    is_bot BOOLEAN NOT NULL DEFAULT FALSE,
+                    counts INTEGER[] NOT NULL, -- Phần đóng góp theo thứ tự CONTRIBUTION_COLUMNS (message_index.py)
+                    mention_ids BIGINT[], -- User được mention (mention_received_count)
+                    PRIMARY KEY (guild_id, message_id)
+                );
+            """)
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_message_contributions_message_id ON message_contributions (message_id);")
+
             log.info("Kiểm tra/Tạo/Cập nhật bảng cơ sở dữ liệu thành công.")
     except Exception as e:
         log.error(f"Lỗi khi thiết lập bảng cơ sở dữ liệu: {e}", exc_info=True)
@@ -432,7 +617,8 @@ async def save_user_scan_results(scan_id: int, user_results: List[Dict[str, Any]
         ))
     try:
         async with pool.acquire() as conn:
-            async with conn.transaction(): await conn.executemany(query, data_tuples)
+            with metrics.DB_FLUSH_SECONDS.time(operation="user_scan_results"):
+                async with conn.transaction(): await conn.executemany(query, data_tuples)
             log.info(f"Đã lưu {len(data_tuples)} kết quả user cho scan_id: {scan_id}")
     except Exception as e:
         log.error(f"Lỗi khi lưu hàng loạt kết quả user cho scan_id {scan_id}: {e}", exc_info=True)
@@ -448,6 +634,7 @@ async def update_scan_status(scan_id: int, status: str, end_time: Optional[datet
     try:
         async with pool.acquire() as conn:
             await conn.execute(query, *params)
+            if end_time: metrics.SCANS_FINISHED.inc(status=status)
             log.info(f"Đã cập nhật trạng thái scan_id {scan_id} thành '{status}'" + (" (Web Ready)" if website_ready else "") + (f" Error: {error[:50]}..." if error else ""))
     except Exception as e:
         log.error(f"Lỗi khi cập nhật trạng thái scan_id {scan_id}: {e}", exc_info=True)
@@ -455,4 +642,669 @@ async def update_scan_status(scan_id: int, status: str, end_time: Optional[datet
         if isinstance(e, asyncpg.exceptions.StringDataRightTruncationError):
              raise e
 
-# --- END OF FILE database.py ---
\ No newline at end of file
+async def save_scan_profile(scan_id: int, profile: Dict[str, Any]):
+    """Lưu profile (thời gian/CPU/REST/DB/bộ nhớ theo pha) vào cột JSONB của bản ghi quét."""
+    if not pool or not scan_id: return
+    try:
+        async with pool.acquire() as conn:
+            await conn.execute("UPDATE scans SET profile = $2 WHERE scan_id = $1", scan_id, profile)
+    except Exception as e:
+        log.error(f"Lỗi lưu profile cho scan_id {scan_id}: {e}", exc_info=False)
+
+async def get_recent_scan_profiles(guild_id: int, limit: int) -> List[Dict[str, Any]]:
+    """Lấy profile của `limit` lần quét gần nhất (có profile) của guild, mới nhất trước."""
+    if not pool: return []
+    query = """
+        SELECT scan_id, start_time, end_time, status, profile FROM scans
+        WHERE guild_id = $1 AND profile IS NOT NULL ORDER BY scan_id DESC LIMIT $2 """
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(query, guild_id, limit)
+            return [dict(row) for row in rows]
+    except Exception as e:
+        log.error(f"Lỗi đọc profile quét cho guild {guild_id}: {e}", exc_info=False)
+        return []
+
+
+# --- Các hàm thao tác DB (Quét tăng dần: checkpoint kênh & dữ liệu tổng hợp) ---
+USER_AGGREGATE_COUNT_COLUMNS = (
+    "message_count", "link_count", "image_count", "other_file_count", "emoji_count",
+    "sticker_count", "mention_given_count", "mention_received_count", "reply_count",
+    "reaction_received_count", "reaction_given_count", "custom_emoji_content_count",
+)
+
+async def get_location_scan_checkpoints(guild_id: int) -> Dict[int, Dict[str, Any]]:
+    """Lấy checkpoint (ID tin nhắn mới nhất đã quét) của từng kênh/luồng trong guild."""
+    if not pool: return {}
+    query = "SELECT location_id, parent_channel_id, last_message_id, message_count, last_scan_time FROM location_scan_checkpoints WHERE guild_id = $1"
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(query, guild_id)
+            return {row['location_id']: dict(row) for row in rows}
+    except Exception as e:
+        log.error(f"Lỗi lấy checkpoint quét kênh cho guild {guild_id}: {e}", exc_info=False)
+        return {}
+
+async def get_user_activity_aggregates(guild_id: int) -> List[Dict[str, Any]]:
+    """Lấy dữ liệu tổng hợp đã lưu của từng user trong guild."""
+    if not pool: return []
+    columns = ", ".join(("user_id", "is_bot") + USER_AGGREGATE_COUNT_COLUMNS + ("first_seen_utc", "last_seen_utc"))
+    query = f"SELECT {columns} FROM user_activity_aggregates WHERE guild_id = $1"
+    try:
+        async with pool.acquire() as conn:
+            rows = await asyncio.wait_for(conn.fetch(query, guild_id), timeout=45.0)
+            return [dict(row) for row in rows]
+    except asyncio.TimeoutError: log.error(f"Timeout khi lấy dữ liệu tổng hợp user cho guild {guild_id}"); return []
+    except Exception as e:
+        log.error(f"Lỗi lấy dữ liệu tổng hợp user cho guild {guild_id}: {e}", exc_info=False)
+        return []
+
+async def get_location_user_message_counts(guild_id: int) -> Dict[int, Dict[int, int]]:
+    """Lấy số tin nhắn đã lưu của từng user theo kênh/luồng. Trả về {location_id: {user_id: count}}."""
+    if not pool: return {}
+    query = "SELECT location_id, user_id, message_count FROM location_user_message_counts WHERE guild_id = $1"
+    result: Dict[int, Dict[int, int]] = {}
+    try:
+        async with pool.acquire() as conn:
+            rows = await asyncio.wait_for(conn.fetch(query, guild_id), timeout=45.0)
+            for row in rows:
+                result.setdefault(row['location_id'], {})[row['user_id']] = row['message_count']
+            return result
+    except asyncio.TimeoutError: log.error(f"Timeout khi lấy số tin nhắn user theo kênh cho guild {guild_id}"); return {}
+    except Exception as e:
+        log.error(f"Lỗi lấy số tin nhắn user theo kênh cho guild {guild_id}: {e}", exc_info=False)
+        return {}
+
+async def save_incremental_scan_state(
+    guild_id: int,
+    checkpoint_rows: List[Dict[str, Any]],
+    user_aggregate_rows: List[Dict[str, Any]],
+    location_user_rows: List[Tuple[int, int, int]],
+    replace_checkpoints: bool,
+    message_index_rows: Optional[List[Tuple[int, int, int, bool, List[int], List[int]]]] = None
+) -> bool:
+    """
+    Lưu checkpoint kênh và dữ liệu tổng hợp trong MỘT transaction để chúng luôn khớp nhau.
+    Dữ liệu tổng hợp luôn được ghi đè toàn bộ (scan_data đã chứa dữ liệu cũ + phần mới).
+    replace_checkpoints=True (quét toàn bộ) sẽ xóa checkpoint (và chỉ mục tin) cũ của guild trước khi ghi.
+    message_index_rows: chỉ mục tin gần đây của lần quét (None = không đụng tới bảng chỉ mục).
+    """
+    if not pool: return False
+    now = datetime.datetime.now(datetime.timezone.utc)
+    checkpoint_query = """
+        INSERT INTO location_scan_checkpoints (guild_id, location_id, parent_channel_id, last_message_id, message_count, last_scan_time)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        ON CONFLICT (guild_id, location_id) DO UPDATE SET
+            parent_channel_id = EXCLUDED.parent_channel_id, last_message_id = EXCLUDED.last_message_id,
+            message_count = EXCLUDED.message_count, last_scan_time = EXCLUDED.last_scan_time; """
+    aggregate_columns = ("guild_id", "user_id", "is_bot") + USER_AGGREGATE_COUNT_COLUMNS + ("first_seen_utc", "last_seen_utc")
+    placeholders = ", ".join(f"${i + 1}" for i in range(len(aggregate_columns)))
+    aggregate_query = f"INSERT INTO user_activity_aggregates ({', '.join(aggregate_columns)}) VALUES ({placeholders})"
+    location_user_query = "INSERT INTO location_user_message_counts (guild_id, location_id, user_id, message_count) VALUES ($1, $2, $3, $4)"
+
+    checkpoint_tuples = [
+        (guild_id, row['location_id'], row.get('parent_channel_id'), row.get('last_message_id'), row.get('message_count', 0), now)
+        for row in checkpoint_rows
+    ]
+    aggregate_tuples = [
+        (guild_id, row['user_id'], row.get('is_bot', False))
+        + tuple(row.get(col, 0) for col in USER_AGGREGATE_COUNT_COLUMNS)
+        + (row.get('first_seen_utc'), row.get('last_seen_utc'))
+        for row in user_aggregate_rows
+    ]
+    location_user_tuples = [(guild_id, location_id, user_id, count) for location_id, user_id, count in location_user_rows]
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if replace_checkpoints:
+                    await conn.execute("DELETE FROM location_scan_checkpoints WHERE guild_id = $1", guild_id)
+                await conn.execute("DELETE FROM user_activity_aggregates WHERE guild_id = $1", guild_id)
+                await conn.execute("DELETE FROM location_user_message_counts WHERE guild_id = $1", guild_id)
+                if checkpoint_tuples: await conn.executemany(checkpoint_query, checkpoint_tuples)
+                if aggregate_tuples: await conn.executemany(aggregate_query, aggregate_tuples)
+                if location_user_tuples: await conn.executemany(location_user_query, location_user_tuples)
+                if message_index_rows is not None:
+                    if replace_checkpoints:
+                        await conn.execute("DELETE FROM message_contributions WHERE guild_id = $1", guild_id)
+                    await _upsert_message_contributions(conn, guild_id, message_index_rows)
+        log.info(
+            f"Đã lưu trạng thái quét tăng dần cho guild {guild_id}: {len(checkpoint_tuples)} checkpoint, {len(aggregate_tuples)} user, "
+            f"{len(location_user_tuples)} cặp user-kênh, {len(message_index_rows or ()):,} tin trong chỉ mục."
+        )
+        return True
+    except Exception as e:
+        log.error(f"Lỗi lưu trạng thái quét tăng dần cho guild {guild_id}: {e}", exc_info=True)
+        return False
+
+
+# --- Các hàm thao tác DB (Cache người thả reaction) ---
+async def get_reaction_user_cache(guild_id: int, message_ids: List[int]) -> Dict[Tuple[int, str], Tuple[int, List[int]]]:
+    """Lấy cache người thả reaction của các tin nhắn. Trả về {(message_id, emoji_key): (reaction_count, user_ids)}."""
+    if not pool or not message_ids: return {}
+    query = "SELECT message_id, emoji_key, reaction_count, user_ids FROM reaction_user_cache WHERE guild_id = $1 AND message_id = ANY($2::BIGINT[])"
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(query, guild_id, message_ids)
+            return {(row['message_id'], row['emoji_key']): (row['reaction_count'], list(row['user_ids'])) for row in rows}
+    except Exception as e:
+        log.error(f"Lỗi lấy cache người thả reaction cho guild {guild_id}: {e}", exc_info=False)
+        return {}
+
+async def save_reaction_user_cache(guild_id: int, rows: List[Tuple[int, str, int, List[int]]]) -> bool:
+    """Lưu (upsert) cache người thả reaction. rows: [(message_id, emoji_key, reaction_count, user_ids)]."""
+    if not pool or not rows: return False
+    query = """
+        INSERT INTO reaction_user_cache (guild_id, message_id, emoji_key, reaction_count, user_ids, last_fetched)
+        VALUES ($1, $2, $3, $4, $5, NOW())
+        ON CONFLICT (guild_id, message_id, emoji_key) DO UPDATE SET
+            reaction_count = EXCLUDED.reaction_count, user_ids = EXCLUDED.user_ids, last_fetched = NOW(); """
+    try:
+        async with pool.acquire() as conn:
+            await conn.executemany(query, [(guild_id, message_id, emoji_key, count, user_ids) for message_id, emoji_key, count, user_ids in rows])
+        return True
+    except Exception as e:
+        log.error(f"Lỗi lưu cache người thả reaction cho guild {guild_id}: {e}", exc_info=False)
+        return False
+
+async def touch_reaction_user_cache(guild_id: int, keys: List[Tuple[int, str]]):
+    """Đánh dấu cache vừa được dùng lại (chỉ ghi dòng cũ hơn 1 ngày) để không bị dọn khi còn được dùng."""
+    if not pool or not keys: return
+    query = """
+        UPDATE reaction_user_cache AS c SET last_fetched = NOW()
+        FROM unnest($2::BIGINT[], $3::TEXT[]) AS k(message_id, emoji_key)
+        WHERE c.guild_id = $1 AND c.message_id = k.message_id AND c.emoji_key = k.emoji_key
+          AND c.last_fetched < NOW() - INTERVAL '1 day'; """
+    try:
+        async with pool.acquire() as conn:
+            await conn.execute(query, guild_id, [key[0] for key in keys], [key[1] for key in keys])
+    except Exception as e:
+        log.error(f"Lỗi cập nhật thời điểm dùng cache người thả reaction cho guild {guild_id}: {e}", exc_info=False)
+
+async def prune_reaction_user_cache(older_than_days: int) -> int:
+    """Xóa cache người thả reaction không được fetch/dùng lại trong older_than_days ngày (mọi guild). Trả về số dòng đã xóa."""
+    if not pool: return 0
+    try:
+        async with pool.acquire() as conn:
+            status = await conn.execute("DELETE FROM reaction_user_cache WHERE last_fetched < NOW() - make_interval(days => $1)", older_than_days)
+            return int(status.split()[-1]) if status else 0
+    except Exception as e:
+        log.error(f"Lỗi dọn cache người thả reaction: {e}", exc_info=False)
+        return 0
+
+async def get_location_scan_stats(guild_id: int) -> Dict[int, Dict[str, Any]]:
+    """Lấy số tin nhắn và thời gian quét lần trước của từng kênh/luồng (dùng để ước lượng kích thước)."""
+    if not pool: return {}
+    query = "SELECT location_id, parent_channel_id, message_count, scan_duration_seconds, last_scan_time FROM location_scan_stats WHERE guild_id = $1"
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(query, guild_id)
+            return {row['location_id']: dict(row) for row in rows}
+    except Exception as e:
+        log.error(f"Lỗi lấy thống kê kích thước kênh cho guild {guild_id}: {e}", exc_info=False)
+        return {}
+
+async def save_location_scan_stats(guild_id: int, rows: List[Dict[str, Any]]) -> bool:
+    """Lưu (upsert) số tin nhắn và thời gian quét của từng kênh/luồng vừa quét xong."""
+    if not pool or not rows: return False
+    now = discord.utils.utcnow()
+    query = """
+        INSERT INTO location_scan_stats (guild_id, location_id, parent_channel_id, message_count, scan_duration_seconds, last_scan_time)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        ON CONFLICT (guild_id, location_id) DO UPDATE SET
+            parent_channel_id = EXCLUDED.parent_channel_id, message_count = EXCLUDED.message_count,
+            scan_duration_seconds = EXCLUDED.scan_duration_seconds, last_scan_time = EXCLUDED.last_scan_time; """
+    try:
+        async with pool.acquire() as conn:
+            await conn.executemany(query, [
+                (guild_id, row['location_id'], row.get('parent_channel_id'), row.get('message_count', 0), row.get('scan_duration_seconds', 0.0), now)
+                for row in rows
+            ])
+        return True
+    except Exception as e:
+        log.error(f"Lỗi lưu thống kê kích thước kênh cho guild {guild_id}: {e}", exc_info=False)
+        return False
+
+async def get_user_profile_cache(user_ids: List[int], ttl_hours: int, negative_ttl_hours: int) -> Dict[int, Dict[str, Any]]:
+    """Lấy hồ sơ user còn hạn trong cache (dòng not_found=True là kết quả 'không tìm thấy' đã nhớ)."""
+    if not pool or not user_ids or ttl_hours <= 0: return {}
+    query = """
+        SELECT user_id, username, display_name, avatar_hash, avatar_url, is_bot, not_found, fetched_at
+        FROM user_profile_cache
+        WHERE user_id = ANY($1::BIGINT[])
+          AND fetched_at > NOW() - make_interval(hours => CASE WHEN not_found THEN $3 ELSE $2 END); """
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(query, list(user_ids), ttl_hours, negative_ttl_hours)
+            return {row['user_id']: dict(row) for row in rows}
+    except Exception as e:
+        log.error(f"Lỗi lấy cache hồ sơ user: {e}", exc_info=False)
+        return {}
+
+async def save_user_profile_cache(rows: List[Dict[str, Any]]) -> bool:
+    """Lưu (upsert) hồ sơ user. Mỗi dòng: user_id, username, display_name, avatar_hash, avatar_url, is_bot, not_found."""
+    if not pool or not rows: return False
+    query = """
+        INSERT INTO user_profile_cache (user_id, username, display_name, avatar_hash, avatar_url, is_bot, not_found, fetched_at)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, NOW())
+        ON CONFLICT (user_id) DO UPDATE SET
+            username = EXCLUDED.username, display_name = EXCLUDED.display_name, avatar_hash = EXCLUDED.avatar_hash,
+            avatar_url = EXCLUDED.avatar_url, is_bot = EXCLUDED.is_bot, not_found = EXCLUDED.not_found, fetched_at = NOW(); """
+    try:
+        async with pool.acquire() as conn:
+            await conn.executemany(query, [
+                (row['user_id'], row.get('username'), row.get('display_name'), row.get('avatar_hash'),
+                 row.get('avatar_url'), row.get('is_bot', False), row.get('not_found', False))
+                for row in rows
+            ])
+        return True
+    except Exception as e:
+        log.error(f"Lỗi lưu cache hồ sơ user: {e}", exc_info=False)
+        return False
+
+
+# --- Các hàm thao tác DB (Job quét phân tán) ---
+async def enqueue_scan_jobs(scan_id: int, guild_id: int, jobs: List[Dict[str, Any]]) -> List[int]:
+    """Xóa job cũ của scan (nếu resume) rồi đăng job mới. Mỗi job: location_id, parent_channel_id, kind, priority, spec (chuỗi JSON)."""
+    if not pool or not jobs: return []
+    query = """
+        INSERT INTO scan_jobs (scan_id, guild_id, location_id, parent_channel_id, kind, priority, spec)
+        VALUES ($1, $2, $3, $4, $5, $6, $7::text::jsonb) RETURNING job_id; """
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM scan_jobs WHERE scan_id = $1", scan_id)
+                job_ids = []
+                for job in jobs:
+                    job_ids.append(await conn.fetchval(
+                        query, scan_id, guild_id, job['location_id'], job.get('parent_channel_id'),
+                        job['kind'], job.get('priority', 0), job['spec']
+                    ))
+        log.info(f"Đã đăng {len(job_ids)} job quét phân tán cho scan {scan_id}.")
+        return job_ids
+    except Exception as e:
+        log.error(f"Lỗi đăng job quét phân tán cho scan {scan_id}: {e}", exc_info=True)
+        return []
+
+async def claim_scan_job(worker_id: str, guild_ids: List[int]) -> Optional[Dict[str, Any]]:
+    """Nhận 1 job đang chờ (ưu tiên lớn trước) của các guild worker nhìn thấy. SKIP LOCKED: nhiều worker không nhận trùng."""
+    if not pool or not guild_ids: return None
+    query = """
+        UPDATE scan_jobs SET status = 'running', worker_id = $1, attempts = attempts + 1,
+            claimed_at = NOW(), heartbeat_at = NOW()
+        WHERE job_id = (
+            SELECT job_id FROM scan_jobs
+            WHERE status = 'pending' AND guild_id = ANY($2::BIGINT[])
+            ORDER BY priority DESC, job_id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING job_id, scan_id, guild_id, location_id, parent_channel_id, kind, spec, attempts; """
+    try:
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(query, worker_id, list(guild_ids))
+            return dict(row) if row else None
+    except Exception as e:
+        log.error(f"Lỗi nhận job quét phân tán (worker {worker_id}): {e}", exc_info=False)
+        return None
+
+async def heartbeat_scan_jobs(worker_id: str, job_ids: List[int]):
+    """Báo worker vẫn đang chạy các job (job không có heartbeat quá lâu sẽ bị trả về hàng đợi)."""
+    if not pool or not job_ids: return
+    try:
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE scan_jobs SET heartbeat_at = NOW() WHERE job_id = ANY($1::BIGINT[]) AND worker_id = $2 AND status = 'running'",
+                list(job_ids), worker_id
+            )
+    except Exception as e:
+        log.warning(f"Lỗi cập nhật heartbeat job quét (worker {worker_id}): {e}")
+
+async def complete_scan_job(job_id: int, worker_id: str, result: str) -> bool:
+    """Ghi kết quả job (chuỗi JSON). False nếu job không còn thuộc worker này (đã bị trả về hàng đợi/xóa)."""
+    if not pool: return False
+    query = """
+        UPDATE scan_jobs SET status = 'done', result = $3::text::jsonb, finished_at = NOW(), error = NULL
+        WHERE job_id = $1 AND worker_id = $2 AND status = 'running'; """
+    try:
+        async with pool.acquire() as conn:
+            status = await conn.execute(query, job_id, worker_id, result)
+            return status.endswith(" 1")
+    except Exception as e:
+        log.error(f"Lỗi ghi kết quả job quét {job_id}: {e}", exc_info=False)
+        return False
+
+async def fail_scan_job(job_id: int, worker_id: str, error: str, max_attempts: int):
+    """Job lỗi: trả về hàng đợi nếu còn lượt thử, ngược lại đánh dấu failed."""
+    if not pool: return
+    query = """
+        UPDATE scan_jobs SET status = CASE WHEN attempts >= $4 THEN 'failed' ELSE 'pending' END,
+            worker_id = NULL, error = $3, finished_at = CASE WHEN attempts >= $4 THEN NOW() ELSE NULL END
+        WHERE job_id = $1 AND worker_id = $2 AND status = 'running'; """
+    try:
+        async with pool.acquire() as conn:
+            await conn.execute(query, job_id, worker_id, error[:1000], max_attempts)
+    except Exception as e:
+        log.error(f"Lỗi đánh dấu job quét {job_id} thất bại: {e}", exc_info=False)
+
+async def requeue_stale_scan_jobs(scan_id: int, stale_seconds: int, max_attempts: int) -> int:
+    """Trả job 'running' mất heartbeat (worker chết) về hàng đợi, hoặc failed nếu hết lượt thử."""
+    if not pool: return 0
+    query = """
+        UPDATE scan_jobs SET status = CASE WHEN attempts >= $3 THEN 'failed' ELSE 'pending' END,
+            worker_id = NULL, error = 'Worker mất heartbeat',
+            finished_at = CASE WHEN attempts >= $3 THEN NOW() ELSE NULL END
+        WHERE scan_id = $1 AND status = 'running' AND heartbeat_at < NOW() - make_interval(secs => $2); """
+    try:
+        async with pool.acquire() as conn:
+            status = await conn.execute(query, scan_id, float(stale_seconds), max_attempts)
+            return int(status.split()[-1])
+    except Exception as e:
+        log.error(f"Lỗi trả job quét mất heartbeat của scan {scan_id}: {e}", exc_info=False)
+        return 0
+
+async def get_finished_scan_jobs(scan_id: int, job_ids: List[int]) -> List[Dict[str, Any]]:
+    """Lấy các job đã xong/thất bại trong danh sách job_ids (kèm kết quả)."""
+    if not pool or not job_ids: return []
+    query = """
+        SELECT job_id, location_id, parent_channel_id, kind, status, worker_id, result, error
+        FROM scan_jobs
+        WHERE scan_id = $1 AND job_id = ANY($2::BIGINT[]) AND status IN ('done', 'failed'); """
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(query, scan_id, list(job_ids))
+            return [dict(row) for row in rows]
+    except Exception as e:
+        log.error(f"Lỗi lấy kết quả job quét của scan {scan_id}: {e}", exc_info=False)
+        return []
+
+async def get_scan_job_status_counts(scan_id: int) -> Dict[str, int]:
+    """Số job theo trạng thái của một scan."""
+    if not pool: return {}
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("SELECT status, COUNT(*) AS job_count FROM scan_jobs WHERE scan_id = $1 GROUP BY status", scan_id)
+            return {row['status']: row['job_count'] for row in rows}
+    except Exception as e:
+        log.error(f"Lỗi đếm job quét của scan {scan_id}: {e}", exc_info=False)
+        return {}
+
+async def delete_scan_jobs(scan_id: int):
+    """Xóa job của scan sau khi coordinator đã gộp xong kết quả."""
+    if not pool: return
+    try:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM scan_jobs WHERE scan_id = $1", scan_id)
+    except Exception as e:
+        log.error(f"Lỗi xóa job quét của scan {scan_id}: {e}", exc_info=False)
+
+
+# --- Các hàm thao tác DB (Rollup hoạt động theo ngày) ---
+ROLLUP_INSERT_CHUNK_SIZE = 10_000
+
+async def get_activity_rollup_coverage(guild_id: int) -> Dict[int, int]:
+    """Lấy {location_id: message ID mới nhất đã có trong rollup}."""
+    if not pool: return {}
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("SELECT location_id, last_message_id FROM activity_rollup_coverage WHERE guild_id = $1", guild_id)
+            return {row['location_id']: row['last_message_id'] for row in rows}
+    except Exception as e:
+        log.error(f"Lỗi lấy phạm vi rollup cho guild {guild_id}: {e}", exc_info=False)
+        return {}
+
+async def _upsert_activity_rollups(
+    conn: asyncpg.Connection,
+    guild_id: int,
+    daily_rows: List[Tuple[datetime.date, int, int, int]],
+    hourly_rows: List[Tuple[datetime.date, int, int, int]],
+    coverage_rows: List[Tuple[int, int]]
+):
+    """Cộng rollup vào số đã có (trong transaction của người gọi) và nâng phạm vi đã cộng của từng location."""
+    daily_query = """
+        INSERT INTO activity_daily_rollups (guild_id, day, location_id, user_id, message_count)
+        SELECT $1, * FROM unnest($2::DATE[], $3::BIGINT[], $4::BIGINT[], $5::BIGINT[])
+        ON CONFLICT (guild_id, day, location_id, user_id) DO UPDATE SET
+            message_count = activity_daily_rollups.message_count + EXCLUDED.message_count; """
+    hourly_query = """
+        INSERT INTO activity_hourly_rollups (guild_id, day, location_id, hour, message_count)
+        SELECT $1, * FROM unnest($2::DATE[], $3::BIGINT[], $4::SMALLINT[], $5::BIGINT[])
+        ON CONFLICT (guild_id, day, location_id, hour) DO UPDATE SET
+            message_count = activity_hourly_rollups.message_count + EXCLUDED.message_count; """
+    coverage_query = """
+        INSERT INTO activity_rollup_coverage (guild_id, location_id, last_message_id) VALUES ($1, $2, $3)
+        ON CONFLICT (guild_id, location_id) DO UPDATE SET
+            last_message_id = GREATEST(activity_rollup_coverage.last_message_id, EXCLUDED.last_message_id); """
+    # Ghi theo lô bằng unnest (mỗi lô một câu lệnh thay vì một câu lệnh mỗi dòng)
+    for query, rows in ((daily_query, daily_rows), (hourly_query, hourly_rows)):
+        for start in range(0, len(rows), ROLLUP_INSERT_CHUNK_SIZE):
+            columns = list(zip(*rows[start:start + ROLLUP_INSERT_CHUNK_SIZE]))
+            await conn.execute(query, guild_id, *(list(column) for column in columns))
+    if coverage_rows:
+        await conn.executemany(coverage_query, [(guild_id, location_id, last_id) for location_id, last_id in coverage_rows])
+
+async def save_activity_rollups(
+    guild_id: int,
+    daily_rows: List[Tuple[datetime.date, int, int, int]],
+    hourly_rows: List[Tuple[datetime.date, int, int, int]],
+    coverage_rows: List[Tuple[int, int]],
+    replace_location_ids: Optional[List[int]],
+    replace_from_day: Optional[datetime.date] = None
+) -> bool:
+    """
+    Ghi rollup theo ngày trong MỘT transaction.
+    replace_location_ids != None: xóa rollup cũ của các location đó (từ replace_from_day, None = mọi ngày) rồi ghi mới.
+    replace_location_ids = None (quét tăng dần): cộng thêm vào số đã có.
+    daily_rows: (day, location_id, user_id, count); hourly_rows: (day, location_id, hour, count); coverage_rows: (location_id, last_message_id).
+    """
+    if not pool: return False
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if replace_location_ids:
+                    for table in ("activity_daily_rollups", "activity_hourly_rollups"):
+                        await conn.execute(
+                            f"DELETE FROM {table} WHERE guild_id = $1 AND location_id = ANY($2::BIGINT[]) AND ($3::DATE IS NULL OR day >= $3)",
+                            guild_id, replace_location_ids, replace_from_day
+                        )
+                await _upsert_activity_rollups(conn, guild_id, daily_rows, hourly_rows, coverage_rows)
+        log.info(f"Đã lưu rollup theo ngày cho guild {guild_id}: {len(daily_rows):,} dòng user-kênh-ngày, {len(hourly_rows):,} dòng kênh-giờ-ngày.")
+        return True
+    except Exception as e:
+        log.error(f"Lỗi lưu rollup theo ngày cho guild {guild_id}: {e}", exc_info=True)
+        return False
+
+async def apply_live_activity(
+    guild_id: int,
+    user_aggregate_rows: List[Dict[str, Any]],
+    location_user_rows: List[Tuple[int, int, int]],
+    checkpoint_rows: List[Dict[str, Any]],
+    daily_rows: List[Tuple[datetime.date, int, int, int]],
+    hourly_rows: List[Tuple[datetime.date, int, int, int]],
+    message_index_rows: Optional[List[Tuple[int, int, int, bool, List[int], List[int]]]] = None
+) -> bool:
+    """
+    Cộng dồn hoạt động ghi nhận trực tiếp từ gateway vào dữ liệu tổng hợp, số tin user-kênh, rollup theo ngày,
+    chỉ mục tin và nâng checkpoint từng kênh/luồng trong MỘT transaction (lần quét tăng dần sau chỉ fetch tin mới hơn checkpoint).
+    """
+    if not pool: return False
+    now = datetime.datetime.now(datetime.timezone.utc)
+    aggregate_columns = ("guild_id", "user_id", "is_bot") + USER_AGGREGATE_COUNT_COLUMNS + ("first_seen_utc", "last_seen_utc")
+    placeholders = ", ".join(f"${i + 1}" for i in range(len(aggregate_columns)))
+    aggregate_updates = ", ".join(
+        [f"{col} = user_activity_aggregates.{col} + EXCLUDED.{col}" for col in USER_AGGREGATE_COUNT_COLUMNS]
+        + ["is_bot = user_activity_aggregates.is_bot OR EXCLUDED.is_bot",
+           "first_seen_utc = LEAST(user_activity_aggregates.first_seen_utc, EXCLUDED.first_seen_utc)",
+           "last_seen_utc = GREATEST(user_activity_aggregates.last_seen_utc, EXCLUDED.last_seen_utc)"]
+    )
+    aggregate_query = f"""
+        INSERT INTO user_activity_aggregates ({', '.join(aggregate_columns)}) VALUES ({placeholders})
+        ON CONFLICT (guild_id, user_id) DO UPDATE SET {aggregate_updates}; """
+    location_user_query = """
+        INSERT INTO location_user_message_counts (guild_id, location_id, user_id, message_count) VALUES ($1, $2, $3, $4)
+        ON CONFLICT (guild_id, location_id, user_id) DO UPDATE SET
+            message_count = location_user_message_counts.message_count + EXCLUDED.message_count; """
+    checkpoint_query = """
+        INSERT INTO location_scan_checkpoints (guild_id, location_id, parent_channel_id, last_message_id, message_count, last_scan_time)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        ON CONFLICT (guild_id, location_id) DO UPDATE SET
+            last_message_id = GREATEST(location_scan_checkpoints.last_message_id, EXCLUDED.last_message_id),
+            message_count = location_scan_checkpoints.message_count + EXCLUDED.message_count; """
+    aggregate_tuples = [
+        (guild_id, row['user_id'], row.get('is_bot', False))
+        + tuple(row.get(col, 0) for col in USER_AGGREGATE_COUNT_COLUMNS)
+        + (row.get('first_seen_utc'), row.get('last_seen_utc'))
+        for row in user_aggregate_rows
+    ]
+    location_user_tuples = [(guild_id, location_id, user_id, count) for location_id, user_id, count in location_user_rows]
+    checkpoint_tuples = [
+        (guild_id, row['location_id'], row.get('parent_channel_id'), row['last_message_id'], row.get('message_count', 0), now)
+        for row in checkpoint_rows
+    ]
+    coverage_rows = [(row['location_id'], row['last_message_id']) for row in checkpoint_rows]
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if aggregate_tuples: await conn.executemany(aggregate_query, aggregate_tuples)
+                if location_user_tuples: await conn.executemany(location_user_query, location_user_tuples)
+                if checkpoint_tuples: await conn.executemany(checkpoint_query, checkpoint_tuples)
+                await _upsert_activity_rollups(conn, guild_id, daily_rows, hourly_rows, coverage_rows)
+                if message_index_rows: await _upsert_message_contributions(conn, guild_id, message_index_rows)
+        return True
+    except Exception as e:
+        log.error(f"Lỗi ghi hoạt động trực tiếp cho guild {guild_id}: {e}", exc_info=False)
+        return False
+
+# --- Các hàm thao tác DB (Chỉ mục tin gần đây & đối soát xóa/sửa tin) ---
+async def _upsert_message_contributions(
+    conn: asyncpg.Connection,
+    guild_id: int,
+    rows: List[Tuple[int, int, int, bool, List[int], List[int]]]
+):
+    """Ghi dòng chỉ mục (message_id, location_id, author_id, is_bot, counts, mention_ids) trong transaction của người gọi."""
+    if not rows: return
+    query = """
+        INSERT INTO message_contributions (guild_id, message_id, location_id, author_id, is_bot, counts, mention_ids)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT (guild_id, message_id) DO UPDATE SET
+            location_id = EXCLUDED.location_id, author_id = EXCLUDED.author_id, is_bot = EXCLUDED.is_bot,
+            counts = EXCLUDED.counts, mention_ids = EXCLUDED.mention_ids; """
+    for start in range(0, len(rows), ROLLUP_INSERT_CHUNK_SIZE):
+        await conn.executemany(query, [(guild_id,) + tuple(row) for row in rows[start:start + ROLLUP_INSERT_CHUNK_SIZE]])
+
+async def get_message_contributions(guild_id: int, message_ids: List[int]) -> Optional[Dict[int, Dict[str, Any]]]:
+    """Lấy dòng chỉ mục của các tin. Trả về {message_id: dòng} (tin không có trong chỉ mục bị bỏ qua), None nếu lỗi DB."""
+    if not pool: return None
+    query = """
+        SELECT message_id, location_id, author_id, is_bot, counts, mention_ids
+        FROM message_contributions WHERE guild_id = $1 AND message_id = ANY($2::BIGINT[]) """
+    try:
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(query, guild_id, message_ids)
+            return {row['message_id']: dict(row) for row in rows}
+    except Exception as e:
+        log.error(f"Lỗi đọc chỉ mục tin cho guild {guild_id}: {e}", exc_info=False)
+        return None
+
+async def apply_message_reconciliation(
+    guild_id: int,
+    user_delta_rows: List[Dict[str, Any]],
+    location_user_delta_rows: List[Tuple[int, int, int]],
+    checkpoint_delta_rows: List[Tuple[int, int]],
+    daily_delta_rows: List[Tuple[datetime.date, int, int, int]],
+    hourly_delta_rows: List[Tuple[datetime.date, int, int, int]],
+    deleted_message_ids: List[int],
+    updated_index_rows: List[Tuple[int, int, int, bool, List[int], List[int]]]
+) -> bool:
+    """
+    Trừ/sửa phần đóng góp của các tin bị xóa/sửa trong MỘT transaction: dữ liệu tổng hợp user, số tin user-kênh,
+    số tin của checkpoint, rollup theo ngày và chính chỉ mục. Delta âm, số liệu không xuống dưới 0.
+    user_delta_rows: {"user_id", <cột>: delta}; location_user_delta_rows: (location_id, user_id, delta);
+    checkpoint_delta_rows: (location_id, delta); daily/hourly_delta_rows cùng dạng rollup (delta thay cho số tin).
+    """
+    if not pool: return False
+    aggregate_sets = ", ".join(f"{col} = GREATEST({col} + ${i + 3}, 0)" for i, col in enumerate(USER_AGGREGATE_COUNT_COLUMNS))
+    aggregate_query = f"UPDATE user_activity_aggregates SET {aggregate_sets} WHERE guild_id = $1 AND user_id = $2"
+    location_user_query = """
+        UPDATE location_user_message_counts SET message_count = GREATEST(message_count + $4, 0)
+        WHERE guild_id = $1 AND location_id = $2 AND user_id = $3 """
+    checkpoint_query = """
+        UPDATE location_scan_checkpoints SET message_count = GREATEST(message_count + $3, 0)
+        WHERE guild_id = $1 AND location_id = $2 """
+    daily_query = """
+        UPDATE activity_daily_rollups AS r SET message_count = GREATEST(r.message_count + d.delta, 0)
+        FROM unnest($2::DATE[], $3::BIGINT[], $4::BIGINT[], $5::BIGINT[]) AS d(day, location_id, user_id, delta)
+        WHERE r.guild_id = $1 AND r.day = d.day AND r.location_id = d.location_id AND r.user_id = d.user_id """
+    hourly_query = """
+        UPDATE activity_hourly_rollups AS r SET message_count = GREATEST(r.message_count + d.delta, 0)
+        FROM unnest($2::DATE[], $3::BIGINT[], $4::SMALLINT[], $5::BIGINT[]) AS d(day, location_id, hour, delta)
+        WHERE r.guild_id = $1 AND r.day = d.day AND r.location_id = d.location_id AND r.hour = d.hour """
+    aggregate_tuples = [
+        (guild_id, row['user_id']) + tuple(row.get(col, 0) for col in USER_AGGREGATE_COUNT_COLUMNS)
+        for row in user_delta_rows
+    ]
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if aggregate_tuples: await conn.executemany(aggregate_query, aggregate_tuples)
+                if location_user_delta_rows:
+                    await conn.executemany(location_user_query, [(guild_id,) + tuple(row) for row in location_user_delta_rows])
+                if checkpoint_delta_rows:
+                    await conn.executemany(checkpoint_query, [(guild_id,) + tuple(row) for row in checkpoint_delta_rows])
+                for query, rows in ((daily_query, daily_delta_rows), (hourly_query, hourly_delta_rows)):
+                    if rows: await conn.execute(query, guild_id, *(list(column) for column in zip(*rows)))
+                if deleted_message_ids:
+                    await conn.execute(
+                        "DELETE FROM message_contributions WHERE guild_id = $1 AND message_id = ANY($2::BIGINT[])",
+                        guild_id, deleted_message_ids
+                    )
+                await _upsert_message_contributions(conn, guild_id, updated_index_rows)
+        return True
+    except Exception as e:
+        log.error(f"Lỗi đối soát tin bị xóa/sửa cho guild {guild_id}: {e}", exc_info=False)
+        return False
+
+async def prune_message_contributions(before_message_id: int) -> int:
+    """Xóa dòng chỉ mục của tin cũ hơn khoảng lưu giữ (mọi guild). Trả về số dòng đã xóa."""
+    if not pool: return 0
+    try:
+        async with pool.acquire() as conn:
+            status = await conn.execute("DELETE FROM message_contributions WHERE message_id <= $1", before_message_id)
+            return int(status.split()[-1]) if status else 0
+    except Exception as e:
+        log.error(f"Lỗi dọn chỉ mục tin cũ: {e}", exc_info=False)
+        return 0
+
+async def get_activity_rollup_window(guild_id: int, since_day: datetime.date, until_day: datetime.date) -> Optional[Dict[str, Any]]:
+    """
+    Tổng hợp rollup trong [since_day, until_day]:
+    {"user_counts": {user_id: số tin}, "location_hourly": {location_id: {(thứ 0-6, giờ): số tin}}, "first_day", "last_day", "day_count"}.
+    """
+    if not pool: return None
+    user_query = """
+        SELECT user_id, SUM(message_count) AS message_count FROM activity_daily_rollups
+        WHERE guild_id = $1 AND day BETWEEN $2 AND $3 GROUP BY user_id """
+    hourly_query = """
+        SELECT location_id, EXTRACT(ISODOW FROM day)::int - 1 AS weekday, hour, SUM(message_count) AS message_count
+        FROM activity_hourly_rollups
+        WHERE guild_id = $1 AND day BETWEEN $2 AND $3 GROUP BY location_id, weekday, hour """
+    coverage_query = """
+        SELECT MIN(day) AS first_day, MAX(day) AS last_day, COUNT(DISTINCT day) AS day_count FROM activity_hourly_rollups
+        WHERE guild_id = $1 AND day BETWEEN $2 AND $3 """
+    try:
+        async with pool.acquire() as conn:
+            user_rows = await conn.fetch(user_query, guild_id, since_day, until_day)
+            hourly_rows = await conn.fetch(hourly_query, guild_id, since_day, until_day)
+            coverage = await conn.fetchrow(coverage_query, guild_id, since_day, until_day)
+        location_hourly: Dict[int, Dict[Tuple[int, int], int]] = {}
+        for row in hourly_rows:
+            location_hourly.setdefault(row['location_id'], {})[(row['weekday'], row['hour'])] = row['message_count']
+        return {
+            "user_counts": {row['user_id']: row['message_count'] for row in user_rows},
+            "location_hourly": location_hourly,
+            "first_day": coverage['first_day'], "last_day": coverage['last_day'], "day_count": coverage['day_count'],
+        }
+    except Exception as e:
+        log.error(f"Lỗi đọc rollup theo ngày cho guild {guild_id}: {e}", exc_info=False)
+        return None
+
+# --- END OF FILE database.py ---
@@ -0,0 +1,210 @@
+# --- START OF FILE metrics.py ---
+import asyncio
+import bisect
+import contextlib
+import logging
+import time
+from typing import Dict, Any, List, Optional, Tuple, Callable, Sequence
+
+import config
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8" # Định dạng text exposition của Prometheus
+DEFAULT_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+REQUEST_READ_TIMEOUT_SECONDS = 5.0
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"): return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    """Một metric có nhãn (label); giá trị lưu theo tuple giá trị nhãn, không cần thư viện ngoài."""
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelKey, Any] = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        return tuple(str(labels.get(labelname, "")) for labelname in self.labelnames)
+
+    def _label_text(self, key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs: return ""
+        return "{" + ",".join(f'{labelname}="{_escape_label_value(value)}"' for labelname, value in pairs) + "}"
+
+    def clear(self, **labels):
+        """Xóa các series khớp với nhãn đã cho (không truyền nhãn = xóa hết)."""
+        if not labels:
+            self._values.clear()
+            return
+        positions = [(self.labelnames.index(labelname), str(value)) for labelname, value in labels.items()]
+        for key in [key for key in self._values if all(key[index] == value for index, value in positions)]:
+            del self._values[key]
+
+    def _sample_lines(self) -> List[str]:
+        return [f"{self.name}{self._label_text(key)} {_format_value(value)}" for key, value in self._values.items()]
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"] + self._sample_lines()
+
+
+class MetricCounter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        """Ghi tổng có sẵn từ nơi khác (vd: bộ đếm của rest_scheduler) - chỉ dùng trong collector."""
+        self._values[self._key(labels)] = value
+
+
+class MetricGauge(_Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class MetricHistogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0] # (đếm theo bucket, tổng, số lần)
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _sample_lines(self) -> List[str]:
+        lines: List[str] = []
+        for key, (bucket_counts, total, count) in self._values.items():
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._label_text(key, [('le', _format_value(upper_bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+
+_REGISTRY: List[_Metric] = []
+_COLLECTORS: List[Callable[[], None]] = []
+
+
+def register_collector(collector: Callable[[], None]):
+    """Hàm được gọi ngay trước mỗi lần render để cập nhật metric lấy từ nơi khác (vd: snapshot của rest_scheduler)."""
+    _COLLECTORS.append(collector)
+
+
+def render() -> str:
+    for collector in _COLLECTORS:
+        try:
+            collector()
+        except Exception as collect_err:
+            log.debug(f"Metrics: lỗi collector {getattr(collector, '__name__', collector)}: {collect_err}")
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Các metric của bot ---
+# Quét
+SCAN_ACTIVE = MetricGauge("shiromi_scan_active", "1 nếu guild đang được quét.", ("guild_id",))
+SCANS_FINISHED = MetricCounter("shiromi_scans_finished_total", "Số lần quét kết thúc theo trạng thái.", ("status",))
+SCAN_MESSAGES = MetricCounter("shiromi_scan_messages_total", "Số tin nhắn đã đọc từ history.", ("guild_id",))
+LOCATION_MESSAGES = MetricGauge(
+    "shiromi_scan_location_messages", "Số tin nhắn của kênh/luồng trong lần quét gần nhất.", ("guild_id", "location_id", "location")
+)
+LOCATION_SCAN_SECONDS = MetricGauge(
+    "shiromi_scan_location_duration_seconds", "Thời gian quét kênh/luồng trong lần quét gần nhất.", ("guild_id", "location_id", "location")
+)
+HISTORY_PAGE_SECONDS = MetricHistogram("shiromi_history_page_seconds", "Độ trễ một trang history (1 request REST, không tính thời gian chờ slot).", ("guild_id",))
+SCAN_PERMIT_WAIT_SECONDS = MetricHistogram("shiromi_scan_permit_wait_seconds", "Thời gian chờ permit quét kênh/luồng (AdaptiveScanLimiter).")
+SCAN_AGGREGATE_BYTES = MetricGauge("shiromi_scan_aggregate_bytes", "Bộ nhớ ước lượng của từng dữ liệu tổng hợp trong scan_data (phần còn trong RAM).", ("guild_id", "key"))
+SCAN_SPILLED_ROWS = MetricCounter("shiromi_scan_spilled_rows_total", "Số dòng dữ liệu tổng hợp đã đổ xuống SQLite khi vượt ngân sách bộ nhớ.", ("guild_id", "key"))
+# REST (rest_scheduler)
+REST_SLOT_WAIT_SECONDS = MetricHistogram("shiromi_rest_slot_wait_seconds", "Thời gian chờ slot REST theo route.", ("route",))
+REST_REQUESTS = MetricCounter("shiromi_rest_requests_total", "Số request REST đã được cấp slot theo route.", ("route",))
+REST_RATE_LIMITED = MetricCounter("shiromi_rest_rate_limited_total", "Số response 429 theo route.", ("route",))
+REST_QUEUE_DEPTH = MetricGauge("shiromi_rest_queue_depth", "Số request đang chờ slot theo route.", ("route",))
+REST_IN_FLIGHT = MetricGauge("shiromi_rest_in_flight", "Số request đang chạy theo route.", ("route",))
+REST_GLOBAL_LIMIT = MetricGauge("shiromi_rest_global_limit", "Giới hạn đồng thời tổng hiện tại của rest_scheduler.")
+# DB
+DB_FLUSH_SECONDS = MetricHistogram("shiromi_db_flush_seconds", "Thời gian ghi một lô vào DB.", ("operation",))
+# DM
+DM_REPORTS = MetricCounter("shiromi_dm_reports_total", "Số DM báo cáo theo kết quả.", ("guild_id", "status"))
+DM_BACKLOG = MetricGauge("shiromi_dm_backlog", "Số user còn chờ gửi DM báo cáo.", ("guild_id",))
+
+
+# --- HTTP endpoint ---
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), REQUEST_READ_TIMEOUT_SECONDS)
+        while True: # Bỏ qua header
+            header_line = await asyncio.wait_for(reader.readline(), REQUEST_READ_TIMEOUT_SECONDS)
+            if header_line in (b"\r\n", b"\n", b""): break
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+        if parts and parts[0] == "GET" and path in ("/", "/metrics"):
+            status, content_type, body = "200 OK", CONTENT_TYPE, render().encode("utf-8")
+        else:
+            status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as request_err:
+        log.debug(f"Metrics: lỗi xử lý request: {request_err}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server() -> Optional[asyncio.AbstractServer]:
+    """Mở endpoint /metrics (METRICS_PORT, 0 = tắt)."""
+    if config.METRICS_PORT <= 0:
+        return None
+    try:
+        server = await asyncio.start_server(_handle_request, config.METRICS_HOST, config.METRICS_PORT)
+    except OSError as bind_err:
+        log.error(f"Không mở được endpoint metrics tại {config.METRICS_HOST}:{config.METRICS_PORT}: {bind_err}")
+        return None
+    log.info(f"Endpoint metrics: http://{config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
+    return server
+
+# --- END OF FILE metrics.py ---
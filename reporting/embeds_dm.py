@@ -183,21 +183,18 @@ async def create_personal_activity_embed(
 
     if top_items_lines:
         embed.add_field(
-            name=f"⭐ Top Items Cá Nhân ({TOP_PERSONAL_ITEMS_LIMIT})",
+            name=f"⭐ Top Items Cá Nhân ({TOP_PERSONAL_ITEMS_LIMIT}){utils.since_last_scan_label(scan_data)}",
             value="\n".join(top_items_lines),
             inline=False
         )
 
     # --- Giờ Vàng Cá Nhân ---
-    user_hourly_counter: Counter = scan_data.get("user_hourly_activity", defaultdict(Counter)).get(user_id)
-    if user_hourly_counter:
+    user_hourly_grid = scan_data.get("user_hourly_activity") # ActivityGrid giờ x thứ theo user
+    golden_hour_field = f"☀️🌙 Giờ Vàng Cá Nhân{utils.since_last_scan_label(scan_data)}"
+    if user_hourly_grid is not None and user_id in user_hourly_grid:
         hourly_grouped = defaultdict(int)
-        for hour, count in user_hourly_counter.items():
-             if isinstance(hour, int) and 0 <= hour <= 23: # Thêm kiểm tra hour hợp lệ
-                start_hour = (hour // PERSONAL_GOLDEN_HOUR_INTERVAL) * PERSONAL_GOLDEN_HOUR_INTERVAL
-                hourly_grouped[start_hour] += count
-             else:
-                log.warning(f"Bỏ qua dữ liệu giờ không hợp lệ cho user {user_id}: hour={hour}")
+        for hour, count in enumerate(user_hourly_grid.hourly(user_id)):
+            if count: hourly_grouped[(hour // PERSONAL_GOLDEN_HOUR_INTERVAL) * PERSONAL_GOLDEN_HOUR_INTERVAL] += count
 
         if hourly_grouped:
             timezone_str = "UTC"
@@ -213,17 +210,20 @@ async def create_personal_activity_embed(
                 local_end_dt = local_start_dt + datetime.timedelta(hours=PERSONAL_GOLDEN_HOUR_INTERVAL)
                 time_str = f"{local_start_dt.strftime('%H:%M')} - {local_end_dt.strftime('%H:%M')}"
                 golden_hour_line = f"Khung giờ sôi nổi nhất ({timezone_str}): **{time_str}** ({max_count:,} tin)"
-                embed.add_field(name="☀️🌙 Giờ Vàng Cá Nhân", value=golden_hour_line, inline=False)
+                weekday_totals = user_hourly_grid.weekday_totals(user_id, local_offset_hours or 0)
+                best_weekday = max(range(len(weekday_totals)), key=lambda weekday: weekday_totals[weekday])
+                golden_hour_line += f"\nNgày sôi nổi nhất: **{utils.WEEKDAY_NAMES[best_weekday]}** ({weekday_totals[best_weekday]:,} tin)"
+                embed.add_field(name=golden_hour_field, value=golden_hour_line, inline=False)
             except ValueError as ve: # Bắt lỗi ValueError nếu giờ không hợp lệ
                 log.warning(f"Lỗi giá trị giờ khi tính giờ vàng cá nhân cho {user_id} (giờ={best_start_hour}): {ve}")
-                embed.add_field(name="☀️🌙 Giờ Vàng Cá Nhân", value="*Không thể xác định (lỗi giờ)*", inline=False)
+                embed.add_field(name=golden_hour_field, value="*Không thể xác định (lỗi giờ)*", inline=False)
             except Exception as gh_err:
                 log.warning(f"Lỗi tính giờ vàng cá nhân cho {user_id}: {gh_err}")
-                embed.add_field(name="☀️🌙 Giờ Vàng Cá Nhân", value="*Không thể xác định*", inline=False)
+                embed.add_field(name=golden_hour_field, value="*Không thể xác định*", inline=False)
         else:
-             embed.add_field(name="☀️🌙 Giờ Vàng Cá Nhân", value="*Chưa có dữ liệu*", inline=False)
+             embed.add_field(name=golden_hour_field, value="*Chưa có dữ liệu*", inline=False)
     else:
-         embed.add_field(name="☀️🌙 Giờ Vàng Cá Nhân", value="*Chưa có dữ liệu*", inline=False)
+         embed.add_field(name=golden_hour_field, value="*Chưa có dữ liệu*", inline=False)
 
 
     scan_end_time = scan_data.get("scan_end_time", datetime.datetime.now(datetime.timezone.utc))
@@ -5,7 +5,7 @@ import math
 import logging
 import collections
 import time
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Iterator, Tuple
 from discord.ext import commands
 from collections import Counter, defaultdict
 import asyncio
@@ -25,6 +25,32 @@ GOLDEN_HOUR_TOP_CHANNELS = 5
 CHANNEL_ACTIVITY_LIMIT = 10
 UMBRA_HOUR_INTERVAL = 3
 UMBRA_HOUR_TOP_CHANNELS = 5
+SERVER_GRID_KEY = 0 # Hàng duy nhất của ActivityGrid toàn server (cogs/deep_scan_helpers/activity_grid.py)
+TOP_WEEKDAYS_LIMIT = 3
+
+# --- Hàm phụ cho ma trận giờ x thứ (ActivityGrid) ---
+def _group_hours(hourly: List[int], interval: int) -> Dict[int, int]:
+    """Gộp 24 giờ thành các khung `interval` giờ (key = giờ bắt đầu, UTC)."""
+    grouped = {start_hour: 0 for start_hour in range(0, 24, interval)}
+    for hour, count in enumerate(hourly):
+        grouped[(hour // interval) * interval] += count
+    return grouped
+
+
+def _iter_location_hourly(channel_grid: Any, thread_grid: Any, guild: discord.Guild) -> Iterator[Tuple[int, List[int]]]:
+    """(location_id, 24 số tin theo giờ) của các kênh/luồng còn tồn tại."""
+    for grid in (channel_grid, thread_grid):
+        for loc_id in grid.keys():
+            if guild.get_channel_or_thread(loc_id): yield loc_id, grid.hourly(loc_id)
+
+
+def _weekday_lines(weekday_totals: List[int], most_active: bool) -> List[str]:
+    ranked = sorted(range(len(weekday_totals)), key=lambda weekday: weekday_totals[weekday], reverse=most_active)
+    return [
+        f"**`#{rank}`**. **{utils.WEEKDAY_NAMES[weekday]}**: {weekday_totals[weekday]:,} tin"
+        for rank, weekday in enumerate(ranked[:TOP_WEEKDAYS_LIMIT], 1)
+    ]
+
 
 # --- Embed Creation Functions ---
 
@@ -61,7 +87,7 @@ async def create_summary_embed(
     total_custom_stickers = len(scan_data.get("server_sticker_ids_cache", server.stickers))
 
     filtered_reaction_count = overall_total_reaction_count if overall_total_reaction_count is not None else 0
-    reaction_line = f"\n{e('reaction')} Tổng **{filtered_reaction_count:,}** biểu cảm (lọc)." if config.ENABLE_REACTION_SCAN else ""
+    reaction_line = f"\n{e('reaction')} Tổng **{filtered_reaction_count:,}** biểu cảm (lọc){utils.since_last_scan_label(scan_data)}." if config.ENABLE_REACTION_SCAN else ""
     scan_summary = (
         f"Quét **{processed_channels_count:,}** kênh text/voice ({skipped_channels_count} lỗi/bỏ qua).\n"
         f"Quét **{processed_threads_count:,}** luồng ({skipped_threads_count} lỗi/bỏ qua).\n"
@@ -294,15 +320,15 @@ async def create_least_channel_activity_embed(
 
 
 async def create_golden_hour_embed(
-    server_hourly_activity: Counter,
-    channel_hourly_activity: Dict[int, Counter],
-    thread_hourly_activity: Dict[int, Counter],
+    server_hourly_activity: Any,
+    channel_hourly_activity: Any,
+    thread_hourly_activity: Any,
     guild: discord.Guild,
     bot: discord.Client
 ) -> Optional[discord.Embed]:
-    """Tạo embed hiển thị khung giờ hoạt động sôi nổi nhất (Giờ Vàng)."""
+    """Tạo embed hiển thị khung giờ (và thứ trong tuần) hoạt động sôi nổi nhất (Giờ Vàng). Dữ liệu giờ là ActivityGrid."""
     e = lambda name: utils.get_emoji(name, bot)
-    if not server_hourly_activity:
+    if not server_hourly_activity.total(SERVER_GRID_KEY):
         log.debug("Không có dữ liệu giờ để tạo embed Giờ Vàng.")
         return None
 
@@ -314,13 +340,10 @@ async def create_golden_hour_embed(
         color=discord.Color.gold()
     )
 
-    hourly_grouped = defaultdict(int)
-    for hour, count in server_hourly_activity.items():
-        if isinstance(hour, int) and 0 <= hour <= 23:
-            start_hour = (hour // GOLDEN_HOUR_INTERVAL) * GOLDEN_HOUR_INTERVAL
-            hourly_grouped[start_hour] += count
-        else:
-            log.warning(f"Bỏ qua dữ liệu giờ không hợp lệ cho server: hour={hour} (type: {type(hour)})")
+    hourly_grouped = {
+        start_hour: count for start_hour, count in _group_hours(server_hourly_activity.hourly(SERVER_GRID_KEY), GOLDEN_HOUR_INTERVAL).items()
+        if count > 0
+    }
 
     if not hourly_grouped:
         log.warning("Không có dữ liệu giờ hợp lệ để tính giờ vàng server.")
@@ -368,33 +391,16 @@ async def create_golden_hour_embed(
         value="\n".join(server_golden_lines) if server_golden_lines else "Không có dữ liệu.",
         inline=False
     )
-
-    location_hourly_activity = defaultdict(Counter)
-    for loc_id, counts in channel_hourly_activity.items():
-         if guild.get_channel_or_thread(loc_id):
-             for hour, count in counts.items():
-                 if isinstance(hour, int) and 0 <= hour <= 23: location_hourly_activity[loc_id][hour] += count
-                 else: log.warning(f"Bỏ qua dữ liệu giờ không hợp lệ cho channel {loc_id}: hour={hour}")
-    for loc_id, counts in thread_hourly_activity.items():
-        if guild.get_channel_or_thread(loc_id):
-            for hour, count in counts.items():
-                if isinstance(hour, int) and 0 <= hour <= 23: location_hourly_activity[loc_id][hour] += count
-                else: log.warning(f"Bỏ qua dữ liệu giờ không hợp lệ cho thread {loc_id}: hour={hour}")
+    embed.add_field(
+        name=f"📅 Ngày Sôi Nổi Nhất Trong Tuần ({timezone_str})",
+        value="\n".join(_weekday_lines(server_hourly_activity.weekday_totals(SERVER_GRID_KEY, local_offset_hours or 0), most_active=True)),
+        inline=False
+    )
 
     location_golden_hours = {}
-    for loc_id, hourly_counts in location_hourly_activity.items():
-        if not hourly_counts: continue
-        loc_grouped = defaultdict(int)
-        for hour, count in hourly_counts.items():
-            start_hour = (hour // GOLDEN_HOUR_INTERVAL) * GOLDEN_HOUR_INTERVAL
-            loc_grouped[start_hour] += count
-        if loc_grouped:
-            try:
-                best_start_hour, max_count = max(loc_grouped.items(), key=lambda item: item[1])
-                datetime.datetime.now(datetime.timezone.utc).replace(hour=best_start_hour, minute=0)
-                location_golden_hours[loc_id] = (best_start_hour, max_count)
-            except ValueError: log.warning(f"Giờ vàng không hợp lệ ({best_start_hour}) được tính cho location {loc_id}, bỏ qua.")
-            except Exception as e_loc_gold: log.warning(f"Lỗi khi tính giờ vàng cho location {loc_id}: {e_loc_gold}")
+    for loc_id, hourly_counts in _iter_location_hourly(channel_hourly_activity, thread_hourly_activity, guild):
+        best_start_hour, max_count = max(_group_hours(hourly_counts, GOLDEN_HOUR_INTERVAL).items(), key=lambda item: item[1])
+        if max_count > 0: location_golden_hours[loc_id] = (best_start_hour, max_count)
 
     sorted_locations_by_gold = sorted(location_golden_hours.items(), key=lambda item: item[1][1], reverse=True)
 
@@ -426,15 +432,15 @@ async def create_golden_hour_embed(
 
 
 async def create_umbra_hour_embed(
-    server_hourly_activity: Counter,
-    channel_hourly_activity: Dict[int, Counter],
-    thread_hourly_activity: Dict[int, Counter],
+    server_hourly_activity: Any,
+    channel_hourly_activity: Any,
+    thread_hourly_activity: Any,
     guild: discord.Guild,
     bot: discord.Client
 ) -> Optional[discord.Embed]:
-    """Tạo embed hiển thị khung giờ hoạt động yên ắng nhất (Giờ Âm)."""
+    """Tạo embed hiển thị khung giờ (và thứ trong tuần) hoạt động yên ắng nhất (Giờ Âm). Dữ liệu giờ là ActivityGrid."""
     e = lambda name: utils.get_emoji(name, bot)
-    if not server_hourly_activity:
+    if not server_hourly_activity.total(SERVER_GRID_KEY):
         log.debug("Không có dữ liệu giờ để tạo embed Giờ Âm.")
         return None
 
@@ -447,18 +453,7 @@ async def create_umbra_hour_embed(
         color=discord.Color.dark_blue()
     )
 
-    hourly_grouped = defaultdict(int)
-    for h in range(0, 24, UMBRA_HOUR_INTERVAL): hourly_grouped[h] = 0
-    for hour, count in server_hourly_activity.items():
-        if isinstance(hour, int) and 0 <= hour <= 23:
-            start_hour = (hour // UMBRA_HOUR_INTERVAL) * UMBRA_HOUR_INTERVAL
-            hourly_grouped[start_hour] += count
-        else: log.warning(f"Bỏ qua dữ liệu giờ không hợp lệ cho server (giờ âm): hour={hour} (type: {type(hour)})")
-
-    if not hourly_grouped:
-        log.warning("Không có dữ liệu giờ hợp lệ để tính giờ âm server.")
-        return None
-
+    hourly_grouped = _group_hours(server_hourly_activity.hourly(SERVER_GRID_KEY), UMBRA_HOUR_INTERVAL)
     sorted_server_hours = sorted(hourly_grouped.items(), key=lambda item: item[1])
 
     server_umbra_lines = []
@@ -479,34 +474,16 @@ async def create_umbra_hour_embed(
         value="\n".join(server_umbra_lines) if server_umbra_lines else "Không có dữ liệu.",
         inline=False
     )
-
-    location_hourly_activity = defaultdict(Counter)
-    for loc_id, counts in channel_hourly_activity.items():
-         if guild.get_channel_or_thread(loc_id):
-             for hour, count in counts.items():
-                 if isinstance(hour, int) and 0 <= hour <= 23: location_hourly_activity[loc_id][hour] += count
-                 else: log.warning(f"Bỏ qua dữ liệu giờ không hợp lệ cho channel {loc_id} (giờ âm): hour={hour}")
-    for loc_id, counts in thread_hourly_activity.items():
-        if guild.get_channel_or_thread(loc_id):
-            for hour, count in counts.items():
-                if isinstance(hour, int) and 0 <= hour <= 23: location_hourly_activity[loc_id][hour] += count
-                else: log.warning(f"Bỏ qua dữ liệu giờ không hợp lệ cho thread {loc_id} (giờ âm): hour={hour}")
+    embed.add_field(
+        name=f"📅 Ngày Yên Ắng Nhất Trong Tuần ({timezone_str})",
+        value="\n".join(_weekday_lines(server_hourly_activity.weekday_totals(SERVER_GRID_KEY, local_offset_hours or 0), most_active=False)),
+        inline=False
+    )
 
     location_umbra_hours = {}
-    for loc_id, hourly_counts in location_hourly_activity.items():
-        if not hourly_counts: continue
-        loc_grouped = defaultdict(int)
-        for h in range(0, 24, UMBRA_HOUR_INTERVAL): loc_grouped[h] = 0
-        for hour, count in hourly_counts.items():
-            start_hour = (hour // UMBRA_HOUR_INTERVAL) * UMBRA_HOUR_INTERVAL
-            loc_grouped[start_hour] += count
-        if loc_grouped:
-            try:
-                least_start_hour, min_count = min(loc_grouped.items(), key=lambda item: item[1])
-                datetime.datetime.now(datetime.timezone.utc).replace(hour=least_start_hour, minute=0)
-                location_umbra_hours[loc_id] = (least_start_hour, min_count)
-            except ValueError: log.warning(f"Giờ âm không hợp lệ ({least_start_hour}) được tính cho location {loc_id}, bỏ qua.")
-            except Exception as e_loc_umbra: log.warning(f"Lỗi khi tính giờ âm cho location {loc_id}: {e_loc_umbra}")
+    for loc_id, hourly_counts in _iter_location_hourly(channel_hourly_activity, thread_hourly_activity, guild):
+        if not any(hourly_counts): continue
+        location_umbra_hours[loc_id] = min(_group_hours(hourly_counts, UMBRA_HOUR_INTERVAL).items(), key=lambda item: item[1])
 
     sorted_locations_by_umbra = sorted(location_umbra_hours.items(), key=lambda item: item[1][1])
 
@@ -0,0 +1,279 @@
+# --- START OF FILE rest_scheduler.py ---
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import re
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import config
+import metrics
+
+log = logging.getLogger(__name__)
+
+# --- Các route (nhóm request REST) và độ ưu tiên (số nhỏ = ưu tiên cao) ---
+ROUTE_HISTORY = "history"
+ROUTE_THREADS = "threads"
+ROUTE_AUDIT_LOG = "audit_log"
+ROUTE_MEMBER = "member"
+ROUTE_REACTIONS = "reactions"
+ROUTE_STATUS = "status"
+ROUTE_DM = "dm"
+
+ROUTE_PRIORITIES: Dict[str, int] = {
+    ROUTE_HISTORY: 0,
+    ROUTE_THREADS: 1,
+    ROUTE_AUDIT_LOG: 1,
+    ROUTE_MEMBER: 2,
+    ROUTE_REACTIONS: 3,
+    ROUTE_STATUS: 4,
+    ROUTE_DM: 5,
+}
+
+# Số request đồng thời tối đa của từng route (giới hạn tổng nằm ở REST_GLOBAL_CONCURRENCY)
+DEFAULT_ROUTE_LIMITS: Dict[str, int] = {
+    ROUTE_HISTORY: config.SCAN_CONCURRENCY_MAX, # Mỗi kênh/luồng đang quét giữ tối đa 1 request history
+    ROUTE_THREADS: 2,
+    ROUTE_AUDIT_LOG: 1,
+    ROUTE_MEMBER: 4,
+    ROUTE_REACTIONS: config.REACTION_FETCH_WORKERS,
+    ROUTE_STATUS: 1,
+    ROUTE_DM: 2,
+}
+
+ADAPTIVE_INCREASE_AFTER = 50 # Số response thành công liên tiếp (không 429) trước khi nới giới hạn thêm 1
+# Không biết lúc gửi request (không có trace on_request_start) -> coi như gửi trước đó chừng này giây
+UNKNOWN_SEND_AGE_SECONDS = 1.0
+
+# Đoán route từ request aiohttp (dùng cho thống kê 429 theo route)
+_ROUTE_PATTERNS: List[Tuple[str, "re.Pattern[str]", str]] = [
+    ("GET", re.compile(r"/channels/\d+/messages/\d+/reactions/"), ROUTE_REACTIONS),
+    ("GET", re.compile(r"/channels/\d+/messages$"), ROUTE_HISTORY),
+    ("GET", re.compile(r"/threads/archived/|/users/@me/threads/archived/"), ROUTE_THREADS),
+    ("GET", re.compile(r"/guilds/\d+/audit-logs"), ROUTE_AUDIT_LOG),
+    ("GET", re.compile(r"/guilds/\d+/members/\d+$|/users/\d+$"), ROUTE_MEMBER),
+    ("PATCH", re.compile(r"/channels/\d+/messages/\d+$"), ROUTE_STATUS),
+    ("POST", re.compile(r"/users/@me/channels$"), ROUTE_DM),
+]
+
+
+def route_for_request(method: str, path: str) -> Optional[str]:
+    for route_method, pattern, route in _ROUTE_PATTERNS:
+        if method == route_method and pattern.search(path):
+            return route
+    return None
+
+
+class _RouteStats:
+    __slots__ = ("requests", "wait_seconds_total", "max_wait_seconds", "rate_limited")
+
+    def __init__(self):
+        self.requests = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+        self.rate_limited = 0
+
+
+class RestScheduler:
+    """
+    Điều phối request REST của các bước quét: giới hạn đồng thời tổng + theo route,
+    cấp slot theo độ ưu tiên (history > ... > DM) và tự giảm/tăng giới hạn của route theo 429 quan sát được
+    (429 không đoán được route thì giảm giới hạn tổng). Mỗi lần giảm chỉ tính 429 của request gửi sau lần giảm trước,
+    nên một loạt 429 của các request đang bay cùng lúc chỉ làm giảm một lần.
+    Rate limit theo bucket vẫn do discord.py xử lý; scheduler chỉ quyết định ai được gửi request trước.
+    """
+
+    def __init__(self, global_limit: int, route_limits: Dict[str, int]):
+        self.max_global_limit = max(1, global_limit)
+        self.global_limit = self.max_global_limit
+        self.route_limits = {route: max(1, limit) for route, limit in route_limits.items()}
+        self.max_route_limits = dict(self.route_limits)
+        self._in_flight_total = 0
+        self._in_flight: Dict[str, int] = {route: 0 for route in ROUTE_PRIORITIES}
+        self._waiters: List[Tuple[int, int, str, asyncio.Future, float]] = []
+        self._sequence = itertools.count()
+        self._stats: Dict[str, _RouteStats] = {route: _RouteStats() for route in ROUTE_PRIORITIES}
+        # Theo route (None = giới hạn tổng, cho response không đoán được route)
+        self._success_streak: Dict[Optional[str], int] = {}
+        self._last_decrease_at: Dict[Optional[str], float] = {}
+        self.total_rate_limited = 0
+
+    # --- Cấp/trả slot ---
+    def _has_capacity(self, route: str) -> bool:
+        return self._in_flight_total < self.global_limit and self._in_flight[route] < self.route_limits.get(route, 1)
+
+    def _grant(self, route: str):
+        self._in_flight_total += 1
+        self._in_flight[route] += 1
+
+    def _release(self, route: str):
+        self._in_flight_total -= 1
+        self._in_flight[route] -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        blocked = []
+        while self._waiters and self._in_flight_total < self.global_limit:
+            item = heapq.heappop(self._waiters)
+            future, route = item[3], item[2]
+            if future.done(): continue # Người chờ đã bị hủy
+            if self._in_flight[route] < self.route_limits.get(route, 1):
+                self._grant(route)
+                future.set_result(None)
+            else:
+                blocked.append(item) # Route đầy nhưng route khác vẫn có thể chạy
+        for item in blocked:
+            heapq.heappush(self._waiters, item)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, route: str):
+        """Chờ tới lượt gửi request của route (dùng: `async with rest_scheduler.slot(ROUTE_HISTORY): ...`)."""
+        stats = self._stats[route]
+        enqueued_at = time.monotonic()
+        if not self._waiters and self._has_capacity(route):
+            self._grant(route)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (ROUTE_PRIORITIES[route], next(self._sequence), route, future, enqueued_at))
+            self._wake_waiters()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release(route) # Đã được cấp slot nhưng bị hủy trước khi dùng
+                else:
+                    future.cancel()
+                raise
+        waited = time.monotonic() - enqueued_at
+        metrics.REST_SLOT_WAIT_SECONDS.observe(waited, route=route)
+        stats.requests += 1
+        stats.wait_seconds_total += waited
+        if waited > stats.max_wait_seconds: stats.max_wait_seconds = waited
+        try:
+            yield
+        finally:
+            self._release(route)
+
+    # --- Điều chỉnh theo phản hồi của Discord ---
+    def _limit(self, key: Optional[str]) -> Tuple[int, int]:
+        """(giới hạn hiện tại, giới hạn tối đa) của route, hoặc của tổng khi key là None."""
+        if key is None:
+            return self.global_limit, self.max_global_limit
+        return self.route_limits[key], self.max_route_limits[key]
+
+    def _set_limit(self, key: Optional[str], new_limit: int):
+        if key is None: self.global_limit = new_limit
+        else: self.route_limits[key] = new_limit
+
+    def record_response(self, route: Optional[str], status: int, remaining: Optional[int], sent_at: Optional[float] = None):
+        """sent_at: time.monotonic() lúc gửi request (từ trace on_request_start), dùng để bỏ qua 429 đã được tính."""
+        key = route if route in self.route_limits else None
+        if status == 429:
+            self.total_rate_limited += 1
+            if route in self._stats: self._stats[route].rate_limited += 1
+            self._success_streak[key] = 0
+            now = time.monotonic()
+            if sent_at is None: sent_at = now - UNKNOWN_SEND_AGE_SECONDS
+            if sent_at < self._last_decrease_at.get(key, float("-inf")):
+                return # Request gửi trước lần giảm gần nhất: cùng đợt 429 đó, không giảm thêm
+            limit, _ = self._limit(key)
+            new_limit = max(1, limit // 2)
+            self._last_decrease_at[key] = now
+            if new_limit != limit:
+                log.warning(f"REST scheduler: gặp 429, giảm giới hạn đồng thời của {route or 'tổng'} {limit} -> {new_limit}.")
+                self._set_limit(key, new_limit)
+            return
+        if remaining == 0:
+            self._success_streak[key] = 0 # Bucket vừa cạn: chưa nới giới hạn
+            return
+        self._success_streak[key] = self._success_streak.get(key, 0) + 1
+        limit, max_limit = self._limit(key)
+        if self._success_streak[key] >= ADAPTIVE_INCREASE_AFTER and limit < max_limit:
+            self._set_limit(key, limit + 1)
+            self._success_streak[key] = 0
+            log.info(f"REST scheduler: ổn định, tăng giới hạn đồng thời của {route or 'tổng'} lên {limit + 1}.")
+            self._wake_waiters()
+
+    # --- Số liệu ---
+    @property
+    def total_requests(self) -> int:
+        return sum(stats.requests for stats in self._stats.values())
+
+    def queue_depth(self, route: Optional[str] = None) -> int:
+        return sum(1 for item in self._waiters if not item[3].done() and (route is None or item[2] == route))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Số liệu hiện tại: độ sâu hàng đợi, số request đang chạy, thời gian chờ theo route."""
+        routes = {}
+        for route, stats in self._stats.items():
+            routes[route] = {
+                "queued": self.queue_depth(route),
+                "in_flight": self._in_flight[route],
+                "limit": self.route_limits.get(route, 1),
+                "requests": stats.requests,
+                "avg_wait_ms": (stats.wait_seconds_total / stats.requests * 1000) if stats.requests else 0.0,
+                "max_wait_ms": stats.max_wait_seconds * 1000,
+                "rate_limited": stats.rate_limited,
+            }
+        return {
+            "global_limit": self.global_limit, "max_global_limit": self.max_global_limit,
+            "in_flight": self._in_flight_total, "queued": self.queue_depth(),
+            "rate_limited": self.total_rate_limited, "routes": routes,
+        }
+
+    def log_summary(self):
+        snap = self.snapshot()
+        parts = [
+            f"{route}: {data['requests']} req, chờ TB {data['avg_wait_ms']:.0f}ms (max {data['max_wait_ms']:.0f}ms), 429: {data['rate_limited']}"
+            for route, data in snap["routes"].items() if data["requests"]
+        ]
+        log.info(f"REST scheduler: giới hạn {snap['global_limit']}/{snap['max_global_limit']}, 429 tổng: {snap['rate_limited']}. " + " | ".join(parts))
+
+
+rest_scheduler = RestScheduler(config.REST_GLOBAL_CONCURRENCY, DEFAULT_ROUTE_LIMITS)
+
+
+def _collect_metrics():
+    """Chép snapshot của scheduler sang metrics ngay trước mỗi lần endpoint /metrics được đọc."""
+    snap = rest_scheduler.snapshot()
+    metrics.REST_GLOBAL_LIMIT.set(snap["global_limit"])
+    for route, data in snap["routes"].items():
+        metrics.REST_REQUESTS.set_total(data["requests"], route=route)
+        metrics.REST_RATE_LIMITED.set_total(data["rate_limited"], route=route)
+        metrics.REST_QUEUE_DEPTH.set(data["queued"], route=route)
+        metrics.REST_IN_FLIGHT.set(data["in_flight"], route=route)
+    # 429 của request không đoán được route (không đi qua scheduler)
+    metrics.REST_RATE_LIMITED.set_total(snap["rate_limited"] - sum(data["rate_limited"] for data in snap["routes"].values()), route="other")
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def slot(route: str):
+    return rest_scheduler.slot(route)
+
+
+def build_http_trace():
+    """TraceConfig aiohttp (truyền vào Bot qua `http_trace`) để scheduler thấy status 429 và X-RateLimit-Remaining."""
+    import aiohttp
+
+    async def _on_request_start(session, trace_ctx, params):
+        trace_ctx.sent_at = time.monotonic()
+
+    async def _on_request_end(session, trace_ctx, params):
+        try:
+            remaining_header = params.response.headers.get("X-RateLimit-Remaining")
+            remaining = int(remaining_header) if remaining_header is not None else None
+            route = route_for_request(params.method, params.url.path)
+            rest_scheduler.record_response(route, params.response.status, remaining, getattr(trace_ctx, "sent_at", None))
+        except Exception as trace_err:
+            log.debug(f"REST scheduler: lỗi đọc response trace: {trace_err}")
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    return trace_config
+
+# --- END OF FILE rest_scheduler.py ---
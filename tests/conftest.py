@@ -0,0 +1,20 @@
+# --- START OF FILE tests/conftest.py ---
+import os
+import sys
+import types
+
+import pytest
+
+# config.py đọc biến môi trường khi import; test không cần token thật
+os.environ.setdefault("DISCORD_TOKEN", "test-token")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture
+def fake_guild():
+    """Guild tối giản: các hàm được test chỉ đọc id/name."""
+    return types.SimpleNamespace(id=1234, name="Test Guild", emojis=[], stickers=[])
+
+# --- END OF FILE tests/conftest.py ---
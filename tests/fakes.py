@@ -0,0 +1,114 @@
+# --- START OF FILE tests/fakes.py ---
+"""
+Kênh/guild/tin nhắn giả (chỉ các thuộc tính mà bước quét history đọc, không gọi Discord).
+Dùng chung cho test và benchmark (benchmarks/ import qua `tests.fakes`).
+"""
+import asyncio
+import bisect
+import datetime
+from typing import Any, Dict, List, Optional
+
+from cogs.deep_scan_helpers.user_stats import DISCORD_EPOCH_MS
+from cogs.deep_scan_helpers.scan_concurrency import AdaptiveScanLimiter
+from cogs.deep_scan_helpers.scan_worker import _build_job_scan_data
+
+START_MS = 1_650_000_000_000
+
+
+def snowflake(timestamp_ms: int, increment: int = 0) -> int:
+    return ((timestamp_ms - DISCORD_EPOCH_MS) << 22) + increment
+
+
+class FakeUser:
+    def __init__(self, user_id: int, is_bot: bool = False):
+        self.id = user_id
+        self.bot = is_bot
+        self.display_name = f"user{user_id}"
+
+
+class FakeMessage:
+    __slots__ = ("id", "author", "content", "attachments", "stickers", "mentions", "embeds", "reactions", "reference")
+
+    def __init__(self, message_id: int, author: FakeUser, content: str = "hi"):
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.attachments = []
+        self.stickers = []
+        self.mentions = []
+        self.embeds = []
+        self.reactions = []
+        self.reference = None
+
+    @property
+    def created_at(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(((self.id >> 22) + DISCORD_EPOCH_MS) / 1000, tz=datetime.timezone.utc)
+
+    def is_system(self) -> bool:
+        return False
+
+
+class FakeLocation:
+    """Kênh giả: history() trả từng trang giống discord.py (after -> cũ tới mới, before -> mới tới cũ)."""
+    type = "text"
+
+    def __init__(self, location_id: int, name: str, messages: List[FakeMessage], page_latency: float = 0.0):
+        self.id = location_id
+        self.name = name
+        self._messages = messages # Cũ -> mới
+        self._ids = [message.id for message in messages]
+        self.last_message_id = self._ids[-1] if self._ids else None
+        self.page_requests = 0
+        self._page_latency = page_latency
+
+    async def history(self, limit=100, after=None, before=None, oldest_first=None):
+        self.page_requests += 1
+        await asyncio.sleep(self._page_latency) # Nhường event loop / giả lập độ trễ như một request REST
+        if after is not None:
+            start = bisect.bisect_right(self._ids, after.id)
+            page = self._messages[start:start + limit]
+        else:
+            end = bisect.bisect_left(self._ids, before.id) if before is not None else len(self._ids)
+            page = self._messages[max(0, end - limit):end][::-1]
+        for message in page:
+            yield message
+
+
+class FakeGuild:
+    me = None
+    emojis = ()
+
+    def __init__(self, guild_id: int = 4242):
+        self.id = guild_id
+        self.name = "Test Guild"
+
+    def get_member(self, user_id: int):
+        return None
+
+    async def fetch_member(self, user_id: int):
+        return None
+
+
+def make_location(index: int, message_count: int, users: List[FakeUser]) -> FakeLocation:
+    """Kênh thứ index với message_count tin, tác giả xoay vòng qua users."""
+    created_ms = START_MS + index * 1_000
+    messages = [
+        FakeMessage(snowflake(created_ms + 60_000 + position * 30_000, index), users[position % len(users)])
+        for position in range(message_count)
+    ]
+    return FakeLocation(snowflake(created_ms, index), f"kenh-{index}", messages)
+
+
+def make_users(count: int) -> List[FakeUser]:
+    return [FakeUser(1_000 + index) for index in range(count)]
+
+
+def new_scan_data(guild: FakeGuild, locations: List[FakeLocation], limiter: AdaptiveScanLimiter) -> Dict[str, Any]:
+    """scan_data tối thiểu cho bước quét history (giống scan_data của một job worker), với kích thước đúng của từng kênh."""
+    first_location: Optional[FakeLocation] = locations[0] if locations else None
+    job: Dict[str, Any] = {"location_id": first_location.id if first_location else 0, "scan_id": None}
+    scan_data = _build_job_scan_data(None, guild, job, {}, limiter)
+    scan_data["location_size_estimates"] = {location.id: len(location._messages) for location in locations}
+    return scan_data
+
+# --- END OF FILE tests/fakes.py ---
@@ -0,0 +1,68 @@
+# --- START OF FILE tests/test_activity_grid.py ---
+import pickle
+import datetime
+
+from cogs.deep_scan_helpers.activity_grid import ActivityGrid, GRID_CELLS, SERVER_GRID_KEY, weekday_hour_of_ms
+
+
+def _ms(dt: datetime.datetime) -> int:
+    return int(dt.timestamp() * 1000)
+
+
+def test_weekday_hour_matches_datetime():
+    for dt in (
+        datetime.datetime(1970, 1, 1, 0, 0, tzinfo=datetime.timezone.utc), # Thứ Năm
+        datetime.datetime(2024, 2, 29, 23, 59, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2025, 6, 1, 7, 30, tzinfo=datetime.timezone.utc), # Chủ Nhật
+    ):
+        assert weekday_hour_of_ms(_ms(dt)) == (dt.weekday(), dt.hour)
+
+
+def test_hourly_and_weekday_totals():
+    grid = ActivityGrid()
+    grid.add(SERVER_GRID_KEY, 0, 23, 5) # Thứ Hai 23h UTC
+    grid.add(SERVER_GRID_KEY, 6, 23, 2) # Chủ Nhật 23h UTC
+    grid.add(SERVER_GRID_KEY, 2, 10)
+    hourly = grid.hourly(SERVER_GRID_KEY)
+    assert hourly[23] == 7 and hourly[10] == 1 and sum(hourly) == 8
+    assert grid.weekday_totals(SERVER_GRID_KEY) == [5, 0, 1, 0, 0, 0, 2]
+    # UTC+7: 23h UTC là 6h sáng hôm sau; 23h Chủ Nhật sang Thứ Hai tuần sau (quay vòng)
+    assert grid.weekday_totals(SERVER_GRID_KEY, 7) == [2, 5, 1, 0, 0, 0, 0]
+    # UTC-11: 10h Thứ Tư UTC là 23h Thứ Ba
+    assert grid.weekday_totals(SERVER_GRID_KEY, -11) == [5, 1, 0, 0, 0, 0, 2]
+    assert grid.total(SERVER_GRID_KEY) == 8
+    assert grid.hourly(99) == [0] * 24 and grid.weekday_totals(99) == [0] * 7 and grid.total(99) == 0
+    assert 99 not in grid
+
+
+def test_merge_adds_rows_and_creates_missing():
+    grid = ActivityGrid()
+    grid.add(1, 0, 0, 3)
+    other = ActivityGrid()
+    other.add(2, 4, 12, 5)
+    other.add(1, 0, 0, 4)
+    other.add(1, 6, 23, 1)
+    grid.merge(other)
+    assert list(grid.keys()) == [1, 2]
+    assert grid.total(1) == 8 and grid.total(2) == 5
+    assert grid.row_cells(1)[0] == 7 and grid.row_cells(1)[GRID_CELLS - 1] == 1
+    assert other.total(1) == 5 # Ma trận nguồn không đổi
+
+
+def test_copy_is_independent_and_picklable():
+    grid = ActivityGrid()
+    grid.add(10, 1, 1, 2)
+    clone = grid.copy()
+    grid.add(10, 1, 1, 5)
+    grid.add(11, 0, 0)
+    assert clone.total(10) == 2 and 11 not in clone and len(clone) == 1
+    clone.add(12, 3, 3)
+    assert 12 not in grid
+
+    restored = pickle.loads(pickle.dumps(grid))
+    assert list(restored.keys()) == [10, 11]
+    assert restored.total(10) == 7 and restored.row_cells(11)[0] == 1
+    restored.add(13, 0, 0) # Hàng mới vẫn được gán đúng sau khi nạp lại
+    assert restored.find_row(13) == 2
+
+# --- END OF FILE tests/test_activity_grid.py ---
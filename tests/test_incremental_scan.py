@@ -0,0 +1,188 @@
+# --- START OF FILE tests/test_incremental_scan.py ---
+import asyncio
+import datetime
+from collections import Counter, defaultdict
+
+import discord
+
+import config
+import database
+import utils
+from cogs.deep_scan_helpers import incremental_scan
+from cogs.deep_scan_helpers.report_generation import label_since_last_scan
+from cogs.deep_scan_helpers.user_stats import UserStatsStore, datetime_to_ms
+from cogs.deep_scan_helpers.scan_channels import _scan_location_with_permit
+from cogs.deep_scan_helpers.scan_concurrency import AdaptiveScanLimiter
+
+from .fakes import FakeGuild, make_location, make_users, new_scan_data
+
+
+def _scan_data(guild):
+    return {
+        "server": guild, "scan_errors": [], "user_stats": UserStatsStore(),
+        "overall_total_message_count": 0,
+        "user_channel_message_counts": defaultdict(lambda: defaultdict(int)),
+    }
+
+
+def test_load_state_seeds_aggregates_and_checkpoints(monkeypatch, fake_guild):
+    seen = datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc)
+
+    async def get_checkpoints(guild_id):
+        return {10: {"last_message_id": 900, "message_count": 5}, 11: {"last_message_id": None, "message_count": 0}}
+
+    async def get_aggregates(guild_id):
+        return [
+            {"user_id": 1, "is_bot": False, "message_count": 4, "link_count": 1, "first_seen_utc": seen, "last_seen_utc": seen},
+            {"user_id": 2, "is_bot": True, "message_count": 1},
+        ]
+
+    async def get_location_counts(guild_id):
+        return {10: {1: 4, 2: 1}}
+
+    monkeypatch.setattr(config, "ENABLE_INCREMENTAL_SCAN", True)
+    monkeypatch.setattr(config, "ENABLE_ACTIVITY_ROLLUPS", False)
+    monkeypatch.setattr(database, "get_location_scan_checkpoints", get_checkpoints)
+    monkeypatch.setattr(database, "get_user_activity_aggregates", get_aggregates)
+    monkeypatch.setattr(database, "get_location_user_message_counts", get_location_counts)
+    monkeypatch.setattr(incremental_scan, "start_message_index", lambda scan_data: None)
+
+    scan_data = _scan_data(fake_guild)
+    asyncio.run(incremental_scan.load_incremental_scan_state(scan_data))
+
+    stats = scan_data["user_stats"]
+    assert scan_data["incremental_mode"] is True
+    assert scan_data["location_checkpoints"] == {10: 900} # Checkpoint không có ID bị bỏ qua
+    assert scan_data["overall_total_message_count"] == 5
+    assert stats.message_count[stats.find_row(1)] == 4
+    assert stats.link_count[stats.find_row(1)] == 1
+    assert stats.first_seen_ms[stats.find_row(1)] == datetime_to_ms(seen)
+    assert stats.is_bot[stats.find_row(2)] == 1
+    assert scan_data["user_channel_message_counts"][1][10] == 4
+    # Seed của location không tính bot vào author_counts
+    assert scan_data["incremental_location_seeds"][10] == {"message_count": 5, "author_counts": Counter({1: 4})}
+
+
+def test_load_state_skips_keyword_scans(monkeypatch, fake_guild):
+    async def must_not_be_called(guild_id):
+        raise AssertionError("không được đọc DB khi quét có keywords")
+
+    monkeypatch.setattr(config, "ENABLE_INCREMENTAL_SCAN", True)
+    monkeypatch.setattr(database, "get_location_scan_checkpoints", must_not_be_called)
+    monkeypatch.setattr(incremental_scan, "start_message_index", lambda scan_data: None)
+    scan_data = _scan_data(fake_guild)
+    scan_data["target_keywords"] = ["abc"]
+    asyncio.run(incremental_scan.load_incremental_scan_state(scan_data))
+    assert scan_data["incremental_mode"] is False
+    assert scan_data["location_checkpoints"] == {}
+
+
+def test_collect_checkpoint_rows_counts_partial_failures():
+    scan_data = {"channel_details": [
+        {"id": 1, "newest_message_id": 50, "message_count": 3, "new_message_count": 3, "threads_data": [
+            {"id": 2, "parent_channel_id": 1, "newest_message_id": 70, "message_count": 2, "new_message_count": 2, "error": "Forbidden"},
+        ]},
+        {"id": 3, "message_count": 0}, # Bỏ qua (không quét)
+    ]}
+    rows, partial_failures = incremental_scan._collect_checkpoint_rows(scan_data)
+    assert [row["location_id"] for row in rows] == [1, 2]
+    assert rows[1]["parent_channel_id"] == 1
+    assert partial_failures == 1
+
+
+def test_save_state_refuses_partial_full_scan(monkeypatch, fake_guild):
+    async def must_not_be_called(*args, **kwargs):
+        raise AssertionError("không được lưu khi quét toàn bộ bị lỗi giữa chừng")
+
+    monkeypatch.setattr(config, "ENABLE_INCREMENTAL_SCAN", True)
+    monkeypatch.setattr(database, "save_incremental_scan_state", must_not_be_called)
+    scan_data = _scan_data(fake_guild)
+    scan_data["channel_details"] = [{"id": 1, "newest_message_id": 5, "new_message_count": 1, "error": "timeout"}]
+    assert asyncio.run(incremental_scan.save_incremental_scan_state(scan_data)) is False
+    assert scan_data["scan_errors"]
+
+
+def test_failed_middle_range_blocks_incremental_checkpoint(monkeypatch):
+    """Quét tăng dần chia khoảng: khoảng giữa lỗi sau khi khoảng sau đã đọc tin mới hơn -> không được lưu checkpoint."""
+    monkeypatch.setattr(config, "SCAN_RANGE_SPLIT_MIN_MESSAGES", 100)
+    monkeypatch.setattr(config, "SCAN_RANGE_SPLIT_MAX_PARTS", 4)
+    monkeypatch.setattr(config, "SCAN_RECORD_DIR", "")
+    monkeypatch.setattr(config, "ENABLE_INCREMENTAL_SCAN", True)
+    location = make_location(0, 800, make_users(3))
+    ids = location._ids
+    checkpoint_id = ids[99] # Lần trước đã quét tới tin thứ 100
+    fail_from = ids[350] # Nằm trong khoảng thứ 2
+    original_history = location.history
+    later_range_pages = []
+
+    async def flaky_history(limit=100, after=None, before=None, oldest_first=None):
+        if after is not None and fail_from <= after.id < ids[450]:
+            raise RuntimeError("mất kết nối")
+        if after is not None and after.id >= ids[450]:
+            later_range_pages.append(after.id)
+        async for message in original_history(limit=limit, after=after, before=before, oldest_first=oldest_first):
+            yield message
+
+    location.history = flaky_history
+    scan_data = new_scan_data(FakeGuild(), [location], AdaptiveScanLimiter(4, 1, 4))
+    scan_data["incremental_mode"] = True
+    scan_data["location_checkpoints"] = {location.id: checkpoint_id}
+    result = asyncio.run(_scan_location_with_permit(scan_data, location))
+    assert result["scan_direction"] == "ranges"
+    assert result["error"] and later_range_pages
+    assert result["newest_message_id"] > fail_from # Tin mới nhất đã đọc nằm sau phần chưa quét của khoảng lỗi
+
+    async def must_not_be_called(*args, **kwargs):
+        raise AssertionError("không được lưu checkpoint vượt qua phần chưa quét")
+
+    monkeypatch.setattr(database, "save_incremental_scan_state", must_not_be_called)
+    scan_data["channel_details"] = [result]
+    assert asyncio.run(incremental_scan.save_incremental_scan_state(scan_data)) is False
+    assert "Không lưu checkpoint quét tăng dần" in scan_data["scan_errors"][-1]
+
+
+def test_failed_sequential_incremental_location_still_saves(monkeypatch, fake_guild):
+    """Quét tăng dần tuần tự cũ -> mới: tin mới nhất đã xử lý vẫn là checkpoint hợp lệ khi lỗi giữa chừng."""
+    saved = {}
+
+    async def save_state(guild_id, checkpoint_rows, *args, **kwargs):
+        saved["rows"] = checkpoint_rows
+        return True
+
+    monkeypatch.setattr(config, "ENABLE_INCREMENTAL_SCAN", True)
+    monkeypatch.setattr(database, "save_incremental_scan_state", save_state)
+    monkeypatch.setattr(incremental_scan, "message_index_rows", lambda scan_data: [])
+    scan_data = _scan_data(fake_guild)
+    scan_data["incremental_mode"] = True
+    scan_data["channel_details"] = [{"id": 1, "newest_message_id": 5, "new_message_count": 1, "error": "timeout", "scan_direction": "after"}]
+    assert asyncio.run(incremental_scan.save_incremental_scan_state(scan_data)) is True
+    assert saved["rows"][0]["last_message_id"] == 5
+
+
+def test_build_rows_from_store():
+    stats = UserStatsStore()
+    row = stats.row(7)
+    stats.message_count[row] = 3
+    stats.touch_seen(row, 1_700_000_000_000)
+    aggregate_rows = incremental_scan.build_user_aggregate_rows(stats)
+    assert aggregate_rows[0]["user_id"] == 7
+    assert aggregate_rows[0]["message_count"] == 3
+    assert aggregate_rows[0]["first_seen_utc"] == aggregate_rows[0]["last_seen_utc"]
+
+    location_rows = incremental_scan.build_location_user_rows({"user_channel_message_counts": {7: {10: 3, 11: 0}}})
+    assert location_rows == [(10, 7, 3)]
+
+
+def test_run_only_sections_are_labelled_in_incremental_reports():
+    # Số liệu theo giờ/emoji/reaction không được nạp lại -> ghi chú thay vì lẫn với tổng toàn thời gian
+    assert utils.since_last_scan_label({"incremental_mode": True})
+    assert utils.since_last_scan_label({"incremental_mode": False}) == ""
+    with_footer = discord.Embed(title="x")
+    with_footer.set_footer(text="★ = Sticker của Server này.")
+    label_since_last_scan(with_footer)
+    assert with_footer.footer.text == f"{utils.SINCE_LAST_SCAN_NOTE} | ★ = Sticker của Server này."
+    without_footer = discord.Embed(title="y")
+    label_since_last_scan(without_footer)
+    assert without_footer.footer.text == utils.SINCE_LAST_SCAN_NOTE
+
+# --- END OF FILE tests/test_incremental_scan.py ---
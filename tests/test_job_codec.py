@@ -0,0 +1,82 @@
+# --- START OF FILE tests/test_job_codec.py ---
+import asyncio
+import datetime
+import json
+import pickle
+from array import array
+from collections import Counter, defaultdict
+
+import pytest
+
+import config
+from cogs.deep_scan_helpers import job_codec
+from cogs.deep_scan_helpers.job_codec import JobPayloadError
+from cogs.deep_scan_helpers.scan_channels import _scan_location_with_permit
+from cogs.deep_scan_helpers.scan_concurrency import AdaptiveScanLimiter
+from cogs.deep_scan_helpers.scan_jobs import decode_job_result, decode_job_spec, serialize_job_result
+
+from .fakes import FakeGuild, make_location, make_users, new_scan_data
+
+
+def _round_trip(value):
+    return job_codec.decode_value(json.loads(job_codec.dumps(value)))
+
+
+def test_round_trip_keeps_key_and_container_types():
+    value = {
+        1: Counter({"👍": 2, 123: 1}), # Key emoji: unicode hoặc ID emoji server
+        (5, 6, 7): [1, 2.5, None, True],
+        "nested": defaultdict(Counter, {9: Counter({"a": 1})}),
+        "ids": {1, 2}, "pair": (1, "x"),
+        "at": datetime.datetime(2024, 1, 2, 3, 4, tzinfo=datetime.timezone.utc), "day": datetime.date(2024, 1, 2),
+        "cells": array('i', [1, -2, 3]),
+    }
+    decoded = _round_trip(value)
+    assert decoded == value
+    assert type(decoded[1]) is Counter and type(decoded["nested"]) is defaultdict
+    assert decoded["nested"].default_factory is Counter
+    assert decoded["cells"].typecode == 'i'
+
+
+def test_job_result_round_trip_matches_scan(monkeypatch):
+    monkeypatch.setattr(config, "SCAN_RECORD_DIR", "")
+    location = make_location(0, 250, make_users(4))
+    scan_data = new_scan_data(FakeGuild(), [location], AdaptiveScanLimiter(1, 1, 1))
+    result = asyncio.run(_scan_location_with_permit(scan_data, location))
+
+    payload = decode_job_result(json.loads(serialize_job_result(scan_data, result)))
+    aggregates = payload["aggregates"]
+    stats, original = aggregates["user_stats"], scan_data["user_stats"]
+    assert list(stats.user_ids) == list(original.user_ids)
+    assert list(stats.message_count) == list(original.message_count)
+    assert stats.find_row(original.user_ids[0]) == 0
+    assert aggregates["server_hourly_activity"].hourly(0) == scan_data["server_hourly_activity"].hourly(0)
+    assert aggregates["user_channel_message_counts"] == {user_id: dict(counts) for user_id, counts in scan_data["user_channel_message_counts"].items()}
+    assert payload["result"]["message_count"] == 250
+    assert payload["result"]["author_counts"] == result["author_counts"]
+
+
+@pytest.mark.parametrize("data", [
+    {"$pickle": "gASVAAAAAAAAAAA="}, # Tag lạ
+    {"$o": ["os_system", {}]}, # Lớp ngoài danh sách
+    {"$o": ["activity_grid", {"cells": {"$a": ["i", ""]}}]}, # Thiếu field
+    {"$dd": ["eval", []]}, # default_factory ngoài danh sách
+    {"$a": ["O", ""]}, # Kiểu array lạ
+    {"a": 1, "b": 2}, # Object JSON không có tag
+    {"$t": "abc"},
+])
+def test_rejects_unknown_payloads(data):
+    with pytest.raises(JobPayloadError):
+        job_codec.decode_value(data)
+
+
+def test_spec_and_result_validation():
+    assert decode_job_spec(json.loads(job_codec.dumps({"estimate": 5, "keywords": ["a"]}))) == {"estimate": 5, "keywords": ["a"]}
+    with pytest.raises(JobPayloadError):
+        decode_job_spec(json.loads(job_codec.dumps({"estimate": 5, "command": "rm"})))
+    with pytest.raises(JobPayloadError):
+        decode_job_result(json.loads(job_codec.dumps({"result": {}, "aggregates": {"bot": 1}})))
+    with pytest.raises(TypeError):
+        job_codec.dumps({"value": pickle}) # Kiểu ngoài danh sách không được gửi đi
+
+# --- END OF FILE tests/test_job_codec.py ---
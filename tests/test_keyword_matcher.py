@@ -0,0 +1,69 @@
+# --- START OF FILE tests/test_keyword_matcher.py ---
+import random
+
+import pytest
+
+from cogs.deep_scan_helpers import keyword_matcher
+from cogs.deep_scan_helpers.keyword_matcher import KeywordMatcher, MATCH_MODES, MATCH_MODE_WORD
+
+KEYWORDS = ["shiromi", "aa", "c++", "trời", "_x", "2024", "!", "ăn gì"]
+CORPUS = [
+    "shiromi shiromi_bot @shiromi, shiromi2 (shiromi)",
+    "aaaa aa aa_aa baa aa.aa",
+    "c++ c++17 học c++! xc++ c++_",
+    "hôm nay trời đẹp, trờiơi trời_ ơitrời trời",
+    "_x __x _x_ a_x _x. x_x",
+    "năm 2024 20245 x2024 2024年 2024",
+    "!! ! a!b !",
+    "ăn gì chưa? ăn gìa bạn ăn gì",
+    "café shiromí 🙂shiromi🙂",
+    "",
+]
+
+
+def _both_paths(keywords, mode, monkeypatch):
+    monkeypatch.setattr(keyword_matcher, "AHO_CORASICK_MIN_KEYWORDS", len(keywords) + 1)
+    small = KeywordMatcher(keywords, mode)
+    monkeypatch.setattr(keyword_matcher, "AHO_CORASICK_MIN_KEYWORDS", 1)
+    automaton = KeywordMatcher(keywords, mode)
+    assert not small.use_automaton and automaton.use_automaton
+    return small, automaton
+
+
+@pytest.mark.parametrize("mode", MATCH_MODES)
+def test_same_counts_on_both_paths(mode, monkeypatch):
+    small, automaton = _both_paths(KEYWORDS, mode, monkeypatch)
+    for text in CORPUS:
+        assert small.count(text) == automaton.count(text), text
+
+
+@pytest.mark.parametrize("mode", MATCH_MODES)
+def test_same_counts_on_random_corpus(mode, monkeypatch):
+    rng = random.Random(6)
+    alphabet = "ab_1 !.-é́"
+    for _ in range(500):
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3))) for _ in range(rng.randint(1, 4))]
+        small, automaton = _both_paths(keywords, mode, monkeypatch)
+        for _ in range(5):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+            assert small.count(text) == automaton.count(text), (keywords, text)
+
+
+def test_word_mode_counts():
+    matcher = KeywordMatcher(KEYWORDS, MATCH_MODE_WORD)
+    assert matcher.count(CORPUS[0]) == {"shiromi": 3}
+    assert matcher.count(CORPUS[1]) == {"aa": 3}
+    assert matcher.count(CORPUS[2]) == {"c++": 2, "!": 1} # "c++!": "+" không phải chữ -> "!" đứng riêng
+    assert matcher.count(CORPUS[3]) == {"trời": 2}
+
+
+def test_adding_keyword_past_threshold_keeps_counts():
+    base = KEYWORDS + [f"pad{index}" for index in range(keyword_matcher.AHO_CORASICK_MIN_KEYWORDS - len(KEYWORDS) - 1)]
+    for mode in MATCH_MODES:
+        below = KeywordMatcher(base, mode)
+        above = KeywordMatcher(base + ["extra"], mode)
+        assert not below.use_automaton and above.use_automaton
+        for text in CORPUS:
+            assert below.count(text) == above.count(text), text
+
+# --- END OF FILE tests/test_keyword_matcher.py ---
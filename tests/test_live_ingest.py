@@ -0,0 +1,122 @@
+# --- START OF FILE tests/test_live_ingest.py ---
+import asyncio
+import types
+
+import config
+import database
+from cogs.deep_scan_helpers.live_ingest import LiveIngestor, LiveMessage, LiveReaction
+from cogs.deep_scan_helpers.scan_channels import MessageRecord
+
+GUILD_ID = 1234
+TRACKED_LOCATION = 10 # Có checkpoint = 500
+UNTRACKED_LOCATION = 99 # Tạo trước khi ghi nhận, không có checkpoint
+
+
+def _record(message_id, author_id, content="hi https://x.y", is_bot=False):
+    return MessageRecord(message_id, author_id, is_bot, content, 0, 0, (), (), False)
+
+
+class FakeActivityDB:
+    def __init__(self):
+        self.calls = []
+        self.fail = False
+
+    async def get_location_scan_checkpoints(self, guild_id):
+        return {TRACKED_LOCATION: {"last_message_id": 500}}
+
+    async def apply_live_activity(self, guild_id, user_rows, location_user_rows, checkpoint_rows, daily_rows, hourly_rows, index_rows=None):
+        if self.fail:
+            return False
+        self.calls.append({"users": {row["user_id"]: row for row in user_rows}, "locations": sorted(location_user_rows), "checkpoints": checkpoint_rows})
+        return True
+
+
+def _ingestor(monkeypatch):
+    monkeypatch.setattr(config, "ENABLE_ACTIVITY_ROLLUPS", False)
+    monkeypatch.setattr(config, "ENABLE_INCREMENTAL_SCAN", False)
+    fake_db = FakeActivityDB()
+    monkeypatch.setattr(database, "get_location_scan_checkpoints", fake_db.get_location_scan_checkpoints)
+    monkeypatch.setattr(database, "apply_live_activity", fake_db.apply_live_activity)
+    guild = types.SimpleNamespace(id=GUILD_ID, emojis=[], stickers=[])
+    bot = types.SimpleNamespace(get_guild=lambda guild_id: guild if guild_id == GUILD_ID else None)
+    return LiveIngestor(bot), fake_db
+
+
+def test_events_held_during_scan_only_count_past_checkpoint(monkeypatch):
+    ingestor, fake_db = _ingestor(monkeypatch)
+
+    async def scenario():
+        await ingestor.pause_guild(GUILD_ID)
+        state = ingestor._states[GUILD_ID]
+        new_location = state.live_since_id + 5_000 # Tạo sau khi bắt đầu ghi nhận -> tính mọi tin
+        state.pending_messages += [
+            LiveMessage(TRACKED_LOCATION, None, False, _record(450, 1)), # Quét đã đọc
+            LiveMessage(TRACKED_LOCATION, None, False, _record(600, 1)),
+            LiveMessage(TRACKED_LOCATION, None, False, _record(700, 2)),
+            LiveMessage(UNTRACKED_LOCATION, None, False, _record(800, 1)), # Không theo dõi liên tục -> bỏ
+            LiveMessage(new_location, TRACKED_LOCATION, True, _record(new_location + 1, 3)),
+        ]
+        state.pending_reactions += [
+            LiveReaction(TRACKED_LOCATION, 450, 2, 1, 1, True), # Giữ lúc quét, tin quét đã đọc -> bỏ
+            LiveReaction(TRACKED_LOCATION, 600, 2, 1, 1, True),
+        ]
+        await ingestor.resume_guild(GUILD_ID, scan_state_saved=True)
+        await ingestor.flush()
+        # Sau khi live: gỡ reaction vào tin cũ vẫn được tính (không còn giữ lại)
+        state.pending_reactions.append(LiveReaction(TRACKED_LOCATION, 450, 2, None, -1, False))
+        await ingestor.flush()
+        return state, new_location
+
+    state, new_location = asyncio.run(scenario())
+    first, second = fake_db.calls
+    assert first["users"][1]["message_count"] == 1
+    assert first["users"][1]["link_count"] == 1
+    assert first["users"][1]["reaction_received_count"] == 1
+    assert first["users"][2]["message_count"] == 1
+    assert first["users"][2]["reaction_given_count"] == 1
+    assert first["users"][3]["message_count"] == 1
+    assert first["locations"] == [(TRACKED_LOCATION, 1, 1), (TRACKED_LOCATION, 2, 1), (new_location, 3, 1)]
+    assert {row["location_id"]: row["last_message_id"] for row in first["checkpoints"]} == {TRACKED_LOCATION: 700, new_location: new_location + 1}
+    assert second["users"] == {2: second["users"][2]} and second["users"][2]["reaction_given_count"] == -1
+    assert state.checkpoints[TRACKED_LOCATION] == 700
+    assert ingestor.ingested_messages == 3
+    assert ingestor.skipped_events == 3
+
+
+def test_failed_flush_keeps_events_and_checkpoints(monkeypatch):
+    ingestor, fake_db = _ingestor(monkeypatch)
+
+    async def scenario():
+        await ingestor.pause_guild(GUILD_ID)
+        await ingestor.resume_guild(GUILD_ID, scan_state_saved=True)
+        state = ingestor._states[GUILD_ID]
+        state.pending_messages.append(LiveMessage(TRACKED_LOCATION, None, False, _record(900, 1)))
+        fake_db.fail = True
+        await ingestor.flush()
+        assert state.pending_count() == 1 and state.checkpoints[TRACKED_LOCATION] == 500
+        fake_db.fail = False
+        await ingestor.flush()
+        return state
+
+    state = asyncio.run(scenario())
+    assert len(fake_db.calls) == 1 and fake_db.calls[0]["users"][1]["message_count"] == 1
+    assert state.checkpoints[TRACKED_LOCATION] == 900
+    assert ingestor.failed_flushes == 1
+
+
+def test_scan_without_saved_state_drops_held_events(monkeypatch):
+    ingestor, fake_db = _ingestor(monkeypatch)
+
+    async def scenario():
+        await ingestor.pause_guild(GUILD_ID)
+        state = ingestor._states[GUILD_ID]
+        state.pending_messages.append(LiveMessage(TRACKED_LOCATION, None, False, _record(900, 1)))
+        await ingestor.resume_guild(GUILD_ID, scan_state_saved=False)
+        await ingestor.flush()
+        return state
+
+    state = asyncio.run(scenario())
+    assert not state.live and state.pending_count() == 0
+    assert fake_db.calls == []
+
+# --- END OF FILE tests/test_live_ingest.py ---
@@ -0,0 +1,34 @@
+# --- START OF FILE tests/test_member_snapshot.py ---
+import asyncio
+
+import utils
+
+
+def test_snapshot_outlives_command_while_dm_task_holds_it(monkeypatch, fake_guild):
+    flushed = []
+
+    async def fake_remember(profiles):
+        flushed.append(profiles)
+
+    monkeypatch.setattr(utils, "remember_user_profiles", fake_remember)
+
+    async def run():
+        snapshot = utils.MemberSnapshot(fake_guild, [], complete=True)
+        utils.set_member_snapshot(snapshot)
+        snapshot.acquire() # Task gửi DM
+        await utils.release_member_snapshot(fake_guild, snapshot) # Lệnh quét kết thúc trước
+        assert utils.get_member_snapshot(fake_guild) is snapshot and not flushed
+
+        # Lần quét mới đặt snapshot khác trước khi task DM cũ xong: không được xóa nhầm
+        newer = utils.MemberSnapshot(fake_guild, [], complete=True)
+        utils.set_member_snapshot(newer)
+        await utils.release_member_snapshot(fake_guild, snapshot)
+        assert len(flushed) == 1
+        assert utils.get_member_snapshot(fake_guild) is newer
+
+        await utils.release_member_snapshot(fake_guild)
+        assert utils.get_member_snapshot(fake_guild) is None and len(flushed) == 2
+
+    asyncio.run(run())
+
+# --- END OF FILE tests/test_member_snapshot.py ---
@@ -0,0 +1,115 @@
+# --- START OF FILE tests/test_message_reconcile.py ---
+import asyncio
+import time
+import types
+
+import config
+import database
+from cogs.deep_scan_helpers.message_index import CONTRIBUTION_COLUMNS
+from cogs.deep_scan_helpers.message_reconcile import MessageReconciler
+from cogs.deep_scan_helpers.user_stats import ms_to_snowflake
+
+GUILD_ID = 1234
+LOCATION_ID = 10
+
+
+def _counts(**values):
+    return [values.get(column, 0) for column in CONTRIBUTION_COLUMNS]
+
+
+class FakeIndexDB:
+    def __init__(self, rows):
+        self.rows = rows
+        self.applied = []
+        self.fail = False
+
+    async def get_message_contributions(self, guild_id, message_ids):
+        return {message_id: self.rows[message_id] for message_id in message_ids if message_id in self.rows}
+
+    async def apply_message_reconciliation(self, guild_id, user_rows, location_user_rows, checkpoint_rows, daily_rows, hourly_rows, removed_ids, updated_index_rows):
+        if self.fail:
+            return False
+        self.applied.append({
+            "users": {row.pop("user_id"): row for row in user_rows}, "location_users": location_user_rows,
+            "checkpoints": checkpoint_rows, "daily": daily_rows, "hourly": hourly_rows,
+            "removed": removed_ids, "updated": updated_index_rows,
+        })
+        return True
+
+
+def _setup(monkeypatch, rows):
+    monkeypatch.setattr(config, "MESSAGE_INDEX_RETENTION_DAYS", 30)
+    monkeypatch.setattr(config, "ENABLE_ACTIVITY_ROLLUPS", True)
+    fake_db = FakeIndexDB(rows)
+    monkeypatch.setattr(database, "get_message_contributions", fake_db.get_message_contributions)
+    monkeypatch.setattr(database, "apply_message_reconciliation", fake_db.apply_message_reconciliation)
+    guild = types.SimpleNamespace(id=GUILD_ID, emojis=[])
+    bot = types.SimpleNamespace(get_guild=lambda guild_id: guild, get_cog=lambda name: None)
+    return MessageReconciler(bot), fake_db
+
+
+def test_delete_and_edit_deltas(monkeypatch):
+    base_id = ms_to_snowflake(int(time.time() * 1000) - 60_000)
+    deleted_id, edited_id, unchanged_id, unknown_id = base_id + 1, base_id + 2, base_id + 3, base_id + 4
+    rows = {
+        deleted_id: {"author_id": 1, "location_id": LOCATION_ID, "is_bot": False,
+                     "counts": _counts(link_count=1, emoji_count=2, mention_given_count=1), "mention_ids": [5]},
+        edited_id: {"author_id": 2, "location_id": LOCATION_ID, "is_bot": False,
+                    "counts": _counts(mention_given_count=1), "mention_ids": [6]},
+        unchanged_id: {"author_id": 3, "location_id": LOCATION_ID, "is_bot": False, "counts": _counts(), "mention_ids": []},
+    }
+    reconciler, fake_db = _setup(monkeypatch, rows)
+    reconciler.on_delete(GUILD_ID, [deleted_id, unknown_id])
+    reconciler.on_edit(GUILD_ID, deleted_id, {"content": "bị xóa rồi"}) # Đã xóa -> bỏ qua
+    reconciler.on_edit(GUILD_ID, edited_id, {"content": "https://a.b https://c.d"})
+    reconciler.on_edit(GUILD_ID, edited_id, {"mentions": [{"id": "7"}, {"id": "8", "bot": True}]}) # Gộp với lần sửa trước
+    reconciler.on_edit(GUILD_ID, unchanged_id, {"content": "vẫn không có link"})
+    reconciler.on_edit(GUILD_ID, unchanged_id, {"pinned": True}) # Không ảnh hưởng số liệu
+    asyncio.run(reconciler.flush())
+
+    (applied,) = fake_db.applied
+    users = applied["users"]
+    assert users[1] == {"message_count": -1, "link_count": -1, "emoji_count": -2, "mention_given_count": -1,
+                        **{column: 0 for column in CONTRIBUTION_COLUMNS if column not in ("link_count", "emoji_count", "mention_given_count")}}
+    assert users[5]["mention_received_count"] == -1
+    assert users[2] == {"link_count": 2} # Chỉ cột thay đổi (vẫn mention 1 người)
+    assert users[6]["mention_received_count"] == -1 and users[7]["mention_received_count"] == 1
+    assert 3 not in users
+    assert applied["location_users"] == [(LOCATION_ID, 1, -1)]
+    assert applied["checkpoints"] == [(LOCATION_ID, -1)]
+    assert [row[-1] for row in applied["daily"]] == [-1] and [row[-1] for row in applied["hourly"]] == [-1]
+    assert applied["removed"] == [deleted_id]
+    assert applied["updated"] == [(edited_id, LOCATION_ID, 2, False, _counts(link_count=2, mention_given_count=1), [7])]
+    assert reconciler.unindexed_events == 1
+    assert reconciler.reconciled_deletes == 1 and reconciler.reconciled_edits == 1
+
+
+def test_old_messages_are_not_queued(monkeypatch):
+    reconciler, fake_db = _setup(monkeypatch, {})
+    old_id = ms_to_snowflake(int(time.time() * 1000) - 40 * 86_400_000)
+    reconciler.on_delete(GUILD_ID, [old_id])
+    reconciler.on_edit(GUILD_ID, old_id + 1, {"content": "x"})
+    assert GUILD_ID not in reconciler._states or reconciler._states[GUILD_ID].pending_count() == 0
+
+
+def test_failed_apply_requeues_and_paused_guild_waits(monkeypatch):
+    message_id = ms_to_snowflake(int(time.time() * 1000)) + 1
+    rows = {message_id: {"author_id": 1, "location_id": LOCATION_ID, "is_bot": False, "counts": _counts(), "mention_ids": []}}
+    reconciler, fake_db = _setup(monkeypatch, rows)
+
+    async def scenario():
+        await reconciler.pause_guild(GUILD_ID)
+        reconciler.on_delete(GUILD_ID, [message_id])
+        await reconciler.flush()
+        assert fake_db.applied == [] # Đang quét: chưa đối soát
+        reconciler.resume_guild(GUILD_ID)
+        fake_db.fail = True
+        await reconciler.flush()
+        assert reconciler._states[GUILD_ID].deleted_ids == {message_id}
+        fake_db.fail = False
+        await reconciler.flush()
+
+    asyncio.run(scenario())
+    assert len(fake_db.applied) == 1 and fake_db.applied[0]["removed"] == [message_id]
+
+# --- END OF FILE tests/test_message_reconcile.py ---
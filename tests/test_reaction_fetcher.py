@@ -0,0 +1,201 @@
+# --- START OF FILE tests/test_reaction_fetcher.py ---
+import asyncio
+import types
+from collections import Counter, defaultdict
+
+import config
+import database
+from cogs.deep_scan_helpers import reaction_fetcher
+from cogs.deep_scan_helpers.reaction_fetcher import ReactionFetcher, ReactionJob
+from cogs.deep_scan_helpers.user_stats import UserStatsStore
+
+from .fakes import FakeGuild, FakeUser
+
+
+class FakeReaction:
+    def __init__(self, emoji, user_ids):
+        self.emoji = emoji
+        self._users = [FakeUser(user_id) for user_id in user_ids] + [FakeUser(9_999, is_bot=True)]
+        self.fetches = 0
+
+    async def users(self):
+        self.fetches += 1
+        for user in self._users:
+            yield user
+
+
+class FakeReactionCache:
+    def __init__(self, rows):
+        self.rows = rows # {(message_id, emoji_key): (count, user_ids)}
+        self.lookups = []
+        self.saved = []
+        self.touched = []
+
+    async def get_reaction_user_cache(self, guild_id, message_ids):
+        self.lookups.append(sorted(message_ids))
+        return {key: value for key, value in self.rows.items() if key[0] in message_ids}
+
+    async def save_reaction_user_cache(self, guild_id, rows):
+        self.saved.extend(rows)
+        return True
+
+    async def touch_reaction_user_cache(self, guild_id, keys):
+        self.touched.extend(keys)
+
+
+def _patch_cache(monkeypatch, cache):
+    for name in ("get_reaction_user_cache", "save_reaction_user_cache", "touch_reaction_user_cache"):
+        monkeypatch.setattr(database, name, getattr(cache, name))
+
+
+def test_cache_lookups_are_batched_across_pages(monkeypatch):
+    cache = FakeReactionCache({(1, "👍"): (2, [10, 11]), (2, "👍"): (5, [10])}) # Tin 2 đổi số lượt thả -> fetch lại
+    _patch_cache(monkeypatch, cache)
+    scan_data = {"server": FakeGuild(), "user_stats": UserStatsStore(), "user_reaction_emoji_given_counts": defaultdict(Counter)}
+    changed = FakeReaction("👍", [12])
+    new = FakeReaction("🔥", [10])
+
+    async def scenario():
+        fetcher = ReactionFetcher(scan_data, worker_count=2, queue_size=10)
+        fetcher.start()
+        await fetcher.submit_many([ReactionJob(1, "👍", 2, FakeReaction("👍", []))]) # Trang 1
+        await fetcher.submit_many([ReactionJob(2, "👍", 1, changed), ReactionJob(1, "👍", 2, None)]) # Trang 2 (job trùng bị bỏ)
+        await fetcher.submit_many([ReactionJob(3, "🔥", 1, new)]) # Trang 3
+        assert cache.lookups == [] # Chưa đủ lô -> chưa tra DB
+        await fetcher.close()
+        return fetcher
+
+    fetcher = asyncio.run(scenario())
+    assert cache.lookups == [[1, 2, 3]] # Một lần tra cho cả 3 trang
+    assert fetcher.cache_hit_count == 1 and fetcher.fetched_count == 2
+    assert (changed.fetches, new.fetches) == (1, 1)
+    assert cache.touched == [(1, "👍")]
+    assert sorted(cache.saved) == [(2, "👍", 1, [12]), (3, "🔥", 1, [10])]
+    stats = scan_data["user_stats"]
+    assert {stats.user_ids[row]: stats.reaction_given_count[row] for row in stats.iter_rows()} == {10: 2, 11: 1, 12: 1}
+    assert scan_data["user_reaction_emoji_given_counts"][10] == Counter({"👍": 1, "🔥": 1})
+    assert fetcher._outstanding == {}
+
+
+def test_full_batch_is_looked_up_immediately(monkeypatch):
+    cache = FakeReactionCache({})
+    _patch_cache(monkeypatch, cache)
+    monkeypatch.setattr(reaction_fetcher, "CACHE_LOOKUP_JOBS", 2)
+    scan_data = {"server": FakeGuild(), "user_stats": UserStatsStore()}
+
+    async def scenario():
+        fetcher = ReactionFetcher(scan_data, worker_count=1, queue_size=10)
+        fetcher.start()
+        await fetcher.submit_many([ReactionJob(1, "a", 1, FakeReaction("a", [10])), ReactionJob(2, "a", 1, FakeReaction("a", [11]))])
+        assert cache.lookups == [[1, 2]]
+        await fetcher.close()
+
+    asyncio.run(scenario())
+    assert len(cache.lookups) == 1
+
+
+def test_dedup_state_does_not_grow_with_scan(monkeypatch):
+    """Bộ lọc trùng chỉ giữ job chưa xong: quét nhiều trang không làm nó lớn dần."""
+    cache = FakeReactionCache({(message_id, "a"): (1, [10]) for message_id in range(200)})
+    _patch_cache(monkeypatch, cache)
+    monkeypatch.setattr(reaction_fetcher, "CACHE_LOOKUP_JOBS", 10)
+    scan_data = {"server": FakeGuild(), "user_stats": UserStatsStore()}
+
+    async def scenario():
+        fetcher = ReactionFetcher(scan_data, worker_count=1, queue_size=10)
+        fetcher.start()
+        peak = 0
+        for page_start in range(0, 200, 10):
+            await fetcher.submit_many([ReactionJob(message_id, "a", 1, None) for message_id in range(page_start, page_start + 10)])
+            peak = max(peak, len(fetcher._outstanding))
+        await fetcher.close()
+        return fetcher, peak
+
+    fetcher, peak = asyncio.run(scenario())
+    assert fetcher.cache_hit_count == 200
+    assert peak == 0 and fetcher._outstanding == {}
+
+
+class FakeReactionGuild(FakeGuild):
+    """Guild có kênh trả lại tin nhắn theo ID (cho job nạp lại từ checkpoint)."""
+
+    def __init__(self, messages):
+        super().__init__()
+        self.fetched_message_ids = []
+        guild = self
+
+        class _Location:
+            async def fetch_message(self, message_id):
+                guild.fetched_message_ids.append(message_id)
+                return messages[message_id]
+
+        self._location = _Location()
+
+    def get_channel_or_thread(self, location_id):
+        return self._location if location_id == 77 else None
+
+
+class BlockingReaction(FakeReaction):
+    """Reaction mà worker lấy người thả mãi không xong (job đang fetch lúc chụp checkpoint)."""
+
+    async def users(self):
+        self.fetches += 1
+        await asyncio.Event().wait()
+        yield None
+
+
+def test_pending_jobs_survive_checkpoint_and_resume(monkeypatch):
+    cache = FakeReactionCache({(3, "a"): (1, [13])})
+    _patch_cache(monkeypatch, cache)
+    monkeypatch.setattr(reaction_fetcher, "CACHE_LOOKUP_JOBS", 2)
+    monkeypatch.setattr(config, "REACTION_FETCH_WORKERS", 2)
+    monkeypatch.setattr(config, "REACTION_FETCH_QUEUE_SIZE", 10)
+
+    async def crash_mid_scan():
+        scan_data = {"server": FakeGuild(), "user_stats": UserStatsStore()}
+        fetcher = ReactionFetcher(scan_data, worker_count=1, queue_size=10)
+        fetcher.start()
+        await fetcher.submit_many([ReactionJob(1, "a", 1, BlockingReaction("a", [11]), 77), ReactionJob(2, "a", 1, FakeReaction("a", [12]), 77)])
+        await asyncio.sleep(0) # Job 1 đang fetch, job 2 nằm trong hàng đợi
+        await fetcher.submit_many([ReactionJob(3, "a", 1, FakeReaction("a", [13]), 77)]) # Chưa tra cache
+        assert fetcher._in_flight == 1
+        pending = fetcher.pending_jobs()
+        await fetcher.abort()
+        return pending
+
+    pending = asyncio.run(crash_mid_scan())
+    assert sorted(pending) == [(77, 1, "a", 1), (77, 2, "a", 1), (77, 3, "a", 1)]
+
+    messages = {message_id: types.SimpleNamespace(reactions=[FakeReaction("a", [10 + message_id])]) for message_id in (1, 2)}
+    guild = FakeReactionGuild(messages)
+    resumed = {"server": guild, "user_stats": UserStatsStore(), "can_scan_reactions": True, "resume_reaction_jobs": pending}
+
+    async def resume():
+        fetcher = reaction_fetcher.start_reaction_fetcher(resumed)
+        await fetcher.close()
+        return fetcher
+
+    fetcher = asyncio.run(resume())
+    assert "resume_reaction_jobs" not in resumed
+    assert fetcher.cache_hit_count == 1 and fetcher.fetched_count == 2
+    assert sorted(guild.fetched_message_ids) == [1, 2] # Cache trúng thì không lấy lại tin nhắn
+    stats = resumed["user_stats"]
+    assert {stats.user_ids[row]: stats.reaction_given_count[row] for row in stats.iter_rows()} == {11: 1, 12: 1, 13: 1}
+    assert fetcher.pending_jobs() == []
+
+
+def test_prune_uses_retention_setting(monkeypatch):
+    calls = []
+
+    async def prune(older_than_days):
+        calls.append(older_than_days)
+        return 3
+
+    monkeypatch.setattr(database, "prune_reaction_user_cache", prune)
+    monkeypatch.setattr(config, "REACTION_CACHE_RETENTION_DAYS", 0)
+    asyncio.run(reaction_fetcher.prune_reaction_cache())
+    monkeypatch.setattr(config, "REACTION_CACHE_RETENTION_DAYS", 45)
+    asyncio.run(reaction_fetcher.prune_reaction_cache())
+    assert calls == [45]
+
+# --- END OF FILE tests/test_reaction_fetcher.py ---
@@ -0,0 +1,80 @@
+# --- START OF FILE tests/test_rest_scheduler.py ---
+import asyncio
+import time
+
+from rest_scheduler import (
+    ADAPTIVE_INCREASE_AFTER, ROUTE_DM, ROUTE_HISTORY, ROUTE_REACTIONS, RestScheduler, route_for_request,
+)
+
+
+def _scheduler():
+    return RestScheduler(16, {ROUTE_HISTORY: 8, ROUTE_REACTIONS: 4, ROUTE_DM: 2})
+
+
+def test_burst_of_429s_decreases_once():
+    scheduler = _scheduler()
+    sent_at = time.monotonic()
+    for _ in range(8): # 8 request gửi cùng lúc đều nhận 429
+        scheduler.record_response(ROUTE_HISTORY, 429, None, sent_at)
+    assert scheduler.route_limits[ROUTE_HISTORY] == 4
+    assert scheduler.total_rate_limited == 8
+    assert scheduler.global_limit == 16 # Route khác không bị ảnh hưởng
+    assert scheduler.route_limits[ROUTE_REACTIONS] == 4
+
+    # Request gửi sau lần giảm vẫn 429 -> giảm tiếp
+    scheduler.record_response(ROUTE_HISTORY, 429, None, time.monotonic())
+    assert scheduler.route_limits[ROUTE_HISTORY] == 2
+
+
+def test_429_without_send_time_uses_window():
+    scheduler = _scheduler()
+    scheduler.record_response(ROUTE_REACTIONS, 429, None)
+    scheduler.record_response(ROUTE_REACTIONS, 429, None) # Ngay sau lần giảm -> coi là cùng đợt
+    assert scheduler.route_limits[ROUTE_REACTIONS] == 2
+
+
+def test_unknown_route_decreases_global_limit():
+    scheduler = _scheduler()
+    scheduler.record_response(None, 429, None, time.monotonic())
+    assert scheduler.global_limit == 8
+    assert scheduler.route_limits[ROUTE_HISTORY] == 8
+
+
+def test_route_limit_recovers_after_successes():
+    scheduler = _scheduler()
+    scheduler.record_response(ROUTE_DM, 429, None, time.monotonic())
+    assert scheduler.route_limits[ROUTE_DM] == 1
+    for _ in range(ADAPTIVE_INCREASE_AFTER - 1):
+        scheduler.record_response(ROUTE_DM, 200, 5)
+    scheduler.record_response(ROUTE_DM, 200, 0) # Bucket cạn -> đếm lại từ đầu
+    assert scheduler.route_limits[ROUTE_DM] == 1
+    for _ in range(ADAPTIVE_INCREASE_AFTER * 3):
+        scheduler.record_response(ROUTE_DM, 200, 5)
+    assert scheduler.route_limits[ROUTE_DM] == 2 # Không vượt giới hạn cấu hình
+
+
+def test_slots_follow_route_priority():
+    async def scenario():
+        scheduler = RestScheduler(1, {ROUTE_HISTORY: 1, ROUTE_DM: 1})
+        order = []
+
+        async def _request(route, name):
+            async with scheduler.slot(route):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        async with scheduler.slot(ROUTE_DM):
+            tasks = [asyncio.create_task(_request(ROUTE_DM, "dm")), asyncio.create_task(_request(ROUTE_HISTORY, "history"))]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["history", "dm"]
+
+
+def test_route_for_request():
+    assert route_for_request("GET", "/api/v10/channels/1/messages") == ROUTE_HISTORY
+    assert route_for_request("GET", "/api/v10/channels/1/messages/2/reactions/x") == ROUTE_REACTIONS
+    assert route_for_request("DELETE", "/api/v10/channels/1/messages") is None
+
+# --- END OF FILE tests/test_rest_scheduler.py ---
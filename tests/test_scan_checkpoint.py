@@ -0,0 +1,157 @@
+# --- START OF FILE tests/test_scan_checkpoint.py ---
+import asyncio
+import threading
+import types
+from collections import Counter, defaultdict
+
+import config
+from cogs.deep_scan_helpers import scan_checkpoint, scan_memory
+from cogs.deep_scan_helpers.scan_concurrency import AdaptiveScanLimiter
+
+from .fakes import FakeGuild, make_location, make_users, new_scan_data
+
+
+def _fresh_scan_data(guild):
+    scan_data = new_scan_data(guild, [], AdaptiveScanLimiter(1, 1, 1))
+    scan_data["scan_errors"] = []
+    return scan_data
+
+
+def _fill(scan_data):
+    stats = scan_data["user_stats"]
+    row = stats.row(1_000)
+    stats.message_count[row] = 42
+    stats.touch_seen(row, 1_700_000_000_000)
+    stats.distinct_mentions[row] = {1_001, 1_002}
+    scan_data["overall_total_message_count"] = 42
+    scan_data["keyword_counts"]["shiromi"] = 3
+    scan_data["user_channel_message_counts"][1_000][55] = 42
+    scan_data["user_reaction_emoji_given_counts"][1_000]["👍"] = 2
+    scan_data["server_hourly_activity"].add(0, 2, 13, 42)
+    scan_data["scan_errors"].append("lỗi cũ")
+    scan_data["completed_location_results"] = {55: {"id": 55, "message_count": 42, "threads_data": [{"id": 56}]}}
+    scan_data["active_location_progress"] = {77: {
+        "direction": "ranges", "cursor": None, "message_count": 5, "new_message_count": 5,
+        "newest_message_id": 900, "author_counts": Counter({1_000: 5}), "oldest_messages": None,
+        "ranges": [{"after": 100, "stop": 500, "done": True}, {"after": 600, "stop": None, "done": False}],
+    }}
+
+
+def test_checkpoint_round_trip_uses_snapshot(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "SCAN_CHECKPOINT_DIR", str(tmp_path))
+    guild = FakeGuild()
+    scan_data = _fresh_scan_data(guild)
+    _fill(scan_data)
+    scan_data["reaction_fetcher"] = types.SimpleNamespace(pending_jobs=lambda: [(77, 5, "👍", 2)])
+
+    # Vòng quét vẫn ghi tiếp trong lúc thread pickle: file phải giữ số liệu lúc chụp
+    original_dump = scan_checkpoint._dump_checkpoint
+
+    def _dump_while_scanning(path, checkpoint):
+        stats = scan_data["user_stats"]
+        stats.message_count[stats.row(1_000)] += 100
+        stats.distinct_mentions[stats.row(1_000)].add(1_003)
+        scan_data["keyword_counts"]["shiromi"] += 100
+        scan_data["user_channel_message_counts"][1_000][55] += 100
+        scan_data["server_hourly_activity"].add(0, 2, 13, 100)
+        scan_data["active_location_progress"][77]["ranges"][1]["after"] = 700
+        return original_dump(path, checkpoint)
+
+    monkeypatch.setattr(scan_checkpoint, "_dump_checkpoint", _dump_while_scanning)
+    assert asyncio.run(scan_checkpoint.save_scan_checkpoint(scan_data))
+
+    checkpoint = asyncio.run(scan_checkpoint.load_scan_checkpoint(guild.id))
+    assert checkpoint is not None
+    restored = _fresh_scan_data(guild)
+    scan_checkpoint.restore_scan_checkpoint(restored, checkpoint)
+
+    stats = restored["user_stats"]
+    row = stats.find_row(1_000)
+    assert stats.message_count[row] == 42
+    assert stats.distinct_mentions[row] == {1_001, 1_002}
+    assert restored["overall_total_message_count"] == 42
+    assert restored["keyword_counts"] == Counter({"shiromi": 3})
+    assert restored["user_channel_message_counts"][1_000][55] == 42
+    assert restored["user_reaction_emoji_given_counts"][1_000] == Counter({"👍": 2})
+    assert restored["server_hourly_activity"].total(0) == 42
+    assert restored["scan_errors"] == ["lỗi cũ"]
+    assert restored["resumed_location_results"][55]["threads_data"] == []
+    cursor = restored["resume_location_cursors"][77]
+    assert cursor["ranges"][1] == {"after": 600, "stop": None, "done": False}
+    assert cursor["author_counts"] == Counter({1_000: 5})
+    assert restored["resume_reaction_jobs"] == [(77, 5, "👍", 2)] # Job reaction chưa xong được lấy lại khi resume
+
+    scan_checkpoint.remove_scan_checkpoint(guild.id)
+    assert asyncio.run(scan_checkpoint.load_scan_checkpoint(guild.id)) is None
+
+
+def test_checkpoint_with_spilled_keys(monkeypatch, tmp_path):
+    """Bảng đã đổ: bản chụp SQLite gồm phần trong file + phần còn trong RAM + lần đổ đang dở, chụp trong thread."""
+    monkeypatch.setattr(config, "SCAN_CHECKPOINT_DIR", str(tmp_path / "ckpt"))
+    monkeypatch.setattr(config, "SCAN_SPILL_DIR", str(tmp_path / "spill"))
+    monkeypatch.setattr(scan_memory, "SPILL_CHUNK_ROWS", 2)
+    guild = FakeGuild()
+    key = "user_channel_message_counts"
+
+    async def _scenario():
+        scan_data = _fresh_scan_data(guild)
+        scan_data["scan_id"] = 1
+        for user_id in range(1, 4):
+            scan_data[key][user_id][55] = user_id
+        await scan_memory.spill_key(scan_data, key) # Đã nằm trong file
+        scan_data[key][1][55] += 10 # Phần trong RAM sau khi đổ
+        scan_data["user_keyword_counts"] = defaultdict(Counter, {user_id: Counter({"a": 1}) for user_id in range(1, 6)})
+        spill_task = asyncio.create_task(scan_memory.spill_key(scan_data, "user_keyword_counts"))
+        await asyncio.sleep(0) # Ghi xong lô đầu (2 user), 3 user còn dở
+        store = scan_data["spill_store"]
+        assert store.pending_items()
+
+        original_write = store.write_snapshot
+        loop_thread = threading.get_ident()
+
+        def _write_while_scanning(path, deltas):
+            assert threading.get_ident() != loop_thread
+            scan_data[key][2][55] += 100 # Vòng quét vẫn ghi vào RAM, không được lọt vào bản chụp
+            return original_write(path, deltas)
+
+        monkeypatch.setattr(store, "write_snapshot", _write_while_scanning)
+        assert await scan_checkpoint.save_scan_checkpoint(scan_data)
+        await spill_task
+        assert dict(scan_data[key].items()) == {1: {55: 11}, 2: {55: 102}, 3: {55: 3}}
+        assert len(scan_data["user_keyword_counts"]) == 5
+
+        checkpoint = await scan_checkpoint.load_scan_checkpoint(guild.id)
+        restored = _fresh_scan_data(guild)
+        restored["scan_id"] = 2
+        scan_checkpoint.restore_scan_checkpoint(restored, checkpoint)
+        assert isinstance(restored[key], scan_memory.SpilledNestedCounts)
+        assert dict(restored[key].items()) == {1: {55: 11}, 2: {55: 2}, 3: {55: 3}}
+        assert {user_id: dict(counts) for user_id, counts in restored["user_keyword_counts"].items()} == {user_id: {"a": 1} for user_id in range(1, 6)}
+        scan_memory.release_spill_store(scan_data)
+        scan_memory.release_spill_store(restored)
+
+    asyncio.run(_scenario())
+
+
+def test_resumed_range_cursor_finishes_location(monkeypatch, tmp_path):
+    """Resume location chia khoảng: khoảng đã xong không quét lại, khoảng dở tiếp tục từ cursor."""
+    from cogs.deep_scan_helpers.scan_channels import _scan_location_with_permit
+    monkeypatch.setattr(config, "SCAN_RECORD_DIR", "")
+    location = make_location(0, 300, make_users(3))
+    ids = location._ids
+    limiter = AdaptiveScanLimiter(2, 1, 2)
+    scan_data = new_scan_data(FakeGuild(), [location], limiter)
+    # Khoảng 1 (tin 0..149) đã xong, khoảng 2 đã quét tới tin 199
+    scan_data["resume_location_cursors"] = {location.id: {
+        "direction": "ranges", "cursor": None, "message_count": 200, "new_message_count": 200,
+        "newest_message_id": ids[199], "author_counts": Counter(), "oldest_messages": None,
+        "ranges": [{"after": location.id - 1, "stop": ids[150], "done": True}, {"after": ids[199], "stop": None, "done": False}],
+    }}
+    result = asyncio.run(_scan_location_with_permit(scan_data, location))
+    assert result["error"] is None
+    assert result["message_count"] == 300
+    assert result["new_message_count"] == 300
+    assert result["newest_message_id"] == ids[-1]
+    assert scan_data["overall_total_message_count"] == 100 # Chỉ phần chưa quét
+
+# --- END OF FILE tests/test_scan_checkpoint.py ---
@@ -0,0 +1,63 @@
+# --- START OF FILE tests/test_scan_concurrency.py ---
+import asyncio
+
+import config
+from cogs.deep_scan_helpers.scan_concurrency import AdaptiveScanLimiter, create_scan_limiter
+
+
+def test_limits_are_clamped(monkeypatch):
+    limiter = AdaptiveScanLimiter(initial_limit=50, min_limit=0, max_limit=8)
+    assert (limiter.min_limit, limiter.limit, limiter.max_limit) == (1, 8, 8)
+    limiter.set_limit(0)
+    assert limiter.limit == 1
+    monkeypatch.setattr(config, "MAX_CONCURRENT_CHANNEL_SCANS", 3)
+    monkeypatch.setattr(config, "SCAN_CONCURRENCY_MAX", 9)
+    assert (create_scan_limiter().limit, create_scan_limiter().max_limit) == (3, 9)
+
+
+def test_cancelled_waiter_does_not_leak_permit():
+    async def scenario():
+        limiter = AdaptiveScanLimiter(1, 1, 1)
+
+        async def _wait():
+            async with limiter.permit():
+                await asyncio.sleep(10)
+
+        async with limiter.permit():
+            waiter = asyncio.create_task(_wait())
+            await asyncio.sleep(0)
+            assert limiter.waiting == 1
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            assert limiter.waiting == 0
+        assert limiter.active == 0
+        async with limiter.permit(): # Không còn người chờ đã hủy chặn đường
+            assert limiter.active == 1
+
+    asyncio.run(scenario())
+
+
+def test_raising_limit_wakes_waiters():
+    async def scenario():
+        limiter = AdaptiveScanLimiter(1, 1, 3)
+        started = []
+        release = asyncio.Event()
+
+        async def _scan(name):
+            async with limiter.permit():
+                started.append(name)
+                await release.wait()
+
+        tasks = [asyncio.create_task(_scan(name)) for name in ("a", "b", "c")]
+        await asyncio.sleep(0)
+        assert started == ["a"]
+        limiter.set_limit(3)
+        await asyncio.sleep(0)
+        assert sorted(started) == ["a", "b", "c"]
+        release.set()
+        await asyncio.gather(*tasks)
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+# --- END OF FILE tests/test_scan_concurrency.py ---
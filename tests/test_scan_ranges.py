@@ -0,0 +1,129 @@
+# --- START OF FILE tests/test_scan_ranges.py ---
+import asyncio
+from collections import Counter
+
+import config
+from cogs.deep_scan_helpers.scan_channels import _scan_location_with_permit
+from cogs.deep_scan_helpers.scan_concurrency import AdaptiveScanLimiter
+from cogs.deep_scan_helpers.scan_planner import plan_history_ranges
+
+from .fakes import FakeGuild, make_location, make_users, new_scan_data
+
+
+def _split_config(monkeypatch, min_messages: int = 100, max_parts: int = 4):
+    monkeypatch.setattr(config, "SCAN_RANGE_SPLIT_MIN_MESSAGES", min_messages)
+    monkeypatch.setattr(config, "SCAN_RANGE_SPLIT_MAX_PARTS", max_parts)
+    monkeypatch.setattr(config, "SCAN_RECORD_DIR", "")
+
+
+def test_plan_history_ranges_covers_location(monkeypatch):
+    _split_config(monkeypatch, min_messages=100, max_parts=4)
+    location = make_location(0, 1_000, make_users(3))
+    ranges = plan_history_ranges({"location_size_estimates": {location.id: 1_000}}, location)
+    assert len(ranges) == 4
+    assert ranges[0]["after"] == location.id - 1
+    assert ranges[-1]["stop"] is None
+    for previous, current in zip(ranges, ranges[1:]):
+        assert previous["stop"] == current["after"] + 1 # Khoảng liên tiếp, không chồng/hở
+    assert not any(history_range["done"] for history_range in ranges)
+
+
+def test_plan_history_ranges_small_location_not_split(monkeypatch):
+    _split_config(monkeypatch, min_messages=100)
+    location = make_location(0, 150, make_users(3))
+    assert plan_history_ranges({"location_size_estimates": {location.id: 150}}, location) == []
+    monkeypatch.setattr(config, "SCAN_RANGE_SPLIT_MIN_MESSAGES", 0)
+    assert plan_history_ranges({"location_size_estimates": {location.id: 10_000}}, location) == []
+
+
+def test_try_acquire_never_jumps_the_queue():
+    async def scenario():
+        limiter = AdaptiveScanLimiter(1, 1, 1)
+        assert limiter.try_acquire()
+        assert not limiter.try_acquire() # Hết permit
+        waiter = asyncio.create_task(_hold(limiter))
+        await asyncio.sleep(0)
+        limiter.release() # Permit chuyển cho người đang chờ, không cho try_acquire
+        assert not limiter.try_acquire()
+        await waiter
+        assert limiter.active == 0
+        assert limiter.try_acquire()
+        limiter.release()
+
+    async def _hold(limiter):
+        async with limiter.permit():
+            await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+
+
+def test_permits_granted_largest_first():
+    async def scenario():
+        limiter = AdaptiveScanLimiter(1, 1, 1)
+        order = []
+
+        async def _scan(name, priority):
+            async with limiter.permit(priority=priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        async with limiter.permit():
+            tasks = [asyncio.create_task(_scan(name, priority)) for name, priority in (("nho", 1), ("lon", 100), ("vua", 10))]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["lon", "vua", "nho"]
+
+
+def test_split_channels_finish_with_fewer_permits_than_channels(monkeypatch):
+    """Giới hạn 2 permit, 6 kênh đều bị chia 4 khoảng: trước đây kênh giữ permit rồi chờ permit cho khoảng phụ -> treo."""
+    _split_config(monkeypatch, min_messages=100, max_parts=4)
+    users = make_users(7)
+    locations = [make_location(index, 450 + index * 10, users) for index in range(6)]
+    limiter = AdaptiveScanLimiter(2, 1, 2)
+    scan_data = new_scan_data(FakeGuild(), locations, limiter)
+
+    async def scenario():
+        return await asyncio.wait_for(
+            asyncio.gather(*(_scan_location_with_permit(scan_data, location) for location in locations)), timeout=10
+        )
+
+    results = asyncio.run(scenario())
+    assert [result["error"] for result in results] == [None] * len(locations)
+    assert [result["message_count"] for result in results] == [len(location._messages) for location in locations]
+    assert limiter.active == 0
+    expected_counts = Counter(message.author.id for location in locations for message in location._messages)
+    stats = scan_data["user_stats"]
+    assert Counter({stats.user_ids[row]: stats.message_count[row] for row in stats.iter_rows()}) == expected_counts
+    assert scan_data["overall_total_message_count"] == sum(expected_counts.values())
+
+
+def test_ranges_use_free_permits(monkeypatch):
+    """Còn permit trống thì các khoảng của một kênh được quét song song và permit phụ được trả lại."""
+    _split_config(monkeypatch, min_messages=100, max_parts=4)
+    location = make_location(0, 2_000, make_users(3))
+    limiter = AdaptiveScanLimiter(4, 1, 4)
+    scan_data = new_scan_data(FakeGuild(), [location], limiter)
+    peak_active = 0
+
+    async def _watch():
+        nonlocal peak_active
+        while True:
+            peak_active = max(peak_active, limiter.active)
+            await asyncio.sleep(0)
+
+    async def scenario():
+        watcher = asyncio.create_task(_watch())
+        try:
+            return await asyncio.wait_for(_scan_location_with_permit(scan_data, location), timeout=10)
+        finally:
+            watcher.cancel()
+
+    result = asyncio.run(scenario())
+    assert result["error"] is None
+    assert result["message_count"] == 2_000
+    assert peak_active == 4
+    assert limiter.active == 0
+
+# --- END OF FILE tests/test_scan_ranges.py ---
@@ -0,0 +1,103 @@
+# --- START OF FILE tests/test_scan_worker.py ---
+import asyncio
+import json
+from collections import Counter
+
+import config
+import database
+from cogs.deep_scan_helpers import job_codec
+from cogs.deep_scan_helpers.scan_jobs import JOB_KIND_CHANNEL, decode_job_result, merge_partial_aggregates
+from cogs.deep_scan_helpers.scan_worker import ScanWorker
+from cogs.deep_scan_helpers.user_stats import UserStatsStore
+
+from .fakes import FakeGuild, make_location, make_users
+
+
+class FakeLocationSource:
+    def __init__(self, guild, locations):
+        self.guild = guild
+        self.locations = {location.id: location for location in locations}
+
+    async def wait_until_ready(self):
+        return
+
+    def guild_ids(self):
+        return [self.guild.id]
+
+    async def get_guild(self, guild_id):
+        return self.guild if guild_id == self.guild.id else None
+
+    async def get_location(self, guild, location_id):
+        return self.locations[location_id]
+
+
+class FakeJobQueue:
+    """Bảng scan_jobs trong bộ nhớ (thay cho các hàm database của worker); cột JSONB đọc ra qua json.loads như codec asyncpg."""
+
+    def __init__(self, guild, locations):
+        self.pending = [
+            {
+                "job_id": index, "scan_id": 1, "guild_id": guild.id, "location_id": location.id,
+                "kind": JOB_KIND_CHANNEL, "attempts": 1,
+                "spec": json.loads(job_codec.dumps({"estimate": len(location._messages)})),
+            }
+            for index, location in enumerate(locations)
+        ]
+        self.results = {}
+        self.failures = []
+
+    async def claim_scan_job(self, worker_id, guild_ids):
+        return self.pending.pop(0) if self.pending else None
+
+    async def complete_scan_job(self, job_id, worker_id, result):
+        self.results[job_id] = decode_job_result(json.loads(result))
+        return True
+
+    async def fail_scan_job(self, job_id, worker_id, error, max_attempts):
+        self.failures.append((job_id, error))
+
+    async def heartbeat_scan_jobs(self, worker_id, job_ids):
+        return
+
+
+def test_worker_finishes_more_split_jobs_than_concurrency(monkeypatch):
+    monkeypatch.setattr(config, "SCAN_RANGE_SPLIT_MIN_MESSAGES", 100)
+    monkeypatch.setattr(config, "SCAN_RANGE_SPLIT_MAX_PARTS", 4)
+    monkeypatch.setattr(config, "SCAN_RECORD_DIR", "")
+    monkeypatch.setattr(config, "SCAN_JOB_POLL_SECONDS", 0.01)
+    guild = FakeGuild()
+    users = make_users(5)
+    locations = [make_location(index, 500 + index * 7, users) for index in range(7)]
+    queue = FakeJobQueue(guild, locations)
+    for name in ("claim_scan_job", "complete_scan_job", "fail_scan_job", "heartbeat_scan_jobs"):
+        monkeypatch.setattr(database, name, getattr(queue, name))
+
+    worker = ScanWorker(None, location_source=FakeLocationSource(guild, locations), concurrency=2, worker_id="test")
+    helper_permits = 0
+    original_try_acquire = worker.range_limiter.try_acquire
+
+    def _counting_try_acquire():
+        nonlocal helper_permits
+        acquired = original_try_acquire()
+        helper_permits += acquired
+        return acquired
+
+    worker.range_limiter.try_acquire = _counting_try_acquire
+    asyncio.run(asyncio.wait_for(worker.run(stop_when_idle=True), timeout=10))
+
+    assert queue.failures == []
+    assert worker.completed_jobs == len(locations)
+    assert helper_permits > 0 # Khoảng phụ chạy bằng ngân sách riêng
+    assert worker.limiter.active == 0 and worker.range_limiter.active == 0
+
+    # Gộp kết quả từng phần như coordinator: số tin theo user khớp với nguồn giả
+    merged = {"user_stats": UserStatsStore(), "overall_total_message_count": 0}
+    for payload in queue.results.values():
+        assert payload["result"]["error"] is None
+        merge_partial_aggregates(merged, payload["aggregates"])
+    stats = merged["user_stats"]
+    expected_counts = Counter(message.author.id for location in locations for message in location._messages)
+    assert Counter({stats.user_ids[row]: stats.message_count[row] for row in stats.iter_rows()}) == expected_counts
+    assert merged["overall_total_message_count"] == sum(expected_counts.values())
+
+# --- END OF FILE tests/test_scan_worker.py ---
@@ -0,0 +1,84 @@
+# --- START OF FILE tests/test_user_stats.py ---
+import pickle
+from collections import Counter, defaultdict
+
+from cogs.deep_scan_helpers.user_stats import (
+    UserStatsStore, finalize_user_metrics, ms_to_snowflake, snowflake_to_ms,
+)
+
+
+def _store(entries):
+    stats = UserStatsStore()
+    for user_id, message_count, seen_ms in entries:
+        row = stats.row(user_id)
+        stats.message_count[row] += message_count
+        stats.touch_seen(row, seen_ms)
+    return stats
+
+
+def test_merge_adds_counts_and_widens_seen_range():
+    left = _store([(1, 3, 2_000), (2, 1, 5_000)])
+    left.distinct_mentions[left.row(1)] = {9}
+    right = _store([(1, 2, 1_000), (3, 7, 9_000)])
+    right.is_bot[right.row(3)] = 1
+    right.distinct_mentions[right.row(1)] = {8}
+    right.touch_seen(right.row(1), 4_000)
+
+    left.merge(right)
+    row = left.find_row(1)
+    assert left.message_count[row] == 5
+    assert (left.first_seen_ms[row], left.last_seen_ms[row]) == (1_000, 4_000)
+    assert left.distinct_mentions[row] == {8, 9}
+    assert left.is_bot[left.find_row(3)] == 1
+    assert left.counter("message_count") == Counter({1: 5, 2: 1, 3: 7})
+
+
+def test_copy_is_independent_and_picklable():
+    stats = _store([(1, 3, 2_000)])
+    stats.distinct_mentions[0] = {5}
+    clone = stats.copy()
+    stats.message_count[0] += 10
+    stats.distinct_mentions[0].add(6)
+    stats.row(2)
+    restored = pickle.loads(pickle.dumps(clone))
+    assert len(restored) == 1
+    assert restored.message_count[0] == 3
+    assert restored.distinct_mentions == {0: {5}}
+
+
+def test_human_author_columns_keep_zero_keys():
+    stats = _store([(1, 2, 1_000), (2, 1, 1_000)])
+    stats.is_bot[stats.row(2)] = 1
+    # link_count chỉ tính cho user thật: giữ key 0 của người viết là người, bỏ bot
+    assert stats.counter("link_count") == Counter({1: 0})
+    assert 1 in stats.counter("link_count")
+
+
+def test_finalize_user_metrics_from_location_counts():
+    stats = _store([(1, 5, 1_000), (2, 1, 1_000)])
+    stats.touch_seen(stats.row(1), 61_000)
+    scan_data = {
+        "user_stats": stats, "user_activity": {},
+        "user_channel_message_counts": defaultdict(lambda: defaultdict(int), {1: {10: 2, 11: 3}, 2: {10: 1}}),
+    }
+    calculated = finalize_user_metrics(scan_data)
+    assert scan_data["user_most_active_channel"][1] == (11, 3)
+    assert scan_data["user_distinct_channel_counts"] == Counter({1: 2, 2: 1})
+    assert scan_data["user_activity"][1]["activity_span_seconds"] == 60.0
+    assert calculated == {"distinct_channels": 2, "most_active": 2, "span": 1}
+
+
+def test_mention_only_users_stay_out_of_user_activity():
+    stats = _store([(1, 2, 1_000)])
+    stats.mention_received_count[stats.row(2)] += 3 # Chỉ được nhắc tên
+    stats.reaction_given_count[stats.row(3)] += 1 # Chỉ thả reaction
+    scan_data = {"user_stats": stats, "user_activity": {}, "user_channel_message_counts": {1: {10: 2}}}
+    finalize_user_metrics(scan_data)
+    assert set(scan_data["user_activity"]) == {1, 3}
+    assert scan_data["user_mention_received_counts"] == Counter({2: 3}) # BXH được nhắc tên vẫn có user này
+
+def test_snowflake_round_trip():
+    timestamp_ms = 1_700_000_000_123
+    assert snowflake_to_ms(ms_to_snowflake(timestamp_ms)) == timestamp_ms
+
+# --- END OF FILE tests/test_user_stats.py ---
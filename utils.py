@@ -14,6 +14,8 @@ import math
 import unicodedata
 import collections
 import config 
+import database
+import rest_scheduler
 
 log = logging.getLogger(__name__)
 
@@ -121,19 +123,198 @@ def format_discord_time(dt_obj: Optional[datetime.datetime], style='f') -> str:
             return dt_utc.strftime('%d/%m/%Y %H:%M UTC')
         except Exception as e_fallback: log.error(f"Lỗi fallback strftime cho '{dt_obj}': {e_fallback}"); return "Lỗi Ngày"
 
+# --- Cache hồ sơ user trong DB (user đã rời server / không tồn tại) ---
+def _user_from_profile(profile: Dict[str, Any], bot: Optional[discord.Client]) -> Optional[discord.User]:
+    """Dựng lại discord.User từ hồ sơ đã cache (None nếu là kết quả 'không tìm thấy' hoặc thiếu bot)."""
+    if profile.get('not_found') or not bot: return None
+    username = profile.get('username') or f"user_{profile['user_id']}"
+    display_name = profile.get('display_name')
+    data = {
+        "id": str(profile['user_id']), "username": username, "discriminator": "0",
+        "global_name": display_name if display_name and display_name != username else None,
+        "avatar": profile.get('avatar_hash'), "bot": bool(profile.get('is_bot')),
+    }
+    try: return discord.User(state=bot._connection, data=data)
+    except Exception as e: log.debug(f"Không dựng được user {profile['user_id']} từ cache: {e}"); return None
+
+def _profile_row(user_id: int, user: Optional[Union[discord.Member, discord.User]]) -> Dict[str, Any]:
+    if user is None: return {"user_id": user_id, "not_found": True}
+    return {
+        "user_id": user_id, "username": user.name, "display_name": user.display_name,
+        "avatar_hash": user.avatar.key if user.avatar else None,
+        "avatar_url": str(user.display_avatar.url) if user.display_avatar else None,
+        "is_bot": user.bot, "not_found": False,
+    }
+
+async def get_cached_user_profiles(user_ids: List[int], bot: Optional[discord.Client]) -> Dict[int, Optional[discord.User]]:
+    """Tra cache hồ sơ còn hạn. Kết quả gồm cả ID được nhớ là 'không tìm thấy' (giá trị None)."""
+    if config.USER_PROFILE_CACHE_TTL_HOURS <= 0 or not user_ids: return {}
+    profiles = await database.get_user_profile_cache(user_ids, config.USER_PROFILE_CACHE_TTL_HOURS, config.USER_PROFILE_NEGATIVE_TTL_HOURS)
+    effective_bot = bot if bot else _bot_ref_for_emoji
+    return {user_id: _user_from_profile(profile, effective_bot) for user_id, profile in profiles.items()}
+
+async def remember_user_profiles(users: Dict[int, Optional[Union[discord.Member, discord.User]]]):
+    """Ghi hồ sơ user (None = không tìm thấy) vào cache DB."""
+    if config.USER_PROFILE_CACHE_TTL_HOURS <= 0 or not users: return
+    await database.save_user_profile_cache([_profile_row(user_id, user) for user_id, user in users.items()])
+
+
+# --- Snapshot member theo ID (dùng chung cho quét, báo cáo, DM trong một lần quét) ---
+class MemberSnapshot:
+    """
+    Index member theo ID, dựng một lần từ danh sách member đã fetch khi bắt đầu quét.
+    User không còn trong server được tra trong cache hồ sơ DB trước, thiếu mới fetch một lần (giới hạn đồng thời)
+    rồi ghi nhớ, kể cả khi không tìm thấy. Kết quả fetch mới được ghi lại vào cache DB khi flush.
+    """
+
+    def __init__(self, guild: discord.Guild, members: List[discord.Member], *, complete: bool, bot: Optional[discord.Client] = None):
+        self.guild = guild
+        self.bot = bot
+        self.complete = complete # True = danh sách member đầy đủ -> ID thiếu chắc chắn đã rời server
+        self._members: Dict[int, discord.Member] = {m.id: m for m in members}
+        self._resolved: Dict[int, Optional[Union[discord.Member, discord.User]]] = {} # Cả kết quả None (negative cache)
+        self._pending: Dict[int, asyncio.Task] = {}
+        self._profile_cache_checked: Set[int] = set()
+        self._fetched_profiles: Dict[int, Optional[Union[discord.Member, discord.User]]] = {} # Chờ ghi vào cache DB
+        self._resolve_limit = asyncio.Semaphore(rest_scheduler.rest_scheduler.route_limits.get(rest_scheduler.ROUTE_MEMBER, 4))
+        self.rest_lookups = 0
+        self._users = 1 # Lệnh quét + task nền còn dùng (acquire)
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def acquire(self):
+        """Task nền (gửi DM) còn tra member sau khi lệnh quét kết thúc -> giữ snapshot tới khi task xong."""
+        self._users += 1
+
+    def release(self) -> bool:
+        """True khi không còn ai dùng (người gọi dọn snapshot)."""
+        self._users -= 1
+        return self._users <= 0
+
+    def get(self, user_id: int) -> Optional[Union[discord.Member, discord.User]]:
+        """Tra cứu không gọi API (member hiện tại hoặc user đã resolve trước đó)."""
+        return self._members.get(user_id) or self._resolved.get(user_id)
+
+    def members(self) -> Dict[int, discord.Member]:
+        return self._members
+
+    async def load_cached_profiles(self, user_ids: List[int]):
+        """Nạp hồ sơ từ cache DB (một query) cho các ID chưa có trong snapshot; không gọi REST."""
+        lookup_ids = [uid for uid in user_ids if uid not in self._members and uid not in self._resolved and uid not in self._profile_cache_checked]
+        if not lookup_ids: return
+        self._profile_cache_checked.update(lookup_ids)
+        cached = await get_cached_user_profiles(lookup_ids, self.bot)
+        self._resolved.update(cached)
+
+    async def flush_profile_cache(self):
+        """Ghi các user vừa fetch qua REST (kể cả 'không tìm thấy') vào cache DB."""
+        profiles, self._fetched_profiles = self._fetched_profiles, {}
+        await remember_user_profiles(profiles)
+
+    async def _fetch_missing(self, user_id: int) -> Optional[Union[discord.Member, discord.User]]:
+        await self.load_cached_profiles([user_id])
+        if user_id in self._resolved: return self._resolved[user_id]
+        user, definitive = await self._fetch_from_api(user_id)
+        if definitive and not isinstance(user, discord.Member):
+            self._fetched_profiles[user_id] = user # Lỗi HTTP tạm thời thì không nhớ 'không tìm thấy'
+        return user
+
+    async def _fetch_from_api(self, user_id: int) -> Tuple[Optional[Union[discord.Member, discord.User]], bool]:
+        """Trả về (user, chắc_chắn). chắc_chắn=False khi lỗi tạm thời (không nên cache)."""
+        async with self._resolve_limit:
+            user = self.guild.get_member(user_id)
+            if user: return user, True
+            self.rest_lookups += 1
+            if not self.complete:
+                try:
+                    async with rest_scheduler.slot(rest_scheduler.ROUTE_MEMBER): return await self.guild.fetch_member(user_id), True
+                except (discord.NotFound, discord.HTTPException): pass
+                except Exception as e: log.error(f"Lỗi fetch member {user_id} guild {self.guild.id}: {e}", exc_info=False)
+            effective_bot = self.bot if self.bot else _bot_ref_for_emoji
+            if not effective_bot: return None, False
+            try:
+                async with rest_scheduler.slot(rest_scheduler.ROUTE_MEMBER): return await effective_bot.fetch_user(user_id), True
+            except discord.NotFound: return None, True
+            except discord.HTTPException: return None, False
+            except Exception as e: log.error(f"Lỗi fetch user {user_id} global: {e}", exc_info=False); return None, False
+
+    async def resolve(self, user_id: int) -> Optional[Union[discord.Member, discord.User]]:
+        member = self._members.get(user_id)
+        if member: return member
+        if user_id in self._resolved: return self._resolved[user_id]
+        task = self._pending.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch_missing(user_id))
+            self._pending[user_id] = task
+            task.add_done_callback(lambda t, uid=user_id: self._finish(uid, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, user_id: int, task: asyncio.Task):
+        self._pending.pop(user_id, None)
+        if not task.cancelled() and task.exception() is None:
+            self._resolved[user_id] = task.result()
+
+    async def resolve_many(self, user_ids: List[int]) -> Dict[int, Optional[Union[discord.Member, discord.User]]]:
+        """Resolve nhiều ID: member lấy từ index, chỉ ID còn thiếu (mỗi ID một lần) mới gọi REST."""
+        unique_ids = list(dict.fromkeys(uid for uid in user_ids if isinstance(uid, int)))
+        results: Dict[int, Optional[Union[discord.Member, discord.User]]] = {}
+        missing_ids = []
+        for uid in unique_ids:
+            cached = self._members.get(uid)
+            if cached is None and uid in self._resolved: cached = self._resolved[uid]
+            elif cached is None: missing_ids.append(uid); continue
+            results[uid] = cached
+        if missing_ids:
+            await self.load_cached_profiles(missing_ids)
+            fetched = await asyncio.gather(*(self.resolve(uid) for uid in missing_ids), return_exceptions=True)
+            for uid, result in zip(missing_ids, fetched):
+                results[uid] = result if isinstance(result, (discord.User, discord.Member)) else None
+        return results
+
+
+_member_snapshots: Dict[int, MemberSnapshot] = {}
+
+def set_member_snapshot(snapshot: MemberSnapshot):
+    _member_snapshots[snapshot.guild.id] = snapshot
+    log.info(f"Snapshot member guild {snapshot.guild.id}: {len(snapshot):,} member ({'đầy đủ' if snapshot.complete else 'từ cache'}).")
+
+def get_member_snapshot(guild: Optional[discord.Guild]) -> Optional[MemberSnapshot]:
+    return _member_snapshots.get(guild.id) if guild else None
+
+async def release_member_snapshot(guild: Optional[discord.Guild], snapshot: Optional[MemberSnapshot] = None):
+    """Nhả snapshot; người dùng cuối cùng ghi nốt cache hồ sơ rồi bỏ snapshot của guild."""
+    if snapshot is None: snapshot = get_member_snapshot(guild)
+    if snapshot is None or not snapshot.release(): return
+    if _member_snapshots.get(snapshot.guild.id) is snapshot: # Lần quét sau có thể đã đặt snapshot mới
+        del _member_snapshots[snapshot.guild.id]
+    log.info(f"Snapshot member guild {snapshot.guild.id}: {snapshot.rest_lookups:,} lượt tra cứu REST cho user vắng mặt.")
+    try: await snapshot.flush_profile_cache()
+    except Exception as e: log.error(f"Lỗi ghi cache hồ sơ user: {e}", exc_info=False)
+
 async def fetch_user_data(guild: Optional[discord.Guild], user_id: int, *, bot_ref: Optional[discord.Client] = None) -> Optional[Union[discord.Member, discord.User]]:
     if not isinstance(user_id, int): return None
+    snapshot = get_member_snapshot(guild)
+    if snapshot: return await snapshot.resolve(user_id)
     user: Optional[Union[discord.Member, discord.User]] = None
     if guild: user = guild.get_member(user_id);
     if user: return user
     if guild:
-        try: user = await guild.fetch_member(user_id); return user
+        try:
+            async with rest_scheduler.slot(rest_scheduler.ROUTE_MEMBER): user = await guild.fetch_member(user_id)
+            return user
         except (discord.NotFound, discord.HTTPException): user = None
         except Exception as e: log.error(f"Lỗi fetch member {user_id} guild {guild.id}: {e}", exc_info=False); user = None
     effective_bot = bot_ref if bot_ref else _bot_ref_for_emoji
     if not user and effective_bot and isinstance(effective_bot, (discord.Client, commands.Bot)):
-        try: user = await effective_bot.fetch_user(user_id); return user
-        except (discord.NotFound, discord.HTTPException): user = None
+        cached = await get_cached_user_profiles([user_id], effective_bot)
+        if user_id in cached: return cached[user_id]
+        try:
+            async with rest_scheduler.slot(rest_scheduler.ROUTE_MEMBER): user = await effective_bot.fetch_user(user_id)
+            await remember_user_profiles({user_id: user})
+            return user
+        except discord.NotFound: user = None; await remember_user_profiles({user_id: None})
+        except discord.HTTPException: user = None
         except Exception as e: log.error(f"Lỗi fetch user {user_id} global: {e}", exc_info=False); user = None
     return user
 
@@ -205,6 +386,8 @@ def get_user_rank(user_id: int, ranking_data: Dict[str, Dict[int, int]], rank_ke
 async def _fetch_user_dict(guild: discord.Guild, user_ids: List[int], bot: Union[discord.Client, commands.Bot]) -> Dict[int, Optional[Union[discord.Member, discord.User]]]:
     user_cache: Dict[int, Optional[Union[discord.Member, discord.User]]] = {}
     if not user_ids: return user_cache
+    snapshot = get_member_snapshot(guild)
+    if snapshot: return await snapshot.resolve_many(user_ids)
     valid_user_ids = list(set(uid for uid in user_ids if isinstance(uid, int)))
     remaining_ids = []
     for uid in valid_user_ids:
@@ -254,6 +437,15 @@ async def fetch_sticker_object(sticker_id: Optional[int], bot: discord.Client, g
     except discord.HTTPException as e: log.warning(f"Lỗi HTTP khi fetch sticker {sticker_id}: {e.status}"); return None
     except Exception as e: log.error(f"Lỗi không xác định khi fetch sticker {sticker_id}: {e}", exc_info=True); return None
 
+WEEKDAY_NAMES = ("Thứ Hai", "Thứ Ba", "Thứ Tư", "Thứ Năm", "Thứ Sáu", "Thứ Bảy", "Chủ Nhật") # Theo datetime.weekday()
+
+# Quét tăng dần chỉ nạp lại số đếm theo user và theo kênh/luồng; các phân tích còn lại (theo giờ, emoji/sticker,
+# reaction theo emoji) chỉ gồm tin mới -> báo cáo ghi rõ để không lẫn với số liệu toàn thời gian
+SINCE_LAST_SCAN_NOTE = "Chỉ tính tin nhắn mới kể từ lần quét trước"
+
+def since_last_scan_label(scan_data: Dict[str, Any]) -> str:
+    return " (từ lần quét trước)" if scan_data.get("incremental_mode") else ""
+
 local_timezone_offset_hours: Optional[int] = None
 def get_local_timezone_offset() -> int:
     global local_timezone_offset_hours